@@ -3,12 +3,15 @@
 from __future__ import division, print_function, unicode_literals
 
 import math
+import threading
+from itertools import islice
 
 import numpy as np
 import six
-from brainstorm.handlers._cpuop import _crop_images
+from six.moves import queue
+from brainstorm.handlers._cpuop import _pad_crop_flip_images
 from brainstorm.randomness import Seedable
-from brainstorm.utils import IteratorValidationError
+from brainstorm.utils import IteratorValidationError, SparseArray
 
 
 class DataIterator(Seedable):
@@ -19,7 +22,15 @@ class DataIterator(Seedable):
             List of input names that this iterator provides.
         length (int | None):
             Number of iterations that this iterator will run.
+        shard (tuple[int, int] | None):
+            If set to ``(nr_shards, shard_nr)``, only every
+            ``nr_shards``-th batch of each pass is yielded, starting with
+            batch ``shard_nr``. Only iterators with ``supports_sharding``
+            respect it, and they skip the other batches before preparing
+            them.
     """
+    __undescribed__ = {'shard'}
+    supports_sharding = False
 
     def __init__(self, data_shapes, length):
         """
@@ -32,10 +43,18 @@ class DataIterator(Seedable):
         super(DataIterator, self).__init__()
         self.data_shapes = data_shapes
         self.length = length
+        self.shard = None
 
     def __call__(self, handler):
         pass
 
+    def _select_shard(self, items):
+        """Select the items of the batches in the shard of this iterator."""
+        if self.shard is None:
+            return items
+        nr_shards, shard_nr = self.shard
+        return islice(items, shard_nr, None, nr_shards)
+
 
 class AddGaussianNoise(DataIterator):
     """
@@ -95,7 +114,12 @@ class AddSaltNPepper(DataIterator):
 
     Supports usage of different amounts and ratios of salt VS pepper for
     different named data items.
+
+    Note:
+        The yielded arrays for the affected data items are reused between
+        iterations and only remain valid until the next one.
     """
+    __undescribed__ = {'_buffers'}
 
     def __init__(self, iter, prob_dict, ratio_dict=None):
         """
@@ -127,13 +151,16 @@ class AddSaltNPepper(DataIterator):
         self.ratio_dict = {} if ratio_dict is None else ratio_dict
         self.prob_dict = prob_dict
         self.iter = iter
+        self._buffers = {}
 
     def __call__(self, handler=None):
         for data in self.iter(handler):
             for key, pr in self.prob_dict.items():
                 ratio = self.ratio_dict.get(key, 0.5)
-                d = data[key].copy()
-                r = self.rnd.rand(*d.shape)
+                d = _get_buffer(self._buffers, key, data[key].shape,
+                                _get_dtype(handler, data[key]))
+                np.copyto(d, data[key], casting='unsafe')
+                r = self.rnd.random_sample(d.shape)
                 d[r >= 1.0 - pr * ratio] = 1.0  # salt
                 d[r <= pr * (1.0 - ratio)] = 0.0  # pepper
                 data[key] = d
@@ -149,7 +176,12 @@ class Flip(DataIterator):
     Defaults to flipping the 'default' named data item with a probability
     of 0.5. Note that the last dimension is flipped, which typically
     corresponds to flipping images horizontally.
+
+    Note:
+        The yielded arrays for the affected data items are reused between
+        iterations and only remain valid until the next one.
     """
+    __undescribed__ = {'_buffers'}
 
     def __init__(self, iter, prob_dict=None):
         """
@@ -174,14 +206,21 @@ class Flip(DataIterator):
                 raise IteratorValidationError("Only 5D data is supported")
         self.prob_dict = prob_dict
         self.iter = iter
+        self._buffers = {}
 
     def __call__(self, handler=None):
         for data in self.iter(handler):
-            for name in self.prob_dict.keys():
+            for name, prob in self.prob_dict.items():
                 assert isinstance(data[name], np.ndarray)
-                for i in range(data[name].shape[1]):
-                    if self.rnd.random_sample() < self.prob_dict[name]:
-                        data[name][:, i, ...] = data[name][:, i, :, ::-1, :]
+                dtype = _get_dtype(handler, data[name])
+                b = data[name].shape[1]
+                flip = (self.rnd.random_sample(b) < prob).astype(np.uint8)
+                offsets = np.zeros(b, dtype=np.int_)
+                out = _get_buffer(self._buffers, name, data[name].shape,
+                                  dtype)
+                _pad_crop_flip_images(data[name].astype(dtype, copy=False),
+                                      0, 0.0, offsets, offsets, flip, out)
+                data[name] = out
             yield data
 
 
@@ -273,6 +312,127 @@ class MultiHot(DataIterator):
             yield data
 
 
+class SparseMultiHot(DataIterator):
+
+    """
+    Convert data to sparse multi hot vectors, according to provided
+    vocabulary sizes. Like :class:`MultiHot`, but yields
+    :class:`brainstorm.utils.SparseArray` objects instead of materializing
+    the dense vectors, which is much cheaper for large vocabularies. These
+    should be provided to sparse inputs of the network (see
+    :func:`brainstorm.layers.Input`).
+    If vocabulary size is not provided for some data item, it is yielded as is.
+
+    Currently this iterator only supports 3D data.
+    """
+
+    def __init__(self, iter, vocab_size_dict):
+        """
+        Args:
+            iter (DataIterator):
+                DataIterator which iterates over the indices to be converted to
+                sparse multi hot.
+            vocab_size_dict (dict[str, int]):
+                Specifies the size of multi hot vectors (the vocabulary size)
+                for some named data items.
+        """
+        data_shapes = dict(iter.data_shapes)
+        for key in vocab_size_dict.keys():
+            if key not in iter.data_shapes:
+                raise IteratorValidationError(
+                    "key {} is not present in iterator. Available keys: {"
+                    "}".format(key, iter.data_shapes.keys()))
+            if not isinstance(vocab_size_dict[key], int):
+                raise IteratorValidationError("Vocabulary size must be int")
+            shape = iter.data_shapes[key]
+            if not len(shape) == 3:
+                raise IteratorValidationError("Only 3D data is supported")
+            data_shapes[key] = shape[:2] + (vocab_size_dict[key],)
+        DataIterator.__init__(self, data_shapes, iter.length)
+        self.vocab_size_dict = vocab_size_dict
+        self.iter = iter
+
+    def __call__(self, handler=None):
+        for data in self.iter(handler):
+            for name in self.vocab_size_dict.keys():
+                indices = data[name]
+                dtype = _get_dtype(handler, indices)
+                rows = np.sort(indices.reshape(-1, indices.shape[2]), axis=1)
+                # every index is only counted once per row
+                unique = np.ones(rows.shape, dtype=bool)
+                unique[:, 1:] = rows[:, 1:] != rows[:, :-1]
+                indptr = np.zeros(rows.shape[0] + 1, dtype=np.int64)
+                np.cumsum(unique.sum(axis=1), out=indptr[1:])
+                data[name] = SparseArray(
+                    np.ones(indptr[-1], dtype=dtype), rows[unique], indptr,
+                    indices.shape[:2] + (self.vocab_size_dict[name],))
+            yield data
+
+
+class Pack(DataIterator):
+    """
+    Packs several sequences back to back into each batch column. Sequences
+    are generated by another iterator, which must provide named data items
+    (such as Minibatches) and a mask that determines their lengths.
+
+    Sequences are placed into columns using a first-fit decreasing strategy,
+    so that much less padding is needed for batches of uneven length.
+    An additional 'reset' data item (shaped ('T', 'B', 1)) marks the first
+    step of each sequence. It should be connected to the 'reset' input of
+    all recurrent layers of the network, such that their state does not
+    carry over from one sequence to the next. The mask is updated to mark
+    the filled positions.
+    """
+
+    def __init__(self, iter, mask_name='mask', reset_name='reset'):
+        """
+        Args:
+            iter (DataIterator):
+                A DataIterator which iterates over the data to be packed.
+            mask_name (Optional[str]):
+                Name of the mask data item. Defaults to 'mask'.
+            reset_name (Optional[str]):
+                Name of the reset data item added by this iterator. Defaults
+                to 'reset'.
+        """
+        if mask_name not in iter.data_shapes:
+            raise IteratorValidationError(
+                "mask {} is not present in iterator. Available keys: {"
+                "}".format(mask_name, iter.data_shapes.keys()))
+        if reset_name in iter.data_shapes:
+            raise IteratorValidationError(
+                "iterator already provides {}".format(reset_name))
+        mask_shape = iter.data_shapes[mask_name]
+        if mask_shape[2:] != (1,):
+            raise IteratorValidationError("Mask must have feature size 1")
+        data_shapes = dict(iter.data_shapes)
+        data_shapes[reset_name] = mask_shape
+        super(Pack, self).__init__(data_shapes, iter.length)
+        self.mask_name = mask_name
+        self.reset_name = reset_name
+        self.iter = iter
+
+    def __call__(self, handler=None):
+        for data in self.iter(handler):
+            mask = data[self.mask_name]
+            time_size = mask.shape[0]
+            lengths = _calculate_lengths_from_mask(mask)
+            columns, offsets, nr_columns = _pack_sequences(lengths,
+                                                           time_size)
+            packed = {k: np.zeros((time_size, nr_columns) + v.shape[2:],
+                                  dtype=v.dtype)
+                      for k, v in data.items()}
+            reset = np.zeros((time_size, nr_columns, 1), dtype=mask.dtype)
+            for i in np.flatnonzero(lengths):
+                c, o, length = columns[i], offsets[i], lengths[i]
+                for k, v in data.items():
+                    packed[k][o:o + length, c] = v[:length, i]
+                reset[o, c] = 1
+            packed[self.reset_name] = reset
+            time_slice = slice(None, int((offsets + lengths).max(initial=0)))
+            yield {k: v[time_slice] for k, v in packed.items()}
+
+
 class Pad(DataIterator):
     """
     Pads images equally on all sides. Images are generated by another
@@ -281,7 +441,12 @@ class Pad(DataIterator):
 
     5D data corresponds to sequences of multi-channel images, which is the
     typical use case. Zero-padding is used unless specified otherwise.
+
+    Note:
+        The yielded arrays for the affected data items are reused between
+        iterations and only remain valid until the next one.
     """
+    __undescribed__ = {'_buffers'}
 
     def __init__(self, iter, size_dict, value_dict=None):
         """
@@ -309,17 +474,100 @@ class Pad(DataIterator):
         self.value_dict = {} if value_dict is None else value_dict
         self.size_dict = size_dict
         self.iter = iter
+        self._buffers = {}
 
     def __call__(self, handler=None):
         for data in self.iter(handler):
             for name in self.size_dict.keys():
                 assert isinstance(data[name], np.ndarray)
                 t, b, h, w, c = data[name].shape
+                dtype = _get_dtype(handler, data[name])
                 size = self.size_dict[name]
                 val = self.value_dict.get(name, 0.0)
-                new_data = val * np.ones((t, b, h + 2 * size, w + 2 * size, c))
-                new_data[:, :, size: -size, size: -size, :] = data[name]
-                data[name] = new_data
+                offsets = np.zeros(b, dtype=np.int_)
+                flip = np.zeros(b, dtype=np.uint8)
+                out = _get_buffer(self._buffers, name,
+                                  (t, b, h + 2 * size, w + 2 * size, c), dtype)
+                _pad_crop_flip_images(data[name].astype(dtype, copy=False),
+                                      size, val, offsets, offsets, flip, out)
+                data[name] = out
+            yield data
+
+
+class PadCropFlip(DataIterator):
+    """
+    Pads, randomly crops and randomly flips images in a single pass. Images
+    are generated by another iterator, which must provide named data items
+    (such as Online, Minibatches, Undivided). Only 5D Numpy data in TNHWC
+    format is supported.
+
+    This is equivalent to chaining Pad, RandomCrop and Flip but avoids the
+    intermediate arrays and touches every output pixel only once.
+
+    Note:
+        The yielded arrays for the affected data items are reused between
+        iterations and only remain valid until the next one.
+    """
+    __undescribed__ = {'_buffers'}
+
+    def __init__(self, iter, shape_dict, size_dict=None, value_dict=None,
+                 prob_dict=None):
+        """
+        Args:
+            iter (DataIterator):
+                A DataIterator which iterates over the images to be augmented.
+            shape_dict (dict[str, (int, int)]):
+                Specifies the crop shapes for some named data items.
+            size_dict (Optional(dict[str, int])):
+                Specifies the padding sizes for some of these data items.
+                Defaults to None meaning no padding.
+            value_dict (Optional(dict[str, float])):
+                Specifies the pad values for some of these data items.
+                Defaults to None meaning zero-padding.
+            prob_dict (Optional(dict[str, float])):
+                Specifies the probability of flipping for some of these data
+                items. Defaults to None meaning no flipping.
+        """
+        super(PadCropFlip, self).__init__(iter.data_shapes, iter.length)
+        self.size_dict = {} if size_dict is None else size_dict
+        self.value_dict = {} if value_dict is None else value_dict
+        self.prob_dict = {} if prob_dict is None else prob_dict
+        for d in (self.size_dict, self.value_dict, self.prob_dict):
+            if not set(d.keys()) <= set(shape_dict.keys()):
+                raise IteratorValidationError(
+                    "padding sizes, values and flip probabilities can only be "
+                    "provided for data names that are cropped")
+        for key, val in shape_dict.items():
+            if key not in iter.data_shapes:
+                raise IteratorValidationError(
+                    "key {} is not present in iterator. Available keys: {"
+                    "}".format(key, iter.data_shapes.keys()))
+            _validate_pad_crop_flip(iter.data_shapes[key], val,
+                                    self.size_dict.get(key, 0),
+                                    self.prob_dict.get(key, 0.0))
+        self.shape_dict = shape_dict
+        self.iter = iter
+        self._buffers = {}
+
+    def __call__(self, handler=None):
+        for data in self.iter(handler):
+            for name in self.shape_dict.keys():
+                assert isinstance(data[name], np.ndarray)
+                t, n, h, w, c = data[name].shape
+                dtype = _get_dtype(handler, data[name])
+                crop_h, crop_w = self.shape_dict[name]
+                size = self.size_dict.get(name, 0)
+                val = self.value_dict.get(name, 0.0)
+                prob = self.prob_dict.get(name, 0.0)
+                row_indices = self.rnd.randint(0, h + 2 * size - crop_h + 1, n)
+                col_indices = self.rnd.randint(0, w + 2 * size - crop_w + 1, n)
+                flip = (self.rnd.random_sample(n) < prob).astype(np.uint8)
+                out = _get_buffer(self._buffers, name,
+                                  (t, n, crop_h, crop_w, c), dtype)
+                _pad_crop_flip_images(data[name].astype(dtype, copy=False),
+                                      size, val, row_indices.astype(np.int_),
+                                      col_indices.astype(np.int_), flip, out)
+                data[name] = out
             yield data
 
 
@@ -331,7 +579,12 @@ class RandomCrop(DataIterator):
 
     5D data corresponds to sequences of multi-channel images, which is the
     typical use case.
+
+    Note:
+        The yielded arrays for the affected data items are reused between
+        iterations and only remain valid until the next one.
     """
+    __undescribed__ = {'_buffers'}
 
     def __init__(self, iter, shape_dict):
         """
@@ -358,20 +611,26 @@ class RandomCrop(DataIterator):
                 raise IteratorValidationError("Invalid crop width")
         self.shape_dict = shape_dict
         self.iter = iter
+        self._buffers = {}
 
     def __call__(self, handler=None):
         for data in self.iter(handler):
             for name in self.shape_dict.keys():
                 assert isinstance(data[name], np.ndarray)
                 t, n, h, w, c = data[name].shape
+                dtype = _get_dtype(handler, data[name])
                 crop_h, crop_w = self.shape_dict[name]
                 max_r = h - crop_h
                 max_c = w - crop_w
-                row_indices = self.rnd.random_integers(0, max_r, n)
-                col_indices = self.rnd.random_integers(0, max_c, n)
-                cropped = np.zeros((t, n, crop_h, crop_w, c))
-                _crop_images(data[name], crop_h, crop_w, row_indices,
-                             col_indices, cropped)
+                row_indices = self.rnd.randint(0, max_r + 1, n)
+                col_indices = self.rnd.randint(0, max_c + 1, n)
+                flip = np.zeros(n, dtype=np.uint8)
+                cropped = _get_buffer(self._buffers, name,
+                                      (t, n, crop_h, crop_w, c), dtype)
+                _pad_crop_flip_images(data[name].astype(dtype, copy=False),
+                                      0, 0.0, row_indices.astype(np.int_),
+                                      col_indices.astype(np.int_), flip,
+                                      cropped)
                 data[name] = cropped
             yield data
 
@@ -394,7 +653,7 @@ class Undivided(DataIterator):
         self.total_size = int(sum(d.size for d in self.data.values()))
 
     def __call__(self, handler=None):
-        yield self.data
+        yield dict(self.data)
 
 
 class Minibatches(DataIterator):
@@ -410,6 +669,7 @@ class Minibatches(DataIterator):
         When shuffling is enabled, this iterator only randomizes the order of
         minibatches, but doesn't re-shuffle instances across batches.
     """
+    supports_sharding = True
 
     def __init__(self, batch_size=1, shuffle=True, cut_according_to='mask',
                  **named_data):
@@ -439,16 +699,11 @@ class Minibatches(DataIterator):
         self.data = named_data
         self.shuffle = shuffle
         self.batch_size = batch_size
-        if isinstance(cut_according_to, (six.string_types, type(None))):
-            if cut_according_to in named_data:
-                self.seq_lens = _calculate_lengths_from_mask(
-                    named_data[cut_according_to])
-            else:
-                self.seq_lens = time_steps * np.ones(nr_sequences,
-                                                     dtype=np.int)
-        else:
-            self.seq_lens = np.array(cut_according_to)
-            assert self.seq_lens.shape == (nr_sequences, )
+        self.seq_lens = _get_seq_lens(named_data, cut_according_to,
+                                      nr_sequences, time_steps)
+        self.padding_ratio = _calculate_padding_ratio(
+            self.seq_lens, [slice(i, i + batch_size)
+                            for i in range(0, nr_sequences, batch_size)])
         self.sample_size = int(
             sum(d.shape[0] * np.prod(d.shape[2:]) * batch_size
                 for d in self.data.values()))
@@ -457,7 +712,7 @@ class Minibatches(DataIterator):
         indices = np.arange(self.length)
         if self.shuffle:
             self.rnd.shuffle(indices)
-        for idx in indices:
+        for idx in self._select_shard(indices):
             batch_slice = slice(idx * self.batch_size,
                                 (idx + 1) * self.batch_size)
             time_slice = slice(None, np.max(self.seq_lens[batch_slice]))
@@ -466,6 +721,294 @@ class Minibatches(DataIterator):
             yield data
 
 
+class BucketedMinibatches(DataIterator):
+    """
+    Minibatch iterator that groups sequences of similar length.
+
+    Sequences are sorted by their length (determined like in Minibatches by
+    `cut_according_to`) and split into buckets of `bucket_size` sequences.
+    Minibatches are formed within these buckets, and each one is cut to the
+    length of its longest sequence. This greatly reduces the amount of
+    padding for data with very uneven sequence lengths.
+
+    After each call, the fraction of padded (time, batch) positions of the
+    current pass through the data is available as `padding_ratio`.
+
+    Within each minibatch the sequences are ordered by decreasing length, so
+    recurrent layers with a connected mask can skip finished sequences.
+
+    Note:
+        When shuffling is enabled, sequences of equal length are shuffled
+        before sorting, sequences are shuffled within each bucket, and the
+        order of all minibatches is randomized across buckets.
+    """
+    supports_sharding = True
+
+    def __init__(self, batch_size=1, shuffle=True, cut_according_to='mask',
+                 bucket_size=None, **named_data):
+        """
+        Args:
+            batch_size (int):
+                The number of data instances per batch. Defaults to 1.
+            shuffle (Optional[bool]):
+                Flag indicating whether the data should be shuffled at the
+                beginning of every pass through the data.
+            cut_according_to (Optional[str or list or array]:
+                Specify how to determine the length of the sequences. Same as
+                for Minibatches.
+            bucket_size (Optional[int]):
+                Number of sequences per bucket. Rounded up to a multiple of
+                the batch size. Defaults to None, meaning one batch per
+                bucket.
+            **named_data (dict[str, np.ndarray]):
+                Named arrays with 3+ dimensions i.e. ('T', 'B', ...).
+        """
+        nr_sequences, time_steps = _assert_correct_data_format(named_data)
+        data_shapes = {n: v.shape for n, v in named_data.items()}
+        bucket_size = batch_size if bucket_size is None else bucket_size
+        self.bucket_size = int(math.ceil(bucket_size / batch_size) *
+                               batch_size)
+        nr_batches = sum(int(math.ceil(min(self.bucket_size, nr_sequences - i)
+                                       / batch_size))
+                         for i in range(0, nr_sequences, self.bucket_size))
+        super(BucketedMinibatches, self).__init__(data_shapes, nr_batches)
+        self.data = named_data
+        self.shuffle = shuffle
+        self.batch_size = batch_size
+        self.seq_lens = _get_seq_lens(named_data, cut_according_to,
+                                      nr_sequences, time_steps)
+        self.padding_ratio = None
+
+    def __call__(self, handler=None):
+        order = np.arange(len(self.seq_lens))
+        if self.shuffle:
+            self.rnd.shuffle(order)
+        order = order[np.argsort(self.seq_lens[order], kind='mergesort')]
+        batches = []
+        for i in range(0, len(order), self.bucket_size):
+            bucket = order[i:i + self.bucket_size]
+            if self.shuffle:
+                self.rnd.shuffle(bucket)
+            batches.extend(bucket[j:j + self.batch_size]
+                           for j in range(0, len(bucket), self.batch_size))
+        if self.shuffle:
+            self.rnd.shuffle(batches)
+        self.padding_ratio = _calculate_padding_ratio(self.seq_lens, batches)
+        for batch_idx in self._select_shard(batches):
+            batch_idx = batch_idx[np.argsort(-self.seq_lens[batch_idx],
+                                             kind='mergesort')]
+            time_slice = slice(None, np.max(self.seq_lens[batch_idx]))
+            data = {k: v[time_slice, batch_idx]
+                    for k, v in self.data.items()}
+            yield data
+
+
+class ChunkedMinibatches(DataIterator):
+    """
+    Minibatch iterator that reads its data lazily from disk.
+
+    Works with any array-like data that can be sliced along the second
+    dimension, such as h5py datasets or ``np.memmap`` arrays, so the data
+    does not have to fit into memory. Data is read in chunks of consecutive
+    sequences, which are aligned with the chunks of HDF5 datasets, and a
+    background thread reads ahead while the network is busy.
+
+    Like Minibatches, this iterator cuts the sequences of each minibatch to
+    their maximum length according to `cut_according_to`.
+
+    Note:
+        When shuffling is enabled, the order of chunks is randomized and the
+        sequences are shuffled within a buffer of `buffer_chunks` chunks.
+        This is weaker than a full shuffle, but keeps reads sequential.
+    """
+    supports_sharding = True
+
+    def __init__(self, batch_size=1, shuffle=True, cut_according_to='mask',
+                 chunk_size=None, buffer_chunks=4, readahead=2,
+                 **named_data):
+        """
+        Args:
+            batch_size (int):
+                The number of data instances per batch. Defaults to 1.
+            shuffle (Optional[bool]):
+                Flag indicating whether the data should be shuffled at the
+                beginning of every pass through the data.
+            cut_according_to (Optional[str or list or array]:
+                Specify how to determine the length of the sequences for
+                shortening them to the longest sequence of the current
+                mini-batch. Same as for Minibatches.
+            chunk_size (Optional[int]):
+                Number of sequences that are read from disk at once. If the
+                data is stored in chunked HDF5 datasets this is rounded up to
+                a multiple of their chunk size. Defaults to None, meaning the
+                HDF5 chunk size (or 16 batches) is used.
+            buffer_chunks (Optional[int]):
+                Number of chunks that are shuffled together. Defaults to 4.
+            readahead (Optional[int]):
+                Number of chunks that are read ahead in a background thread.
+                Set to 0 to read synchronously. Defaults to 2.
+            **named_data (dict[str, array-like]):
+                Named arrays with 3+ dimensions i.e. ('T', 'B', ...).
+        """
+        nr_sequences, time_steps = _assert_correct_data_format(named_data)
+        data_shapes = {n: v.shape for n, v in named_data.items()}
+        nr_batches = int(math.ceil(nr_sequences / batch_size))
+        super(ChunkedMinibatches, self).__init__(data_shapes, nr_batches)
+        if buffer_chunks < 1:
+            raise IteratorValidationError("buffer_chunks must be at least 1")
+        self.data = named_data
+        self.shuffle = shuffle
+        self.batch_size = batch_size
+        self.buffer_chunks = buffer_chunks
+        self.readahead = readahead
+        self.nr_sequences = nr_sequences
+        self.chunk_size = _get_chunk_size(named_data, chunk_size,
+                                          16 * batch_size)
+        self.nr_chunks = int(math.ceil(nr_sequences / self.chunk_size))
+        self.cut_according_to = None
+        self.seq_lens = None
+        if isinstance(cut_according_to, (six.string_types, type(None))):
+            if cut_according_to in named_data:
+                self.cut_according_to = cut_according_to
+        else:
+            self.seq_lens = np.array(cut_according_to)
+            assert self.seq_lens.shape == (nr_sequences, )
+
+    def __call__(self, handler=None):
+        for data in self._select_shard(self._iterate_batches()):
+            yield self._cut(data)
+
+    def _iterate_batches(self):
+        """Yield the batches of a pass, before they are cut."""
+        chunk_order = np.arange(self.nr_chunks)
+        if self.shuffle:
+            self.rnd.shuffle(chunk_order)
+        slices = [slice(i * self.chunk_size,
+                        min((i + 1) * self.chunk_size, self.nr_sequences))
+                  for i in chunk_order]
+        chunks = _read_chunks(self.data, slices, self.readahead)
+        buffered = []
+        for sl, chunk in zip(slices, chunks):
+            # sequence indices, shaped to be sliced along with the data
+            chunk['__index__'] = np.arange(sl.start, sl.stop).reshape(1, -1)
+            buffered.append(chunk)
+            if len(buffered) < self.buffer_chunks:
+                continue
+            for data in self._batches_from(buffered, final=False):
+                yield data
+        for data in self._batches_from(buffered, final=True):
+            yield data
+
+    def _batches_from(self, buffered, final):
+        """Yield batches from the buffered chunks and keep the leftovers."""
+        if not buffered:
+            return
+        if len(buffered) == 1:
+            buf = buffered[0]
+        else:
+            buf = {k: np.concatenate([c[k] for c in buffered], axis=1)
+                   for k in buffered[0]}
+        del buffered[:]
+        nr_seqs = buf['__index__'].shape[1]
+        order = np.arange(nr_seqs)
+        if self.shuffle:
+            self.rnd.shuffle(order)
+        nr_full = nr_seqs // self.batch_size
+        for i in range(nr_full):
+            batch_idx = order[i * self.batch_size:(i + 1) * self.batch_size]
+            yield {k: v[:, batch_idx] for k, v in buf.items()}
+        rest = order[nr_full * self.batch_size:]
+        if len(rest) == 0:
+            return
+        leftover = {k: v[:, rest] for k, v in buf.items()}
+        if final:
+            yield leftover
+        else:
+            buffered.append(leftover)
+
+    def _cut(self, data):
+        index = data.pop('__index__')[0]
+        if self.cut_according_to is not None:
+            seq_lens = _calculate_lengths_from_mask(
+                data[self.cut_according_to])
+        elif self.seq_lens is not None:
+            seq_lens = self.seq_lens[index]
+        else:
+            return data
+        time_slice = slice(None, np.max(seq_lens))
+        return {k: v[time_slice] for k, v in data.items()}
+
+
+def _get_chunk_size(named_data, chunk_size, default):
+    """Determine a chunk size that is aligned with the HDF5 chunks."""
+    alignment = 1
+    for data in named_data.values():
+        chunks = getattr(data, 'chunks', None)
+        if isinstance(chunks, tuple):
+            alignment = max(alignment, chunks[1])
+    if chunk_size is None:
+        chunk_size = alignment if alignment > 1 else default
+    return int(math.ceil(chunk_size / alignment) * alignment)
+
+
+def _read_chunk(named_data, sl):
+    # np.array forces memmaps to be read instead of returning another view
+    return {k: np.array(v[:, sl]) for k, v in named_data.items()}
+
+
+def _read_chunks(named_data, slices, readahead):
+    """Read chunks of the data, using a background thread for readahead."""
+    chunks = (_read_chunk(named_data, sl) for sl in slices)
+    if readahead < 1:
+        return chunks
+    return _read_ahead(chunks, readahead)
+
+
+_DONE = object()
+
+
+def _read_ahead(items, readahead):
+    """Iterate over items, which are produced by a background thread."""
+    item_queue = queue.Queue(maxsize=readahead)
+    stop = threading.Event()
+    reader = threading.Thread(target=_produce_items,
+                              args=(items, item_queue, stop))
+    reader.daemon = True
+    reader.start()
+    try:
+        while True:
+            item = item_queue.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        reader.join()
+
+
+def _produce_items(items, item_queue, stop):
+    try:
+        for item in items:
+            if not _put_unless_stopped(item_queue, item, stop):
+                return
+    except Exception as e:
+        _put_unless_stopped(item_queue, e, stop)
+        return
+    _put_unless_stopped(item_queue, _DONE, stop)
+
+
+def _put_unless_stopped(item_queue, item, stop):
+    while not stop.is_set():
+        try:
+            item_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
 def _assert_correct_data_format(named_data):
     nr_sequences = {}
     nr_timesteps = {}
@@ -493,6 +1036,82 @@ def _assert_correct_data_format(named_data):
     return int(min(nr_sequences.values())), min(nr_timesteps.values())
 
 
+def _validate_pad_crop_flip(data_shape, shape, size, prob):
+    if not (isinstance(shape, tuple) and len(shape) == 2):
+        raise IteratorValidationError("Shape must be a size 2 tuple")
+    if len(data_shape) != 5:
+        raise IteratorValidationError("Only 5D data is supported")
+    if size < 0:
+        raise IteratorValidationError("Invalid padding size")
+    if shape[0] > data_shape[2] + 2 * size or shape[0] < 0:
+        raise IteratorValidationError("Invalid crop height")
+    if shape[1] > data_shape[3] + 2 * size or shape[1] < 0:
+        raise IteratorValidationError("Invalid crop width")
+    if prob > 1.0 or prob < 0.0:
+        raise IteratorValidationError("Invalid probability")
+
+
+def _get_dtype(handler, data):
+    """Determine the dtype that augmented data should be produced in.
+
+    This is the dtype of the handler if available, so the arrays need not be
+    converted again when they are copied into the network buffers.
+    """
+    dtype = getattr(handler, 'dtype', None)
+    if dtype is None:
+        dtype = np.result_type(data.dtype, np.float32)
+    return np.dtype(dtype)
+
+
+def _get_buffer(buffers, name, shape, dtype):
+    """Return a cached output buffer, reallocating only if it doesn't fit."""
+    buf = buffers.get(name)
+    if buf is None or buf.shape != shape or buf.dtype != dtype:
+        buf = np.empty(shape, dtype=dtype)
+        buffers[name] = buf
+    return buf
+
+
+def _get_seq_lens(named_data, cut_according_to, nr_sequences, time_steps):
+    if isinstance(cut_according_to, (six.string_types, type(None))):
+        if cut_according_to in named_data:
+            return _calculate_lengths_from_mask(named_data[cut_according_to])
+        return time_steps * np.ones(nr_sequences, dtype=np.int_)
+    seq_lens = np.array(cut_according_to)
+    assert seq_lens.shape == (nr_sequences, )
+    return seq_lens
+
+
+def _calculate_padding_ratio(seq_lens, batches):
+    """Fraction of the (time, batch) positions in the batches that are
+    padding, given that each batch is cut to its longest sequence."""
+    total = sum(np.max(seq_lens[b]) * len(seq_lens[b]) for b in batches)
+    if total == 0:
+        return 0.0
+    return 1.0 - float(np.sum(seq_lens)) / total
+
+
+def _pack_sequences(lengths, time_size):
+    """Assign sequences to columns of the given size by first-fit
+    decreasing. Returns the column and offset of each sequence and the
+    number of columns."""
+    columns = np.zeros(len(lengths), dtype=np.int_)
+    offsets = np.zeros(len(lengths), dtype=np.int_)
+    fill = []
+    for i in np.argsort(-lengths, kind='mergesort'):
+        if lengths[i] == 0:
+            continue
+        for c, used in enumerate(fill):
+            if used + lengths[i] <= time_size:
+                break
+        else:
+            c = len(fill)
+            fill.append(0)
+        columns[i], offsets[i] = c, fill[c]
+        fill[c] += lengths[i]
+    return columns, offsets, len(fill)
+
+
 def _calculate_lengths_from_mask(mask):
     assert mask.shape[2:] == (1,)
     b = mask[:, :, 0] != 0
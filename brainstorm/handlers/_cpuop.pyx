@@ -243,6 +243,71 @@ def _crop_images(DTYPE_t[:, :, :, :, ::1] inputs not None,
                                                             k + start_row,
                                                             l + start_col, c]
 
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def _pad_crop_flip_images(DTYPE_t[:, :, :, :, :] inputs not None,
+                          int padding,
+                          double value,
+                          np.int_t[:] row_indices,
+                          np.int_t[:] col_indices,
+                          np.uint8_t[:] flip,
+                          DTYPE_t[:, :, :, :, ::1] outputs not None):
+    """
+    Pads, crops and (optionally) horizontally flips images in a single pass.
+
+    Row and column indices refer to the top-left corner of the crop in the
+    padded image. The crop size is taken from the shape of the outputs.
+    The inputs need not be contiguous, so batch slices can be passed as is.
+
+    Args:
+        inputs (numpy.ndarray[ndim=5]):
+            5 dimensional Numpy array
+        padding (int):
+            number of pixels padded on all sides of the inputs
+        value (float):
+            value used for the padded pixels
+        row_indices (numpy.ndarray[ndim=1]):
+            1D Numpy array containing location of top-left row positions
+            with inputs.shape[1] elements (one for each item in batch)
+        col_indices (numpy.ndarray[ndim=1]):
+            1D Numpy array containing location of top-left column positions
+            with inputs.shape[1] elements (one for each item in batch)
+        flip (numpy.ndarray[ndim=1]):
+            1D uint8 Numpy array with inputs.shape[1] elements. Crops are
+            flipped horizontally where it is non-zero.
+        outputs (numpy.ndarray[ndim=5]):
+            5 dimensional Numpy array
+    """
+    cdef int batch_size = row_indices.shape[0]
+    cdef int time_steps = inputs.shape[0]
+    cdef int in_h = inputs.shape[2]
+    cdef int in_w = inputs.shape[3]
+    cdef int num_channels = inputs.shape[4]
+    cdef int height = outputs.shape[2]
+    cdef int width = outputs.shape[3]
+    cdef int start_row, start_col, i, k, l, c, t, in_y, in_x
+    cdef DTYPE_t pad_value = <DTYPE_t>value
+    with nogil:
+        for i in range(batch_size):
+            start_row = row_indices[i] - padding
+            start_col = col_indices[i] - padding
+            for t in range(0, time_steps):
+                for k in range(0, height):
+                    in_y = k + start_row
+                    for l in range(0, width):
+                        if flip[i]:
+                            in_x = width - 1 - l + start_col
+                        else:
+                            in_x = l + start_col
+                        if 0 <= in_y < in_h and 0 <= in_x < in_w:
+                            for c in range(0, num_channels):
+                                outputs[t, i, k, l, c] = inputs[t, i, in_y,
+                                                                in_x, c]
+                        else:
+                            for c in range(0, num_channels):
+                                outputs[t, i, k, l, c] = pad_value
+
 # -------------------------- Caffe2-based routines -------------------------- #
 # Please see Third Party License file for license information
 
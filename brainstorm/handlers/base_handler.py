@@ -116,7 +116,8 @@ class Handler(Describable):
         """Copy the contents of one array to another.
 
         Both source and destination arrays must be of this handler's supported
-        type and have the same shape.
+        type and have the same shape. Column slices of matrices like
+        ``m[:, :k]`` can be used as well.
 
         Args:
             dest (array_type): Destination array.
@@ -153,6 +154,21 @@ class Handler(Describable):
                         Numpy array.
         """
 
+    @abc.abstractmethod
+    def create_indices_from_numpy(self, arr):
+        """Create a new array of integer indices from a Numpy array.
+
+        Unlike :meth:`create_from_numpy` the entries are not converted to the
+        dtype of this handler. This is used for the indices of a
+        :class:`brainstorm.utils.SparseArray`.
+
+        Args:
+            arr (numpy.ndarray): Numpy array of integer values.
+        Returns:
+            array_type: New array of integers with the same shape and entries
+                        as the given Numpy array.
+        """
+
     @abc.abstractmethod
     def fill(self, mem, val):
         """Fill an array with a given value.
@@ -284,6 +300,8 @@ class Handler(Describable):
     def add_tt(self, a, b, out):
         """Add two tensors element-wise,
 
+        Column slices of matrices like ``m[:, :k]`` can be used as well.
+
         Args:
             a (array_type): First array.
             b (array_type): Second array.
@@ -326,6 +344,75 @@ class Handler(Describable):
             None
         """
 
+    @abc.abstractmethod
+    def batchnorm_backward(self, x_hat, std, gamma, dout, dx, dgamma, dbeta):
+        """Add the derivatives of a batch normalization to arrays.
+
+        Adds the gradients wrt. gamma and beta to :attr:`dgamma` and
+        :attr:`dbeta`, and the deltas wrt. the inputs to :attr:`dx`, which
+        are given by
+        `gamma / std * (dout - mean(dout) - x_hat * mean(dout * x_hat))`
+        where the means are taken over the first dimension.
+
+        Args:
+            x_hat (array_type): Normalized inputs of shape (N, F) as computed
+                                by :meth:`batchnorm_forward_train`.
+            std (array_type): Batch standard deviation of shape (F,).
+            gamma (array_type): Scale of shape (F,).
+            dout (array_type): Deltas wrt. the outputs of shape (N, F).
+            dx (array_type): Array of shape (N, F) to which the deltas wrt.
+                             the inputs are added.
+            dgamma (array_type): Array of shape (F,) to which the gradient
+                                 wrt. gamma is added.
+            dbeta (array_type): Array of shape (F,) to which the gradient
+                                wrt. beta is added.
+        Returns:
+            None
+        """
+
+    @abc.abstractmethod
+    def batchnorm_forward_infer(self, x, gamma, beta, mean, std, out):
+        """Normalize a matrix using given statistics, then scale and shift.
+
+        Computes `out = gamma * (x - mean) / std + beta` in a single pass.
+
+        Args:
+            x (array_type): Input array of shape (N, F).
+            gamma (array_type): Scale of shape (F,).
+            beta (array_type): Shift of shape (F,).
+            mean (array_type): Mean of shape (F,).
+            std (array_type): Standard deviation of shape (F,).
+            out (array_type): Output array of shape (N, F).
+        Returns:
+            None
+        """
+
+    @abc.abstractmethod
+    def batchnorm_forward_train(self, x, gamma, beta, epsilon, mean, std,
+                                x_hat, out):
+        """Normalize a matrix using its batch statistics, then scale and
+        shift.
+
+        The mean and variance of each column are computed with a numerically
+        stable single-pass (Welford) algorithm. Then
+        `x_hat = (x - mean) / std` with `std = sqrt(variance + epsilon)` and
+        `out = gamma * x_hat + beta` are computed.
+
+        Args:
+            x (array_type): Input array of shape (N, F).
+            gamma (array_type): Scale of shape (F,).
+            beta (array_type): Shift of shape (F,).
+            epsilon (float): Added to the variance for numerical stability.
+            mean (array_type): Output array for the mean of shape (F,).
+            std (array_type): Output array for the standard deviation of
+                              shape (F,).
+            x_hat (array_type): Output array for the normalized inputs of
+                                shape (N, F).
+            out (array_type): Output array of shape (N, F).
+        Returns:
+            None
+        """
+
     @abc.abstractmethod
     def binarize_v(self, v, out):
         """Convert a column vector into a matrix of one-hot row vectors.
@@ -427,7 +514,9 @@ class Handler(Describable):
     def dot_add_mm(self, a, b, out, transa=False, transb=False):
         """Multiply two matrices and add to a matrix.
 
-        Only 2D arrays (matrices) are supported.
+        Only 2D arrays (matrices) are supported. Their rows need not be
+        contiguous to each other, so column slices like ``m[:, :k]`` can be
+        used as well.
 
         Args:
             a (array_type): First matrix.
@@ -444,7 +533,9 @@ class Handler(Describable):
     def dot_mm(self, a, b, out, transa=False, transb=False):
         """Multiply two matrices.
 
-        Only 2D arrays (matrices) are supported.
+        Only 2D arrays (matrices) are supported. Their rows need not be
+        contiguous to each other, so column slices like ``m[:, :k]`` can be
+        used as well.
 
         Args:
             a (array_type): First matrix.
@@ -490,6 +581,78 @@ class Handler(Describable):
             None
         """
 
+    @abc.abstractmethod
+    def dropout_backward(self, a, seed, keep_prob, out):
+        """Add deltas to an array using the dropout mask of a seed.
+
+        Adds `a * mask / keep_prob` to :attr:`out`, where the mask is
+        regenerated from :attr:`seed` in the same way as in
+        :meth:`dropout_forward`.
+
+        Args:
+            a (array_type): Deltas wrt. the outputs of the dropout.
+            seed (array_type): Array of shape (1,) that contains the seed
+                               used in :meth:`dropout_forward`.
+            keep_prob (float): Probability of an element being kept.
+            out (array_type): Array to which the deltas are added.
+        Returns:
+            None
+        """
+
+    @abc.abstractmethod
+    def dropout_backward_inplace(self, a, seed, keep_prob):
+        """Turn the deltas of a dropout in place into the deltas wrt. its
+        inputs.
+
+        Overwrites :attr:`a` with `a * mask / keep_prob`, where the mask is
+        regenerated from :attr:`seed` like in :meth:`dropout_backward`.
+
+        Args:
+            a (array_type): Deltas wrt. the outputs of the dropout, which are
+                            overwritten.
+            seed (array_type): Array of shape (1,) that contains the seed
+                               used in :meth:`dropout_forward`.
+            keep_prob (float): Probability of an element being kept.
+        Returns:
+            None
+        """
+
+    @abc.abstractmethod
+    def dropout_forward(self, a, seed, keep_prob, out):
+        """Apply dropout to an array and scale the kept elements.
+
+        A new seed is drawn and stored in :attr:`seed`. Each element `i` is
+        kept if a counter-based random number computed from the seed and `i`
+        is smaller than :attr:`keep_prob`. The kept elements are scaled by
+        `1 / keep_prob` and the others are set to zero. Only the seed has to
+        be stored to regenerate the same mask in :meth:`dropout_backward`.
+
+        Args:
+            a (array_type): Input array.
+            seed (array_type): Array of shape (1,) for storing the seed.
+            keep_prob (float): Probability of an element being kept.
+            out (array_type): Output array.
+        Returns:
+            None
+        """
+
+    @abc.abstractmethod
+    def equal_vv(self, a, b, out):
+        """Compare every element of a column vector with a row vector.
+
+        Therefore, `out[i, j] = 1`, if a[i, 0] equals b[0, j]
+        `out[i, j] = 0`, otherwise.
+
+        Args:
+            a (array_type): Column vector (2D array with a single column).
+            b (array_type): Row vector (2D array with a single row).
+            out (array_type): Matrix (2D array) into which the output is
+                              placed. It has as many rows as :attr:`a` and as
+                              many columns as :attr:`b`.
+        Returns:
+            None
+        """
+
     @abc.abstractmethod
     def fill_gaussian(self, mean, std, out):
         """Fill an array with values drawn from a Gaussian distribution.
@@ -503,6 +666,26 @@ class Handler(Describable):
             None
         """
 
+    @abc.abstractmethod
+    def gather_rows(self, m, v, out):
+        """Copy rows of a matrix using indices from a vector.
+
+        :attr:`v` must be a column vector with one row for each row of
+        :attr:`out`. Row `i` of :attr:`out` is set to the row `v[i, 0]` of
+        :attr:`m`, such that `out[i, :] = m[v[i, 0], :]`.
+
+        Args:
+            m (array_type): Matrix (2D array) whose rows should be copied.
+            v (array_type): Column vector (2D array with a single column)
+                            whose values are used as row indices into
+                            :attr:`m`.
+            out (array_type): Matrix into which the output is placed. It must
+                              have as many columns as :attr:`m` and as many
+                              rows as :attr:`v`.
+        Returns:
+            None
+        """
+
     @abc.abstractmethod
     def generate_probability_mask(self, mask, probability):
         """Fill an array with zeros and ones.
@@ -693,6 +876,43 @@ class Handler(Describable):
             None
         """
 
+    @abc.abstractmethod
+    def sample_indices(self, n, out):
+        """Draw distinct indices uniformly at random.
+
+        Fills the column vector :attr:`out` with distinct values drawn
+        uniformly (without replacement) from `0, ..., n - 1` using the random
+        state of this handler, sorted in ascending order.
+
+        Args:
+            n (int): Number of indices to draw from. Must be at least the
+                     number of rows of :attr:`out`.
+            out (array_type): Column vector (2D array with a single column)
+                              into which the indices are placed.
+        Returns:
+            None
+        """
+
+    @abc.abstractmethod
+    def scatter_add_rows(self, m, v, out):
+        """Add the rows of a matrix to rows of another one given by indices.
+
+        This is the counterpart of :meth:`gather_rows`. Row `i` of :attr:`m`
+        is added to row `v[i, 0]` of :attr:`out`, such that
+        `out[v[i, 0], :] += m[i, :]`. Rows with repeated indices are all
+        accumulated.
+
+        Args:
+            m (array_type): Matrix (2D array) whose rows should be added.
+            v (array_type): Column vector (2D array with a single column)
+                            with as many rows as :attr:`m`, whose values are
+                            used as row indices into :attr:`out`.
+            out (array_type): Matrix to which the rows are added. It must
+                              have as many columns as :attr:`m`.
+        Returns:
+            None
+        """
+
     @abc.abstractmethod
     def sign_t(self, a, out):
         """Compute an element-wise indication of the sign of a number.
@@ -708,6 +928,39 @@ class Handler(Describable):
             None
         """
 
+    @abc.abstractmethod
+    def sparse_dot_mm(self, a, b, out, transb=False):
+        """Multiply a sparse matrix with a dense matrix.
+
+        Computes `out = a * b` (or `out = a * b.T` if :attr:`transb` is set).
+
+        Args:
+            a (brainstorm.utils.SparseArray): Sparse 2D matrix whose arrays
+                belong to this handler.
+            b (array_type): Dense 2D matrix.
+            out (array_type): Array into which the output is placed.
+            transb (bool): Whether to transpose :attr:`b`.
+        Returns:
+            None
+        """
+
+    @abc.abstractmethod
+    def sparse_dot_add_mm_transposed(self, a, b, out):
+        """Add the product of a transposed dense and a sparse matrix to out.
+
+        Computes `out += b.T * a`. This is the gradient wrt. the weights of
+        :meth:`sparse_dot_mm` with :attr:`transb` set, and only touches the
+        columns of :attr:`out` for which :attr:`a` has non-zero entries.
+
+        Args:
+            a (brainstorm.utils.SparseArray): Sparse 2D matrix whose arrays
+                belong to this handler.
+            b (array_type): Dense 2D matrix with as many rows as :attr:`a`.
+            out (array_type): Array to which the output is added.
+        Returns:
+            None
+        """
+
     @abc.abstractmethod
     def split_add_tt(self, x, out_a, out_b):
         """Split array x along the last axis and add the parts to out_i.
@@ -850,6 +1103,41 @@ class Handler(Describable):
             None
         """
 
+    @abc.abstractmethod
+    def softmax_ce_forward(self, m, v, out, loss):
+        """Compute the softmax over the last dimension of a matrix together
+        with the multinomial cross-entropy loss wrt. class indices.
+
+        The loss of row `i` is computed as `log(sum_j(exp(m[i, j]))) -
+        m[i, v[i]]` using the log-sum-exp trick, which is numerically exact.
+
+        Args:
+            m (array_type): Input array of shape (N, C).
+            v (array_type): Class indices of shape (N, 1).
+            out (array_type): Output array for the softmax of shape (N, C).
+            loss (array_type): Output array for the loss of shape (N, 1).
+        Returns:
+            None
+        """
+
+    @abc.abstractmethod
+    def softmax_ce_backward(self, m, v, dloss, out):
+        """Add the derivatives of the multinomial cross-entropy loss wrt.
+        the inputs of the softmax to an array.
+
+        This computes `out += (m - onehot(v)) * dloss` without materializing
+        the one-hot encoding of the class indices.
+
+        Args:
+            m (array_type): Output of the softmax of shape (N, C).
+            v (array_type): Class indices of shape (N, 1).
+            dloss (array_type): Deltas of the loss of shape (N, 1).
+            out (array_type): Array of shape (N, C) to which the derivatives
+                              are added.
+        Returns:
+            None
+        """
+
     @abc.abstractmethod
     def tanh(self, x, y):
         """Compute the tanh (hyperbolic tangent) function.
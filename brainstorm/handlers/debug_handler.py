@@ -5,6 +5,7 @@ from __future__ import division, print_function, unicode_literals
 import numpy as np
 
 from brainstorm.handlers.base_handler import Handler
+from brainstorm.utils import SparseArray
 
 
 # ############################## Debug Array ################################ #
@@ -104,6 +105,12 @@ class DebugHandler(Handler):
         assert isinstance(arr, np.ndarray)
         return DebugArray(self.handler.create_from_numpy(arr))
 
+    def create_indices_from_numpy(self, arr):
+        assert isinstance(arr, np.ndarray)
+        assert np.all(arr == np.round(arr)), \
+            "indices must be integers but were {}".format(arr)
+        return DebugArray(self.handler.create_indices_from_numpy(arr))
+
     @check_for_inf_or_nan
     def fill(self, mem, val):
         assert_debug_arrays(mem)
@@ -203,6 +210,43 @@ class DebugHandler(Handler):
         self.handler.avgpool2d_forward_batch(inputs.array, window,
                                              outputs.array, padding, stride)
 
+    @check_for_inf_or_nan
+    def batchnorm_backward(self, x_hat, std, gamma, dout, dx, dgamma, dbeta):
+        assert_debug_arrays(x_hat, std, gamma, dout, dx, dgamma, dbeta)
+        assert_shapes_equal(x_hat, dout, dx)
+        assert_shapes_equal(std, gamma, dgamma, dbeta)
+        assert len(x_hat.shape) == 2, "len({}) != 2".format(x_hat.shape)
+        assert std.shape == (x_hat.shape[1],)
+        self.handler.batchnorm_backward(x_hat.array, std.array, gamma.array,
+                                        dout.array, dx.array, dgamma.array,
+                                        dbeta.array)
+
+    @check_for_inf_or_nan
+    def batchnorm_forward_infer(self, x, gamma, beta, mean, std, out):
+        assert_debug_arrays(x, gamma, beta, mean, std, out)
+        assert_shapes_equal(x, out)
+        assert_shapes_equal(gamma, beta, mean, std)
+        assert len(x.shape) == 2, "len({}) != 2".format(x.shape)
+        assert mean.shape == (x.shape[1],)
+        self.handler.batchnorm_forward_infer(x.array, gamma.array,
+                                             beta.array, mean.array,
+                                             std.array, out.array)
+
+    @check_for_inf_or_nan
+    def batchnorm_forward_train(self, x, gamma, beta, epsilon, mean, std,
+                                x_hat, out):
+        assert_debug_arrays(x, gamma, beta, mean, std, x_hat, out)
+        assert_shapes_equal(x, x_hat, out)
+        assert_shapes_equal(gamma, beta, mean, std)
+        assert len(x.shape) == 2, "len({}) != 2".format(x.shape)
+        assert mean.shape == (x.shape[1],)
+        assert_is_scalar(epsilon)
+        assert epsilon >= 0.0
+        self.handler.batchnorm_forward_train(x.array, gamma.array,
+                                             beta.array, epsilon, mean.array,
+                                             std.array, x_hat.array,
+                                             out.array)
+
     @check_for_inf_or_nan
     def binarize_v(self, v, out):
         assert_debug_arrays(v, out)
@@ -315,12 +359,57 @@ class DebugHandler(Handler):
         assert_shapes_equal(a, b, out)
         self.handler.divide_tt(a.array, b.array, out.array)
 
+    @check_for_inf_or_nan
+    def dropout_backward(self, a, seed, keep_prob, out):
+        assert_debug_arrays(a, seed, out)
+        assert_shapes_equal(a, out)
+        assert seed.shape == (1,), "invalid seed shape {}".format(seed.shape)
+        assert_is_scalar(keep_prob)
+        assert 0.0 < keep_prob <= 1.0, "{}".format(keep_prob)
+        self.handler.dropout_backward(a.array, seed.array, keep_prob,
+                                      out.array)
+
+    @check_for_inf_or_nan
+    def dropout_backward_inplace(self, a, seed, keep_prob):
+        assert_debug_arrays(a, seed)
+        assert seed.shape == (1,), "invalid seed shape {}".format(seed.shape)
+        assert_is_scalar(keep_prob)
+        assert 0.0 < keep_prob <= 1.0, "{}".format(keep_prob)
+        self.handler.dropout_backward_inplace(a.array, seed.array, keep_prob)
+
+    @check_for_inf_or_nan
+    def dropout_forward(self, a, seed, keep_prob, out):
+        assert_debug_arrays(a, seed, out)
+        assert_shapes_equal(a, out)
+        assert seed.shape == (1,), "invalid seed shape {}".format(seed.shape)
+        assert_is_scalar(keep_prob)
+        assert 0.0 < keep_prob <= 1.0, "{}".format(keep_prob)
+        self.handler.dropout_forward(a.array, seed.array, keep_prob,
+                                     out.array)
+
+    @check_for_inf_or_nan
+    def equal_vv(self, a, b, out):
+        assert_debug_arrays(a, b, out)
+        assert len(a.shape) == len(b.shape) == len(out.shape) == 2
+        assert a.shape == (out.shape[0], 1)
+        assert b.shape == (1, out.shape[1])
+        self.handler.equal_vv(a.array, b.array, out.array)
+
     @check_for_inf_or_nan
     def fill_gaussian(self, mean, std, out):
         assert_debug_arrays(out)
         assert std >= 0.0
         self.handler.fill_gaussian(mean, std, out.array)
 
+    @check_for_inf_or_nan
+    def gather_rows(self, m, v, out):
+        assert_debug_arrays(m, v, out)
+        assert len(m.shape) == len(v.shape) == len(out.shape) == 2
+        assert v.shape == (out.shape[0], 1)
+        assert m.shape[1] == out.shape[1]
+        assert_valid_row_indices(v, m.shape[0])
+        self.handler.gather_rows(m.array, v.array, out.array)
+
     @check_for_inf_or_nan
     def generate_probability_mask(self, mask, probability):
         assert_debug_arrays(mask)
@@ -432,12 +521,52 @@ class DebugHandler(Handler):
         assert_shapes_equal(a, b, out)
         self.handler.mult_tt(a.array, b.array, out.array)
 
+    @check_for_inf_or_nan
+    def sample_indices(self, n, out):
+        assert_debug_arrays(out)
+        assert len(out.shape) == 2 and out.shape[1] == 1
+        assert isinstance(n, int) and n >= out.shape[0]
+        self.handler.sample_indices(n, out.array)
+
+    @check_for_inf_or_nan
+    def scatter_add_rows(self, m, v, out):
+        assert_debug_arrays(m, v, out)
+        assert len(m.shape) == len(v.shape) == len(out.shape) == 2
+        assert v.shape == (m.shape[0], 1)
+        assert m.shape[1] == out.shape[1]
+        assert_valid_row_indices(v, out.shape[0])
+        self.handler.scatter_add_rows(m.array, v.array, out.array)
+
     @check_for_inf_or_nan
     def sign_t(self, a, out):
         assert_debug_arrays(a, out)
         assert_shapes_equal(a, out)
         self.handler.sign_t(a.array, out.array)
 
+    @check_for_inf_or_nan
+    def sparse_dot_mm(self, a, b, out, transb=False):
+        assert_sparse_debug_array(a)
+        assert_debug_arrays(b, out)
+        assert len(b.shape) == 2, "len({}) != 2".format(b.shape)
+        assert transb in [True, False]
+        b1, b2 = (b.shape[1], b.shape[0]) if transb else b.shape
+        assert a.shape[1] == b1, "{} @ {}".format(a.shape, b.shape)
+        assert out.shape == (a.shape[0], b2), "{} != {}".format(
+            out.shape, (a.shape[0], b2))
+        self.handler.sparse_dot_mm(unwrap_sparse(a), b.array, out.array,
+                                   transb)
+
+    @check_for_inf_or_nan
+    def sparse_dot_add_mm_transposed(self, a, b, out):
+        assert_sparse_debug_array(a)
+        assert_debug_arrays(b, out)
+        assert len(b.shape) == 2, "len({}) != 2".format(b.shape)
+        assert b.shape[0] == a.shape[0], "{} != {}".format(b.shape, a.shape)
+        assert out.shape == (b.shape[1], a.shape[1]), "{} != {}".format(
+            out.shape, (b.shape[1], a.shape[1]))
+        self.handler.sparse_dot_add_mm_transposed(unwrap_sparse(a), b.array,
+                                                  out.array)
+
     @check_for_inf_or_nan
     def split_add_tt(self, x, out_a, out_b):
         assert(out_a.shape[-1] + out_b.shape[-1] == x.shape[-1])
@@ -547,6 +676,28 @@ class DebugHandler(Handler):
         assert len(m.shape) == 2, "len({}) != 2".format(m.shape)
         self.handler.softmax_m(m.array, out.array)
 
+    @check_for_inf_or_nan
+    def softmax_ce_forward(self, m, v, out, loss):
+        assert_debug_arrays(m, v, out, loss)
+        assert_shapes_equal(m, out)
+        assert_shapes_equal(v, loss)
+        assert len(m.shape) == 2, "len({}) != 2".format(m.shape)
+        assert v.shape == (m.shape[0], 1)
+        assert_valid_row_indices(v, m.shape[1])
+        self.handler.softmax_ce_forward(m.array, v.array, out.array,
+                                        loss.array)
+
+    @check_for_inf_or_nan
+    def softmax_ce_backward(self, m, v, dloss, out):
+        assert_debug_arrays(m, v, dloss, out)
+        assert_shapes_equal(m, out)
+        assert_shapes_equal(v, dloss)
+        assert len(m.shape) == 2, "len({}) != 2".format(m.shape)
+        assert v.shape == (m.shape[0], 1)
+        assert_valid_row_indices(v, m.shape[1])
+        self.handler.softmax_ce_backward(m.array, v.array, dloss.array,
+                                         out.array)
+
 
 # ############################ Helper Methods ############################### #
 
@@ -580,3 +731,26 @@ def assert_shapes_equal(ref_shape, *shapes):
 def assert_is_scalar(s):
     assert isinstance(s, (int, float)), \
         "{} is not a scalar but a {}".format(s, type(s))
+
+
+def assert_valid_row_indices(v, nr_rows):
+    indices = v.array
+    assert np.all(indices == np.round(indices)), \
+        "indices must be integers but were {}".format(indices)
+    assert np.all((0 <= indices) & (indices < nr_rows)), \
+        "indices must be in [0, {}) but were {}".format(nr_rows, indices)
+
+
+def assert_sparse_debug_array(a):
+    assert isinstance(a, SparseArray), \
+        "{} is no SparseArray but a {}".format(a, type(a))
+    assert_debug_arrays(a.data, a.indices, a.indptr)
+    assert len(a.shape) == 2, "len({}) != 2".format(a.shape)
+    assert a.indptr.shape == (a.shape[0] + 1,)
+    assert a.data.shape == a.indices.shape == (a.nnz,)
+    assert_valid_row_indices(a.indices.reshape((a.nnz, 1)), a.shape[1])
+
+
+def unwrap_sparse(a):
+    return SparseArray(a.data.array, a.indices.array, a.indptr.array,
+                       a.shape)
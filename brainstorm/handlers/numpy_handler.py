@@ -54,6 +54,9 @@ class NumpyHandler(Handler):
     def create_from_numpy(self, arr):
         return arr.copy()
 
+    def create_indices_from_numpy(self, arr):
+        return arr.astype(np.int64)
+
     def fill(self, mem, val):
         mem.fill(val)
 
@@ -62,7 +65,7 @@ class NumpyHandler(Handler):
         return arr.copy()
 
     def set_from_numpy(self, mem, arr):
-        mem[:] = arr.astype(self.dtype)
+        mem[:] = arr
 
     # ---------------------------- Debug helpers ---------------------------- #
 
@@ -96,6 +99,33 @@ class NumpyHandler(Handler):
         brainstorm.handlers._cpuop.avgpool_forward(inputs, window, outputs,
                                                    padding, stride)
 
+    def batchnorm_backward(self, x_hat, std, gamma, dout, dx, dgamma, dbeta):
+        m = x_hat.shape[0]
+        dbeta_b = np.sum(dout, axis=0)
+        dgamma_b = np.einsum('ij,ij->j', dout, x_hat)
+        dgamma += dgamma_b
+        dbeta += dbeta_b
+        # dx += gamma / std * (dout - x_hat * dgamma_b / m - dbeta_b / m)
+        scale = gamma / std
+        _batchnorm_add_input_deltas(x_hat, dout, scale,
+                                    scale * dgamma_b / m,
+                                    scale * dbeta_b / m, dx)
+
+    def batchnorm_forward_infer(self, x, gamma, beta, mean, std, out):
+        scale = gamma / std
+        np.multiply(x, scale, out=out)
+        out += beta - mean * scale
+
+    def batchnorm_forward_train(self, x, gamma, beta, epsilon, mean, std,
+                                x_hat, out):
+        _welford_mean_and_var(x, mean, std)
+        std += epsilon
+        np.sqrt(std, std)
+        np.subtract(x, mean, out=x_hat)
+        x_hat /= std
+        np.multiply(x_hat, gamma, out=out)
+        out += beta
+
     def binarize_v(self, v, out):
         eye = np.eye(out.shape[1], dtype=self.dtype)
         out[:] = eye[v.astype(np.int32)].reshape(out.shape)
@@ -190,14 +220,35 @@ class NumpyHandler(Handler):
     def divide_tt(self, a, b, out):
         out[:] = a / b
 
+    def dropout_backward(self, a, seed, keep_prob, out):
+        keep = _counter_uniform(int(seed[0]), a.size) < keep_prob
+        out += a * keep.reshape(a.shape) / keep_prob
+
+    def dropout_backward_inplace(self, a, seed, keep_prob):
+        keep = _counter_uniform(int(seed[0]), a.size) < keep_prob
+        a *= keep.reshape(a.shape) / keep_prob
+
+    def dropout_forward(self, a, seed, keep_prob, out):
+        seed[0] = self.rnd.randint(1 << 24)
+        keep = _counter_uniform(int(seed[0]), a.size) < keep_prob
+        out[:] = a * keep.reshape(a.shape) / keep_prob
+
+    def equal_vv(self, a, b, out):
+        np.equal(a, b, out=out, casting='unsafe')
+
     def fill_gaussian(self, mean, std, out):
-        out[:] = std * self.rnd.standard_normal(out.shape) + mean
+        out[:] = std * self.rnd.standard_normal(out.shape,
+                                                dtype=self.dtype) + mean
 
     def fill_if(self, mem, val, cond):
         mem[cond != 0] = val
 
+    def gather_rows(self, m, v, out):
+        np.take(m, v[:, 0].astype(np.int64), axis=0, out=out)
+
     def generate_probability_mask(self, mask, probability):
-        mask[:] = self.rnd.uniform(size=mask.shape) < probability
+        mask[:] = self.rnd.random_sample(mask.shape,
+                                         dtype=self.dtype) < probability
 
     def index_m_by_v(self, m, v, out):
         out[:, 0] = m[np.arange(m.shape[0]), v.squeeze().astype(np.int32)]
@@ -245,9 +296,32 @@ class NumpyHandler(Handler):
     def mult_tt(self, a, b, out):
         np.multiply(a, b, out)
 
+    def sample_indices(self, n, out):
+        out[:, 0] = np.sort(self.rnd.choice(n, out.shape[0], replace=False))
+
+    def scatter_add_rows(self, m, v, out):
+        np.add.at(out, v[:, 0].astype(np.int64), m)
+
     def sign_t(self, a, out):
         np.sign(a, out=out)
 
+    def sparse_dot_mm(self, a, b, out, transb=False):
+        out.fill(0.0)
+        starts = a.indptr[:-1].astype(np.int64)
+        non_empty = a.indptr[1:] > a.indptr[:-1]
+        if not non_empty.any():
+            return
+        b_rows = b.T if transb else b
+        contributions = a.data[:, None] * b_rows[a.indices.astype(np.int64)]
+        # rows are stored consecutively, so they can be summed segment-wise
+        out[non_empty] = np.add.reduceat(contributions, starts[non_empty])
+
+    def sparse_dot_add_mm_transposed(self, a, b, out):
+        rows = np.repeat(np.arange(a.shape[0]),
+                         np.diff(a.indptr).astype(np.int64))
+        np.add.at(out.T, a.indices.astype(np.int64),
+                  a.data[:, None] * b[rows])
+
     def split_add_tt(self, x, out_a, out_b):
         oa = out_a.reshape(-1, out_a.shape[-1])
         ob = out_b.reshape(-1, out_b.shape[-1])
@@ -294,6 +368,21 @@ class NumpyHandler(Handler):
         e = np.exp(m - maxes)
         out[:] = e / np.sum(e, axis=1, keepdims=True)
 
+    def softmax_ce_forward(self, m, v, out, loss):
+        rows = np.arange(m.shape[0])
+        idx = v[:, 0].astype(np.int64)
+        maxes = np.amax(m, axis=1, keepdims=True)
+        shifted = m - maxes
+        e = np.exp(shifted)
+        sums = np.sum(e, axis=1, keepdims=True)
+        loss[:, 0] = np.log(sums[:, 0]) - shifted[rows, idx]
+        out[:] = e / sums
+
+    def softmax_ce_backward(self, m, v, dloss, out):
+        rows = np.arange(m.shape[0])
+        out += m * dloss
+        out[rows, v[:, 0].astype(np.int64)] -= dloss[:, 0]
+
     def tanh(self, x, y):
         np.tanh(x, y)
 
@@ -308,3 +397,63 @@ class NumpyHandler(Handler):
         # TODO: Optimize this implementation
         dx[:] = dy * (y >= 0.) + dy * (y + 1.) * (y < 0.)
 
+
+def _hash32(x):
+    """The lowbias32 integer hash for arrays of type uint32."""
+    x = x ^ (x >> np.uint32(16))
+    x = x * np.uint32(0x7feb352d)
+    x = x ^ (x >> np.uint32(15))
+    x = x * np.uint32(0x846ca68b)
+    return x ^ (x >> np.uint32(16))
+
+
+def _counter_uniform(seed, size):
+    """Uniform random numbers in [0, 1) computed from a seed and the index.
+
+    Must produce the same numbers as the dropout kernels of the PyCudaHandler.
+    """
+    key = _hash32(np.array([seed], dtype=np.uint32))
+    x = _hash32(_hash32(np.arange(size, dtype=np.uint32) ^ key) + key)
+    return (x >> np.uint32(8)) * (1.0 / (1 << 24))
+
+
+def _batchnorm_add_input_deltas(x_hat, dout, scale, x_hat_scale, shift, dx,
+                                block_size=1024):
+    """Compute dx += dout * scale - x_hat * x_hat_scale - shift.
+
+    The rows are processed in blocks using a single buffer of the size of a
+    block, so no temporaries of the size of the matrix are created.
+    """
+    buffer = np.empty((min(block_size, dx.shape[0]), dx.shape[1]),
+                      dtype=dx.dtype)
+    for start in range(0, dx.shape[0], block_size):
+        rows = slice(start, start + block_size)
+        block = buffer[:dx[rows].shape[0]]
+        np.multiply(dout[rows], scale, out=block)
+        dx[rows] += block
+        np.multiply(x_hat[rows], x_hat_scale, out=block)
+        block += shift
+        dx[rows] -= block
+
+
+def _welford_mean_and_var(x, mean, var, block_size=1024):
+    """Compute the column-wise mean and variance of a matrix.
+
+    The rows are processed in blocks that fit into the cache, and the
+    statistics of the blocks are merged using the parallel variant of
+    Welford's algorithm (Chan et al.), so the matrix is only read once.
+    """
+    n = 0
+    mean.fill(0.)
+    var.fill(0.)  # holds the sum of squared differences until the end
+    for start in range(0, x.shape[0], block_size):
+        block = x[start:start + block_size]
+        n_block = block.shape[0]
+        block_mean = np.mean(block, axis=0)
+        delta = block_mean - mean
+        total = n + n_block
+        var += np.sum(np.square(block - block_mean), axis=0)
+        var += np.square(delta) * (n * n_block / total)
+        mean += delta * (n_block / total)
+        n = total
+    var /= n
@@ -4,6 +4,7 @@ from __future__ import division, print_function
 
 import numpy as np
 import pycuda
+import skcuda.cublas as cublas
 import skcuda.linalg as culinalg
 import skcuda.misc as cumisc
 from pycuda import cumath, gpuarray
@@ -82,6 +83,9 @@ class PyCudaHandler(Handler):
 
     def copy_to(self, src, dest):
         # Copy data from src to dest (both must be GPUArrays)
+        if not (src.flags.c_contiguous and dest.flags.c_contiguous):
+            self._strided_geam(1.0, src, 0.0, src, dest)
+            return
         pycuda.driver.memcpy_dtod(dest.gpudata, src.gpudata, dest.nbytes)
 
     def copy_to_if(self, src, dest, cond):
@@ -90,6 +94,9 @@ class PyCudaHandler(Handler):
     def create_from_numpy(self, arr):
         return gpuarray.to_gpu(arr.astype(self.dtype))
 
+    def create_indices_from_numpy(self, arr):
+        return gpuarray.to_gpu(arr.astype(np.int32))
+
     def fill(self, mem, val):
         mem.fill(val)
 
@@ -104,7 +111,7 @@ class PyCudaHandler(Handler):
         assert mem.shape == arr.shape, "Shape of destination ({}) != Shape " \
                                        "of source ({})".format(mem.shape,
                                                                arr.shape)
-        mem.set(arr.astype(self.dtype))
+        mem.set(np.ascontiguousarray(arr, dtype=self.dtype))
 
     # ---------------------------- Debug helpers ---------------------------- #
 
@@ -128,6 +135,10 @@ class PyCudaHandler(Handler):
         add_st_kernel(s, t, out)
 
     def add_tt(self, a, b, out):
+        if not (a.flags.c_contiguous and b.flags.c_contiguous and
+                out.flags.c_contiguous):
+            self._strided_geam(1.0, a, 1.0, b, out)
+            return
         add_mm_kernel(a, b, out)
 
     def avgpool2d_backward_batch(self, inputs, window, outputs, padding,
@@ -160,6 +171,39 @@ class PyCudaHandler(Handler):
                                block=(NUM_CUDA_THREADS, 1, 1),
                                grid=(get_blocks(outputs.size), 1))
 
+    def batchnorm_backward(self, x_hat, std, gamma, dout, dx, dgamma, dbeta):
+        n, f = x_hat.shape
+        grid = _get_batchnorm_grid(n, f)
+        partials = gpuarray.empty((2, grid[1], f), dtype=self.dtype)
+        sums = gpuarray.empty((2, f), dtype=self.dtype)
+        _batchnorm_backward_partial_impl(
+            x_hat, dout, partials, np.int32(n), np.int32(f),
+            block=(BATCHNORM_COLUMNS, BATCHNORM_ROWS, 1), grid=grid)
+        _batchnorm_backward_merge_impl(partials, sums, np.int32(f),
+                                       np.int32(grid[1]),
+                                       block=(NUM_CUDA_THREADS, 1, 1),
+                                       grid=(get_blocks(f), 1))
+        batchnorm_backward_kernel(x_hat, std, gamma, dout, sums, dx, n, f)
+        add_mm_kernel(dbeta, sums[0], dbeta)
+        add_mm_kernel(dgamma, sums[1], dgamma)
+
+    def batchnorm_forward_infer(self, x, gamma, beta, mean, std, out):
+        batchnorm_infer_kernel(x, gamma, beta, mean, std, out, x.shape[1])
+
+    def batchnorm_forward_train(self, x, gamma, beta, epsilon, mean, std,
+                                x_hat, out):
+        n, f = x.shape
+        grid = _get_batchnorm_grid(n, f)
+        partials = gpuarray.empty((2, grid[1], f), dtype=self.dtype)
+        _welford_partial_impl(x, partials, np.int32(n), np.int32(f),
+                              block=(BATCHNORM_COLUMNS, BATCHNORM_ROWS, 1),
+                              grid=grid)
+        _welford_merge_impl(partials, mean, std, np.float32(epsilon),
+                            np.int32(n), np.int32(f), np.int32(grid[1]),
+                            block=(NUM_CUDA_THREADS, 1, 1),
+                            grid=(get_blocks(f), 1))
+        batchnorm_train_kernel(x, gamma, beta, mean, std, x_hat, out, f)
+
     def binarize_v(self, v, out):
         binarize_v_kernel(out, v, out.shape[0], out.shape[1])
 
@@ -257,26 +301,87 @@ class PyCudaHandler(Handler):
         self.add_mv(flat_outputs, bias, flat_outputs)
 
     def dot_add_mm(self, a, b, out, transa=False, transb=False):
+        if not (a.flags.c_contiguous and b.flags.c_contiguous and
+                out.flags.c_contiguous):
+            self._strided_gemm(a, b, out, transa, transb, beta=1.0)
+            return
         transa = 'T' if transa else 'N'
         transb = 'T' if transb else 'N'
         culinalg.add_dot(a, b, out, transa, transb)
 
     def dot_mm(self, a, b, out, transa=False, transb=False):
+        if not (a.flags.c_contiguous and b.flags.c_contiguous and
+                out.flags.c_contiguous):
+            self._strided_gemm(a, b, out, transa, transb, beta=0.0)
+            return
         transa = 'T' if transa else 'N'
         transb = 'T' if transb else 'N'
         culinalg.dot(a, b, transa=transa, transb=transb, out=out)
 
+    def _strided_gemm(self, a, b, out, transa, transb, beta):
+        """Compute out = op(a) * op(b) + beta * out for matrices whose rows
+        may be strided, like column slices.
+
+        cuBLAS works on column-major matrices, so the transposed product
+        op(b).T * op(a).T is computed, which is out in row-major order.
+        """
+        for m in (a, b, out):
+            assert m.strides[1] == m.dtype.itemsize
+        m, n = out.shape
+        k = a.shape[0] if transa else a.shape[1]
+        itemsize = out.dtype.itemsize
+        cublas.cublasSgemm(self.context,
+                           't' if transb else 'n', 't' if transa else 'n',
+                           n, m, k, 1.0,
+                           b.gpudata, b.strides[0] // itemsize,
+                           a.gpudata, a.strides[0] // itemsize,
+                           beta, out.gpudata, out.strides[0] // itemsize)
+
+    def _strided_geam(self, alpha, a, beta, b, out):
+        """Compute out = alpha * a + beta * b for matrices whose rows may be
+        strided, like column slices.
+
+        Like in :meth:`_strided_gemm` the row-major matrices are passed to
+        cuBLAS as their column-major transposes.
+        """
+        for m in (a, b, out):
+            assert m.strides[1] == m.dtype.itemsize
+        rows, cols = out.shape
+        itemsize = out.dtype.itemsize
+        cublas.cublasSgeam(self.context, 'n', 'n', cols, rows,
+                           alpha, a.gpudata, a.strides[0] // itemsize,
+                           beta, b.gpudata, b.strides[0] // itemsize,
+                           out.gpudata, out.strides[0] // itemsize)
+
     def divide_mv(self, m, v, out):
         cumisc.div_matvec(m, v, out=out)
 
     def divide_tt(self, a, b, out):
         div_kernel(a, b, out)
 
+    def dropout_backward(self, a, seed, keep_prob, out):
+        dropout_backward_kernel(a, seed, keep_prob, out)
+
+    def dropout_backward_inplace(self, a, seed, keep_prob):
+        # applies the mask of the seed without drawing a new one
+        dropout_forward_kernel(a, seed, keep_prob, a)
+
+    def dropout_forward(self, a, seed, keep_prob, out):
+        self.rnd.fill_uniform(seed)
+        create_seed_kernel(seed)
+        dropout_forward_kernel(a, seed, keep_prob, out)
+
+    def equal_vv(self, a, b, out):
+        equal_vv_kernel(out, a, b, out.shape[1])
+
     def fill_gaussian(self, mean, std, out):
         self.rnd.fill_normal(out)
         self.mult_st(std, out, out=out)
         self.add_st(mean, out, out=out)
 
+    def gather_rows(self, m, v, out):
+        gather_rows_kernel(out, v, m, out.shape[1])
+
     def generate_probability_mask(self, mask, probability):
         self.rnd.fill_uniform(mask)
         create_probabilistic_mask_kernel(mask, probability, mask)
@@ -351,9 +456,35 @@ class PyCudaHandler(Handler):
     def mult_tt(self, a, b, out):
         mult_tt_kernel(a, b, out)
 
+    def sample_indices(self, n, out):
+        # Floyd's algorithm needs only one random number per index
+        k = out.shape[0]
+        uniform = gpuarray.empty((k,), dtype=np.float32)
+        self.rnd.fill_uniform(uniform)
+        indices = set()
+        for j, u in zip(range(n - k, n), uniform.get()):
+            i = min(int(u * (j + 1)), j)
+            indices.add(j if i in indices else i)
+        self.set_from_numpy(out, np.array(sorted(indices)).reshape(k, 1))
+
+    def scatter_add_rows(self, m, v, out):
+        scatter_add_rows_kernel(m, v, out, m.shape[1])
+
     def sign_t(self, a, out):
         sign_kernel(a, out)
 
+    def sparse_dot_mm(self, a, b, out, transb=False):
+        if transb:
+            sparse_dot_mm_transb_kernel(out, a.data, a.indices, a.indptr, b,
+                                        out.shape[1], b.shape[1])
+        else:
+            sparse_dot_mm_kernel(out, a.data, a.indices, a.indptr, b,
+                                 out.shape[1])
+
+    def sparse_dot_add_mm_transposed(self, a, b, out):
+        sparse_dot_add_mm_transposed_kernel(b, a.data, a.indices, a.indptr,
+                                            out, b.shape[1], out.shape[1])
+
     def split_add_tt(self, x, out_a, out_b):
         assert(out_a.shape[-1] + out_b.shape[-1] == x.shape[-1])
         n = int(np.prod(x.shape[:-1]))
@@ -407,6 +538,14 @@ class PyCudaHandler(Handler):
                       np.int32(k), block=(32, 1, 1), grid=(n, 1, 1))
         return out
 
+    def softmax_ce_forward(self, m, v, out, loss):
+        n, k = m.shape
+        _softmax_ce_impl(m, v, out, loss, np.int32(n), np.int32(k),
+                         block=(32, 1, 1), grid=(n, 1, 1))
+
+    def softmax_ce_backward(self, m, v, dloss, out):
+        softmax_ce_backward_kernel(m, v, dloss, out, m.shape[1])
+
     def tanh(self, x, y):
         tanh_kernel(x, y)
 
@@ -432,6 +571,29 @@ add_st_kernel = ElementwiseKernel(
     "add_st_kernel"
 )
 
+batchnorm_backward_kernel = ElementwiseKernel(
+    "float* x_hat, float* std, float* gamma, float* dout, float* sums, "
+    "float* dx, int n, int f",
+    "dx[i] += gamma[i % f] / std[i % f] * (dout[i] - sums[i % f] / n - "
+    "x_hat[i] * sums[f + i % f] / n)",
+    "batchnorm_backward_kernel"
+)
+
+batchnorm_infer_kernel = ElementwiseKernel(
+    "float* x, float* gamma, float* beta, float* mean, float* std, "
+    "float* out, int f",
+    "out[i] = gamma[i % f] * (x[i] - mean[i % f]) / std[i % f] + beta[i % f]",
+    "batchnorm_infer_kernel"
+)
+
+batchnorm_train_kernel = ElementwiseKernel(
+    "float* x, float* gamma, float* beta, float* mean, float* std, "
+    "float* x_hat, float* out, int f",
+    "x_hat[i] = (x[i] - mean[i % f]) / std[i % f];"
+    "out[i] = gamma[i % f] * x_hat[i] + beta[i % f]",
+    "batchnorm_train_kernel"
+)
+
 binarize_v_kernel = ElementwiseKernel(
     "float* out, float* v, int nrows, int ncols",
     "out[i] = v[i / ncols] == (i % ncols) ? 1.0f : 0.0f",
@@ -468,18 +630,67 @@ create_probabilistic_mask_kernel = ElementwiseKernel(
     "create_probabilistic_mask_kernel"
 )
 
+create_seed_kernel = ElementwiseKernel(
+    "float* seed",
+    "seed[i] = floorf(seed[i] * 16777215.0f)",
+    "create_seed_kernel"
+)
+
+# Same counter-based random numbers as _counter_uniform in numpy_handler
+__counter_uniform_code = """
+    __device__ unsigned int hash32(unsigned int x) {
+        x ^= x >> 16;
+        x *= 0x7feb352dU;
+        x ^= x >> 15;
+        x *= 0x846ca68bU;
+        return x ^ (x >> 16);
+    }
+
+    __device__ float counter_uniform(float seed, unsigned int i) {
+        unsigned int key = hash32((unsigned int) seed);
+        unsigned int x = hash32(hash32(i ^ key) + key);
+        return (x >> 8) * (1.0f / 16777216.0f);
+    }
+    """
+
+dropout_backward_kernel = ElementwiseKernel(
+    "float* a, float* seed, float keep_prob, float* out",
+    "if (counter_uniform(seed[0], i) < keep_prob) out[i] += a[i] / keep_prob",
+    "dropout_backward_kernel",
+    preamble=__counter_uniform_code
+)
+
+dropout_forward_kernel = ElementwiseKernel(
+    "float* a, float* seed, float keep_prob, float* out",
+    "out[i] = counter_uniform(seed[0], i) < keep_prob ? a[i] / keep_prob : 0",
+    "dropout_forward_kernel",
+    preamble=__counter_uniform_code
+)
+
 div_kernel = ElementwiseKernel(
     "float* a, float* b, float* out",
     "out[i] = a[i] / b[i];",
     "div_kernel"
 )
 
+equal_vv_kernel = ElementwiseKernel(
+    "float* out, float* a, float* b, int ncols",
+    "out[i] = a[i / ncols] == b[i % ncols] ? 1.0f : 0.0f",
+    "equal_vv_kernel"
+)
+
 fill_if_kernel = ElementwiseKernel(
     "float* mem, float val, float* cond",
     "if (cond[i] != 0) mem[i] = val",
     "fill_if_kernel"
 )
 
+gather_rows_kernel = ElementwiseKernel(
+    "float* out, float* v, float* m, int ncols",
+    "out[i] = m[int(v[i / ncols]) * ncols + i % ncols]",
+    "gather_rows_kernel"
+)
+
 index_m_by_v_kernel = ElementwiseKernel(
     "float* out, float* v, float* m, int nrows, int ncols",
     "out[i] = m[i * ncols + int(v[i])]",
@@ -554,12 +765,54 @@ sigmoid_kernel = ElementwiseKernel(
     "sigmoid_kernel"
 )
 
+scatter_add_rows_kernel = ElementwiseKernel(
+    "float* m, float* v, float* out, int ncols",
+    "atomicAdd(&out[int(v[i / ncols]) * ncols + i % ncols], m[i])",
+    "scatter_add_rows_kernel"
+)
+
 sign_kernel = ElementwiseKernel(
     "float* a, float* out",
     "out[i] = (a[i] > 0) - (a[i] < 0);",
     "sign_kernel"
 )
 
+softmax_ce_backward_kernel = ElementwiseKernel(
+    "float* m, float* v, float* dloss, float* out, int ncols",
+    "out[i] += (m[i] - (v[i / ncols] == (i % ncols) ? 1.0f : 0.0f)) * "
+    "dloss[i / ncols]",
+    "softmax_ce_backward_kernel"
+)
+
+sparse_dot_mm_kernel = ElementwiseKernel(
+    "float* out, float* data, int* indices, int* indptr, float* b, "
+    "int ncols",
+    "int row = i / ncols; int col = i % ncols; float sum = 0;"
+    "for (int j = indptr[row]; j < indptr[row + 1]; j++)"
+    "  sum += data[j] * b[indices[j] * ncols + col];"
+    "out[i] = sum",
+    "sparse_dot_mm_kernel"
+)
+
+sparse_dot_mm_transb_kernel = ElementwiseKernel(
+    "float* out, float* data, int* indices, int* indptr, float* b, "
+    "int ncols, int bcols",
+    "int row = i / ncols; int col = i % ncols; float sum = 0;"
+    "for (int j = indptr[row]; j < indptr[row + 1]; j++)"
+    "  sum += data[j] * b[col * bcols + indices[j]];"
+    "out[i] = sum",
+    "sparse_dot_mm_transb_kernel"
+)
+
+sparse_dot_add_mm_transposed_kernel = ElementwiseKernel(
+    "float* b, float* data, int* indices, int* indptr, float* out, "
+    "int ncols, int outcols",
+    "int row = i / ncols; int col = i % ncols;"
+    "for (int j = indptr[row]; j < indptr[row + 1]; j++)"
+    "  atomicAdd(&out[col * outcols + indices[j]], data[j] * b[i])",
+    "sparse_dot_add_mm_transposed_kernel"
+)
+
 subtract_mm_kernel = ElementwiseKernel(
     "float* x, float* y, float *out",
     "out[i] = x[i] - y[i]",
@@ -676,6 +929,211 @@ __softmax_kernel_code = """
 _mod_softmax = SourceModule(__softmax_kernel_code)
 _softmax_impl = _mod_softmax.get_function("softmax_kernel")
 
+
+__softmax_ce_kernel_code = """
+    #include "float.h"
+
+    __global__ void softmax_ce_kernel(float* mat, float* targets, float* out,
+                                      float* loss, unsigned int height,
+                                      unsigned int width) {
+        __shared__ float vals[32];
+        __shared__ float row_max;
+        __shared__ float row_sum;
+        __shared__ float target_val;
+        float* row = mat + blockIdx.x * width;
+        float cur_max = -FLT_MAX;
+
+        // read the target logit first, since out might be the same as mat
+        if (threadIdx.x == 0)
+            target_val = row[(int) targets[blockIdx.x]];
+        for (unsigned int i = threadIdx.x; i < width; i += 32) {
+            if (row[i] > cur_max)
+                cur_max = row[i];
+        }
+        vals[threadIdx.x] = cur_max;
+        __syncthreads();
+        if (threadIdx.x == 0) {
+            cur_max = -FLT_MAX;
+            for (unsigned int i = 0; i < 32; i++) {
+                if (vals[i] > cur_max)
+                    cur_max = vals[i];
+            }
+            row_max = cur_max;
+        }
+        __syncthreads();
+
+        float sum = 0.0;
+        for (unsigned int i = threadIdx.x; i < width; i += 32) {
+            float x = __expf(row[i] - row_max);
+            out[blockIdx.x * width + i] = x;
+            sum += x;
+        }
+        vals[threadIdx.x] = sum;
+        __syncthreads();
+        if (threadIdx.x == 0) {
+            sum = 0.0;
+            for (unsigned int i = 0; i < 32; i++)
+                sum += vals[i];
+            row_sum = sum;
+            // log-sum-exp minus the logit of the target
+            loss[blockIdx.x] = __logf(sum) + row_max - target_val;
+        }
+        __syncthreads();
+        for (unsigned int i = threadIdx.x; i < width; i += 32) {
+            out[blockIdx.x * width + i] /= row_sum;
+        }
+    }
+    """
+_mod_softmax_ce = SourceModule(__softmax_ce_kernel_code)
+_softmax_ce_impl = _mod_softmax_ce.get_function("softmax_ce_kernel")
+
+BATCHNORM_COLUMNS = 32
+BATCHNORM_ROWS = 8
+
+__batchnorm_kernel_code = """
+    // The rows are reduced in parallel: the blocks form a grid of
+    // COLUMNS-wide column tiles times nr_parts row partitions. Thread (x, y)
+    // of row partition r reduces the rows r * ROWS + y + k * nr_parts * ROWS
+    // of its column, the ROWS threads of a column are then merged in shared
+    // memory, and a second kernel merges the nr_parts partial results.
+    #define COLUMNS %(columns)d
+    #define ROWS %(rows)d
+
+    // the number of rows that were reduced by row partition r
+    __device__ int partition_size(int r, int n, int nr_parts) {
+        int stride = nr_parts * ROWS;
+        return n / stride * ROWS + min(max(n %% stride - r * ROWS, 0), ROWS);
+    }
+
+    // merge two Welford states (Chan et al.)
+    __device__ void welford_merge(int& count, float& mean, float& m2,
+                                  int count_b, float mean_b, float m2_b) {
+        int total = count + count_b;
+        if (count_b == 0)
+            return;
+        float delta = mean_b - mean;
+        float ratio = (float)count_b / total;
+        mean += delta * ratio;
+        m2 += m2_b + delta * delta * count * ratio;
+        count = total;
+    }
+
+    __global__ void welford_partial_kernel(float* x, float* partials, int n,
+                                           int f) {
+        __shared__ int s_count[ROWS][COLUMNS];
+        __shared__ float s_mean[ROWS][COLUMNS];
+        __shared__ float s_m2[ROWS][COLUMNS];
+        int j = blockIdx.x * COLUMNS + threadIdx.x;
+        int count = 0;
+        float mean = 0.0f;
+        float m2 = 0.0f;
+        if (j < f) {
+            for (int i = blockIdx.y * ROWS + threadIdx.y; i < n;
+                 i += gridDim.y * ROWS) {
+                float delta = x[i * f + j] - mean;
+                count++;
+                mean += delta / count;
+                m2 += delta * (x[i * f + j] - mean);
+            }
+        }
+        s_count[threadIdx.y][threadIdx.x] = count;
+        s_mean[threadIdx.y][threadIdx.x] = mean;
+        s_m2[threadIdx.y][threadIdx.x] = m2;
+        __syncthreads();
+        if (threadIdx.y != 0 || j >= f)
+            return;
+        for (int k = 1; k < ROWS; k++) {
+            welford_merge(count, mean, m2, s_count[k][threadIdx.x],
+                          s_mean[k][threadIdx.x], s_m2[k][threadIdx.x]);
+        }
+        partials[blockIdx.y * f + j] = mean;
+        partials[(gridDim.y + blockIdx.y) * f + j] = m2;
+    }
+
+    __global__ void welford_merge_kernel(float* partials, float* mean,
+                                         float* std, float epsilon, int n,
+                                         int f, int nr_parts) {
+        int j = blockIdx.x * blockDim.x + threadIdx.x;
+        if (j >= f)
+            return;
+        int count = 0;
+        float m = 0.0f;
+        float m2 = 0.0f;
+        for (int r = 0; r < nr_parts; r++) {
+            welford_merge(count, m, m2, partition_size(r, n, nr_parts),
+                          partials[r * f + j],
+                          partials[(nr_parts + r) * f + j]);
+        }
+        mean[j] = m;
+        std[j] = sqrtf(m2 / n + epsilon);
+    }
+
+    __global__ void batchnorm_backward_partial_kernel(float* x_hat,
+                                                      float* dout,
+                                                      float* partials,
+                                                      int n, int f) {
+        __shared__ float s_dbeta[ROWS][COLUMNS];
+        __shared__ float s_dgamma[ROWS][COLUMNS];
+        int j = blockIdx.x * COLUMNS + threadIdx.x;
+        float dbeta = 0.0f;
+        float dgamma = 0.0f;
+        if (j < f) {
+            for (int i = blockIdx.y * ROWS + threadIdx.y; i < n;
+                 i += gridDim.y * ROWS) {
+                dbeta += dout[i * f + j];
+                dgamma += dout[i * f + j] * x_hat[i * f + j];
+            }
+        }
+        s_dbeta[threadIdx.y][threadIdx.x] = dbeta;
+        s_dgamma[threadIdx.y][threadIdx.x] = dgamma;
+        __syncthreads();
+        if (threadIdx.y != 0 || j >= f)
+            return;
+        for (int k = 1; k < ROWS; k++) {
+            dbeta += s_dbeta[k][threadIdx.x];
+            dgamma += s_dgamma[k][threadIdx.x];
+        }
+        partials[blockIdx.y * f + j] = dbeta;
+        partials[(gridDim.y + blockIdx.y) * f + j] = dgamma;
+    }
+
+    // sums[0] = sum(dout), sums[1] = sum(dout * x_hat)
+    __global__ void batchnorm_backward_merge_kernel(float* partials,
+                                                    float* sums, int f,
+                                                    int nr_parts) {
+        int j = blockIdx.x * blockDim.x + threadIdx.x;
+        if (j >= f)
+            return;
+        float dbeta = 0.0f;
+        float dgamma = 0.0f;
+        for (int r = 0; r < nr_parts; r++) {
+            dbeta += partials[r * f + j];
+            dgamma += partials[(nr_parts + r) * f + j];
+        }
+        sums[j] = dbeta;
+        sums[f + j] = dgamma;
+    }
+    """ % {'columns': BATCHNORM_COLUMNS, 'rows': BATCHNORM_ROWS}
+_mod_batchnorm = SourceModule(__batchnorm_kernel_code)
+_welford_partial_impl = _mod_batchnorm.get_function("welford_partial_kernel")
+_welford_merge_impl = _mod_batchnorm.get_function("welford_merge_kernel")
+_batchnorm_backward_partial_impl = _mod_batchnorm.get_function(
+    "batchnorm_backward_partial_kernel")
+_batchnorm_backward_merge_impl = _mod_batchnorm.get_function(
+    "batchnorm_backward_merge_kernel")
+
+
+def _get_batchnorm_grid(n, f):
+    """Get the grid for the partial batchnorm reductions of an (n, f) matrix.
+
+    Every thread reduces at least 32 rows, and there are at most 128 row
+    partitions, so the merge kernels stay cheap.
+    """
+    nr_parts = int(min(max(n // (32 * BATCHNORM_ROWS), 1), 128))
+    nr_tiles = (f + BATCHNORM_COLUMNS - 1) // BATCHNORM_COLUMNS
+    return (nr_tiles, nr_parts)
+
+
 # ----------------------------- Caffe2 Kernels ------------------------------ #
 # Please see Third Party License file for license information
 
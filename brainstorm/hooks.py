@@ -3,17 +3,20 @@
 from __future__ import division, print_function, unicode_literals
 
 import math
+import os
 import signal
 import sys
+import threading
 from collections import OrderedDict
 
 import h5py
 import numpy as np
-from six import string_types
+from six import reraise, string_types
 
-from brainstorm.describable import Describable
+from brainstorm.describable import Describable, get_description
 from brainstorm import optional
-from brainstorm.structure.network import Network
+from brainstorm.structure.architecture import get_replica_names
+from brainstorm.structure.network import Network, write_network_file
 from brainstorm.tools import evaluate
 from brainstorm.utils import get_by_path, progress_bar, get_brainstorm_info
 
@@ -51,6 +54,22 @@ class Hook(Describable):
     def __call__(self, epoch_nr, update_nr, net, stepper, logs):
         pass
 
+    def finish(self):
+        """Called by the trainer when the training ends, even if it failed."""
+        pass
+
+    def get_state(self):
+        """
+        Return the values (encodable as JSON, or numpy arrays) that this hook
+        accumulated during training and needs when the training is resumed.
+        """
+        return {}
+
+    def set_state(self, state):
+        """Restore the state returned by :meth:`get_state`."""
+        for name, value in state.items():
+            setattr(self, name, value)
+
 
 # -------------------------------- Saviors ---------------------------------- #
 
@@ -90,6 +109,9 @@ class SaveBestNetwork(Hook):
             Specifies whether the logs of this monitor should be printed, and
             acts as a fallback verbosity for the used data iterator.
             If not set it defaults to the verbosity setting of the trainer.
+        asynchronous (Optional[bool]):
+            If True (default) the file is written on a background thread, see
+            :class:`SaveNetwork`.
     Examples:
         Add a hook to monitor a quantity of interest:
 
@@ -109,15 +131,19 @@ class SaveBestNetwork(Hook):
             ...                                       filename='best_loss.h5',
         ...                                           criterion='min'))
     """
-    __undescribed__ = {'parameters': None}
-    __default_values__ = {'filename': None}
+    __undescribed__ = {'parameters': None, '_writer': None}
+    __default_values__ = {'filename': None, 'asynchronous': True}
 
     def __init__(self, log_name, filename=None, criterion='max', name=None,
-                 timescale='epoch', interval=1, verbose=None):
+                 timescale='epoch', interval=1, verbose=None,
+                 asynchronous=True):
         super(SaveBestNetwork, self).__init__(name, timescale,
                                               interval, verbose)
         self.log_name = log_name
         self.filename = filename
+        self.asynchronous = asynchronous
+        self._writer = None
+        self.parameters = None
         self.best_parameters = None
         assert criterion == 'min' or criterion == 'max'
         self.best_so_far = np.inf if criterion == 'min' else -np.inf
@@ -146,7 +172,8 @@ class SaveBestNetwork(Hook):
                 self.message("{} improved (criterion: {}). Saving network to "
                              "{}".format(self.log_name, self.criterion,
                                          self.filename))
-                net.save_as_hdf5(self.filename)
+                self._writer = _save_network(net, self.filename,
+                                             self.asynchronous, self._writer)
             else:
                 self.message("{} improved (criterion: {}). Caching parameters".
                              format(self.log_name, self.criterion))
@@ -156,9 +183,23 @@ class SaveBestNetwork(Hook):
                          format(self.timescale, self.best_t, self.log_name,
                                 self.best_so_far))
 
+    def finish(self):
+        if self._writer is not None:
+            self._writer.wait()
+
+    def get_state(self):
+        state = {'best_so_far': float(self.best_so_far),
+                 'best_t': self.best_t}
+        if self.filename is None and self.parameters is not None:
+            state['parameters'] = self.parameters
+        return state
+
     def load_best_network(self):
-        return Network.from_hdf5(self.filename) if self.filename is not None \
-            else self.parameters
+        if self.filename is None:
+            return self.parameters
+        if self._writer is not None:
+            self._writer.wait()
+        return Network.from_hdf5(self.filename)
 
 
 class SaveLogs(Hook):
@@ -190,19 +231,128 @@ class SaveNetwork(Hook):
     """
     Periodically save the weights of the network to the given file.
     Default behavior is to save the network after every training epoch.
+
+    By default the parameters are only copied to a staging buffer in the
+    training loop, and the file is compressed and written on a background
+    thread. At most one write is in flight: saving again waits for the
+    previous write to finish, and so does the end of the training, which
+    also raises the error of a failed write. The file is first written next
+    to the target and then renamed, so the target is never left
+    half-written.
     """
+    __undescribed__ = {'_writer': None}
+    __default_values__ = {'asynchronous': True}
 
-    def __init__(self, filename, name=None, timescale='epoch', interval=1):
+    def __init__(self, filename, name=None, timescale='epoch', interval=1,
+                 asynchronous=True):
         super(SaveNetwork, self).__init__(name, timescale, interval)
         self.filename = filename
+        self.asynchronous = asynchronous
+        self._writer = None
 
     def __call__(self, epoch_nr, update_nr, net, stepper, logs):
-        net.save_as_hdf5(self.filename)
+        self._writer = _save_network(net, self.filename, self.asynchronous,
+                                     self._writer)
+
+    def finish(self):
+        if self._writer is not None:
+            self._writer.wait()
 
     def load_network(self):
+        if self._writer is not None:
+            self._writer.wait()
         return Network.from_hdf5(self.filename)
 
 
+class SaveTrainingState(Hook):
+    """
+    Periodically save the full state of the training to the given file, so
+    that it can be continued exactly using
+    :meth:`brainstorm.training.trainer.Trainer.resume`. Default behavior is
+    to save after every training epoch, but saving after updates (in the
+    middle of an epoch) is supported as well.
+
+    Every save writes a new file that then replaces the old one, so an
+    interrupted save leaves the previous state intact. The file can also be
+    loaded as a network using
+    :meth:`brainstorm.structure.network.Network.from_hdf5`.
+
+    Args:
+        trainer (brainstorm.training.trainer.Trainer):
+            The trainer whose state should be saved.
+        filename (str):
+            Name of the HDF5 file.
+    """
+    __undescribed__ = {'trainer': None}
+
+    def __init__(self, trainer, filename, name=None, timescale='epoch',
+                 interval=1):
+        super(SaveTrainingState, self).__init__(name, timescale, interval)
+        self.trainer = trainer
+        self.filename = filename
+
+    def __call__(self, epoch_nr, update_nr, net, stepper, logs):
+        self.trainer.save_state(self.filename, net)
+
+
+def _save_network(net, filename, asynchronous, writer):
+    """Save the network, possibly in the background, and return the writer
+    used for that (or None)."""
+    if not asynchronous:
+        net.save_as_hdf5(filename)
+        return writer
+    writer = writer or _NetworkWriter()
+    writer.write(net, filename)
+    return writer
+
+
+class _NetworkWriter(object):
+    """
+    Writes network files on a background thread, one at a time.
+
+    Errors of a write are raised by the next call to write or wait.
+    """
+
+    def __init__(self):
+        self._staging = None
+        self._thread = None
+        self._error = None
+
+    def write(self, net, filename):
+        self.wait()
+        parameters = net.buffer.parameters
+        if self._staging is None or self._staging.shape != parameters.shape \
+                or self._staging.dtype != net.handler.dtype:
+            self._staging = np.empty(parameters.shape, net.handler.dtype)
+        if isinstance(parameters, np.ndarray):
+            np.copyto(self._staging, parameters)
+        else:
+            self._staging[:] = net.handler.get_numpy_copy(parameters)
+        self._thread = threading.Thread(
+            target=self._write,
+            args=(filename, get_description(net), self._staging,
+                  net._get_layout_description()))
+        self._thread.start()
+
+    def _write(self, filename, description, parameters, layout):
+        temp_filename = filename + '.tmp'
+        try:
+            write_network_file(temp_filename, description, parameters,
+                               layout=layout)
+            os.replace(temp_filename, filename)
+        except Exception:
+            self._error = sys.exc_info()
+
+    def wait(self):
+        """Wait for the pending write and raise its error if it failed."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            reraise(*error)
+
+
 # -------------------------------- Monitors --------------------------------- #
 
 class MonitorLayerDeltas(Hook):
@@ -422,6 +572,35 @@ class MonitorScores(Hook):
         return evaluate(net, self.iter, self.scorers)
 
 
+class MonitorStepperAttribute(Hook):
+    """
+    Monitor an attribute of the training stepper, like a scheduled learning
+    rate. If the attribute has one value per replica of an ensemble (see
+    brainstorm.structure.replicate_architecture) each of them is logged under
+    the name of the replica.
+    """
+    def __init__(self, attr_name='learning_rate', name=None,
+                 timescale='epoch', interval=1, verbose=None):
+        if name is None:
+            name = "Monitor_{}".format(attr_name)
+        super(MonitorStepperAttribute, self).__init__(name, timescale,
+                                                      interval, verbose)
+        self.attr_name = attr_name
+
+    def start(self, net, stepper, verbose, named_data_iters):
+        super(MonitorStepperAttribute, self).start(net, stepper, verbose,
+                                                   named_data_iters)
+        assert hasattr(stepper, self.attr_name), \
+            "The stepper {} does not have the attribute {}".format(
+                stepper.__class__.__name__, self.attr_name)
+
+    def __call__(self, epoch_nr, update_nr, net, stepper, logs):
+        value = getattr(stepper, self.attr_name)
+        if np.ndim(value) == 0:
+            return value
+        return OrderedDict(zip(get_replica_names(len(value)), value))
+
+
 # -------------------------------- Stoppers --------------------------------- #
 
 class EarlyStopper(Hook):
@@ -11,6 +11,7 @@ from brainstorm.layers.convolution_layer_2d import Convolution2D
 from brainstorm.layers.deltas_scaling_layer import DeltasScaling
 from brainstorm.layers.dropout_layer import Dropout
 from brainstorm.layers.elementwise_layer import Elementwise
+from brainstorm.layers.embedding_layer import Embedding
 from brainstorm.layers.fully_connected_layer import FullyConnected
 from brainstorm.layers.highway_layer import Highway
 from brainstorm.layers.input_layer import Input
@@ -23,6 +24,8 @@ from brainstorm.layers.mask_layer import Mask
 from brainstorm.layers.noop_layer import NoOp
 from brainstorm.layers.pooling_layer_2d import Pooling2D
 from brainstorm.layers.recurrent_layer import Recurrent
+from brainstorm.layers.sampled_softmax_ce_layer import SampledSoftmaxCE
+from brainstorm.layers.select_replica_layer import SelectReplica
 from brainstorm.layers.sigmoid_ce_layer import SigmoidCE
 from brainstorm.layers.softmax_ce_layer import SoftmaxCE
 from brainstorm.layers.squared_difference_layer import SquaredDifference
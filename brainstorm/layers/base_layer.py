@@ -51,6 +51,9 @@ class Layer(object):
             List of outgoing connections
         handler (brainstorm.handlers.base_handler.Handler):
             The handler currently responsible for this layer
+        aliased_outputs (set[str]):
+            Names of the outputs from `output_aliases` or `in_place_outputs`
+            that the layout has placed as views over their inputs
     """
     expected_kwargs = {}
     """Set of all kwargs that this layer accepts"""
@@ -58,6 +61,26 @@ class Layer(object):
     expected_inputs = {}
     """Names and shape-templates for all inputs of this layer"""
 
+    optional_inputs = ()
+    """Names of inputs from `expected_inputs` that need not be connected"""
+
+    accepts_sparse_inputs = ()
+    """Names of inputs from `expected_inputs` that can be sparse"""
+
+    output_aliases = {}
+    """Outputs that may be laid out as the concatenation of some inputs"""
+
+    in_place_outputs = {}
+    """Outputs that may be computed in place, overwriting the given input"""
+
+    takes_no_outputs_in_backward = ()
+    """Names of outputs that are not read during the backward pass"""
+
+    nr_replicas = None
+    """Number of replicas stacked along the first axis of all parameters of
+    this layer (see :func:`brainstorm.structure.replicate_architecture`), or
+    None if it has no replica axis"""
+
     computes_no_input_deltas_for = ()
     computes_no_gradients_for = ()
     takes_no_output_deltas_from = ()
@@ -74,6 +97,7 @@ class Layer(object):
         self.incoming = incoming_connections
         self.outgoing = outgoing_connections
         self.handler = None
+        self.aliased_outputs = set()
         self._validate_kwargs()
         self._validate_in_shapes()
         out, param, intern = self.setup(self.kwargs, self.in_shapes)
@@ -163,10 +187,11 @@ class Layer(object):
                 'are: {}'.format(self.name, in_shape_names - input_names,
                                  input_names))
 
-        if not input_names.issubset(in_shape_names):
+        required_names = input_names - set(self.optional_inputs)
+        if not required_names.issubset(in_shape_names):
             raise LayerValidationError(
                 '{}: All inputs need to be connected. Missing {}.'
-                .format(self.name, input_names - in_shape_names))
+                .format(self.name, required_names - in_shape_names))
 
         for input_name, in_shape in self.in_shapes.items():
             if not self.expected_inputs[input_name].matches(in_shape):
@@ -174,6 +199,11 @@ class Layer(object):
                     "{}: in_shape ({}) for {} doesn't match StructureTemplate "
                     "{}".format(self.name, in_shape, input_name,
                                 self.expected_inputs[input_name]))
+            if in_shape.is_sparse and \
+                    input_name not in self.accepts_sparse_inputs:
+                raise LayerValidationError(
+                    "{}: input {} does not support sparse data.".format(
+                        self.name, input_name))
 
     def _validate_connections(self):
         """
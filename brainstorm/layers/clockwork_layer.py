@@ -2,26 +2,39 @@
 # coding=utf-8
 from __future__ import division, print_function, unicode_literals
 from collections import OrderedDict
+
 from brainstorm.structure.construction import ConstructionWrapper
 from brainstorm.utils import LayerValidationError, flatten_time, \
     flatten_time_and_features
 from brainstorm.layers.base_layer import Layer
+from brainstorm.layers.clockwork_mixin import ClockworkMixin
 from brainstorm.structure.buffer_structure import BufferStructure, \
     StructureTemplate
 
 
 def Clockwork(size, activation='tanh', name=None):
+    """Create a Clockwork RNN layer.
+
+    Each unit is only updated at timesteps that are divisible by its entry in
+    the 'timing' parameter. The recurrent matrix products are only computed
+    for the leading units that can be active at each step, so the units
+    should be sorted by increasing period to benefit from this (a warning is
+    issued otherwise).
+    """
     return ConstructionWrapper.create(ClockworkLayerImpl,
                                       size=size,
                                       name=name,
                                       activation=activation)
 
 
-class ClockworkLayerImpl(Layer):
-    expected_inputs = {'default': StructureTemplate('T', 'B', '...')}
+class ClockworkLayerImpl(ClockworkMixin, Layer):
+    expected_inputs = {'default': StructureTemplate('T', 'B', '...'),
+                       'reset': StructureTemplate('T', 'B', 1)}
+    optional_inputs = ('reset',)
     expected_kwargs = {'size', 'activation'}
 
     computes_no_gradients_for = ['timing']
+    computes_no_input_deltas_for = ['reset']
 
     def setup(self, kwargs, in_shapes):
         self.activation = kwargs.get('activation', 'tanh')
@@ -49,6 +62,7 @@ class ClockworkLayerImpl(Layer):
                                            is_backward_only=True)
         internals['dHb'] = BufferStructure('T', 'B', self.size, context_size=1,
                                            is_backward_only=True)
+        internals.update(self._get_clock_internals(in_shapes))
 
         return outputs, parameters, internals
 
@@ -68,14 +82,29 @@ class ClockworkLayerImpl(Layer):
 
         tmp = _h.zeros(timing.shape)
         cond = _h.zeros(outputs[0].shape)
+
+        keep, phase, sizes = self._get_clock(buffers, forward=True)
+        if keep is not None:
+            timings = _h.allocate(cond.shape)
+            _h.broadcast_t(timing.reshape((1, timing.shape[0])), 0, timings)
+            prev = _h.allocate(outputs[0].shape)
+
         for t in range(inputs.shape[0]):
-            _h.dot_add_mm(outputs[t - 1], R, Ha[t], transb=True)
+            if keep is None:
+                prev = outputs[t - 1]
+            else:
+                _h.mult_mv(outputs[t - 1], keep[t], prev)
+            self._dot_add_active(prev, R, Ha[t], sizes[t])
             _h.act_func[self.activation](Ha[t], outputs[t])
             # Undo updates
             if t > 0:
-                _h.fill(tmp, t)
-                _h.modulo_tt(tmp, timing, tmp)
-                _h.broadcast_t(tmp.reshape((1, tmp.shape[0])), 0, cond)
+                if keep is None:
+                    _h.fill(tmp, t)
+                    _h.modulo_tt(tmp, timing, tmp)
+                    _h.broadcast_t(tmp.reshape((1, tmp.shape[0])), 0, cond)
+                else:
+                    _h.broadcast_t(phase[t], 1, cond)
+                    _h.modulo_tt(cond, timings, cond)
                 _h.copy_to_if(outputs[t - 1], outputs[t], cond)
 
     def backward_pass(self, buffers):
@@ -87,21 +116,36 @@ class ClockworkLayerImpl(Layer):
         outputs = buffers.outputs.default
         dinputs = buffers.input_deltas.default
         doutputs = buffers.output_deltas.default
-        Ha, dHa, dHb = buffers.internals
+        Ha, dHa, dHb = buffers.internals[:3]
 
         tmp = _h.zeros(timing.shape)
         cond = _h.zeros(outputs[0].shape)
 
+        keep, phase, sizes = self._get_clock(buffers, forward=False)
+        if keep is not None:
+            timings = _h.allocate(cond.shape)
+            _h.broadcast_t(timing.reshape((1, timing.shape[0])), 0, timings)
+            dnext = _h.allocate(dHa[0].shape)
+
         _h.copy_to(doutputs, dHb)
         T = inputs.shape[0] - 1
         _h.act_func_deriv[self.activation](Ha[T], outputs[T], dHb[T], dHa[T])
         for t in range(T - 1, -1, -1):
-            _h.fill(tmp, t + 1)
-            _h.modulo_tt(tmp, timing, tmp)
-            _h.broadcast_t(tmp.reshape((1, tmp.shape[0])), 0, cond)
+            if keep is None:
+                _h.fill(tmp, t + 1)
+                _h.modulo_tt(tmp, timing, tmp)
+                _h.broadcast_t(tmp.reshape((1, tmp.shape[0])), 0, cond)
+            else:
+                _h.broadcast_t(phase[t + 1], 1, cond)
+                _h.modulo_tt(cond, timings, cond)
             _h.add_into_if(dHb[t + 1], dHb[t], cond)
             _h.fill_if(dHa[t+1], 0.0, cond)
-            _h.dot_add_mm(dHa[t + 1], R, dHb[t])
+            if keep is None:
+                dnext = dHa[t + 1]
+            else:
+                _h.mult_mv(dHa[t + 1], keep[t + 1], dnext)
+            # inactive units of step t + 1 have no deltas
+            self._dot_add_active_deltas(dnext, R, dHb[t], sizes[t + 1])
             _h.act_func_deriv[self.activation](Ha[t], outputs[t], dHb[t],
                                                dHa[t])
 
@@ -118,5 +162,13 @@ class ClockworkLayerImpl(Layer):
 
         flat_outputs = flatten_time(outputs[:-2])
         flat_dHa = flatten_time(dHa[1:-1])
+        context = outputs[-1]
+        if keep is not None:
+            # the state seen at t is outputs[t - 1] * keep[t]
+            masked = _h.allocate(flat_outputs.shape)
+            _h.mult_mv(flat_outputs, flatten_time(keep[1:-1]), masked)
+            flat_outputs = masked
+            context = _h.allocate(outputs[-1].shape)
+            _h.mult_mv(outputs[-1], keep[0], context)
         _h.dot_add_mm(flat_dHa, flat_outputs, dR, transa=True)
-        _h.dot_add_mm(dHa[0], outputs[-1], dR, transa=True)
+        _h.dot_add_mm(dHa[0], context, dR, transa=True)
@@ -2,26 +2,39 @@
 # coding=utf-8
 from __future__ import division, print_function, unicode_literals
 from collections import OrderedDict
+
 from brainstorm.structure.construction import ConstructionWrapper
 from brainstorm.utils import LayerValidationError, flatten_time, \
     flatten_time_and_features
 from brainstorm.layers.base_layer import Layer
+from brainstorm.layers.clockwork_mixin import ClockworkMixin
 from brainstorm.structure.buffer_structure import BufferStructure, \
     StructureTemplate
 
 
 def ClockworkLstm(size, activation='tanh', name=None):
+    """Create a Clockwork LSTM layer.
+
+    Each block is only updated at timesteps that are divisible by its entry
+    in the 'timing' parameter. The recurrent matrix products are only
+    computed for the leading blocks that can be active at each step, so the
+    blocks should be sorted by increasing period to benefit from this (a
+    warning is issued otherwise).
+    """
     return ConstructionWrapper.create(ClockworkLstmLayerImpl,
                                       size=size,
                                       name=name,
                                       activation=activation)
 
 
-class ClockworkLstmLayerImpl(Layer):
+class ClockworkLstmLayerImpl(ClockworkMixin, Layer):
     expected_kwargs = {'size', 'activation'}
-    expected_inputs = {'default': StructureTemplate('T', 'B', '...')}
+    expected_inputs = {'default': StructureTemplate('T', 'B', '...'),
+                       'reset': StructureTemplate('T', 'B', 1)}
+    optional_inputs = ('reset',)
 
     computes_no_gradients_for = ['timing']
+    computes_no_input_deltas_for = ['reset']
 
     def setup(self, kwargs, in_shapes):
         self.activation = kwargs.get('activation', 'tanh')
@@ -91,6 +104,7 @@ class ClockworkLstmLayerImpl(Layer):
                                            is_backward_only=True)
         internals['dCb'] = BufferStructure('T', 'B', self.size, context_size=1,
                                            is_backward_only=True)
+        internals.update(self._get_clock_internals(in_shapes))
 
         return outputs, parameters, internals
 
@@ -104,10 +118,11 @@ class ClockworkLstmLayerImpl(Layer):
          timing) = buffers.parameters
 
         (Za, Zb, Ia, Ib, Fa, Fb, Oa, Ob, Ca, Cb,
-         dZa, dZb, dIa, dIb, dFa, dFb, dOa, dOb, dCa, dCb) = buffers.internals
+         dZa, dZb, dIa, dIb, dFa, dFb, dOa, dOb, dCa,
+         dCb) = buffers.internals[:20]
         x = buffers.inputs.default
         y = buffers.outputs.default
-        time_size, batch_size = x.shape[0], x.shape[1]
+        time_size = x.shape[0]
 
         # Temporary variable to be filled with the current value of time t
         tmp = _h.zeros(timing.shape)
@@ -123,31 +138,43 @@ class ClockworkLstmLayerImpl(Layer):
         _h.dot_mm(flat_x, Wf, flat_Fa, transb=True)
         _h.dot_mm(flat_x, Wo, flat_Oa, transb=True)
 
+        keep, phase, sizes = self._get_clock(buffers, forward=True)
+        if keep is not None:
+            timings = _h.allocate(cond.shape)
+            _h.broadcast_t(timing.reshape((1, timing.shape[0])), 0, timings)
+            y_prev = _h.allocate(y[0].shape)
+            c_prev = _h.allocate(Ca[0].shape)
+
         for t in range(time_size):
+            if keep is None:
+                y_prev, c_prev = y[t - 1], Ca[t - 1]
+            else:
+                _h.mult_mv(y[t - 1], keep[t], y_prev)
+                _h.mult_mv(Ca[t - 1], keep[t], c_prev)
 
             # Block input
-            _h.dot_add_mm(y[t - 1], Rz, Za[t], transb=True)
+            self._dot_add_active(y_prev, Rz, Za[t], sizes[t])
             _h.add_mv(Za[t], bz.reshape((1, self.size)), Za[t])
             _h.act_func[self.activation](Za[t], Zb[t])
 
             # Input Gate
-            _h.dot_add_mm(y[t - 1], Ri, Ia[t], transb=True)
-            _h.mult_add_mv(Ca[t - 1], pi, Ia[t])  # ADDED PEEPHOLE CONNECTION
+            self._dot_add_active(y_prev, Ri, Ia[t], sizes[t])
+            _h.mult_add_mv(c_prev, pi, Ia[t])  # ADDED PEEPHOLE CONNECTION
             _h.add_mv(Ia[t], bi.reshape((1, self.size)), Ia[t])
             _h.sigmoid(Ia[t], Ib[t])
 
             # Forget Gate
-            _h.dot_add_mm(y[t - 1], Rf, Fa[t], transb=True)
-            _h.mult_add_mv(Ca[t - 1], pf, Fa[t])  # ADDED PEEPHOLE CONNECTION
+            self._dot_add_active(y_prev, Rf, Fa[t], sizes[t])
+            _h.mult_add_mv(c_prev, pf, Fa[t])  # ADDED PEEPHOLE CONNECTION
             _h.add_mv(Fa[t], bf.reshape((1, self.size)), Fa[t])
             _h.sigmoid(Fa[t], Fb[t])
 
             # Cell
             _h.mult_tt(Ib[t], Zb[t], Ca[t])
-            _h.mult_add_tt(Fb[t], Ca[t - 1], Ca[t])
+            _h.mult_add_tt(Fb[t], c_prev, Ca[t])
 
             # Output Gate
-            _h.dot_add_mm(y[t - 1], Ro, Oa[t], transb=True)
+            self._dot_add_active(y_prev, Ro, Oa[t], sizes[t])
             _h.mult_add_mv(Ca[t], po, Oa[t])  # ADDED PEEPHOLE CONNECTION
             _h.add_mv(Oa[t], bo.reshape((1, self.size)), Oa[t])
             _h.sigmoid(Oa[t], Ob[t])
@@ -157,9 +184,13 @@ class ClockworkLstmLayerImpl(Layer):
             _h.mult_tt(Ob[t], Cb[t], y[t])
 
             if t > 0:
-                _h.fill(tmp, t)
-                _h.modulo_tt(tmp, timing, tmp)
-                _h.broadcast_t(tmp.reshape((1, tmp.shape[0])), 0, cond)
+                if keep is None:
+                    _h.fill(tmp, t)
+                    _h.modulo_tt(tmp, timing, tmp)
+                    _h.broadcast_t(tmp.reshape((1, tmp.shape[0])), 0, cond)
+                else:
+                    _h.broadcast_t(phase[t], 1, cond)
+                    _h.modulo_tt(cond, timings, cond)
 
             # Reset Cell
                 _h.copy_to_if(Ca[t-1], Ca[t], cond)
@@ -183,7 +214,8 @@ class ClockworkLstmLayerImpl(Layer):
          timing) = buffers.parameters
 
         (Za, Zb, Ia, Ib, Fa, Fb, Oa, Ob, Ca, Cb,
-         dZa, dZb, dIa, dIb, dFa, dFb, dOa, dOb, dCa, dCb) = buffers.internals
+         dZa, dZb, dIa, dIb, dFa, dFb, dOa, dOb, dCa,
+         dCb) = buffers.internals[:20]
 
         x = buffers.inputs.default
         dx = buffers.input_deltas.default
@@ -192,7 +224,7 @@ class ClockworkLstmLayerImpl(Layer):
 
         dy = _h.allocate(y.shape)
 
-        time_size, batch_size = x.shape[0], x.shape[1]
+        time_size = x.shape[0]
 
         # Temporary variable to be filled with the current value of time t
         tmp = _h.zeros(timing.shape)
@@ -200,20 +232,48 @@ class ClockworkLstmLayerImpl(Layer):
         _h.fill(dCa, 0.0)
         cond = _h.zeros(y[0].shape)
 
+        keep, phase, sizes = self._get_clock(buffers, forward=False)
+        if keep is not None:
+            timings = _h.allocate(cond.shape)
+            _h.broadcast_t(timing.reshape((1, timing.shape[0])), 0, timings)
+            dy_rec = _h.allocate(dy[0].shape)
+            dc_rec = _h.allocate(dCa[0].shape)
+
         for t in range(time_size - 1, -1, - 1):
+            # inactive units of step t + 1 have no deltas
+            k = sizes[t + 1] if t + 1 < time_size else self.size
             # Accumulate recurrent deltas
             _h.add_tt(dy[t], deltas[t], dy[t])
-            _h.fill(tmp, t)
-            _h.modulo_tt(tmp, timing, tmp)
-            _h.broadcast_t(tmp.reshape((1, tmp.shape[0])), 0, cond)
-
-            _h.dot_add_mm(dIa[t + 1], Ri, dy[t])
-            _h.dot_add_mm(dFa[t + 1], Rf, dy[t])
-            _h.dot_add_mm(dOa[t + 1], Ro, dy[t])
-            _h.dot_add_mm(dZa[t + 1], Rz, dy[t])
+            if keep is None:
+                _h.fill(tmp, t)
+                _h.modulo_tt(tmp, timing, tmp)
+                _h.broadcast_t(tmp.reshape((1, tmp.shape[0])), 0, cond)
 
-            _h.mult_add_mv(dIa[t + 1], pi, dCa[t])
-            _h.mult_add_mv(dFa[t + 1], pf, dCa[t])
+                self._dot_add_active_deltas(dIa[t + 1], Ri, dy[t], k)
+                self._dot_add_active_deltas(dFa[t + 1], Rf, dy[t], k)
+                self._dot_add_active_deltas(dOa[t + 1], Ro, dy[t], k)
+                self._dot_add_active_deltas(dZa[t + 1], Rz, dy[t], k)
+
+                _h.mult_add_mv(dIa[t + 1], pi, dCa[t])
+                _h.mult_add_mv(dFa[t + 1], pf, dCa[t])
+            else:
+                _h.broadcast_t(phase[t], 1, cond)
+                _h.modulo_tt(cond, timings, cond)
+
+                # block the recurrent deltas at sequence boundaries
+                _h.fill(dy_rec, 0.0)
+                self._dot_add_active_deltas(dIa[t + 1], Ri, dy_rec, k)
+                self._dot_add_active_deltas(dFa[t + 1], Rf, dy_rec, k)
+                self._dot_add_active_deltas(dOa[t + 1], Ro, dy_rec, k)
+                self._dot_add_active_deltas(dZa[t + 1], Rz, dy_rec, k)
+                _h.mult_mv(dy_rec, keep[t + 1], dy_rec)
+                _h.add_tt(dy[t], dy_rec, dy[t])
+
+                _h.mult_mv(dIa[t + 1], pi, dc_rec)
+                _h.mult_add_mv(dFa[t + 1], pf, dc_rec)
+                _h.mult_add_tt(dCa[t + 1], Fb[t + 1], dc_rec)
+                _h.mult_mv(dc_rec, keep[t + 1], dc_rec)
+                _h.add_tt(dCa[t], dc_rec, dCa[t])
 
             # Output Gate
             _h.mult_tt(dy[t], Cb[t], dOb[t])
@@ -227,10 +287,13 @@ class ClockworkLstmLayerImpl(Layer):
             _h.act_func_deriv[self.activation](Ca[t], Cb[t], dCb[t], dCb[t])
             _h.fill_if(dCb[t], 0, cond)
             _h.add_tt(dCa[t], dCb[t], dCa[t])
-            _h.mult_add_tt(dCa[t + 1], Fb[t + 1], dCa[t])
+            if keep is None:
+                _h.mult_add_tt(dCa[t + 1], Fb[t + 1], dCa[t])
 
             # Forget Gate
             _h.mult_tt(dCa[t], Ca[t - 1], dFb[t])
+            if keep is not None:
+                _h.mult_mv(dFb[t], keep[t], dFb[t])
             _h.sigmoid_deriv(Fa[t], Fb[t], dFb[t], dFa[t])
 
             # Input Gate
@@ -285,6 +348,15 @@ class ClockworkLstmLayerImpl(Layer):
 
         flat_cell = flatten_time(Ca[:-2])
         flat_cell2 = flatten_time(Ca[:-1])
+        if keep is not None:
+            # the state seen at t is y[t - 1] * keep[t] (same for the cells)
+            flat_keep = flatten_time(keep[1:-1])
+            masked_outputs = _h.allocate(flat_outputs.shape)
+            _h.mult_mv(flat_outputs, flat_keep, masked_outputs)
+            flat_outputs = masked_outputs
+            masked_cell = _h.allocate(flat_cell.shape)
+            _h.mult_mv(flat_cell, flat_keep, masked_cell)
+            flat_cell = masked_cell
 
         dWco_tmp = _h.allocate(flat_cell2.shape)
         dWc_tmp = _h.allocate(dpo.shape)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# coding=utf-8
+from __future__ import division, print_function, unicode_literals
+
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+
+from brainstorm.structure.buffer_structure import BufferStructure
+from brainstorm.utils import get_active_unit_sizes
+
+
+class ClockworkMixin(object):
+    """Clock handling shared by the Clockwork and ClockworkLstm layers.
+
+    If the optional 'reset' input is connected, the clock of a column
+    restarts whenever reset is set, such that all modules are active at the
+    first step of each packed sequence. The resulting keep mask and clock
+    phase are computed once in the forward pass and stored in the 'keep' and
+    'phase' internals for the backward pass.
+    """
+
+    def _get_clock_internals(self, in_shapes):
+        internals = OrderedDict()
+        if 'reset' in in_shapes:
+            internals['keep'] = BufferStructure('T', 'B', 1, context_size=1)
+            internals['phase'] = BufferStructure('T', 'B', 1)
+        return internals
+
+    def _compute_reset_phases(self, buffers):
+        """Fill the keep and phase internals from the reset input.
+
+        Returns:
+            numpy.ndarray: A host copy of the phases.
+        """
+        _h = self.handler
+        reset = _h.get_numpy_copy(buffers.inputs.reset) != 0
+        steps = np.arange(reset.shape[0]).reshape((-1, 1, 1))
+        starts = np.where(reset, steps, 0)
+        phase = steps - np.maximum.accumulate(starts, axis=0)
+        keep = np.ones(buffers.internals.keep.shape)
+        keep[:-1][reset] = 0.0
+        _h.set_from_numpy(buffers.internals.keep, keep)
+        _h.set_from_numpy(buffers.internals.phase, phase)
+        return phase
+
+    def _get_active_sizes(self, timing, phase, time_size):
+        """Get the number of leading units to compute at each step."""
+        timing = self.handler.get_numpy_copy(timing)
+        if np.any(np.diff(timing) < 0):
+            warnings.warn('The units of layer {} are not sorted by increasing '
+                          'timing, so the recurrent products can not be '
+                          'restricted to the active units.'.format(self.name))
+        if phase is None:
+            phase = np.arange(time_size).reshape((time_size, 1))
+        sizes = get_active_unit_sizes(timing, phase)
+        sizes[0] = self.size  # nothing is undone at the first step
+        return sizes
+
+    def _get_clock(self, buffers, forward):
+        """Get the keep mask, the phases and the active sizes of a pass.
+
+        The keep mask and the phases are None if there is no reset input.
+        """
+        timing = buffers.parameters.timing
+        time_size = buffers.inputs.default.shape[0]
+        if 'reset' not in buffers.inputs:
+            return None, None, self._get_active_sizes(timing, None, time_size)
+        keep, phase = buffers.internals.keep, buffers.internals.phase
+        if forward:
+            host_phase = self._compute_reset_phases(buffers)
+        else:
+            host_phase = self.handler.get_numpy_copy(phase)
+        return keep, phase, self._get_active_sizes(timing, host_phase,
+                                                   time_size)
+
+    def _dot_add_active(self, prev, R, out, k):
+        """Add prev * R.T to out, but only for the first k units."""
+        if k > 0:
+            self.handler.dot_add_mm(prev, R[:k], out[:, :k], transb=True)
+
+    def _dot_add_active_deltas(self, deltas, R, out, k):
+        """Add deltas * R to out, where only the first k units have deltas."""
+        if k > 0:
+            self.handler.dot_add_mm(deltas[:, :k], R[:k], out)
@@ -26,6 +26,8 @@ def DeltasScaling(factor, name=None):
 class DeltasScalingLayerImpl(Layer):
     expected_inputs = {'default': StructureTemplate('T', 'B', '...')}
     expected_kwargs = {'factor'}
+    in_place_outputs = {'default': 'default'}
+    takes_no_outputs_in_backward = ('default',)
 
     def setup(self, kwargs, in_shapes):
         if 'factor' not in kwargs:
@@ -35,9 +37,16 @@ class DeltasScalingLayerImpl(Layer):
         return out_shapes, OrderedDict(), OrderedDict()
 
     def forward_pass(self, buffers, training_pass=True):
+        if 'default' in self.aliased_outputs:
+            return  # the output already is the input
         self.handler.copy_to(buffers.inputs.default, buffers.outputs.default)
 
     def backward_pass(self, buffers):
+        if 'default' in self.aliased_outputs:
+            # the output deltas are turned into the input deltas
+            self.handler.mult_st(self.factor, buffers.output_deltas.default,
+                                 buffers.output_deltas.default)
+            return
         self.handler.mult_add_st(self.factor,
                                  buffers.output_deltas.default,
                                  buffers.input_deltas.default)
@@ -5,7 +5,8 @@ from __future__ import division, print_function, unicode_literals
 from collections import OrderedDict
 
 from brainstorm.layers.base_layer import Layer
-from brainstorm.structure.buffer_structure import StructureTemplate
+from brainstorm.structure.buffer_structure import (BufferStructure,
+                                                   StructureTemplate)
 from brainstorm.structure.construction import ConstructionWrapper
 
 
@@ -13,6 +14,9 @@ def Dropout(drop_prob=0.5, name=None):
     """Create a Dropout layer.
 
     drop_prob is the probability of a unit being dropped, i.e. 0
+
+    Instead of the dropout mask only the seed it was generated from is
+    stored, and the mask is regenerated for the backward pass.
     """
     return ConstructionWrapper.create(DropoutLayerImpl, drop_prob=drop_prob,
                                       name=name)
@@ -22,6 +26,8 @@ class DropoutLayerImpl(Layer):
 
     expected_inputs = {'default': StructureTemplate('T', 'B', '...')}
     expected_kwargs = {'drop_prob'}
+    in_place_outputs = {'default': 'default'}
+    takes_no_outputs_in_backward = ('default',)
 
     def setup(self, kwargs, in_shapes):
         self.drop_prob = kwargs.get('drop_prob', 0.5)
@@ -30,23 +36,26 @@ class DropoutLayerImpl(Layer):
         outputs['default'] = in_shapes['default']
 
         internals = OrderedDict()
-        internals['mask'] = self.in_shapes['default']
+        internals['seed'] = BufferStructure(1)
         return outputs, OrderedDict(), internals
 
     def forward_pass(self, buffers, training_pass=True):
         _h = self.handler
 
         if training_pass:
-            _h.generate_probability_mask(buffers.internals.mask,
-                                         1 - self.drop_prob)
-            _h.mult_tt(buffers.inputs.default, buffers.internals.mask,
-                       out=buffers.outputs.default)
-            _h.mult_st(1 / (1 - self.drop_prob), buffers.outputs.default,
-                       out=buffers.outputs.default)
-        else:
+            _h.dropout_forward(buffers.inputs.default, buffers.internals.seed,
+                               1 - self.drop_prob, buffers.outputs.default)
+        elif 'default' not in self.aliased_outputs:
             _h.copy_to(buffers.inputs.default, buffers.outputs.default)
 
     def backward_pass(self, buffers):
-        self.handler.mult_add_tt(buffers.output_deltas.default,
-                                 buffers.internals.mask,
-                                 buffers.input_deltas.default)
+        if 'default' in self.aliased_outputs:
+            # the output deltas are turned into the input deltas
+            self.handler.dropout_backward_inplace(
+                buffers.output_deltas.default, buffers.internals.seed,
+                1 - self.drop_prob)
+            return
+        self.handler.dropout_backward(buffers.output_deltas.default,
+                                      buffers.internals.seed,
+                                      1 - self.drop_prob,
+                                      buffers.input_deltas.default)
@@ -22,16 +22,26 @@ class ElementwiseLayerImpl(Layer):
 
     expected_inputs = {'default': StructureTemplate('T', 'B', '...')}
     expected_kwargs = {'activation'}
+    in_place_outputs = {'default': 'default'}
 
     def setup(self, kwargs, in_shapes):
         self.activation = kwargs.get('activation', 'rel')
         return in_shapes, OrderedDict(), OrderedDict()
 
     def forward_pass(self, buffers, training_pass=True):
+        if 'default' in self.aliased_outputs:
+            self.handler.inplace_act_func[self.activation](
+                buffers.outputs.default)
+            return
         self.handler.act_func[self.activation](buffers.inputs.default,
                                                buffers.outputs.default)
 
     def backward_pass(self, buffers):
+        if 'default' in self.aliased_outputs:
+            # the output deltas are turned into the input deltas
+            self.handler.inplace_act_func_deriv[self.activation](
+                buffers.outputs.default, buffers.output_deltas.default)
+            return
         tmp = self.handler.allocate(buffers.input_deltas.default.shape)
         self.handler.act_func_deriv[self.activation](
             buffers.inputs.default, buffers.outputs.default,
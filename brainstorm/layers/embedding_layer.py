@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# coding=utf-8
+from __future__ import division, print_function, unicode_literals
+
+from collections import OrderedDict
+
+from brainstorm.layers.base_layer import Layer
+from brainstorm.structure.buffer_structure import (BufferStructure,
+                                                   StructureTemplate)
+from brainstorm.structure.construction import ConstructionWrapper
+from brainstorm.utils import LayerValidationError, flatten_all_but_last
+
+
+def Embedding(vocab_size, size, name=None):
+    """Create an Embedding layer that maps indices to learned vectors.
+
+    The 'default' input holds integer indices (0-based) into a vocabulary of
+    `vocab_size` entries, with a last dimension of size 1. Each index is
+    replaced by the corresponding row of the weight matrix 'W', which is
+    equivalent to a linear FullyConnected layer without bias applied to a
+    one-hot encoding of the input, but without materializing it.
+
+    WARNING:
+        This layer does not compute derivatives wrt the 'default' input.
+    """
+    return ConstructionWrapper.create(EmbeddingLayerImpl, name=name,
+                                      vocab_size=vocab_size, size=size)
+
+
+class EmbeddingLayerImpl(Layer):
+
+    expected_inputs = {'default': StructureTemplate('T', 'B', '...')}
+    expected_kwargs = {'vocab_size', 'size'}
+
+    computes_no_input_deltas_for = ['default']
+    takes_no_outputs_in_backward = ('default',)
+
+    def setup(self, kwargs, in_shapes):
+        self.vocab_size = kwargs['vocab_size']
+        self.size = kwargs['size']
+        if not isinstance(self.vocab_size, int) or self.vocab_size < 1:
+            raise LayerValidationError('vocab_size must be a positive int '
+                                       'but was {}'.format(self.vocab_size))
+        if not isinstance(self.size, int) or self.size < 1:
+            raise LayerValidationError('size must be a positive int but was '
+                                       '{}'.format(self.size))
+        in_shape = in_shapes['default'].feature_shape
+        if in_shape[-1] != 1:
+            raise LayerValidationError(
+                'Last dimension of the input must be size 1 but was {}'
+                .format(in_shape[-1]))
+
+        outputs = OrderedDict()
+        outputs['default'] = BufferStructure('T', 'B', *(in_shape[:-1] +
+                                                         (self.size,)))
+
+        parameters = OrderedDict()
+        parameters['W'] = BufferStructure(self.vocab_size, self.size)
+
+        internals = OrderedDict()
+        return outputs, parameters, internals
+
+    def forward_pass(self, buffers, training_pass=True):
+        # prepare
+        _h = self.handler
+        W = buffers.parameters.W
+        indices = flatten_all_but_last(buffers.inputs.default)
+        outputs = flatten_all_but_last(buffers.outputs.default)
+
+        # look up the rows of W
+        _h.gather_rows(W, indices, outputs)
+
+    def backward_pass(self, buffers):
+        # prepare
+        _h = self.handler
+        dW = buffers.gradients.W
+        indices = flatten_all_but_last(buffers.inputs.default)
+        out_deltas = flatten_all_but_last(buffers.output_deltas.default)
+
+        # only the rows that were looked up receive gradients
+        _h.scatter_add_rows(out_deltas, indices, dW)
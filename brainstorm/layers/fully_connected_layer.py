@@ -4,6 +4,8 @@ from __future__ import division, print_function, unicode_literals
 
 from collections import OrderedDict
 
+import numpy as np
+
 from brainstorm.layers.base_layer import Layer
 from brainstorm.structure.buffer_structure import (BufferStructure,
                                                    StructureTemplate)
@@ -13,7 +15,18 @@ from brainstorm.utils import (LayerValidationError, flatten_time,
 
 
 def FullyConnected(size=None, activation='rel', name=None):
-    """Create a Fully Connected (inner product) layer."""
+    """Create a Fully Connected (inner product) layer.
+
+    The 'default' input may be sparse (see :func:`Input`), in which case no
+    deltas are computed for it.
+
+    Ensembles (see :func:`brainstorm.structure.replicate_architecture`) set
+    the 'nr_replicas' keyword argument, which computes that many independent
+    replicas of the layer at once. Their parameters and the features of the
+    output are then stacked along a new first axis. If 'replicated_input' is
+    set, the first feature axis of the input holds one input per replica,
+    otherwise all replicas share the same input.
+    """
     if size is None:
         return ConstructionWrapper.create(FullyConnectedLayerImpl, name=name,
                                           activation=activation)
@@ -25,26 +38,55 @@ def FullyConnected(size=None, activation='rel', name=None):
 class FullyConnectedLayerImpl(Layer):
 
     expected_inputs = {'default': StructureTemplate('T', 'B', '...')}
-    expected_kwargs = {'size', 'activation'}
+    expected_kwargs = {'size', 'activation', 'nr_replicas',
+                       'replicated_input'}
+    accepts_sparse_inputs = ('default',)
 
     def setup(self, kwargs, in_shapes):
         self.activation = kwargs.get('activation', 'rel')
-        self.size = kwargs.get('size', self.in_shapes['default'].feature_shape)
+        if self.activation == 'linear':
+            # only the derivative of the activation depends on the outputs
+            self.takes_no_outputs_in_backward = ('default',)
+        self.sparse_input = in_shapes['default'].is_sparse
+        self.nr_replicas = kwargs.get('nr_replicas')
+        self.replicated_input = kwargs.get('replicated_input', False)
+        in_shape = in_shapes['default'].feature_shape
+        replica_shape = ()
+        if self.nr_replicas is not None:
+            if not isinstance(self.nr_replicas, int) or self.nr_replicas < 1:
+                raise LayerValidationError(
+                    'nr_replicas must be a positive int but was {}'
+                    .format(self.nr_replicas))
+            if self.sparse_input:
+                raise LayerValidationError(
+                    'Replicas can not be computed for sparse inputs')
+            replica_shape = (self.nr_replicas,)
+        if self.replicated_input:
+            if not replica_shape or in_shape[:1] != replica_shape:
+                raise LayerValidationError(
+                    'A replicated input needs {} replicas as its first '
+                    'feature axis but had shape {}'.format(self.nr_replicas,
+                                                           in_shape))
+            in_shape = in_shape[1:]
+
+        self.size = kwargs.get('size', in_shape)
         self.size = (self.size,) if isinstance(self.size, int) else self.size
 
         if not isinstance(self.size, (tuple, list)) or \
                 not all(isinstance(item, int) for item in self.size):
             raise LayerValidationError('size must be int or tuple[int] but '
                                        'was {}'.format(self.size))
-        in_size = in_shapes['default'].feature_size
+        in_size = int(np.prod(in_shape))
+        out_size = int(np.prod(self.size))
 
         outputs = OrderedDict()
-        outputs['default'] = BufferStructure('T', 'B', *self.size)
-        out_size = outputs['default'].feature_size
+        outputs['default'] = BufferStructure('T', 'B', *(replica_shape +
+                                                         tuple(self.size)))
 
         parameters = OrderedDict()
-        parameters['W'] = BufferStructure(out_size, in_size)
-        parameters['bias'] = BufferStructure(out_size)
+        parameters['W'] = BufferStructure(*(replica_shape +
+                                            (out_size, in_size)))
+        parameters['bias'] = BufferStructure(*(replica_shape + (out_size,)))
 
         internals = OrderedDict()
         return outputs, parameters, internals
@@ -57,8 +99,17 @@ class FullyConnectedLayerImpl(Layer):
         outputs = flatten_time_and_features(buffers.outputs.default)
 
         # calculate outputs
-        _h.dot_mm(inputs, W, outputs, transb=True)
-        _h.add_mv(outputs, bias.reshape((1, bias.shape[0])), outputs)
+        if self.sparse_input:
+            _h.sparse_dot_mm(inputs, W, outputs, transb=True)
+        elif self.replicated_input:
+            for k in range(self.nr_replicas):
+                _h.dot_mm(self._get_replica(inputs, k), W[k],
+                          self._get_replica(outputs, k), transb=True)
+        else:
+            # all replicas share the input, so it is a single product
+            _h.dot_mm(inputs, W.reshape((outputs.shape[1], inputs.shape[1])),
+                      outputs, transb=True)
+        _h.add_mv(outputs, bias.reshape((1, bias.size)), outputs)
         _h.inplace_act_func[self.activation](outputs)
 
     def backward_pass(self, buffers):
@@ -68,11 +119,32 @@ class FullyConnectedLayerImpl(Layer):
         dW, dbias = buffers.gradients
         inputs = flatten_time_and_features(buffers.inputs.default)
         outputs = flatten_time_and_features(buffers.outputs.default)
-        in_deltas = flatten_time_and_features(buffers.input_deltas.default)
         out_deltas = flatten_time_and_features(buffers.output_deltas.default)
 
         # calculate in_deltas and gradients
         _h.inplace_act_func_deriv[self.activation](outputs, out_deltas)
-        _h.dot_add_mm(out_deltas, W, out=in_deltas)
-        _h.dot_mm(out_deltas, inputs, out=dW, transa=True)
-        _h.sum_t(out_deltas, axis=0, out=dbias)
+        if self.sparse_input:
+            # sparse inputs receive no deltas
+            _h.fill(dW, 0.0)
+            _h.sparse_dot_add_mm_transposed(inputs, out_deltas, dW)
+        elif self.replicated_input:
+            in_deltas = flatten_time_and_features(
+                buffers.input_deltas.default)
+            for k in range(self.nr_replicas):
+                replica_deltas = self._get_replica(out_deltas, k)
+                _h.dot_add_mm(replica_deltas, W[k],
+                              out=self._get_replica(in_deltas, k))
+                _h.dot_mm(replica_deltas, self._get_replica(inputs, k),
+                          out=dW[k], transa=True)
+        else:
+            in_deltas = flatten_time_and_features(
+                buffers.input_deltas.default)
+            shape = (out_deltas.shape[1], inputs.shape[1])
+            _h.dot_add_mm(out_deltas, W.reshape(shape), out=in_deltas)
+            _h.dot_mm(out_deltas, inputs, out=dW.reshape(shape), transa=True)
+        _h.sum_t(out_deltas, axis=0, out=dbias.reshape((dbias.size,)))
+
+    def _get_replica(self, array, k):
+        """Get the columns of a flattened array that belong to replica k."""
+        size = array.shape[1] // self.nr_replicas
+        return array[:, k * size:(k + 1) * size]
@@ -10,20 +10,29 @@ from brainstorm.structure.construction import ConstructionWrapper
 from brainstorm.utils import LayerValidationError
 
 
-def Input(out_shapes):
+def Input(out_shapes, sparse_inputs=()):
     """Create an Input layer.
     Special input layer type, that provides access to external data.
 
     The 'out_shapes' keyword argument is required and specifies the names and
     shapes of all external inputs.
+
+    The names listed in 'sparse_inputs' are provided as
+    :class:`brainstorm.utils.SparseArray` instead of dense arrays. They are
+    not allocated in the network buffers, and can only be connected to
+    layers that support sparse inputs (like FullyConnected).
     """
+    if sparse_inputs:
+        return ConstructionWrapper.create(InputLayerImpl,
+                                          out_shapes=out_shapes,
+                                          sparse_inputs=sparse_inputs)
     return ConstructionWrapper.create(InputLayerImpl, out_shapes=out_shapes)
 
 
 class InputLayerImpl(Layer):
 
     expected_inputs = {}
-    expected_kwargs = {'out_shapes'}
+    expected_kwargs = {'out_shapes', 'sparse_inputs'}
 
     def setup(self, kwargs, in_shapes):
         if 'out_shapes' not in kwargs:
@@ -33,9 +42,15 @@ class InputLayerImpl(Layer):
                 'InputLayer cannot have any incoming connections!'
                 '(But had these: {})'.format(in_shapes))
 
+        sparse_inputs = set(kwargs.get('sparse_inputs', ()))
+        if not sparse_inputs <= set(kwargs['out_shapes']):
+            raise LayerValidationError(
+                'Unknown sparse_inputs: {}'.format(
+                    sparse_inputs - set(kwargs['out_shapes'])))
+
         outputs = OrderedDict()
         for n, s in self.kwargs['out_shapes'].items():
-            outputs[n] = BufferStructure(*s)
+            outputs[n] = BufferStructure(*s, is_sparse=n in sparse_inputs)
         return outputs, OrderedDict(), OrderedDict()
 
     def _validate_connections(self):
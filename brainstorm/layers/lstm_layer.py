@@ -9,20 +9,35 @@ from brainstorm.structure.buffer_structure import (BufferStructure,
                                                    StructureTemplate)
 from brainstorm.structure.construction import ConstructionWrapper
 from brainstorm.utils import LayerValidationError, flatten_time, \
-    flatten_time_and_features
+    flatten_time_and_features, get_active_batch_sizes
 
 
 def Lstm(size, activation='tanh', name=None):
-    """Create an LSTM layer."""
+    """Create an LSTM layer.
+
+    The optional 'reset' input (shape ('T', 'B', 1)) marks timesteps at which
+    a new sequence starts. There the outputs and cell states are reset to
+    zero and no gradients flow back to the previous timestep.
+
+    If the optional 'mask' input (shape ('T', 'B', 1)) is connected, the
+    layer skips all batch columns whose sequence has already ended. Their
+    outputs are set to zero and they receive no deltas. This works best if
+    the columns are sorted by decreasing sequence length.
+    """
     return ConstructionWrapper.create(LstmLayerImpl, size=size,
                                       name=name, activation=activation)
 
 
 class LstmLayerImpl(Layer):
 
-    expected_inputs = {'default': StructureTemplate('T', 'B', '...')}
+    expected_inputs = {'default': StructureTemplate('T', 'B', '...'),
+                       'mask': StructureTemplate('T', 'B', 1),
+                       'reset': StructureTemplate('T', 'B', 1)}
+    optional_inputs = ('mask', 'reset')
     expected_kwargs = {'size', 'activation'}
 
+    computes_no_input_deltas_for = ['mask', 'reset']
+
     def setup(self, kwargs, in_shapes):
         self.activation = kwargs.get('activation', 'tanh')
         in_size = in_shapes['default'].feature_size
@@ -87,6 +102,13 @@ class LstmLayerImpl(Layer):
                                            is_backward_only=True)
         return outputs, parameters, internals
 
+    def _get_active_batch_sizes(self, buffers):
+        time_size, batch_size = buffers.inputs.default.shape[:2]
+        if 'mask' not in buffers.inputs:
+            return [batch_size] * time_size
+        mask = self.handler.get_numpy_copy(buffers.inputs.mask)
+        return get_active_batch_sizes(mask)
+
     def forward_pass(self, buffers, training_pass=True):
         # prepare
         _h = self.handler
@@ -112,37 +134,60 @@ class LstmLayerImpl(Layer):
         _h.dot_mm(flat_x, Wf, flat_Fa, transb=True)
         _h.dot_mm(flat_x, Wo, flat_Oa, transb=True)
 
-        for t in range(time_size):
+        sizes = self._get_active_batch_sizes(buffers)
+        keep = None
+        if 'reset' in buffers.inputs:
+            keep = _h.ones((time_size + 1, batch_size, 1))
+            _h.fill_if(keep[:-1], 0.0, buffers.inputs.reset)
+            y_prev_buffer = _h.allocate(y[0].shape)
+            c_prev_buffer = _h.allocate(Ca[0].shape)
+
+        for t, n in enumerate(sizes):
+            # columns from n on have ended and are not computed
+            if n < batch_size:
+                _h.fill(y[t][n:], 0.0)
+                _h.fill(Ca[t][n:], 0.0)
+            if n == 0:
+                continue
+            y_prev, c_prev = y[t - 1][:n], Ca[t - 1][:n]
+            if keep is not None:
+                _h.mult_mv(y_prev, keep[t][:n], y_prev_buffer[:n])
+                _h.mult_mv(c_prev, keep[t][:n], c_prev_buffer[:n])
+                y_prev, c_prev = y_prev_buffer[:n], c_prev_buffer[:n]
+            Za_t, Zb_t, Ia_t, Ib_t = Za[t][:n], Zb[t][:n], Ia[t][:n], Ib[t][:n]
+            Fa_t, Fb_t, Oa_t, Ob_t = Fa[t][:n], Fb[t][:n], Oa[t][:n], Ob[t][:n]
+            Ca_t, Cb_t, y_t = Ca[t][:n], Cb[t][:n], y[t][:n]
+
             # Block input
-            _h.dot_add_mm(y[t - 1], Rz, Za[t], transb=True)
-            _h.add_mv(Za[t], bz.reshape((1, self.size)), Za[t])
-            _h.act_func[self.activation](Za[t], Zb[t])
+            _h.dot_add_mm(y_prev, Rz, Za_t, transb=True)
+            _h.add_mv(Za_t, bz.reshape((1, self.size)), Za_t)
+            _h.act_func[self.activation](Za_t, Zb_t)
 
             # Input Gate
-            _h.dot_add_mm(y[t - 1], Ri, Ia[t], transb=True)
-            _h.mult_add_mv(Ca[t - 1], pi, Ia[t])
-            _h.add_mv(Ia[t], bi.reshape((1, self.size)), Ia[t])
-            _h.sigmoid(Ia[t], Ib[t])
+            _h.dot_add_mm(y_prev, Ri, Ia_t, transb=True)
+            _h.mult_add_mv(c_prev, pi, Ia_t)
+            _h.add_mv(Ia_t, bi.reshape((1, self.size)), Ia_t)
+            _h.sigmoid(Ia_t, Ib_t)
 
             # Forget Gate
-            _h.dot_add_mm(y[t - 1], Rf, Fa[t], transb=True)
-            _h.mult_add_mv(Ca[t - 1], pf, Fa[t])
-            _h.add_mv(Fa[t], bf.reshape((1, self.size)), Fa[t])
-            _h.sigmoid(Fa[t], Fb[t])
+            _h.dot_add_mm(y_prev, Rf, Fa_t, transb=True)
+            _h.mult_add_mv(c_prev, pf, Fa_t)
+            _h.add_mv(Fa_t, bf.reshape((1, self.size)), Fa_t)
+            _h.sigmoid(Fa_t, Fb_t)
 
             # Cell
-            _h.mult_tt(Ib[t], Zb[t], Ca[t])
-            _h.mult_add_tt(Fb[t], Ca[t - 1], Ca[t])
+            _h.mult_tt(Ib_t, Zb_t, Ca_t)
+            _h.mult_add_tt(Fb_t, c_prev, Ca_t)
 
             # Output Gate
-            _h.dot_add_mm(y[t - 1], Ro, Oa[t], transb=True)
-            _h.mult_add_mv(Ca[t], po, Oa[t])
-            _h.add_mv(Oa[t], bo.reshape((1, self.size)), Oa[t])
-            _h.sigmoid(Oa[t], Ob[t])
+            _h.dot_add_mm(y_prev, Ro, Oa_t, transb=True)
+            _h.mult_add_mv(Ca_t, po, Oa_t)
+            _h.add_mv(Oa_t, bo.reshape((1, self.size)), Oa_t)
+            _h.sigmoid(Oa_t, Ob_t)
 
             # Block output
-            _h.act_func[self.activation](Ca[t], Cb[t])
-            _h.mult_tt(Ob[t], Cb[t], y[t])
+            _h.act_func[self.activation](Ca_t, Cb_t)
+            _h.mult_tt(Ob_t, Cb_t, y_t)
 
     def backward_pass(self, buffers):
         # prepare
@@ -162,47 +207,58 @@ class LstmLayerImpl(Layer):
         x = buffers.inputs.default
         dx = buffers.input_deltas.default
         y = buffers.outputs.default
-        deltas = buffers.output_deltas.default
 
         dy = _h.allocate(y.shape)
         _h.fill(dCa, 0.0)
 
         time_size, batch_size = x.shape[0], x.shape[1]
-        for t in range(time_size - 1, -1, - 1):
-            # Accumulate recurrent deltas
-            _h.copy_to(deltas[t], dy[t])
-            _h.dot_add_mm(dIa[t + 1], Ri, dy[t])
-            _h.dot_add_mm(dFa[t + 1], Rf, dy[t])
-            _h.dot_add_mm(dOa[t + 1], Ro, dy[t])
-            _h.dot_add_mm(dZa[t + 1], Rz, dy[t])
 
-            # Peephole connection part:
-            _h.mult_add_mv(dIa[t + 1], pi, dCa[t])
-            _h.mult_add_mv(dFa[t + 1], pf, dCa[t])
+        sizes = self._get_active_batch_sizes(buffers)
+        keep = None
+        if 'reset' in buffers.inputs:
+            keep = _h.ones((time_size + 1, batch_size, 1))
+            _h.fill_if(keep[:-1], 0.0, buffers.inputs.reset)
+
+        for t in range(time_size - 1, -1, - 1):
+            n = sizes[t]
+            # only the first m rows of the deltas at t + 1 can be non-zero
+            m = sizes[t + 1] if t + 1 < time_size else n
+            if n < batch_size:
+                _h.fill(dZa[t][n:], 0.0)
+                _h.fill(dIa[t][n:], 0.0)
+                _h.fill(dFa[t][n:], 0.0)
+                _h.fill(dOa[t][n:], 0.0)
+            if n == 0:
+                continue
+            dy_t, dCa_t = dy[t][:n], dCa[t][:n]
+            self._accumulate_recurrent_deltas(buffers, dy, t, n, m, keep)
 
             # Output Gate
-            _h.mult_tt(dy[t], Cb[t], dOb[t])
-            _h.sigmoid_deriv(Oa[t], Ob[t], dOb[t], dOa[t])
+            _h.mult_tt(dy_t, Cb[t][:n], dOb[t][:n])
+            _h.sigmoid_deriv(Oa[t][:n], Ob[t][:n], dOb[t][:n], dOa[t][:n])
             # Peephole connection
-            _h.mult_add_mv(dOa[t], po, dCa[t])
+            _h.mult_add_mv(dOa[t][:n], po, dCa_t)
 
             # Cell
-            _h.mult_tt(dy[t], Ob[t], dCb[t])
-            _h.act_func_deriv[self.activation](Ca[t], Cb[t], dCb[t], dCb[t])
-            _h.add_tt(dCa[t], dCb[t], dCa[t])
-            _h.mult_add_tt(dCa[t + 1], Fb[t + 1], dCa[t])
+            _h.mult_tt(dy_t, Ob[t][:n], dCb[t][:n])
+            _h.act_func_deriv[self.activation](Ca[t][:n], Cb[t][:n],
+                                               dCb[t][:n], dCb[t][:n])
+            _h.add_tt(dCa_t, dCb[t][:n], dCa_t)
 
             # Forget Gate
-            _h.mult_tt(dCa[t], Ca[t - 1], dFb[t])
-            _h.sigmoid_deriv(Fa[t], Fb[t], dFb[t], dFa[t])
+            _h.mult_tt(dCa_t, Ca[t - 1][:n], dFb[t][:n])
+            if keep is not None:
+                _h.mult_mv(dFb[t][:n], keep[t][:n], dFb[t][:n])
+            _h.sigmoid_deriv(Fa[t][:n], Fb[t][:n], dFb[t][:n], dFa[t][:n])
 
             # Input Gate
-            _h.mult_tt(dCa[t], Zb[t], dIb[t])
-            _h.sigmoid_deriv(Ia[t], Ib[t], dIb[t], dIa[t])
+            _h.mult_tt(dCa_t, Zb[t][:n], dIb[t][:n])
+            _h.sigmoid_deriv(Ia[t][:n], Ib[t][:n], dIb[t][:n], dIa[t][:n])
 
             # Block Input
-            _h.mult_tt(dCa[t], Ib[t], dZb[t])
-            _h.act_func_deriv[self.activation](Za[t], Zb[t], dZb[t], dZa[t])
+            _h.mult_tt(dCa_t, Ib[t][:n], dZb[t][:n])
+            _h.act_func_deriv[self.activation](Za[t][:n], Zb[t][:n],
+                                               dZb[t][:n], dZa[t][:n])
 
         flat_inputs = flatten_time_and_features(x)
         flat_dinputs = flatten_time_and_features(dx)
@@ -236,6 +292,15 @@ class LstmLayerImpl(Layer):
         flat_outputs = flatten_time(y[:-2])
         flat_cell = flatten_time(Ca[:-2])
         flat_cell2 = flatten_time(Ca[:-1])
+        if keep is not None:
+            # the state seen at t is y[t - 1] * keep[t] (same for the cells)
+            flat_keep = flatten_time(keep[1:-1])
+            masked_outputs = _h.allocate(flat_outputs.shape)
+            _h.mult_mv(flat_outputs, flat_keep, masked_outputs)
+            flat_outputs = masked_outputs
+            masked_cell = _h.allocate(flat_cell.shape)
+            _h.mult_mv(flat_cell, flat_keep, masked_cell)
+            flat_cell = masked_cell
 
         dWco_tmp = _h.allocate(flat_cell2.shape)
         dWc_tmp = _h.allocate(dpo.shape)
@@ -276,3 +341,32 @@ class LstmLayerImpl(Layer):
         _h.mult_tt(dCa[-1], dIa[0], dWcif_tmp)
         _h.sum_t(dWcif_tmp, axis=0, out=dWc_tmp)
         _h.add_tt(dpf, dWc_tmp, dpf)
+
+    def _accumulate_recurrent_deltas(self, buffers, dy, t, n, m, keep):
+        """Add the deltas from time step t + 1 to dy and dCa at t, where
+        only the first n columns are active at t and m at t + 1."""
+        _h = self.handler
+        p = buffers.parameters
+        dIa, dFa, dOa, dZa, dCa, Fb = (
+            buffers.internals[name]
+            for name in ['dIa', 'dFa', 'dOa', 'dZa', 'dCa', 'Fb'])
+        deltas = buffers.output_deltas.default
+        dy_t, dCa_t = dy[t][:n], dCa[t][:n]
+        if keep is None:
+            _h.copy_to(deltas[t][:n], dy_t)
+        if m > 0:
+            _h.dot_add_mm(dIa[t + 1][:m], p.Ri, dy[t][:m])
+            _h.dot_add_mm(dFa[t + 1][:m], p.Rf, dy[t][:m])
+            _h.dot_add_mm(dOa[t + 1][:m], p.Ro, dy[t][:m])
+            _h.dot_add_mm(dZa[t + 1][:m], p.Rz, dy[t][:m])
+
+            # Peephole connection part:
+            _h.mult_add_mv(dIa[t + 1][:m], p.pi, dCa[t][:m])
+            _h.mult_add_mv(dFa[t + 1][:m], p.pf, dCa[t][:m])
+            _h.mult_add_tt(dCa[t + 1][:m], Fb[t + 1][:m], dCa[t][:m])
+
+        if keep is not None:
+            # block the recurrent deltas at sequence boundaries
+            _h.mult_mv(dy_t, keep[t + 1][:n], dy_t)
+            _h.add_tt(dy_t, deltas[t][:n], dy_t)
+            _h.mult_mv(dCa_t, keep[t + 1][:n], dCa_t)
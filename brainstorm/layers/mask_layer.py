@@ -21,6 +21,8 @@ class MaskLayerImpl(Layer):
                        'mask': StructureTemplate('T', 'B', '...')}
 
     computes_no_input_deltas_for = ['mask']
+    in_place_outputs = {'default': 'default'}
+    takes_no_outputs_in_backward = ('default',)
 
     def setup(self, kwargs, in_shapes):
         in_shape = in_shapes['default'].feature_shape
@@ -59,8 +61,12 @@ class MaskLayerImpl(Layer):
         _h = self.handler
 
         flat_out_deltas = self.flatten_buffer(buffers.output_deltas.default)
-        tmp = self.handler.allocate(flat_out_deltas.shape)
         flat_mask = self.flatten_buffer(buffers.inputs.mask)
+        if 'default' in self.aliased_outputs:
+            # the output deltas are turned into the input deltas
+            _h.mult_mv(flat_out_deltas, flat_mask, flat_out_deltas)
+            return
+        tmp = self.handler.allocate(flat_out_deltas.shape)
         flat_in_deltas = self.flatten_buffer(buffers.input_deltas.default)
 
         _h.mult_mv(flat_out_deltas, flat_mask, tmp)
@@ -12,7 +12,12 @@ from brainstorm.utils import LayerValidationError, flatten_all_but_last
 
 
 def Merge(name=None):
-    """Create a layer that merges two inputs into one along the last dim"""
+    """Create a layer that merges two inputs into one along the last dim.
+
+    Whenever possible the layout places the sources of both inputs next to
+    each other, such that the output is just a view over them and neither
+    pass has to copy anything.
+    """
     return ConstructionWrapper.create(MergeLayerImpl, name=name)
 
 
@@ -20,6 +25,8 @@ class MergeLayerImpl(Layer):
     expected_inputs = {'inputs_1': StructureTemplate('...'),
                        'inputs_2': StructureTemplate('...')}
     expected_kwargs = {}
+    output_aliases = {'default': ('inputs_1', 'inputs_2')}
+    takes_no_outputs_in_backward = ('default',)
 
     def setup(self, kwargs, in_shapes):
         # 'inputs_1' and 'inputs_2' must have same shape except for last dim
@@ -44,14 +51,15 @@ class MergeLayerImpl(Layer):
         return outputs, parameters, internals
 
     def forward_pass(self, buffers, training_pass=True):
-        # prepare
+        if 'default' in self.aliased_outputs:
+            return  # the output already is a view over both inputs
         self.handler.merge_tt(buffers.inputs.inputs_1,
                               buffers.inputs.inputs_2,
                               buffers.outputs.default)
 
     def backward_pass(self, buffers):
-        # prepare
-        _h = self.handler
+        if 'default' in self.aliased_outputs:
+            return  # the deltas of both inputs already are a view
         self.handler.split_add_tt(buffers.output_deltas.default,
                                   buffers.input_deltas.inputs_1,
                                   buffers.input_deltas.inputs_2)
@@ -9,20 +9,36 @@ from brainstorm.structure.buffer_structure import (BufferStructure,
                                                    StructureTemplate)
 from brainstorm.structure.construction import ConstructionWrapper
 from brainstorm.utils import LayerValidationError, flatten_time, \
-    flatten_time_and_features
+    flatten_time_and_features, get_active_batch_sizes
 
 
 def Recurrent(size, activation='tanh', name=None):
-    """Create a Simple Recurrent layer."""
+    """Create a Simple Recurrent layer.
+
+    The optional 'reset' input (shape ('T', 'B', 1)) marks timesteps at which
+    a new sequence starts. There the recurrent state is reset to zero and no
+    gradients flow back to the previous timestep, so that several sequences
+    can be packed back to back into one batch column.
+
+    If the optional 'mask' input (shape ('T', 'B', 1)) is connected, the
+    layer skips all batch columns whose sequence has already ended. Their
+    outputs are set to zero and they receive no deltas. This works best if
+    the columns are sorted by decreasing sequence length.
+    """
     return ConstructionWrapper.create(RecurrentLayerImpl, size=size,
                                       name=name, activation=activation)
 
 
 class RecurrentLayerImpl(Layer):
 
-    expected_inputs = {'default': StructureTemplate('T', 'B', '...')}
+    expected_inputs = {'default': StructureTemplate('T', 'B', '...'),
+                       'mask': StructureTemplate('T', 'B', 1),
+                       'reset': StructureTemplate('T', 'B', 1)}
+    optional_inputs = ('mask', 'reset')
     expected_kwargs = {'size', 'activation'}
 
+    computes_no_input_deltas_for = ['mask', 'reset']
+
     def setup(self, kwargs, in_shapes):
         self.activation = kwargs.get('activation', 'tanh')
         self.size = kwargs.get('size', self.in_shapes['default'].feature_size)
@@ -48,6 +64,13 @@ class RecurrentLayerImpl(Layer):
                                            is_backward_only=True)
         return outputs, parameters, internals
 
+    def _get_active_batch_sizes(self, buffers):
+        time_size, batch_size = buffers.inputs.default.shape[:2]
+        if 'mask' not in buffers.inputs:
+            return [batch_size] * time_size
+        mask = self.handler.get_numpy_copy(buffers.inputs.mask)
+        return get_active_batch_sizes(mask)
+
     def forward_pass(self, buffers, training_pass=True):
         # prepare
         _h = self.handler
@@ -62,9 +85,24 @@ class RecurrentLayerImpl(Layer):
         _h.dot_mm(flat_inputs, W, flat_H, transb=True)
         _h.add_mv(flat_H, bias.reshape((1, self.size)), flat_H)
 
-        for t in range(inputs.shape[0]):
-            _h.dot_add_mm(outputs[t - 1], R, Ha[t], transb=True)
-            _h.act_func[self.activation](Ha[t], outputs[t])
+        sizes = self._get_active_batch_sizes(buffers)
+        keep = None
+        if 'reset' in buffers.inputs:
+            keep = _h.ones((inputs.shape[0] + 1, inputs.shape[1], 1))
+            _h.fill_if(keep[:-1], 0.0, buffers.inputs.reset)
+            prev_buffer = _h.allocate(outputs[0].shape)
+
+        for t, n in enumerate(sizes):
+            if n < inputs.shape[1]:
+                _h.fill(outputs[t][n:], 0.0)
+            if n == 0:
+                continue
+            prev = outputs[t - 1][:n]
+            if keep is not None:
+                _h.mult_mv(prev, keep[t][:n], prev_buffer[:n])
+                prev = prev_buffer[:n]
+            _h.dot_add_mm(prev, R, Ha[t][:n], transb=True)
+            _h.act_func[self.activation](Ha[t][:n], outputs[t][:n])
 
     def backward_pass(self, buffers):
         # prepare
@@ -77,13 +115,29 @@ class RecurrentLayerImpl(Layer):
         doutputs = buffers.output_deltas.default
         Ha, dHa, dHb = buffers.internals
 
+        sizes = self._get_active_batch_sizes(buffers)
+        keep = None
+        if 'reset' in buffers.inputs:
+            keep = _h.ones((inputs.shape[0] + 1, inputs.shape[1], 1))
+            _h.fill_if(keep[:-1], 0.0, buffers.inputs.reset)
+            dnext_buffer = _h.allocate(dHa[0].shape)
+
         _h.copy_to(doutputs, dHb)
-        T = inputs.shape[0] - 1
-        _h.act_func_deriv[self.activation](Ha[T], outputs[T], dHb[T], dHa[T])
-        for t in range(T - 1, -1, -1):
-            _h.dot_add_mm(dHa[t + 1], R, dHb[t])
-            _h.act_func_deriv[self.activation](Ha[t], outputs[t],
-                                               dHb[t], dHa[t])
+        for t in range(inputs.shape[0] - 1, -1, -1):
+            # only the first sizes[t + 1] rows of dHa[t + 1] can be non-zero
+            m = sizes[t + 1] if t + 1 < len(sizes) else 0
+            if m > 0:
+                dnext = dHa[t + 1][:m]
+                if keep is not None:
+                    _h.mult_mv(dnext, keep[t + 1][:m], dnext_buffer[:m])
+                    dnext = dnext_buffer[:m]
+                _h.dot_add_mm(dnext, R, dHb[t][:m])
+            n = sizes[t]
+            if n < inputs.shape[1]:
+                _h.fill(dHa[t][n:], 0.0)
+            if n > 0:
+                _h.act_func_deriv[self.activation](Ha[t][:n], outputs[t][:n],
+                                                   dHb[t][:n], dHa[t][:n])
 
         flat_inputs = flatten_time_and_features(inputs)
         flat_dinputs = flatten_time_and_features(dinputs)
@@ -98,5 +152,13 @@ class RecurrentLayerImpl(Layer):
 
         flat_outputs = flatten_time(outputs[:-2])
         flat_dHa = flatten_time(dHa[1:-1])
+        context = outputs[-1]
+        if keep is not None:
+            # the state seen at t is outputs[t - 1] * keep[t]
+            masked = _h.allocate(flat_outputs.shape)
+            _h.mult_mv(flat_outputs, flatten_time(keep[1:-1]), masked)
+            flat_outputs = masked
+            context = _h.allocate(outputs[-1].shape)
+            _h.mult_mv(outputs[-1], keep[0], context)
         _h.dot_add_mm(flat_dHa, flat_outputs, dR, transa=True)
-        _h.dot_add_mm(dHa[0], outputs[-1], dR, transa=True)
+        _h.dot_add_mm(dHa[0], context, dR, transa=True)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# coding=utf-8
+from __future__ import division, print_function, unicode_literals
+
+from collections import OrderedDict
+
+from brainstorm.layers.base_layer import Layer
+from brainstorm.structure.buffer_structure import (BufferStructure,
+                                                   StructureTemplate)
+from brainstorm.structure.construction import ConstructionWrapper
+from brainstorm.utils import (LayerValidationError, flatten_all_but_last,
+                              flatten_time_and_features)
+
+# logit of removed classes, whose probability then vanishes
+REMOVED_LOGIT = -1e30
+
+
+def SampledSoftmaxCE(size, nr_samples, predictions=False, name=None):
+    """Create a sampled softmax layer with Multinomial Cross Entropy loss.
+
+    Combines a linear projection of the 'default' input onto `size` classes
+    (parameters 'W' and 'bias') with a softmax and the multinomial
+    cross-entropy loss wrt. the class indices (0-based) in 'targets'. The
+    losses are stored in the 'loss' output.
+
+    During training only the target class and `nr_samples` negative classes
+    are evaluated, which are drawn uniformly (without replacement) by the
+    handler for every forward pass and shared among all positions. Sampled
+    classes that coincide with the target of a position are removed from
+    the softmax of that position. This makes the cost and the memory of the
+    layer independent of `size`, which is useful for large vocabularies.
+
+    If the forward pass is not a training pass the exact softmax over all
+    classes is computed instead, and the loss is the exact cross-entropy.
+    The per-class probabilities are only stored if `predictions` is True,
+    in which case the layer has a 'predictions' output of `size` features,
+    which is only written by these passes.
+
+    WARNING:
+        This layer does not compute derivatives wrt the 'targets' input.
+        It also does not use the deltas coming in from the 'predictions'.
+    """
+    return ConstructionWrapper.create(SampledSoftmaxCELayerImpl, name=name,
+                                      size=size, nr_samples=nr_samples,
+                                      predictions=predictions)
+
+
+class SampledSoftmaxCELayerImpl(Layer):
+
+    expected_inputs = {'default': StructureTemplate('T', 'B', '...'),
+                       'targets': StructureTemplate('T', 'B', 1)}
+    expected_kwargs = {'size', 'nr_samples', 'predictions'}
+
+    computes_no_input_deltas_for = ['targets']
+    takes_no_output_deltas_from = ['predictions']
+
+    def setup(self, kwargs, in_shapes):
+        self.size = kwargs['size']
+        self.nr_samples = kwargs['nr_samples']
+        if not isinstance(self.size, int) or self.size < 1:
+            raise LayerValidationError('size must be a positive int but was '
+                                       '{}'.format(self.size))
+        if not isinstance(self.nr_samples, int) or \
+                not 1 <= self.nr_samples <= self.size:
+            raise LayerValidationError(
+                'nr_samples must be an int between 1 and size ({}) but was '
+                '{}'.format(self.size, self.nr_samples))
+        self.predictions = kwargs.get('predictions', False)
+        in_size = in_shapes['default'].feature_size
+        nr_samples = self.nr_samples
+
+        outputs = OrderedDict()
+        if self.predictions:
+            outputs['predictions'] = BufferStructure('T', 'B', self.size)
+        outputs['loss'] = BufferStructure('T', 'B', 1)
+
+        parameters = OrderedDict()
+        parameters['W'] = BufferStructure(self.size, in_size)
+        parameters['bias'] = BufferStructure(self.size)
+
+        internals = OrderedDict()
+        internals['samples'] = BufferStructure(nr_samples, 1)
+        internals['W_true'] = BufferStructure('T', 'B', in_size)
+        internals['b_true'] = BufferStructure('T', 'B', 1)
+        internals['W_sampled'] = BufferStructure(nr_samples, in_size)
+        internals['b_sampled'] = BufferStructure(nr_samples, 1)
+        internals['H_true'] = BufferStructure('T', 'B', in_size)
+        internals['logits_true'] = BufferStructure('T', 'B', 1)
+        internals['logits_sampled'] = BufferStructure('T', 'B', nr_samples)
+        internals['hits'] = BufferStructure('T', 'B', nr_samples)
+        internals['probs'] = BufferStructure('T', 'B', nr_samples + 1)
+        # the column of the target in probs, which is always the first one
+        internals['target_columns'] = BufferStructure('T', 'B', 1)
+        internals['dlogits_true'] = BufferStructure('T', 'B', 1,
+                                                    is_backward_only=True)
+        internals['dlogits_sampled'] = BufferStructure(
+            'T', 'B', nr_samples, is_backward_only=True)
+        internals['dW_true'] = BufferStructure('T', 'B', in_size,
+                                               is_backward_only=True)
+        internals['dW_sampled'] = BufferStructure(nr_samples, in_size,
+                                                  is_backward_only=True)
+        internals['db_sampled'] = BufferStructure(1, nr_samples,
+                                                  is_backward_only=True)
+        return outputs, parameters, internals
+
+    def forward_pass(self, buffers, training_pass=True):
+        if training_pass:
+            self._sampled_forward_pass(buffers)
+        else:
+            self._full_forward_pass(buffers)
+
+    def _full_forward_pass(self, buffers):
+        # prepare
+        _h = self.handler
+        W, bias = buffers.parameters
+        inputs = flatten_time_and_features(buffers.inputs.default)
+        targets = flatten_all_but_last(buffers.inputs.targets)
+        loss = flatten_all_but_last(buffers.outputs.loss)
+        if self.predictions:
+            probs = flatten_all_but_last(buffers.outputs.predictions)
+        else:
+            # only needed for this pass
+            probs = _h.allocate((inputs.shape[0], self.size))
+
+        # exact softmax and cross entropy error over all classes
+        _h.dot_mm(inputs, W, probs, transb=True)
+        _h.add_mv(probs, bias.reshape((1, self.size)), probs)
+        _h.softmax_ce_forward(probs, targets, probs, loss)
+
+    def _sampled_forward_pass(self, buffers):
+        # prepare
+        _h = self.handler
+        W, bias = buffers.parameters
+        bias = bias.reshape((self.size, 1))
+        inputs = flatten_time_and_features(buffers.inputs.default)
+        targets = flatten_all_but_last(buffers.inputs.targets)
+        loss = flatten_all_but_last(buffers.outputs.loss)
+        samples = buffers.internals.samples
+        W_true = flatten_all_but_last(buffers.internals.W_true)
+        b_true = flatten_all_but_last(buffers.internals.b_true)
+        W_sampled = buffers.internals.W_sampled
+        b_sampled = buffers.internals.b_sampled
+        H_true = flatten_all_but_last(buffers.internals.H_true)
+        logits_true = flatten_all_but_last(buffers.internals.logits_true)
+        logits_sampled = flatten_all_but_last(
+            buffers.internals.logits_sampled)
+        hits = flatten_all_but_last(buffers.internals.hits)
+        probs = flatten_all_but_last(buffers.internals.probs)
+        target_columns = flatten_all_but_last(
+            buffers.internals.target_columns)
+
+        # draw the negative classes
+        _h.sample_indices(self.size, samples)
+
+        # logits of the targets
+        _h.gather_rows(W, targets, W_true)
+        _h.gather_rows(bias, targets, b_true)
+        _h.mult_tt(inputs, W_true, H_true)
+        _h.sum_t(H_true, axis=1, out=logits_true)
+        _h.add_tt(logits_true, b_true, logits_true)
+
+        # logits of the sampled classes
+        _h.gather_rows(W, samples, W_sampled)
+        _h.gather_rows(bias, samples, b_sampled)
+        _h.dot_mm(inputs, W_sampled, logits_sampled, transb=True)
+        _h.add_mv(logits_sampled, b_sampled.reshape((1, self.nr_samples)),
+                  logits_sampled)
+
+        # remove the sampled classes that are the target of a position
+        _h.equal_vv(targets, samples.reshape((1, self.nr_samples)), hits)
+        _h.fill_if(logits_sampled, REMOVED_LOGIT, hits)
+
+        # softmax and multinomial cross entropy error over the target (first
+        # column) and the sampled classes
+        _h.merge_tt(logits_true, logits_sampled, probs)
+        _h.fill(target_columns, 0.)
+        _h.softmax_ce_forward(probs, target_columns, probs, loss)
+
+    def backward_pass(self, buffers):
+        # prepare
+        _h = self.handler
+        W, bias = buffers.parameters
+        dW, dbias = buffers.gradients
+        dbias = dbias.reshape((self.size, 1))
+        inputs = flatten_time_and_features(buffers.inputs.default)
+        targets = flatten_all_but_last(buffers.inputs.targets)
+        dinputs = flatten_time_and_features(buffers.input_deltas.default)
+        dloss = flatten_all_but_last(buffers.output_deltas.loss)
+        samples = buffers.internals.samples
+        W_true = flatten_all_but_last(buffers.internals.W_true)
+        W_sampled = buffers.internals.W_sampled
+        H_true = flatten_all_but_last(buffers.internals.H_true)
+        probs = flatten_all_but_last(buffers.internals.probs)
+        dlogits_true = flatten_all_but_last(buffers.internals.dlogits_true)
+        dlogits_sampled = flatten_all_but_last(
+            buffers.internals.dlogits_sampled)
+        dW_true = flatten_all_but_last(buffers.internals.dW_true)
+        dW_sampled = buffers.internals.dW_sampled
+        db_sampled = buffers.internals.db_sampled
+
+        # derivative of multinomial cross-entropy error wrt softmax:
+        # y - t, where the target is always in the first column
+        _h.fill(dlogits_true, 0.)
+        _h.fill(dlogits_sampled, 0.)
+        _h.split_add_tt(probs, dlogits_true, dlogits_sampled)
+        _h.add_st(-1, dlogits_true, dlogits_true)
+        _h.mult_mv(dlogits_true, dloss, dlogits_true)
+        _h.mult_mv(dlogits_sampled, dloss, dlogits_sampled)
+
+        # input deltas
+        _h.mult_mv(W_true, dlogits_true, H_true)
+        _h.add_tt(H_true, dinputs, dinputs)
+        _h.dot_add_mm(dlogits_sampled, W_sampled, dinputs)
+
+        # gradients for the rows of the targets
+        _h.mult_mv(inputs, dlogits_true, dW_true)
+        _h.scatter_add_rows(dW_true, targets, dW)
+        _h.scatter_add_rows(dlogits_true, targets, dbias)
+
+        # gradients for the rows of the sampled classes
+        _h.dot_mm(dlogits_sampled, inputs, dW_sampled, transa=True)
+        _h.scatter_add_rows(dW_sampled, samples, dW)
+        _h.sum_t(dlogits_sampled, axis=0, out=db_sampled)
+        _h.scatter_add_rows(db_sampled.reshape((self.nr_samples, 1)),
+                            samples, dbias)
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# coding=utf-8
+from __future__ import division, print_function, unicode_literals
+
+from collections import OrderedDict
+
+from brainstorm.layers.base_layer import Layer
+from brainstorm.structure.buffer_structure import (BufferStructure,
+                                                   StructureTemplate)
+from brainstorm.structure.construction import ConstructionWrapper
+from brainstorm.utils import LayerValidationError, flatten_time_and_features
+
+
+def SelectReplica(replica, name=None):
+    """Create a SelectReplica layer.
+
+    This layer copies the outputs of one replica from a layer that computes
+    several replicas at once (see
+    :func:`brainstorm.structure.replicate_architecture`), which are stacked
+    along the first feature axis of its input.
+    """
+    return ConstructionWrapper.create(SelectReplicaLayerImpl, name=name,
+                                      replica=replica)
+
+
+class SelectReplicaLayerImpl(Layer):
+
+    expected_inputs = {'default': StructureTemplate('T', 'B', '...')}
+    expected_kwargs = {'replica'}
+    takes_no_outputs_in_backward = ('default',)
+
+    def setup(self, kwargs, in_shapes):
+        if 'replica' not in kwargs:
+            raise LayerValidationError("SelectReplica requires 'replica'")
+        self.replica = kwargs['replica']
+        in_shape = in_shapes['default'].feature_shape
+        if len(in_shape) < 2:
+            raise LayerValidationError(
+                'The input of SelectReplica needs a replica axis and features '
+                'but had shape {}'.format(in_shape))
+        if not isinstance(self.replica, int) or \
+                not 0 <= self.replica < in_shape[0]:
+            raise LayerValidationError(
+                'Invalid replica {} for {} replicas'.format(self.replica,
+                                                            in_shape[0]))
+
+        outputs = OrderedDict()
+        outputs['default'] = BufferStructure('T', 'B', *in_shape[1:])
+        return outputs, OrderedDict(), OrderedDict()
+
+    def forward_pass(self, buffers, training_pass=True):
+        inputs = flatten_time_and_features(buffers.inputs.default)
+        outputs = flatten_time_and_features(buffers.outputs.default)
+        self.handler.copy_to(self._get_replica(inputs), outputs)
+
+    def backward_pass(self, buffers):
+        out_deltas = flatten_time_and_features(buffers.output_deltas.default)
+        in_deltas = self._get_replica(
+            flatten_time_and_features(buffers.input_deltas.default))
+        self.handler.add_tt(out_deltas, in_deltas, out=in_deltas)
+
+    def _get_replica(self, array):
+        size = array.shape[1] // self.in_shapes['default'].feature_shape[0]
+        return array[:, self.replica * size:(self.replica + 1) * size]
@@ -19,7 +19,8 @@ def SoftmaxCE(name=None):
 
     It also takes class indices (0-based) as the 'targets' input,
     and computes the multinomial cross-entropy loss. The resulting losses are
-    stored in the 'loss' output.
+    stored in the 'loss' output. The loss is computed from the inputs using
+    the log-sum-exp trick, so it is exact even for very small probabilities.
 
     For pixel/voxel-wise classification, the `channel` dimension must be
     right-most (known as NHWC or NDHWC format).
@@ -57,10 +58,7 @@ class SoftmaxCELayerImpl(Layer):
         outputs['predictions'] = BufferStructure('T', 'B', *in_shape)
         outputs['loss'] = BufferStructure('T', 'B', *tar_shape)
 
-        internals = OrderedDict()
-        internals['t_bin'] = BufferStructure('T', 'B', *in_shape,
-                                             is_backward_only=True)
-        return outputs, OrderedDict(), internals
+        return outputs, OrderedDict(), OrderedDict()
 
     def forward_pass(self, buffers, training_pass=True):
         # prepare
@@ -76,17 +74,11 @@ class SoftmaxCELayerImpl(Layer):
         flat_loss = flatten_all_but_last(loss)
         flat_targets = flatten_all_but_last(targets)
 
-        # softmax
-        _h.softmax_m(flat_inputs, flat_probs)
-
-        # the multinomial cross entropy error is given by
+        # softmax and multinomial cross entropy error, which is given by
         # - sum over i: p_i * ln(y_i)
         # now our targets are indices so all p_i = 0 except for i=t
-        _h.fill(loss, 0.)
-        _h.index_m_by_v(flat_probs, flat_targets, flat_loss)
-        _h.clip_t(flat_loss, 1e-6, 1.0, flat_loss)
-        _h.log_t(loss, loss)
-        _h.mult_st(-1, loss, loss)
+        _h.softmax_ce_forward(flat_inputs, flat_targets, flat_probs,
+                              flat_loss)
 
     def backward_pass(self, buffers):
         # prepare
@@ -96,19 +88,14 @@ class SoftmaxCELayerImpl(Layer):
 
         dinputs = buffers.input_deltas.default
         dloss = buffers.output_deltas.loss
-        t_bin = buffers.internals.t_bin
 
         # reshape
         flat_probs = flatten_all_but_last(probs)
         flat_targets = flatten_all_but_last(targets)
-        flat_t_bin = flatten_all_but_last(t_bin)
         flat_dloss = flatten_all_but_last(dloss)
         flat_dinputs = flatten_all_but_last(dinputs)
 
         # derivative of multinomial cross-entropy error wrt softmax:
         # y - t
-        _h.binarize_v(flat_targets, flat_t_bin)
-        _h.mult_st(-1, flat_t_bin, flat_t_bin)
-        _h.add_tt(flat_t_bin, flat_probs, flat_t_bin)
-        _h.mult_mv(flat_t_bin, flat_dloss, flat_t_bin)
-        _h.add_tt(flat_t_bin, flat_dinputs, flat_dinputs)
+        _h.softmax_ce_backward(flat_probs, flat_targets, flat_dloss,
+                               flat_dinputs)
@@ -50,5 +50,14 @@ except ImportError as e:
     bokeh_mock = MissingDependencyMock(sys.exc_info())
 
 
+try:
+    import threadpoolctl
+    has_threadpoolctl = True
+except ImportError as e:
+    has_threadpoolctl = False
+    threadpoolctl_mock = MissingDependencyMock(sys.exc_info())
+
+
 __all__ = ['has_pycuda', 'pycuda_mock', 'has_bokeh', 'bokeh_mock',
+           'has_threadpoolctl', 'threadpoolctl_mock',
            'MissingDependencyMock']
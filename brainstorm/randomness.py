@@ -11,15 +11,23 @@ class RandomState(np.random.RandomState):
     """
     An extension of the numpy RandomState that saves it's own seed
     and offers convenience methods to generate seeds and other RandomStates.
+
+    It uses the counter-based Philox generator instead of the Mersenne
+    Twister, so (re-)seeding is cheap and independent streams can be
+    derived from a seed with :meth:`create_stream`. The key of the
+    generator consists of the seed and the number of the stream.
     """
 
     seed_range = (0, 1000000000)
 
-    def __init__(self, seed=None):
+    def __init__(self, seed=None, stream=0):
         if seed is None:
             seed = global_rnd.generate_seed()
-        super(RandomState, self).__init__(seed)
+        super(RandomState, self).__init__(
+            np.random.Philox(key=_get_key(seed, stream)))
+        self._generator = np.random.Generator(self._bit_generator)
         self._seed = seed
+        self._stream = stream
 
     def seed(self, seed=None):
         """
@@ -32,7 +40,10 @@ class RandomState(np.random.RandomState):
             seed (int):
                 the seed to reseed this random state with.
         """
-        super(RandomState, self).seed(seed)
+        if seed is None:
+            seed = global_rnd.generate_seed()
+        self.set_state(
+            np.random.Philox(key=_get_key(seed, self._stream)).state)
         self._seed = seed
 
     def get_seed(self):
@@ -51,6 +62,15 @@ class RandomState(np.random.RandomState):
         """
         self.seed(seed)
 
+    def get_stream(self):
+        """
+        Return the number of the stream of this RandomState.
+        """
+        return self._stream
+
+    def get_state(self, legacy=False):
+        return super(RandomState, self).get_state(legacy=legacy)
+
     def reset(self):
         """
         Reset the internal state of this RandomState.
@@ -79,17 +99,57 @@ class RandomState(np.random.RandomState):
             seed = self.generate_seed()
         return RandomState(seed)
 
+    def create_stream(self, stream):
+        """
+        Create and return a new RandomState with the same seed but a
+        different stream. Streams with different numbers are independent,
+        so this can be used to derive the random numbers for different
+        threads, processes or layers from a single seed. It does not change
+        the state of this RandomState.
+
+        Args:
+            stream (int):
+                the non-negative number of the stream.
+        """
+        return RandomState(self._seed, stream)
+
+    def random_sample(self, size=None, dtype=None):
+        """
+        Return random floats in the interval [0.0, 1.0).
+
+        Like the numpy method, but if dtype (float32 or float64) is given,
+        the numbers are generated directly in that dtype.
+        """
+        if dtype is None:
+            return super(RandomState, self).random_sample(size)
+        return self._generator.random(size, dtype=dtype)
+
+    def standard_normal(self, size=None, dtype=None):
+        """
+        Draw samples from a standard Normal distribution (mean=0, stdev=1).
+
+        Like the numpy method, but if dtype (float32 or float64) is given,
+        the numbers are generated directly in that dtype.
+        """
+        if dtype is None:
+            return super(RandomState, self).standard_normal(size)
+        return self._generator.standard_normal(size, dtype=dtype)
+
     def __reduce__(self):
         # Note: We need to override __reduce__ and __setstate__
         # because numpys RandomState implements them such that if pickled and
         # unpickled it would yield a numpy RandomState instead of a
         # brainstorm RandomState.
-        return self.__class__, (self._seed,), self.get_state()
+        return self.__class__, (self._seed, self._stream), self.get_state()
 
     def __setstate__(self, state):
         self.set_state(state)
 
 
+def _get_key(seed, stream):
+    return np.array([seed, stream], dtype=np.uint64)
+
+
 class Seedable(Describable):
     """
     Base class for all objects that use randomness.
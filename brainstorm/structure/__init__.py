@@ -2,7 +2,8 @@
 # coding=utf-8
 from __future__ import division, print_function
 from brainstorm.structure.network import Network
-from brainstorm.structure.architecture import generate_architecture
+from brainstorm.structure.architecture import (generate_architecture,
+                                               replicate_architecture)
 
 
-__all__ = ['Network', 'generate_architecture']
+__all__ = ['Network', 'generate_architecture', 'replicate_architecture']
@@ -2,6 +2,8 @@
 # coding=utf-8
 from __future__ import division, print_function, unicode_literals
 
+import hashlib
+import json
 from collections import OrderedDict, namedtuple
 from copy import copy
 
@@ -155,6 +157,160 @@ def get_canonical_layer_order(architecture):
     return list(reversed(layer_order))
 
 
+def get_architecture_hash(architecture):
+    """
+    Compute a hash of the architecture, which is the same for all
+    architectures that result in the same network, or None if the
+    architecture can not be encoded as JSON.
+
+    Only the order of the layers (and of connections given as sets) is
+    normalized, since they are sorted anyway (see
+    :func:`get_canonical_layer_order`). Everything else keeps its order,
+    because for example the order of the out_shapes of an Input layer
+    determines the order of its outputs.
+    """
+    layers = [[name, architecture[name]] for name in sorted(architecture)]
+    try:
+        encoded = json.dumps(layers, separators=(',', ':'),
+                             default=_sort_set).encode()
+    except (TypeError, ValueError):
+        return None
+    return hashlib.sha1(encoded).hexdigest()
+
+
+def _sort_set(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def get_replica_names(nr_replicas):
+    """
+    Get the names of the replicas of an ensemble, which are zero-padded so
+    they sort in the order of the replicas.
+    """
+    width = len(str(nr_replicas - 1))
+    return ['Replica{:0{}d}'.format(k, width) for k in range(nr_replicas)]
+
+
+def replicate_architecture(architecture, nr_replicas):
+    """
+    Create the architecture of an ensemble with independent replicas of all
+    the layers of the given architecture, which share its Input layer.
+
+    FullyConnected layers that get dense inputs from the Input layer or from
+    other such layers are batched: they keep their name, but compute all the
+    replicas at once, stacked along the first axis of their parameters and
+    of the features of their outputs (see the nr_replicas argument of
+    :func:`brainstorm.layers.FullyConnected`). So their products are
+    batched over the replicas instead of being run once per replica.
+
+    The names of all other layers are prefixed with the name of the replica
+    (see :func:`get_replica_names`), so every replica has its own loss. They
+    get the outputs of a batched layer from SelectReplica layers, which are
+    named like the batched layer with the prefix of their replica, so the
+    outputs of every replica can be found under the same name as in
+    separate networks.
+
+    Args:
+        architecture (dict):
+            The architecture to replicate.
+        nr_replicas (int):
+            Number of replicas.
+    Returns:
+        dict:
+            The architecture of the ensemble.
+    """
+    if not isinstance(nr_replicas, int) or nr_replicas < 1:
+        raise ValueError('nr_replicas must be a positive int but was {}'
+                         .format(nr_replicas))
+    prefixes = [name + '_' for name in get_replica_names(nr_replicas)]
+    batched = _get_batched_layers(architecture)
+
+    ensemble = {}
+    for layer_name, layer in architecture.items():
+        if layer_name == 'Input':
+            layer = copy(layer)
+            layer['@outgoing_connections'] = _prefix_connections(
+                layer['@outgoing_connections'], prefixes, batched)
+            ensemble[layer_name] = layer
+        elif layer_name in batched:
+            ensemble.update(_batch_layer(architecture, layer_name, prefixes,
+                                         batched))
+        else:
+            for prefix in prefixes:
+                replica = copy(layer)
+                replica['@outgoing_connections'] = _prefix_connections(
+                    layer['@outgoing_connections'], [prefix], batched)
+                ensemble[prefix + layer_name] = replica
+    return ensemble
+
+
+def _prefix_connections(outgoing, prefixes, batched):
+    """
+    Connect to every replica of the end layers, or just once to batched end
+    layers.
+    """
+    if isinstance(outgoing, (list, set, tuple)):
+        return _prefix_connections({'default': outgoing}, prefixes,
+                                   batched)['default']
+    prefixed = {}
+    for out_name, cons in outgoing.items():
+        to_batched = [c for c in cons if parse_connection(c)[0] in batched]
+        prefixed[out_name] = to_batched + [p + c for p in prefixes
+                                           for c in cons
+                                           if c not in to_batched]
+    return prefixed
+
+
+def _get_batched_layers(architecture):
+    """Get the names of the layers that replicate_architecture batches."""
+    connections = collect_all_connections(architecture)
+    sparse_inputs = set(architecture.get('Input', {}).get('sparse_inputs',
+                                                          ()))
+    batched = set()
+    for layer_name in get_canonical_layer_order(architecture):
+        incoming = [c for c in connections if c.end_layer == layer_name]
+        if architecture[layer_name]['@type'] != 'FullyConnected' or \
+                len(incoming) != 1:
+            continue
+        con = incoming[0]
+        if con.start_layer in batched or (
+                con.start_layer == 'Input' and
+                con.output_name not in sparse_inputs):
+            batched.add(layer_name)
+    return batched
+
+
+def _batch_layer(architecture, layer_name, prefixes, batched):
+    """
+    Create the batched layer of an ensemble and the SelectReplica layers for
+    its end layers that are not batched.
+    """
+    layer = copy(architecture[layer_name])
+    outgoing = layer['@outgoing_connections']
+    if isinstance(outgoing, dict):
+        outgoing = outgoing.get('default', [])
+    to_batched = [c for c in outgoing if parse_connection(c)[0] in batched]
+    to_others = [c for c in outgoing if c not in to_batched]
+    start_layer = [c.start_layer for c in collect_all_connections(architecture)
+                   if c.end_layer == layer_name][0]
+
+    layer['nr_replicas'] = len(prefixes)
+    layer['replicated_input'] = start_layer != 'Input'
+    layer['@outgoing_connections'] = to_batched
+    layers = {layer_name: layer}
+    if not to_others:
+        return layers
+    for k, prefix in enumerate(prefixes):
+        layer['@outgoing_connections'].append(prefix + layer_name)
+        layers[prefix + layer_name] = {
+            '@type': 'SelectReplica',
+            'replica': k,
+            '@outgoing_connections': [prefix + c for c in to_others]}
+    return layers
+
+
 def get_kwargs(layer):
     kwarg_ignore = {'@type', '@outgoing_connections'}
     return {k: copy(v) for k, v in layer.items() if k not in kwarg_ignore}
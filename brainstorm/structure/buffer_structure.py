@@ -112,13 +112,14 @@ class BufferStructure(object):
         shape = layout['@shape']
         context_size = layout.get('@context_size', 0)
         is_backward_only = layout.get('@is_backward_only', False)
+        is_sparse = layout.get('@is_sparse', False)
         return cls(*shape, context_size=context_size,
-                   is_backward_only=is_backward_only)
+                   is_backward_only=is_backward_only, is_sparse=is_sparse)
 
     # The following signature unfortunately is not python2 compatible:
     # def __init__(self, *args, context_size=0, backward_only=False):
     def __init__(self, *args, **kwargs):
-        expected_kwargs = {'context_size', 'is_backward_only'}
+        expected_kwargs = {'context_size', 'is_backward_only', 'is_sparse'}
         if not set(kwargs.keys()) <= expected_kwargs:
             raise TypeError('Unexpected keyword argument {}'
                             .format(set(kwargs.keys()) - expected_kwargs))
@@ -126,6 +127,8 @@ class BufferStructure(object):
         self.shape = args
         self.context_size = kwargs.get('context_size', 0)
         self.is_backward_only = kwargs.get('is_backward_only', False)
+        # sparse buffers take no space, they are provided externally
+        self.is_sparse = kwargs.get('is_sparse', False)
 
         if 'T' in self.shape:
             self.buffer_type = 2
@@ -188,7 +191,9 @@ class BufferStructure(object):
                     'The feature dimensions have to be all-integer. But was {}'
                     .format(self.feature_shape))
 
-        # validate context_size
+        self._validate_context_and_sparsity()
+
+    def _validate_context_and_sparsity(self):
         if not isinstance(self.context_size, int) or self.context_size < 0:
             raise StructureValidationError(
                 "context_size has to be a non-negative integer, but was {}"
@@ -198,6 +203,18 @@ class BufferStructure(object):
             raise StructureValidationError("context_size is only available for"
                                            "shapes that scale with time.")
 
+        if self.is_sparse and (not self.scales_with_time or
+                               len(self.feature_shape) != 1 or
+                               self.context_size):
+            raise StructureValidationError(
+                "Sparse buffers need to have a shape of the form ('T', 'B', "
+                "F) and no context (but shape was {})".format(self.shape))
+
+    @property
+    def allocated_size(self):
+        """The number of features that is allocated in a buffer hub."""
+        return 0 if self.is_sparse else self.feature_size
+
     def to_json(self, i):
         descr = {
             '@shape': self.shape,
@@ -208,6 +225,8 @@ class BufferStructure(object):
             descr['@context_size'] = self.context_size
         if self.is_backward_only:
             descr['@is_backward_only'] = True
+        if self.is_sparse:
+            descr['@is_sparse'] = True
         return descr
 
     def get_shape(self, time_size, batch_size):
@@ -277,6 +296,12 @@ def combine_buffer_structures(shapes):
     for s in shapes:
         assert isinstance(s, BufferStructure)
 
+    if any(s.is_sparse for s in shapes):
+        if len(shapes) > 1:
+            raise ValidationError('Sparse buffers can not be combined with '
+                                  'other buffers. But got: {}'.format(shapes))
+        return BufferStructure(*shapes[0].shape, is_sparse=True)
+
     dimensions = [s.nr_dims for s in shapes]
     if min(dimensions) != max(dimensions):
         raise ValueError('Dimensionality mismatch. {}'.format(shapes))
@@ -25,6 +25,12 @@ class BufferView(list):
             self.__dict__[n] = self[i]
         return self
 
+    def set_buffer(self, name, buffer):
+        """Replace the buffer with the given name (e.g. for sparse data)."""
+        i = self._buffer_names.index(name)
+        self[i] = buffer
+        self.__dict__[name] = buffer
+
     def _asdict(self):
         return dict(zip(self._buffer_names, self))
 
@@ -38,7 +44,7 @@ class BufferView(list):
         return self._asdict().values()
 
     def __getitem__(self, item):
-        if isinstance(item, int):
+        if isinstance(item, (int, slice)):
             return super(BufferView, self).__getitem__(item)
         if item in self._keys:
             return self.__dict__[item]
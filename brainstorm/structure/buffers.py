@@ -12,13 +12,14 @@ from brainstorm.utils import sort_by_index_key
 
 
 def create_buffer_views_from_layout(layout, buffers, hubs, existing_view=None):
-    if '@slice' in layout:
+    if '@slice' in layout and not layout.get('@is_sparse', False):
         buffer_nr = layout['@hub']
         feature_slice = slice(*layout['@slice'])
         structure = BufferStructure.from_layout(layout)
         full_buffer = structure.create_from_buffer_hub(
             buffers[buffer_nr], hubs[buffer_nr], feature_slice)
     else:
+        # sparse buffers are not allocated but set by provide_external_data
         full_buffer = None
 
     if layout['@type'] == 'BufferView':
@@ -40,7 +41,7 @@ def create_buffer_views_from_layout(layout, buffers, hubs, existing_view=None):
         else:
             return BufferView(names, child_buffers, full_buffer)
     else:  # layout['@type'] == 'array':
-        assert full_buffer is not None, layout
+        assert full_buffer is not None or layout.get('@is_sparse'), layout
         return full_buffer
 
 
@@ -63,6 +64,7 @@ class BufferManager(object):
         self.size = -1
         self.full_buffer = None
         self.buffers = []
+        self.external_buffers = {}
         self.views = None
         self.resize(0, 0)
 
@@ -79,11 +81,14 @@ class BufferManager(object):
             self.full_buffer = self.handler.allocate((total_size,))
             self.size = total_size
 
-        self.buffers = [self.full_buffer[slices[i]].reshape(shapes[i])
+        self.buffers = [self.external_buffers[i]
+                        if i in self.external_buffers else
+                        self.full_buffer[slices[i]].reshape(shapes[i])
                         for i in range(len(self.hubs))]
 
         parameters = None
-        if self.views is not None:
+        param_hub = self.layout['parameters']['@hub']
+        if self.views is not None and param_hub not in self.external_buffers:
             # copy the parameters
             parameters = self.handler.get_numpy_copy(self.views.parameters)
 
@@ -95,8 +100,34 @@ class BufferManager(object):
 
         return self.views
 
+    def set_external_buffer(self, name, buffer, copy=True):
+        """
+        Let the 'parameters' or 'gradients' use the given memory instead of a
+        slice of the full buffer, for example to share them between processes.
+
+        Args:
+            name (str):
+                Either 'parameters' or 'gradients'.
+            buffer (array_like):
+                Array of the handler with the same shape as the buffer.
+            copy (Optional[bool]):
+                Whether to copy the current values into the new memory.
+                Defaults to True.
+        """
+        hub_nr = self.layout[name]['@hub']
+        assert buffer.shape == self.buffers[hub_nr].shape, \
+            "{} != {}".format(buffer.shape, self.buffers[hub_nr].shape)
+        if copy:
+            self.handler.copy_to(self.buffers[hub_nr], buffer)
+        self.external_buffers[hub_nr] = buffer
+        self.buffers[hub_nr] = buffer
+        self.views = create_buffer_views_from_layout(
+            self.layout, self.buffers, self.hubs, existing_view=self.views)
+        return self.views
+
     def set_handler(self, new_handler):
         self.full_buffer = None
+        self.external_buffers = {}
         self.size = -1
         self.time_size = -1
         self.batch_size = -1
@@ -3,10 +3,12 @@
 from __future__ import division, print_function, unicode_literals
 
 import itertools
+import json
 from collections import OrderedDict
 
 import numpy as np
 
+from brainstorm.structure.architecture import get_architecture_hash
 from brainstorm.structure.buffer_structure import BufferStructure
 from brainstorm.utils import (NetworkValidationError, get_by_path,
                               convert_to_nested_indices, flatten,
@@ -15,7 +17,7 @@ from brainstorm.utils import (NetworkValidationError, get_by_path,
 
 class Hub(object):
     @staticmethod
-    def create(source_set, sink_set, layout, connections):
+    def create(source_set, sink_set, layout, connections, orders=()):
         def ensure_uniform(l):
             assert min(l) == max(l)
             return l[0]
@@ -31,25 +33,62 @@ class Hub(object):
         # max context size
         context_size = max([s.context_size for s in structs])
 
-        hub = Hub(flat_sources, nesting, sorted(sink_set), btype, context_size)
+        orders = [(first, second) for first, second in orders
+                  if set(first) | set(second) <= set(flat_sources)]
+
+        hub = Hub(flat_sources, nesting, sorted(sink_set), btype, context_size,
+                  orders)
         hub.setup(connections)
-        hub.sizes = [structs[i].feature_size for i in hub.perm]
+        hub.sizes = [structs[i].allocated_size for i in hub.perm]
         hub.size = sum(hub.sizes)
         hub.is_backward_only = ensure_uniform([structs[i].is_backward_only
                                                for i in hub.perm])
         return hub
 
-    def __init__(self, flat_sources, nesting, sinks, btype, context_size=0):
+    def __init__(self, flat_sources, nesting, sinks, btype, context_size=0,
+                 orders=()):
         self.flat_sources = flat_sources
         self.nesting = nesting
         self.sinks = sinks
         self.btype = btype
         self.context_size = context_size
+        self.orders = orders
         self.connection_table = []
         self.sizes = []
         self.size = -1
         self.perm = None
 
+    def to_json(self):
+        """
+        Return a JSON serializable description of this hub after it was set
+        up. The nesting is only needed for the setup and is left out.
+        """
+        return {
+            'flat_sources': self.flat_sources,
+            'sinks': self.sinks,
+            'btype': self.btype,
+            'context_size': self.context_size,
+            'orders': self.orders,
+            'connection_table': np.asarray(self.connection_table).tolist(),
+            'sizes': self.sizes,
+            'size': self.size,
+            'perm': self.perm,
+            'is_backward_only': self.is_backward_only
+        }
+
+    @staticmethod
+    def from_json(description):
+        """Recreate a hub from :meth:`to_json` without setting it up."""
+        hub = Hub(description['flat_sources'], (), description['sinks'],
+                  description['btype'], description['context_size'],
+                  description['orders'])
+        hub.connection_table = np.array(description['connection_table'])
+        hub.sizes = description['sizes']
+        hub.size = description['size']
+        hub.perm = description['perm']
+        hub.is_backward_only = description['is_backward_only']
+        return hub
+
     def get_shape(self, time_size=1, batch_size=1):
         full_shape = (time_size + self.context_size,
                       batch_size,
@@ -83,13 +122,14 @@ class Hub(object):
         """
         Given a list of sources and a connection table, find a permutation of
         the sources, such that they can be connected to the sinks via a single
-        buffer.
+        buffer and all the ordering constraints of the hub are met.
         """
         # systematically try all permutations until one satisfies the condition
         for perm in itertools.permutations(self.nesting):
             self.perm = list(flatten(perm))
             ct = np.atleast_2d(self.connection_table[self.perm])
-            if Hub.can_be_connected_with_single_buffer(ct):
+            if Hub.can_be_connected_with_single_buffer(ct) and \
+                    self.satisfies_orders(self.perm):
                 self.connection_table = ct
                 self.flat_sources = [self.flat_sources[i] for i in self.perm]
                 return
@@ -97,6 +137,23 @@ class Hub(object):
         raise NetworkValidationError("Failed to lay out buffers. "
                                      "Please change connectivity.")
 
+    def satisfies_orders(self, perm):
+        """
+        Check if a permutation of the sources places all sources of the first
+        group of every ordering constraint before those of the second group.
+
+        Args:
+            perm (list[int]):
+                permutation of the indices of the flat sources
+
+        Returns:
+            bool
+        """
+        position = {self.flat_sources[i]: p for p, i in enumerate(perm)}
+        return all(max(position[s] for s in first) <
+                   min(position[s] for s in second)
+                   for first, second in self.orders)
+
     @staticmethod
     def can_be_connected_with_single_buffer(connection_table):
         """
@@ -131,17 +188,108 @@ class Hub(object):
             yield sink_name, (int(start), int(stop))
 
 
-def create_layout(layers):
+def create_layout(layers, in_place=False):
+    # greedily alias all outputs that can be laid out as views of the inputs
+    # and, if enabled, those that can be computed in place
+    aliases = []
+    hubs, layout = create_layout_with_aliases(layers, aliases)
+    for alias in get_alias_candidates(layers):
+        if alias[3] and not in_place:
+            continue
+        try:
+            hubs, layout = create_layout_with_aliases(layers,
+                                                      aliases + [alias])
+            aliases.append(alias)
+        except NetworkValidationError:
+            # conflicting constraints: the layer has to copy instead
+            pass
+
+    for layer in layers.values():
+        layer.aliased_outputs = set()
+    for layer_name, output_name, input_names, in_place in aliases:
+        layers[layer_name].aliased_outputs.add(output_name)
+
+    return hubs, layout
+
+
+def layout_to_json(layers, hubs, layout):
+    """
+    Serialize the result of :func:`create_layout` for the given layers, so
+    it can be restored with :func:`layout_from_json` without computing it
+    again.
+    """
+    return {
+        'hubs': [hub.to_json() for hub in hubs],
+        'layout': layout,
+        'aliased_outputs': {name: sorted(layer.aliased_outputs)
+                            for name, layer in layers.items()}
+    }
+
+
+def layout_from_json(layers, description):
+    """
+    Restore the hubs and the layout serialized by :func:`layout_to_json` and
+    mark the aliased outputs of the layers like :func:`create_layout` does.
+    """
+    for name, layer in layers.items():
+        layer.aliased_outputs = set(description['aliased_outputs'][name])
+    hubs = [Hub.from_json(h) for h in description['hubs']]
+    return hubs, description['layout']
+
+
+# maximal number of layouts kept in the cache
+LAYOUT_CACHE_SIZE = 64
+
+# JSON encoded layouts (see layout_to_json) by the hash of their architecture,
+# with the most recently used last
+_layout_cache = OrderedDict()
+
+
+def get_layout(layers, architecture, in_place=False):
+    """
+    Like :func:`create_layout`, but the layout is only computed once for
+    every architecture (with or without running layers in place) and then
+    taken from the cache.
+
+    The layers have to be instantiated from the architecture without any
+    further changes, because only the architecture is used as the key.
+    Architectures that can not be encoded as JSON are never cached. The
+    cache keeps the :data:`LAYOUT_CACHE_SIZE` most recently used layouts.
+    """
+    key = get_architecture_hash(architecture)
+    if key is None:
+        return create_layout(layers, in_place)
+    if in_place:
+        key += '-in_place'
+    if key in _layout_cache:
+        _layout_cache.move_to_end(key)
+    else:
+        hubs, layout = create_layout(layers, in_place)
+        _layout_cache[key] = json.dumps(layout_to_json(layers, hubs, layout))
+        while len(_layout_cache) > LAYOUT_CACHE_SIZE:
+            _layout_cache.popitem(last=False)
+    # always restore from JSON, so every network gets its own copy
+    return layout_from_json(layers, json.loads(_layout_cache[key]))
+
+
+def clear_layout_cache():
+    """Remove all layouts from the cache."""
+    _layout_cache.clear()
+
+
+def create_layout_with_aliases(layers, aliases):
     # gather connections and order-constraints
     forced_orders = get_forced_orders(layers)
-    connections = get_connections(layers)
+    connections = get_connections(layers, aliases)
+    alias_orders = get_alias_orders(connections, aliases)
 
     # create a stub layout
     layout = create_layout_stub(layers)
     all_sources = get_all_sources(forced_orders, connections, layout)
 
     # group into hubs and lay them out
-    hubs = group_into_hubs(all_sources, forced_orders, connections, layout)
+    hubs = group_into_hubs(all_sources, forced_orders, connections, layout,
+                           alias_orders)
     hubs = sorted(hubs, key=lambda x: (x.is_backward_only, x.btype))
     layout_hubs(hubs, layout)
 
@@ -316,19 +464,145 @@ def get_backward_connection(start, stop, layer):
     return new_start, new_end
 
 
-def get_connections(layers):
-    connections = []
+def get_alias_candidates(layers):
+    """
+    Gather all outputs that could be laid out as the concatenation of some of
+    the inputs of their layer or that could overwrite an input in place, in
+    the order of the layers.
+
+    Only inputs with a single feature dimension and the same buffer type as
+    the output qualify for concatenation, because only then is it contiguous
+    in the hub. Inputs can only be overwritten by outputs of the same shape.
+
+    Returns:
+        list[(str, str, tuple[str], bool)]:
+            list of (layer_name, output_name, input_names, in_place) tuples
+    """
+    candidates = []
+    for layer_name, layer in layers.items():
+        for output_name, input_names in sorted(layer.output_aliases.items()):
+            out_struct = layer.out_shapes[output_name]
+            in_structs = [layer.in_shapes.get(n) for n in input_names]
+            if any(s is None or s.is_sparse or
+                   s.buffer_type != out_struct.buffer_type or
+                   len(s.shape) != s.buffer_type + 1 for s in in_structs):
+                continue
+            candidates.append((layer_name, output_name, tuple(input_names),
+                               False))
+
+        for output_name, input_name in sorted(layer.in_place_outputs.items()):
+            out_struct = layer.out_shapes[output_name]
+            in_struct = layer.in_shapes.get(input_name)
+            if in_struct is None or in_struct.is_sparse or \
+                    in_struct.shape != out_struct.shape:
+                continue
+            candidates.append((layer_name, output_name, (input_name,), True))
+    return candidates
+
+
+def check_in_place_alias(connections, layers, aliases, layer_name,
+                         input_name):
+    """
+    Make sure an input can be overwritten in place without affecting any
+    other layer.
+
+    This requires the input to be connected to a single source, whose layer
+    does not read it during the backward pass. Apart from the given input the
+    source may only be read by layers earlier in the chain of layers that
+    overwrite it in place.
+    """
+    sink = get_normalized_path(layer_name, 'inputs', input_name)
+    sources = [start for start, end in connections if end == sink]
+    if len(sources) != 1:
+        raise NetworkValidationError(
+            "Can not overwrite {} in place, because it is not connected to "
+            "exactly one source".format(sink))
+    source = sources[0]
+    source_layer, _, source_output = source.split('.', 2)
+    if source_output not in layers[source_layer].takes_no_outputs_in_backward:
+        raise NetworkValidationError(
+            "Can not overwrite {} in place, because it is read during the "
+            "backward pass".format(source))
+
+    allowed_sinks = {sink}
+    for name, output_name, input_names, in_place in aliases:
+        if in_place and \
+                output_name in layers[name].takes_no_outputs_in_backward:
+            allowed_sinks.add(get_normalized_path(name, 'outputs',
+                                                  output_name))
+            allowed_sinks.update(get_normalized_path(name, 'inputs', n)
+                                 for n in input_names)
+    for start, end in connections:
+        if start == source and end not in allowed_sinks:
+            raise NetworkValidationError(
+                "Can not overwrite {} in place, because it is also read by "
+                "{}".format(source, end))
+
+
+def get_aliased_connections(connections, layer_name, output_name,
+                            input_names):
+    """
+    Rewrite the forward connections such that the given output becomes a sink
+    spanning all the sources of the given inputs, and all consumers of the
+    output are connected to these sources directly.
+    """
+    output = get_normalized_path(layer_name, 'outputs', output_name)
+    groups = [{start for start, end in connections
+               if end == get_normalized_path(layer_name, 'inputs', n)}
+              for n in input_names]
+    sources = set().union(*groups)
+    if not all(groups) or len(sources) != sum(len(g) for g in groups):
+        raise NetworkValidationError(
+            "Can not alias {} with the inputs {}".format(output, input_names))
+
+    aliased = [(start, end) for start, end in connections if start != output]
+    for start, end in connections:
+        if start == output:
+            aliased.extend((s, end) for s in sorted(sources))
+    aliased.extend((s, output) for s in sorted(sources))
+    return aliased
+
+
+def get_alias_orders(connections, aliases):
+    """
+    Gather the ordering constraints that ensure the sources of the inputs of
+    every aliased output appear in the same order as the inputs.
+
+    Returns:
+        list[(list[str], list[str])]:
+            list of (first, second) tuples such that all sources in first need
+            to be placed before those in second
+    """
+    orders = []
+    for layer_name, output_name, input_names, in_place in aliases:
+        for category in ['inputs', 'input_deltas']:
+            groups = [sorted(start for start, end in connections
+                             if end == get_normalized_path(layer_name,
+                                                           category, n))
+                      for n in input_names]
+            orders.extend(zip(groups[:-1], groups[1:]))
+    return orders
+
+
+def get_connections(layers, aliases=()):
+    forward_connections = []
     for layer_name, layer in layers.items():
         for con in layer.outgoing:
             start = get_normalized_path(con.start_layer, 'outputs',
                                         con.output_name)
             end = get_normalized_path(con.end_layer, 'inputs', con.input_name)
-            connections.append((start, end))
+            forward_connections.append((start, end))
+    forward_connections = apply_aliases(forward_connections, layers, aliases)
 
-            bwd_con = get_backward_connection(start, end, layer)
+    connections = []
+    for start, end in forward_connections:
+        connections.append((start, end))
+
+        layer = layers[start.split('.', 1)[0]]
+        bwd_con = get_backward_connection(start, end, layer)
 
-            if bwd_con:
-                connections.append(bwd_con)
+        if bwd_con:
+            connections.append(bwd_con)
 
     # add connections to implicit 'parameters', and 'gradients'-layer
     for layer_name, layer in layers.items():
@@ -344,6 +618,17 @@ def get_connections(layers):
     return sorted(connections)
 
 
+def apply_aliases(connections, layers, aliases):
+    for i, (layer_name, output_name, input_names, in_place) in \
+            enumerate(aliases):
+        if in_place:
+            check_in_place_alias(connections, layers, aliases[:i],
+                                 layer_name, input_names[0])
+        connections = get_aliased_connections(
+            connections, layer_name, output_name, input_names)
+    return connections
+
+
 def get_order(structure):
     return tuple(sorted(structure, key=lambda x: structure[x]['@index']))
 
@@ -373,7 +658,8 @@ def merge_connections(connections, forced_orders):
     return merged_connections
 
 
-def group_into_hubs(remaining_sources, forced_orders, connections, layout):
+def group_into_hubs(remaining_sources, forced_orders, connections, layout,
+                    orders=()):
     m_cons = merge_connections(connections, forced_orders)
     hubs = []
     while remaining_sources:
@@ -382,7 +668,8 @@ def group_into_hubs(remaining_sources, forced_orders, connections, layout):
         for s in source_set:
             remaining_sources.remove(s)
 
-        hubs.append(Hub.create(source_set, sink_set, layout, connections))
+        hubs.append(Hub.create(source_set, sink_set, layout, connections,
+                               orders))
 
     return hubs
 
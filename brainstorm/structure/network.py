@@ -3,13 +3,15 @@
 from __future__ import division, print_function, unicode_literals
 
 import json
+import mmap
+import struct
 from collections import OrderedDict
 
 import h5py
 import numpy as np
 
 from brainstorm.describable import create_from_description, get_description
-from brainstorm.handlers import default_handler
+from brainstorm.handlers import NumpyHandler, default_handler
 from brainstorm.initializers import ArrayInitializer, evaluate_initializer
 from brainstorm.layers.loss_layer import LossLayerImpl
 from brainstorm.randomness import Seedable
@@ -17,11 +19,13 @@ from brainstorm.structure.architecture import (
     generate_architecture, instantiate_layers_from_architecture)
 from brainstorm.structure.buffer_views import BufferView
 from brainstorm.structure.buffers import BufferManager
-from brainstorm.structure.layout import create_layout
+from brainstorm.structure.layout import (get_layout, layout_from_json,
+                                         layout_to_json)
 from brainstorm.structure.view_references import (order_and_copy_modifiers,
                                                   prune_view_references,
                                                   resolve_references)
-from brainstorm.utils import NetworkValidationError, get_brainstorm_info
+from brainstorm.utils import (NetworkValidationError, SparseArray,
+                              get_brainstorm_info)
 from brainstorm.value_modifiers import GradientModifier
 
 __all__ = ['Network']
@@ -31,58 +35,93 @@ __all__ = ['Network']
 
 class Network(Seedable):
     __undescribed__ = {'layers', 'loss_layers', 'buffer', '_buffer_manager'}
+    __default_values__ = {'in_place': False}
 
     # -------------------------- Constructors ---------------------------------
     @classmethod
-    def from_layer(cls, some_layer):
+    def from_layer(cls, some_layer, in_place=False):
         """
         Create Network instance from a construction layer.
 
         Args:
             some_layer (brainstorm.construction.ConstructionWrapper):
                 Some layer used to wire up an architecture with `>>`
+            in_place (Optional[bool]):
+                Whether layers may overwrite their inputs, see
+                :meth:`from_architecture`. Defaults to False.
 
         Returns:
             Network:
                 A fully functional Network instance.
         """
         arch = generate_architecture(some_layer)
-        return cls.from_architecture(arch)
+        return cls.from_architecture(arch, in_place=in_place)
 
     @classmethod
-    def from_architecture(cls, architecture):
+    def from_architecture(cls, architecture, layout=None, in_place=False):
         """
         Create Network instance from given architecture.
 
+        The layout of the buffers is only computed the first time a network
+        is created from an architecture and then cached (see
+        :func:`brainstorm.structure.layout.get_layout`).
+
         Args:
             architecture (dict):
                 JSON serializable Architecture description.
+            layout (Optional[dict]):
+                The layout of the buffers for this architecture as returned
+                by :func:`brainstorm.structure.layout.layout_to_json` (e.g.
+                read from a network file). It is only used for this network
+                and not added to the cache. Defaults to None.
+            in_place (Optional[bool]):
+                Whether layers that support it (like Elementwise or Dropout)
+                may overwrite their input instead of writing to their own
+                output. This saves memory, but the outputs that are
+                overwritten no longer hold their values after the forward
+                pass, so they must not be read e.g. by scorers or as the
+                output of the network. Defaults to False.
         Returns:
             Network:
                 A fully functional Network instance.
         """
         layers = instantiate_layers_from_architecture(architecture)
-        hubs, layout = create_layout(layers)
+        if layout is None:
+            hubs, layout = get_layout(layers, architecture, in_place)
+        else:
+            hubs, layout = layout_from_json(layers, layout)
         buffer_manager = BufferManager(layout, hubs)
-        return cls(layers, buffer_manager, architecture)
+        return cls(layers, buffer_manager, architecture, in_place=in_place)
 
     @classmethod
     def __new_from_description__(cls, description):
-        net = Network.from_architecture(description['architecture'])
-        net.set_handler(create_from_description(description['handler']))
-        net.initialize(create_from_description(description['initializers']))
-        net.set_gradient_modifiers(
+        net = Network.from_architecture(
+            description['architecture'],
+            in_place=description.get('in_place', False))
+        net._set_up_from_description(description)
+        return net
+
+    def _set_up_from_description(self, description, initialize=True):
+        self.set_handler(create_from_description(description['handler']))
+        if initialize:
+            self.initialize(
+                create_from_description(description['initializers']))
+        else:
+            self.initializers = description['initializers']
+        self.set_gradient_modifiers(
             create_from_description(description['gradient_modifiers']))
-        net.set_weight_modifiers(
+        self.set_weight_modifiers(
             create_from_description(description['weight_modifiers']))
-        net.output_name = description.get('output_name')
-        return net
+        self.output_name = description.get('output_name')
 
     @classmethod
     def from_hdf5(cls, filename):
         """
         Load network from HDF5 file.
 
+        If the file contains the layout of the buffers, it is used instead of
+        being computed again.
+
         Args:
             filename (str):
                 Name of the file that the network should be loaded from.
@@ -95,14 +134,66 @@ class Network(Seedable):
             :meth:`.save_as_hdf5`
         """
         with h5py.File(filename, 'r') as f:
-            description = json.loads(f['description'].value.decode())
-            net = create_from_description(description)
+            description = json.loads(f['description'][()].decode())
+            layout = None
+            if 'layout' in f:
+                layout = json.loads(f['layout'][()].decode())
+            net = cls.from_architecture(
+                description['architecture'], layout,
+                in_place=description.get('in_place', False))
+            net._set_up_from_description(description)
+            net.handler.set_from_numpy(net.buffer.parameters,
+                                       f['parameters'][()])
+        return net
+
+    @classmethod
+    def from_raw(cls, filename, mmap=True):
+        """
+        Load network from a raw file written by :meth:`save_as_raw`.
+
+        The layout of the buffers is read from the file instead of being
+        computed, and the parameters need no decompression. If the network
+        uses a NumpyHandler with the dtype of the file, the parameters are
+        memory-mapped copy-on-write: pages are only read from disk when they
+        are used, all processes that load the same file share them in the
+        page cache, and changes to the parameters never reach the file.
+
+        Args:
+            filename (str):
+                Name of the file that the network should be loaded from.
+            mmap (Optional[bool]):
+                Whether to memory-map the parameters if possible. Otherwise
+                they are copied. Defaults to True.
+
+        Returns:
+            Network:
+                The loaded network.
+        """
+        header, offset = _read_raw_header(filename)
+        description = header['description']
+        architecture = description['architecture']
+        net = cls.from_architecture(
+            architecture, header['layout'],
+            in_place=description.get('in_place', False))
+        net._set_up_from_description(description, initialize=False)
+
+        if not header['size']:
+            return net  # an empty file can not be memory-mapped
+        dtype = np.dtype(header['dtype'])
+        parameters = np.memmap(filename, dtype=dtype, mode='c',
+                               offset=offset, shape=(header['size'],))
+        if mmap and isinstance(net.handler, NumpyHandler) and \
+                np.dtype(net.handler.dtype) == dtype:
+            # a plain ndarray view on the map, as the handler expects
+            net._buffer_manager.set_external_buffer(
+                'parameters', parameters.view(np.ndarray), copy=False)
+        else:
             net.handler.set_from_numpy(net.buffer.parameters,
-                                       f['parameters'].value)
+                                       np.asarray(parameters))
         return net
 
     def __init__(self, layers, buffer_manager, architecture, seed=None,
-                 handler=default_handler):
+                 handler=default_handler, in_place=False):
         super(Network, self).__init__(seed)
         self.layers = layers
         self.loss_layers = _get_loss_layers(layers)
@@ -115,6 +206,7 @@ class Network(Seedable):
         self.weight_modifiers = {}
         self.gradient_modifiers = {}
         self.output_name = None
+        self.in_place = in_place
 
     def get(self, buffer_path):
         """
@@ -236,6 +328,11 @@ class Network(Seedable):
             Each view must match exactly one initialization and up to one
             fallback to be unambiguous. Otherwise the initialization will fail.
 
+        Note:
+            The replicas of layers batched by
+            :func:`brainstorm.structure.replicate_architecture` are
+            initialized one after another, with the shape of a single one.
+
         You can specify a seed to make the initialization reproducible:
 
         >>> net.initialize({'default': bs.Gaussian()}, seed=1234)
@@ -268,10 +365,17 @@ class Network(Seedable):
                             layer_name, view_name, fb))
 
                 fb = fb.pop() if len(fb) else None
-                self.handler.set_from_numpy(
-                    view,
-                    evaluate_initializer(init.pop(), view.shape, fb,
-                                         seed=init_rnd.generate_seed()))
+                init = init.pop()
+                nr_replicas = self.layers[layer_name].nr_replicas
+                if nr_replicas is None:
+                    values = evaluate_initializer(
+                        init, view.shape, fb, seed=init_rnd.generate_seed())
+                else:  # every replica is initialized like a separate layer
+                    values = np.stack([evaluate_initializer(
+                        init, view.shape[1:], fb,
+                        seed=init_rnd.generate_seed())
+                        for _ in range(nr_replicas)])
+                self.handler.set_from_numpy(view, values)
 
     def set_weight_modifiers(self, default_or_mod_dict=None, **kwargs):
         """
@@ -386,22 +490,43 @@ class Network(Seedable):
         Args:
             data (dict):
                 A dictionary of the data that will be copied to the outputs of
-                the Input layer.
+                the Input layer. Sparse inputs of the Input layer expect
+                a :class:`brainstorm.utils.SparseArray` of numpy arrays.
             all_inputs (bool):
                 If set to False this method will NOT check that all inputs are
                 provided. Defaults to True.
         """
         time_size, batch_size = data[next(iter(data))].shape[: 2]
         self.buffer = self._buffer_manager.resize(time_size, batch_size)
+        sparse_inputs = self.layers['Input'].kwargs.get('sparse_inputs', ())
         for name, buf in self.buffer.Input.outputs.items():
             if name not in data.keys() and all_inputs is False:
                 continue
-            if isinstance(data[name], self.handler.array_type):
+            if name in sparse_inputs:
+                self._set_sparse_input(name, data[name])
+            elif isinstance(data[name], SparseArray):
+                self.handler.set_from_numpy(buf, data[name].to_dense())
+            elif isinstance(data[name], self.handler.array_type):
                 self.handler.copy_to(data[name], buf)
             else:
                 # assert isinstance(data[name], np.ndarray)
                 self.handler.set_from_numpy(buf, data[name])
 
+    def _set_sparse_input(self, name, value):
+        if not isinstance(value, SparseArray):
+            raise ValueError('Input "{}" is sparse and requires a SparseArray '
+                             'but got {}'.format(name, type(value)))
+        _h = self.handler
+        sparse = SparseArray(_h.create_from_numpy(value.data),
+                             _h.create_indices_from_numpy(value.indices),
+                             _h.create_indices_from_numpy(value.indptr),
+                             value.shape)
+        self.buffer.Input.outputs.set_buffer(name, sparse)
+        for con in self.layers['Input'].outgoing:
+            if con.output_name == name:
+                self.buffer[con.end_layer].inputs.set_buffer(con.input_name,
+                                                             sparse)
+
     def forward_pass(self, training_pass=False, context=None):
         """
         Perform a forward pass on all the provided data.
@@ -523,20 +648,90 @@ class Network(Seedable):
             comment (Optional[str]):
                 An optional comment that will be saved inside the file.
         """
-        with h5py.File(filename, 'w') as f:
-            f.attrs.create('info', get_brainstorm_info())
-            f.attrs.create('format', b'Network file v1.0')
-            if comment:
-                f.attrs.create('comment', comment.encode())
-            description = get_description(self)
-            f['description'] = json.dumps(description).encode()
-            f.create_dataset(
-                'parameters', compression='gzip',
-                data=self.get('parameters'))
+        write_network_file(filename, get_description(self),
+                           self.get('parameters'), comment,
+                           self._get_layout_description())
+
+    def save_as_raw(self, filename, comment=''):
+        """
+        Save this network as a raw file, which can be loaded quickly with
+        :meth:`from_raw`.
+
+        The file starts with a JSON header containing the description of this
+        network and its buffer layout, followed by the uncompressed
+        parameters at an offset aligned to the memory page size.
+
+        Args:
+            filename (str):
+                Name of the file this network should be saved to.
+                All directories have to exist already.
+
+            comment (Optional[str]):
+                An optional comment that will be saved inside the file.
+        """
+        parameters = self.get('parameters')
+        header = json.dumps({
+            'info': get_brainstorm_info().decode(),
+            'comment': comment,
+            'description': get_description(self),
+            'layout': self._get_layout_description(),
+            'dtype': parameters.dtype.str,
+            'size': parameters.size
+        }).encode()
+        offset = _get_raw_offset(len(header))
+        with open(filename, 'wb') as f:
+            f.write(RAW_FORMAT + struct.pack('<Q', len(header)) + header)
+            f.write(b'\0' * (offset - f.tell()))
+            parameters.tofile(f)
+
+    def _get_layout_description(self):
+        manager = self._buffer_manager
+        return layout_to_json(self.layers, manager.hubs, manager.layout)
 
 
 # ########################### Helper Methods ##################################
 
+RAW_FORMAT = b'Network raw v1.0'
+
+
+def _get_raw_offset(header_size):
+    """Offset of the parameters in a raw file, aligned to the page size."""
+    size = len(RAW_FORMAT) + 8 + header_size
+    page = mmap.ALLOCATIONGRANULARITY
+    return (size + page - 1) // page * page
+
+
+def _read_raw_header(filename):
+    with open(filename, 'rb') as f:
+        if f.read(len(RAW_FORMAT)) != RAW_FORMAT:
+            raise IOError('{} is not a raw network file'.format(filename))
+        header_size, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_size).decode())
+    return header, _get_raw_offset(header_size)
+
+
+def write_network_file(filename, description, parameters, comment='',
+                       layout=None):
+    """
+    Write the description and the parameters of a network to an HDF5 file.
+
+    This does not need the network itself, so it can run in the background on
+    a copy of the parameters (see :class:`brainstorm.hooks.SaveNetwork`).
+    The layout of the buffers (see
+    :func:`brainstorm.structure.layout.layout_to_json`) is optional and
+    saves computing it when the file is loaded.
+    """
+    with h5py.File(filename, 'w') as f:
+        f.attrs.create('info', get_brainstorm_info())
+        f.attrs.create('format', b'Network file v1.0')
+        if comment:
+            f.attrs.create('comment', comment.encode())
+        f['description'] = json.dumps(description).encode()
+        if layout is not None:
+            f['layout'] = json.dumps(layout).encode()
+        f.create_dataset('parameters', compression='gzip', data=parameters)
+
+
 def _get_loss_layers(layers):
     return [name for name, l in layers.items() if isinstance(l, LossLayerImpl)]
 
@@ -5,10 +5,13 @@ from __future__ import division, print_function, unicode_literals
 import numpy as np
 import pytest
 
-from brainstorm.data_iterators import (AddGaussianNoise, Flip, Minibatches,
-                                       Pad, RandomCrop, Undivided)
+from brainstorm.data_iterators import (AddGaussianNoise, AddSaltNPepper,
+                                       BucketedMinibatches, ChunkedMinibatches,
+                                       Flip, Minibatches, MultiHot, Pack, Pad,
+                                       PadCropFlip, RandomCrop, SparseMultiHot,
+                                       Undivided)
 from brainstorm.handlers import default_handler
-from brainstorm.handlers._cpuop import _crop_images
+from brainstorm.handlers._cpuop import _crop_images, _pad_crop_flip_images
 from brainstorm.utils import IteratorValidationError
 
 # ######################### Nested Iterators ##################################
@@ -43,6 +46,36 @@ def test_flip():
     assert np.allclose(x['targets'], c)
 
 
+def test_pack():
+    mask = np.array([
+        [1, 1, 0, 0],
+        [1, 1, 1, 0],
+        [1, 0, 0, 0],
+        [1, 1, 1, 1],
+    ]).T[:, :, None]
+    a = np.arange(16).reshape(4, 4, 1) + 1
+    iterator = Undivided(default=a, mask=mask)
+    x = next(Pack(iterator)(default_handler))
+    assert set(x.keys()) == {'default', 'mask', 'reset'}
+    assert x['default'].shape == (4, 3, 1)
+    assert np.all(x['default'][:, 0, 0] == a[:, 3, 0])
+    assert np.all(x['default'][:, 1, 0] == [2, 6, 10, 3])
+    assert np.all(x['default'][:, 2, 0] == [1, 5, 0, 0])
+    assert np.all(x['reset'][:, :, 0] == [[1, 1, 1],
+                                          [0, 0, 0],
+                                          [0, 0, 0],
+                                          [0, 1, 0]])
+    assert np.all(x['mask'][:, :, 0] == [[1, 1, 1],
+                                         [1, 1, 1],
+                                         [1, 1, 0],
+                                         [1, 1, 0]])
+
+
+def test_pack_without_mask_raises():
+    with pytest.raises(IteratorValidationError):
+        _ = Pack(inner)
+
+
 def test_pad_dict_mismatch_raises():
     with pytest.raises(IteratorValidationError):
         _ = Pad(inner, size_dict={'images': 1})
@@ -93,6 +126,72 @@ def test_random_crop():
     assert np.allclose(x['targets'], c)
 
 
+def test_pad_crop_flip():
+    a = np.random.randn(2, 3, 5, 5, 4)
+    b = np.random.randn(2, 3, 4, 4, 1)
+    iterator = Undivided(default=a, secondary=b)
+    pcf = PadCropFlip(iterator, shape_dict={'default': (5, 5)},
+                      size_dict={'default': 1},
+                      prob_dict={'default': 1.0})(default_handler)
+    x = next(pcf)
+    assert x['default'].shape == (2, 3, 5, 5, 4)
+    assert x['default'].dtype == default_handler.dtype
+    assert np.allclose(x['secondary'], b)
+    padded = np.pad(a, ((0, 0), (0, 0), (1, 1), (1, 1), (0, 0)), 'constant')
+    for i in range(3):
+        windows = [padded[:, i, r:r + 5, c:c + 5][:, :, ::-1]
+                   for r in range(3) for c in range(3)]
+        assert any(np.allclose(x['default'][:, i], w) for w in windows)
+
+
+def test_pad_crop_flip_dict_mismatch_raises():
+    with pytest.raises(IteratorValidationError):
+        _ = PadCropFlip(inner, shape_dict={'images': (1, 1)})
+    with pytest.raises(IteratorValidationError):
+        _ = PadCropFlip(inner, shape_dict={'default': (1, 1)},
+                        size_dict={'images': 1})
+    with pytest.raises(IteratorValidationError):
+        _ = PadCropFlip(inner, shape_dict={'default': (3, 3)})
+    with pytest.raises(IteratorValidationError):
+        _ = PadCropFlip(inner, shape_dict={'default': (1, 1)},
+                        prob_dict={'default': 2.0})
+
+
+def test_augmentation_reuses_buffers_and_keeps_data():
+    a = np.random.randn(2, 4, 5, 5, 1)
+    a_copy = a.copy()
+    iterator = Minibatches(batch_size=2, shuffle=False, default=a)
+    flip = Flip(iterator, prob_dict={'default': 1.0})(default_handler)
+    x1 = next(flip)['default']
+    x2 = next(flip)['default']
+    assert x1 is x2
+    assert x2.dtype == default_handler.dtype
+    assert np.allclose(x2, a[:, 2:, :, ::-1])
+    assert np.allclose(a, a_copy)
+
+
+def test_salt_n_pepper_keeps_data():
+    a = np.random.rand(2, 3, 4)
+    a_copy = a.copy()
+    iterator = Undivided(default=a)
+    snp = AddSaltNPepper(iterator, prob_dict={'default': 1.0},
+                         ratio_dict={'default': 1.0})(default_handler)
+    x = next(snp)
+    assert np.all(x['default'] == 1.0)
+    assert np.allclose(a, a_copy)
+
+
+def test_pad_crop_flip_images_operation():
+    a = np.random.randn(3, 2, 4, 4, 2)
+    out = np.zeros((3, 2, 4, 4, 2))
+    _pad_crop_flip_images(a, 1, -1.0, np.array([0, 2]), np.array([1, 2]),
+                          np.array([0, 1], dtype=np.uint8), out)
+    padded = np.pad(a, ((0, 0), (0, 0), (1, 1), (1, 1), (0, 0)),
+                    'constant', constant_values=-1.0)
+    assert np.allclose(out[:, 0, ...], padded[:, 0, 0:4, 1:5, :])
+    assert np.allclose(out[:, 1, ...], padded[:, 1, 2:6, 2:6, :][:, :, ::-1])
+
+
 def test_crop_images_operation():
     a = np.random.randn(3, 2, 5, 5, 4)
     out = np.zeros((3, 2, 3, 3, 4))
@@ -304,6 +403,133 @@ def test_minibatch_with_length():
         next(it)
 
 
+@pytest.mark.parametrize('iterator', [Minibatches, BucketedMinibatches,
+                                      ChunkedMinibatches])
+def test_sharded_iterators_split_the_batches_of_a_pass(iterator):
+    input_data = np.arange(2 * 23).reshape(2, 23, 1)
+    full = iterator(batch_size=4, my_data=input_data)
+    full.rnd.set_seed(3)
+    batches = [x['my_data'] for x in full(default_handler)]
+    shards = []
+    for shard_nr in range(3):
+        it = iterator(batch_size=4, my_data=input_data)
+        it.rnd.set_seed(3)
+        it.shard = (3, shard_nr)
+        shard = [x['my_data'] for x in it(default_handler)]
+        assert len(shard) == len(batches[shard_nr::3])
+        assert all(np.all(x == y)
+                   for x, y in zip(shard, batches[shard_nr::3]))
+        shards.extend(shard)
+    seen = np.concatenate([x[0, :, 0] for x in shards])
+    assert sorted(seen) == list(range(23))
+
+
+def test_minibatch_padding_ratio():
+    input_data = np.zeros((4, 4, 3))
+    it = Minibatches(batch_size=2, cut_according_to=[1, 4, 2, 2],
+                     my_data=input_data)
+    assert it.padding_ratio == 1.0 - 9 / 12
+
+
+# ########################## BucketedMinibatches ############################ #
+
+def test_bucketed_minibatches_groups_by_length():
+    seq_lens = np.array([5, 1, 4, 2, 5, 1, 3, 2])
+    input_data = np.arange(5 * 8).reshape(5, 8, 1)
+    it = BucketedMinibatches(batch_size=2, cut_according_to=seq_lens,
+                             my_data=input_data)
+    assert it.length == 4
+    for _ in range(2):
+        batches = list(it(default_handler))
+        assert len(batches) == 4
+        lens = sorted(x['my_data'].shape[0] for x in batches)
+        assert lens == [1, 2, 4, 5]
+        seen = np.concatenate([x['my_data'][0, :, 0] for x in batches])
+        assert sorted(seen) == list(range(8))
+        assert it.padding_ratio == 1.0 - 23 / 24
+
+
+def test_bucketed_minibatches_bucket_size_and_mask():
+    mask = np.array([
+        [1, 1, 0, 0],
+        [1, 1, 1, 1],
+        [1, 0, 0, 0],
+        [1, 1, 1, 0],
+        [1, 1, 0, 0],
+    ]).T[:, :, None]
+    input_data = np.zeros((4, 5, 3))
+    it = BucketedMinibatches(batch_size=2, bucket_size=3, shuffle=False,
+                             my_data=input_data, mask=mask)
+    assert it.bucket_size == 4
+    assert it.length == 3
+    shapes = [x['my_data'].shape for x in it(default_handler)]
+    assert shapes == [(2, 2, 3), (3, 2, 3), (4, 1, 3)]
+
+
+def test_bucketed_minibatches_sorts_columns_by_decreasing_length():
+    seq_lens = np.array([1, 3, 2, 5, 4, 2])
+    input_data = np.arange(5 * 6).reshape(5, 6, 1) % 6
+    it = BucketedMinibatches(batch_size=3, bucket_size=6,
+                             cut_according_to=seq_lens, my_data=input_data)
+    for x in it(default_handler):
+        lens = seq_lens[x['my_data'][0, :, 0]]
+        assert np.all(np.diff(lens) <= 0)
+
+
+# ########################### ChunkedMinibatches ############################ #
+
+@pytest.mark.parametrize('readahead', [0, 2])
+def test_chunked_minibatches_covers_all_sequences(readahead, tmpdir):
+    input_data = np.memmap(str(tmpdir.join('data.npy')), dtype=np.float64,
+                           mode='w+', shape=(2, 23, 1))
+    input_data[:] = np.arange(23).reshape(1, 23, 1)
+    it = ChunkedMinibatches(batch_size=4, chunk_size=5, buffer_chunks=2,
+                            readahead=readahead, my_data=input_data)
+    assert it.length == 6
+    seen = []
+    for _ in range(2):
+        batches = list(it(default_handler))
+        assert len(batches) == it.length
+        assert all(x['my_data'].shape[1] == 4 for x in batches[:-1])
+        epoch = np.concatenate([x['my_data'][0, :, 0] for x in batches])
+        assert sorted(epoch) == list(range(23))
+        seen.append(epoch)
+    assert not np.all(seen[0] == seen[1])
+
+
+def test_chunked_minibatches_no_shuffle_and_mask():
+    input_data = np.arange(20).reshape(4, 5, 1)
+    mask = np.array([
+        [1, 1, 0, 0],
+        [1, 1, 1, 0],
+        [1, 1, 1, 0],
+        [1, 0, 0, 0],
+        [1, 1, 0, 0],
+    ]).T[:, :, None]
+    it = ChunkedMinibatches(batch_size=3, shuffle=False, chunk_size=2,
+                            my_data=input_data, mask=mask)(default_handler)
+    x = next(it)
+    assert x['my_data'].shape == (3, 3, 1)
+    assert np.all(x['my_data'] == input_data[:3, :3])
+    x = next(it)
+    assert x['mask'].shape == (2, 2, 1)
+    assert np.all(x['my_data'] == input_data[:2, 3:])
+    with pytest.raises(StopIteration):
+        next(it)
+
+
+def test_chunked_minibatches_hdf5_chunk_alignment(tmpdir):
+    h5py = pytest.importorskip('h5py')
+    with h5py.File(str(tmpdir.join('data.h5')), 'w') as f:
+        ds = f.create_dataset('default', data=np.random.randn(3, 40, 2),
+                              chunks=(3, 8, 2))
+        it = ChunkedMinibatches(batch_size=5, chunk_size=10, default=ds)
+        assert it.chunk_size == 16
+        batches = list(it(default_handler))
+        assert sum(x['default'].shape[1] for x in batches) == 40
+        assert all(isinstance(x['default'], np.ndarray) for x in batches)
+
+
 def test_calculate_lengths_from_mask():
     mask = np.array([
         [1, 1, 1, 1, 1, 0, 0, 0],
@@ -312,3 +538,15 @@ def test_calculate_lengths_from_mask():
         [1, 1, 1, 1, 0, 0, 0, 0],
         [0, 0, 0, 0, 0, 0, 0, 0]]).T[:, :, None]
     assert all(_calculate_lengths_from_mask(mask) == [5, 8, 3, 4, 0])
+
+
+def test_sparse_multi_hot_matches_multi_hot():
+    indices = np.array([[[0, 3]], [[2, 2]], [[4, 1]]])
+    dense = next(MultiHot(Undivided(default=indices),
+                          {'default': 5})(default_handler))['default']
+    it = SparseMultiHot(Undivided(default=indices), {'default': 5})
+    assert it.data_shapes['default'] == (3, 1, 5)
+    sparse = next(it(default_handler))['default']
+    assert sparse.shape == (3, 1, 5)
+    assert sparse.nnz == 5
+    assert np.all(sparse.to_dense() == dense)
@@ -40,13 +40,82 @@ architectures = [{
     'Loss': {
         '@type': 'Loss',
         '@outgoing_connections': {}
+    }}, {
+    'Input': {
+        '@type': 'Input',
+        'out_shapes': {'default': ('T', 'B', 3,)},
+        '@outgoing_connections': {
+            'default': ['A', 'B'],
+        }},
+    'A': {
+        '@type': 'FullyConnected',
+        'size': 2,
+        '@outgoing_connections': {
+            'default': ['Merge.inputs_1']
+        }},
+    'B': {
+        '@type': 'FullyConnected',
+        'size': 3,
+        '@outgoing_connections': {
+            'default': ['Merge.inputs_2']
+        }},
+    'Merge': {
+        '@type': 'Merge',
+        '@outgoing_connections': {
+            'default': ['Output']
+        }},
+    'Output': {
+        '@type': 'FullyConnected',
+        'size': 2,
+        '@outgoing_connections': {
+            'default': ['Loss']
+        }},
+    'Loss': {
+        '@type': 'Loss',
+        '@outgoing_connections': {}
+    }}, {
+    'Input': {
+        '@type': 'Input',
+        'out_shapes': {'default': ('T', 'B', 3,)},
+        '@outgoing_connections': {
+            'default': ['A'],
+        }},
+    'A': {
+        '@type': 'FullyConnected',
+        'size': 4,
+        'activation': 'linear',
+        '@outgoing_connections': {
+            'default': ['NoOp']
+        }},
+    'NoOp': {
+        '@type': 'NoOp',
+        '@outgoing_connections': {
+            'default': ['Tanh']
+        }},
+    'Tanh': {
+        '@type': 'Elementwise',
+        'activation': 'tanh',
+        '@outgoing_connections': {
+            'default': ['Output']
+        }},
+    'Output': {
+        '@type': 'FullyConnected',
+        'size': 2,
+        '@outgoing_connections': {
+            'default': ['Loss']
+        }},
+    'Loss': {
+        '@type': 'Loss',
+        '@outgoing_connections': {}
     }}
 ]
 
 
-@pytest.fixture(scope='module', params=architectures)
+@pytest.fixture(scope='module', params=[(a, in_place) for a in architectures
+                                        for in_place in [False, True]])
 def net(request):
-    n = Network.from_architecture(request.param)
+    architecture, in_place = request.param
+    n = Network.from_architecture(architecture, in_place=in_place)
     n.set_handler(NumpyHandler(dtype=np.float64))
     n.initialize(Gaussian(1), seed=235)
     return n
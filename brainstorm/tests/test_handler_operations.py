@@ -8,6 +8,7 @@ import pytest
 
 from brainstorm.handlers import NumpyHandler
 from brainstorm.optional import has_pycuda
+from brainstorm.utils import SparseArray
 
 # np.random.seed(1234)
 dtype = np.float32
@@ -55,6 +56,107 @@ def _conv2d_forward_batch(inputs, weights, bias, outputs, padding, stride):
                         outputs[i, j, k, l] += bias[l]
 
 
+def test_gather_and_scatter_add_rows_numpy():
+    _h = NumpyHandler(dtype=dtype)
+    m = np.arange(12, dtype=dtype).reshape(4, 3)
+    v = np.array([[2], [0], [2]], dtype=dtype)
+    out = np.zeros((3, 3), dtype=dtype)
+    _h.gather_rows(m, v, out)
+    assert np.all(out == m[[2, 0, 2]])
+
+    grad = np.zeros_like(m)
+    _h.scatter_add_rows(out, v, grad)
+    expected = np.zeros_like(m)
+    expected[0] = m[0]
+    expected[2] = 2 * m[2]
+    assert np.all(grad == expected)
+
+
+def test_sample_indices_numpy():
+    _h = NumpyHandler(dtype=dtype, seed=1234)
+    out = np.zeros((20, 1), dtype=dtype)
+    _h.sample_indices(30, out)
+    assert np.all(np.diff(out[:, 0]) > 0)
+    assert 0 <= out.min() and out.max() < 30
+
+    _h.sample_indices(20, out)
+    assert np.all(out[:, 0] == np.arange(20))
+
+
+def test_sparse_dot_mm_numpy():
+    _h = NumpyHandler(dtype=dtype)
+    dense = np.array([[0, 2, 0], [0, 0, 0], [1, 0, 3]], dtype=dtype)
+    a = SparseArray.from_dense(dense)
+    b = np.arange(6, dtype=dtype).reshape(3, 2)
+    out = np.ones((3, 2), dtype=dtype)
+    _h.sparse_dot_mm(a, b, out)
+    assert np.allclose(out, dense.dot(b))
+
+    _h.sparse_dot_mm(a, b.T.copy(), out, transb=True)
+    assert np.allclose(out, dense.dot(b))
+
+    grad = np.ones((2, 3), dtype=dtype)
+    _h.sparse_dot_add_mm_transposed(a, b, grad)
+    assert np.allclose(grad, 1 + b.T.dot(dense))
+
+
+def test_softmax_ce_forward_is_exact_for_tiny_probabilities():
+    _h = NumpyHandler(dtype=dtype)
+    m = np.array([[0., 50., -50.], [1., 2., 3.]], dtype=dtype)
+    v = np.array([[2], [0]], dtype=dtype)
+    probs = np.zeros_like(m)
+    loss = np.zeros((2, 1), dtype=dtype)
+    _h.softmax_ce_forward(m, v, probs, loss)
+    e = np.exp(m - m.max(axis=1, keepdims=True))
+    assert np.allclose(probs, e / e.sum(axis=1, keepdims=True))
+    assert np.allclose(loss[:, 0], [100., np.log(e[1].sum()) + 2.])
+
+    deltas = np.ones_like(m)
+    _h.softmax_ce_backward(probs, v, np.array([[1.], [2.]], dtype=dtype),
+                           deltas)
+    expected = 1 + (probs - np.eye(3)[[2, 0]]) * [[1.], [2.]]
+    assert np.allclose(deltas, expected)
+
+
+def test_dropout_forward_and_backward_numpy():
+    _h = NumpyHandler(dtype=dtype, seed=1234)
+    a = np.ones((100, 50), dtype=dtype)
+    seed = np.zeros((1,), dtype=dtype)
+    out = np.zeros_like(a)
+    _h.dropout_forward(a, seed, 0.8, out)
+    kept = out != 0
+    assert np.allclose(out[kept], 1 / 0.8)
+    assert abs(kept.mean() - 0.8) < 0.02
+
+    deltas = np.ones_like(a)
+    _h.dropout_backward(a, seed, 0.8, deltas)
+    assert np.allclose(deltas, 1 + out)
+    deltas = a.copy()
+    _h.dropout_backward_inplace(deltas, seed, 0.8)
+    assert np.allclose(deltas, out)
+
+    first_seed = seed.copy()
+    _h.dropout_forward(a, seed, 0.8, out)
+    assert seed[0] != first_seed[0]
+    assert np.any((out != 0) != kept)
+
+
+def test_batchnorm_forward_train_statistics_numpy():
+    _h = NumpyHandler(dtype=np.float64)
+    # more rows than one block and a large offset, to test the merging
+    x = np.random.randn(2500, 3) * [1., 2., 3.] + 1e4
+    mean = np.zeros(3)
+    std = np.zeros(3)
+    x_hat = np.zeros_like(x)
+    out = np.zeros_like(x)
+    _h.batchnorm_forward_train(x, np.ones(3) * 2, np.ones(3), 0., mean, std,
+                               x_hat, out)
+    assert np.allclose(mean, x.mean(axis=0))
+    assert np.allclose(std, x.std(axis=0))
+    assert np.allclose(x_hat, (x - x.mean(axis=0)) / x.std(axis=0))
+    assert np.allclose(out, 2 * x_hat + 1)
+
+
 def test_conv2d_forward_batch_numpy():
     _h = NumpyHandler(dtype=dtype)
     for input_shape in ((3, 3), (5, 4), (4, 9)):
@@ -10,6 +10,7 @@ import pytest
 
 from brainstorm.handlers import NumpyHandler
 from brainstorm.optional import has_pycuda
+from brainstorm.utils import SparseArray
 
 non_default_handlers = []
 handler_ids = []
@@ -72,6 +73,12 @@ def get_args_from_ref_args(handler, ref_args):
         if type(ref_arg) is ref.array_type:
             temp = handler.create_from_numpy(ref_arg)
             args.append(temp)
+        elif isinstance(ref_arg, SparseArray):
+            args.append(SparseArray(
+                handler.create_from_numpy(ref_arg.data),
+                handler.create_indices_from_numpy(ref_arg.indices),
+                handler.create_indices_from_numpy(ref_arg.indptr),
+                ref_arg.shape))
         else:
             args.append(ref_arg)
     return args
@@ -126,6 +133,44 @@ def test_dot_add_mm(handler):
         assert operation_check(handler, 'dot_add_mm', ref_args)
 
 
+@pytest.mark.parametrize("handler", non_default_handlers, ids=handler_ids)
+@pytest.mark.parametrize("transb", [False, True])
+def test_dot_add_mm_on_column_slices(handler, transb):
+    a = np.random.randn(4, 6).astype(ref_dtype)
+    b = np.random.randn(5, 3).astype(ref_dtype)
+    out = np.random.randn(4, 5).astype(ref_dtype)
+    ha, hb, hout = [handler.create_from_numpy(m) for m in (a, b, out)]
+    if transb:
+        handler.dot_add_mm(ha[:, :3], hb[:2], hout[:, :2], transb=True)
+        out[:, :2] += a[:, :3].dot(b[:2].T)
+    else:
+        handler.dot_add_mm(ha[:, :5], hb, hout[:, :3])
+        out[:, :3] += a[:, :5].dot(b)
+    assert np.allclose(handler.get_numpy_copy(hout), out, atol=1e-5)
+
+
+@pytest.mark.parametrize("handler", non_default_handlers, ids=handler_ids)
+def test_copy_to_and_add_tt_on_column_slices(handler):
+    a = np.random.randn(4, 6).astype(ref_dtype)
+    out = np.random.randn(4, 2).astype(ref_dtype)
+    ha, hout = handler.create_from_numpy(a), handler.create_from_numpy(out)
+    handler.copy_to(ha[:, 2:4], hout)
+    assert np.allclose(handler.get_numpy_copy(hout), a[:, 2:4])
+    handler.add_tt(hout, ha[:, 4:], ha[:, 4:])
+    a[:, 4:] += a[:, 2:4]
+    assert np.allclose(handler.get_numpy_copy(ha), a, atol=1e-5)
+
+
+@pytest.mark.parametrize("handler", non_default_handlers, ids=handler_ids)
+def test_equal_vv(handler):
+    a = np.random.randint(0, 4, (5, 1)).astype(ref_dtype)
+    b = np.random.randint(0, 4, (1, 3)).astype(ref_dtype)
+    out = np.random.randn(5, 3).astype(ref_dtype)
+    ref_args = (a, b, out)
+
+    assert operation_check(handler, 'equal_vv', ref_args)
+
+
 @pytest.mark.parametrize("handler", non_default_handlers, ids=handler_ids)
 def test_mult_tt(handler):
     list_a = get_random_arrays(some_2d_shapes + some_nd_shapes)
@@ -368,6 +413,44 @@ def test_mult_mv(handler):
         assert operation_check(handler, 'mult_mv', ref_args)
 
 
+@pytest.mark.parametrize("handler", non_default_handlers, ids=handler_ids)
+def test_batchnorm_forward_train(handler):
+    for x in get_random_arrays(some_2d_shapes + ((50, 3),)):
+        f = x.shape[1]
+        gamma, beta = get_random_arrays(((f,), (f,)))
+        mean = np.zeros(f, dtype=ref_dtype)
+        std = np.zeros(f, dtype=ref_dtype)
+        x_hat = np.zeros_like(x)
+        out = np.zeros_like(x)
+        ref_args = (x, gamma, beta, 1e-5, mean, std, x_hat, out)
+        assert operation_check(handler, 'batchnorm_forward_train', ref_args,
+                               atol=1e-4)
+
+
+@pytest.mark.parametrize("handler", non_default_handlers, ids=handler_ids)
+def test_batchnorm_forward_infer(handler):
+    for x in get_random_arrays():
+        f = x.shape[1]
+        gamma, beta, mean = get_random_arrays(((f,), (f,), (f,)))
+        std = np.random.rand(f).astype(ref_dtype) + 0.5
+        out = np.zeros_like(x)
+        ref_args = (x, gamma, beta, mean, std, out)
+        assert operation_check(handler, 'batchnorm_forward_infer', ref_args,
+                               atol=1e-5)
+
+
+@pytest.mark.parametrize("handler", non_default_handlers, ids=handler_ids)
+def test_batchnorm_backward(handler):
+    for x_hat, dout, dx in zip(get_random_arrays(), get_random_arrays(),
+                               get_random_arrays()):
+        f = x_hat.shape[1]
+        gamma, dgamma, dbeta = get_random_arrays(((f,), (f,), (f,)))
+        std = np.random.rand(f).astype(ref_dtype) + 0.5
+        ref_args = (x_hat, std, gamma, dout, dx, dgamma, dbeta)
+        assert operation_check(handler, 'batchnorm_backward', ref_args,
+                               atol=1e-5)
+
+
 @pytest.mark.parametrize("handler", non_default_handlers, ids=handler_ids)
 def test_binarize_v(handler):
     v = np.random.random_integers(0, 4, (10, 1)).astype(ref_dtype)
@@ -386,6 +469,90 @@ def test_index_m_by_v(handler):
         assert operation_check(handler, 'index_m_by_v', ref_args)
 
 
+@pytest.mark.parametrize("handler", non_default_handlers, ids=handler_ids)
+def test_dropout_backward(handler):
+    list_a = get_random_arrays(some_nd_shapes)
+    for a in list_a:
+        seed = np.array([12345.], dtype=ref_dtype)
+        out = np.random.randn(*a.shape).astype(ref_dtype)
+        ref_args = (a, seed, 0.7, out)
+        assert operation_check(handler, 'dropout_backward', ref_args,
+                               atol=1e-6)
+
+
+@pytest.mark.parametrize("handler", non_default_handlers, ids=handler_ids)
+def test_dropout_backward_inplace(handler):
+    list_a = get_random_arrays(some_nd_shapes)
+    for a in list_a:
+        seed = np.array([12345.], dtype=ref_dtype)
+        ref_args = (a, seed, 0.7)
+        assert operation_check(handler, 'dropout_backward_inplace', ref_args,
+                               atol=1e-6)
+
+
+@pytest.mark.parametrize("handler", non_default_handlers, ids=handler_ids)
+def test_dropout_forward_uses_same_mask_as_reference(handler):
+    list_a = get_random_arrays(some_nd_shapes)
+    for a in list_a:
+        seed = handler.allocate((1,))
+        out = handler.allocate(a.shape)
+        handler.dropout_forward(handler.create_from_numpy(a), seed, 0.7, out)
+        expected = np.zeros_like(a)
+        ref.dropout_backward(a, handler.get_numpy_copy(seed), 0.7, expected)
+        assert np.allclose(handler.get_numpy_copy(out), expected, atol=1e-6)
+
+
+@pytest.mark.parametrize("handler", non_default_handlers, ids=handler_ids)
+def test_gather_rows(handler):
+    m_list = get_random_arrays()
+    for m in m_list:
+        v = np.random.randint(0, m.shape[0], (7, 1))
+        out = np.random.random_sample((7, m.shape[1]))
+        ref_args = (m, v, out)
+        assert operation_check(handler, 'gather_rows', ref_args)
+
+
+@pytest.mark.parametrize("handler", non_default_handlers, ids=handler_ids)
+def test_scatter_add_rows(handler):
+    out_list = get_random_arrays()
+    for out in out_list:
+        v = np.random.randint(0, out.shape[0], (7, 1))
+        m = np.random.random_sample((7, out.shape[1]))
+        ref_args = (m, v, out)
+        assert operation_check(handler, 'scatter_add_rows', ref_args)
+
+
+def get_random_sparse_array(shape, dtype=ref_dtype):
+    dense = np.random.randn(*shape).astype(dtype)
+    dense[np.random.rand(*shape) < 0.6] = 0.
+    return SparseArray.from_dense(dense)
+
+
+@pytest.mark.parametrize("handler", non_default_handlers, ids=handler_ids)
+def test_sparse_dot_mm(handler):
+    for a_shape, b_shape, transb in [((3, 4), (4, 5), False),
+                                     ((5, 7), (2, 7), True),
+                                     ((1, 1), (3, 1), True)]:
+        a = get_random_sparse_array(a_shape)
+        b = np.random.randn(*b_shape).astype(ref_dtype)
+        out = np.random.randn(a_shape[0],
+                              b_shape[0 if transb else 1]).astype(ref_dtype)
+        ref_args = (a, b, out, transb)
+        assert operation_check(handler, 'sparse_dot_mm', ref_args,
+                               ignored_args=(0,), atol=1e-5)
+
+
+@pytest.mark.parametrize("handler", non_default_handlers, ids=handler_ids)
+def test_sparse_dot_add_mm_transposed(handler):
+    for a_shape, nr_columns in [((3, 4), 5), ((7, 2), 1), ((1, 1), 3)]:
+        a = get_random_sparse_array(a_shape)
+        b = np.random.randn(a_shape[0], nr_columns).astype(ref_dtype)
+        out = np.random.randn(nr_columns, a_shape[1]).astype(ref_dtype)
+        ref_args = (a, b, out)
+        assert operation_check(handler, 'sparse_dot_add_mm_transposed',
+                               ref_args, ignored_args=(0,), atol=1e-5)
+
+
 @pytest.mark.parametrize("handler", non_default_handlers, ids=handler_ids)
 def test_sigmoid(handler):
     list_a = get_random_arrays(some_nd_shapes)
@@ -669,6 +836,33 @@ def test_softmax_m(handler):
         assert operation_check(handler, 'softmax_m', ref_args)
 
 
+@pytest.mark.parametrize("handler", non_default_handlers, ids=handler_ids)
+def test_softmax_ce_forward(handler):
+    list_a = get_random_arrays(some_2d_shapes)
+
+    for m in list_a:
+        v = np.random.randint(0, m.shape[1], (m.shape[0], 1)).astype(
+            ref_dtype)
+        out = np.zeros_like(m, dtype=ref_dtype)
+        loss = np.zeros((m.shape[0], 1), dtype=ref_dtype)
+        ref_args = (m, v, out, loss)
+        assert operation_check(handler, 'softmax_ce_forward', ref_args,
+                               atol=1e-6)
+
+
+@pytest.mark.parametrize("handler", non_default_handlers, ids=handler_ids)
+def test_softmax_ce_backward(handler):
+    list_a = get_random_arrays(some_2d_shapes)
+
+    for m in list_a:
+        v = np.random.randint(0, m.shape[1], (m.shape[0], 1)).astype(
+            ref_dtype)
+        dloss = np.random.randn(m.shape[0], 1).astype(ref_dtype)
+        out = np.random.randn(*m.shape).astype(ref_dtype)
+        ref_args = (m, v, dloss, out)
+        assert operation_check(handler, 'softmax_ce_backward', ref_args)
+
+
 @pytest.mark.parametrize("handler", non_default_handlers, ids=handler_ids)
 def test_merge_tt(handler):
     shapes = [((5, 4), (5, 3)),
@@ -3,6 +3,8 @@
 
 from __future__ import division, print_function, unicode_literals
 
+import warnings
+
 import numpy as np
 import pytest
 
@@ -14,6 +16,7 @@ from brainstorm.layers.softmax_ce_layer import SoftmaxCELayerImpl
 from brainstorm.layers.sigmoid_ce_layer import SigmoidCELayerImpl
 from brainstorm.layers.convolution_layer_2d import Convolution2DLayerImpl
 from brainstorm.layers.elementwise_layer import ElementwiseLayerImpl
+from brainstorm.layers.embedding_layer import EmbeddingLayerImpl
 from brainstorm.layers.fully_connected_layer import FullyConnectedLayerImpl
 from brainstorm.layers.highway_layer import HighwayLayerImpl
 from brainstorm.layers.input_layer import InputLayerImpl
@@ -25,6 +28,9 @@ from brainstorm.layers.mask_layer import MaskLayerImpl
 from brainstorm.layers.noop_layer import NoOpLayerImpl
 from brainstorm.layers.pooling_layer_2d import Pooling2DLayerImpl
 from brainstorm.layers.recurrent_layer import RecurrentLayerImpl
+from brainstorm.layers.sampled_softmax_ce_layer import \
+    SampledSoftmaxCELayerImpl
+from brainstorm.layers.select_replica_layer import SelectReplicaLayerImpl
 from brainstorm.layers.squared_error_layer import SquaredErrorLayerImpl
 from brainstorm.layers.squared_difference_layer import \
     SquaredDifferenceLayerImpl
@@ -64,6 +70,42 @@ def fully_connected_layer(spec):
     return layer, spec
 
 
+def fully_connected_layer_replicas(spec):
+    in_shapes = {'default': BufferStructure('T', 'B', 5)}
+    layer = FullyConnectedLayerImpl('FullyConnectedLayer', in_shapes,
+                                    NO_CON, NO_CON,
+                                    size=4, nr_replicas=3,
+                                    activation=spec['activation'])
+    return layer, spec
+
+
+def fully_connected_layer_replicated_input(spec):
+    in_shapes = {'default': BufferStructure('T', 'B', 3, 2, 2)}
+    layer = FullyConnectedLayerImpl('FullyConnectedLayer', in_shapes,
+                                    NO_CON, NO_CON,
+                                    size=2, nr_replicas=3,
+                                    replicated_input=True,
+                                    activation=spec['activation'])
+    return layer, spec
+
+
+def select_replica_layer(spec):
+    in_shapes = {'default': BufferStructure('T', 'B', 3, 2)}
+    layer = SelectReplicaLayerImpl('SelectReplicaLayer', in_shapes, NO_CON,
+                                   NO_CON, replica=1)
+    return layer, spec
+
+
+def embedding_layer(spec):
+    time_steps = spec.get('time_steps', 3)
+    batch_size = spec.get('batch_size', 2)
+    in_shapes = {'default': BufferStructure('T', 'B', 2, 1)}
+    layer = EmbeddingLayerImpl('EmbeddingLayer', in_shapes, NO_CON, NO_CON,
+                               vocab_size=5, size=4)
+    spec['default'] = np.random.randint(0, 5, (time_steps, batch_size, 2, 1))
+    return layer, spec
+
+
 def fully_connected_layer_2d(spec):
     in_shapes = {'default': BufferStructure('T', 'B', 2, 3)}
     layer = FullyConnectedLayerImpl('FullyConnectedLayer', in_shapes,
@@ -135,6 +177,19 @@ def softmax_ce_layer(spec):
     return layer, spec
 
 
+def sampled_softmax_ce_layer(spec):
+    time_steps = spec.get('time_steps', 3)
+    batch_size = spec.get('batch_size', 2)
+    in_shapes = {'default': BufferStructure('T', 'B', 2, 2),
+                 'targets': BufferStructure('T', 'B', 1)}
+    # sampling all classes makes the sampled set deterministic
+    layer = SampledSoftmaxCELayerImpl('SampledSoftmaxCELayer', in_shapes,
+                                      NO_CON, NO_CON, size=5, nr_samples=5,
+                                      predictions=spec.get('predictions'))
+    spec['targets'] = np.random.randint(0, 5, (time_steps, batch_size, 1))
+    return layer, spec
+
+
 def sigmoid_ce_layer(spec):
     time_steps = spec.get('time_steps', 3)
     batch_size = spec.get('batch_size', 2)
@@ -160,6 +215,34 @@ def rnn_layer(spec):
     return layer, spec
 
 
+def rnn_layer_with_reset(spec):
+    time_steps = spec.get('time_steps', 3)
+    batch_size = spec.get('batch_size', 2)
+    layer = RecurrentLayerImpl('RnnLayer',
+                               {'default': BufferStructure('T', 'B', 3),
+                                'reset': BufferStructure('T', 'B', 1)},
+                               NO_CON, NO_CON,
+                               size=4,
+                               activation=spec['activation'])
+    spec['reset'] = np.random.randint(0, 2, (time_steps, batch_size, 1))
+    return layer, spec
+
+
+def rnn_layer_with_mask(spec):
+    time_steps = spec.get('time_steps', 3)
+    batch_size = spec.get('batch_size', 2)
+    layer = RecurrentLayerImpl('RnnLayer',
+                               {'default': BufferStructure('T', 'B', 3),
+                                'mask': BufferStructure('T', 'B', 1)},
+                               NO_CON, NO_CON,
+                               size=4,
+                               activation=spec['activation'])
+    lengths = np.random.randint(0, time_steps + 1, batch_size)
+    spec['mask'] = (np.arange(time_steps).reshape(-1, 1, 1) <
+                    lengths.reshape(1, -1, 1)).astype(float)
+    return layer, spec
+
+
 def rnn_layer_2d(spec):
     layer = RecurrentLayerImpl('RnnLayer',
                                {'default': BufferStructure('T', 'B', 2, 1, 2)},
@@ -178,6 +261,36 @@ def lstm_layer(spec):
     return layer, spec
 
 
+def lstm_layer_with_reset(spec):
+    time_steps = spec.get('time_steps', 3)
+    batch_size = spec.get('batch_size', 2)
+    layer = LstmLayerImpl('LstmLayer',
+                          {'default': BufferStructure('T', 'B', 3),
+                           'reset': BufferStructure('T', 'B', 1)},
+                          NO_CON, NO_CON,
+                          size=4,
+                          activation=spec['activation'])
+    spec['reset'] = np.random.randint(0, 2, (time_steps, batch_size, 1))
+    return layer, spec
+
+
+def lstm_layer_with_mask(spec):
+    time_steps = spec.get('time_steps', 3)
+    batch_size = spec.get('batch_size', 2)
+    layer = LstmLayerImpl('LstmLayer',
+                          {'default': BufferStructure('T', 'B', 3),
+                           'mask': BufferStructure('T', 'B', 1),
+                           'reset': BufferStructure('T', 'B', 1)},
+                          NO_CON, NO_CON,
+                          size=4,
+                          activation=spec['activation'])
+    lengths = np.random.randint(0, time_steps + 1, batch_size)
+    spec['mask'] = (np.arange(time_steps).reshape(-1, 1, 1) <
+                    lengths.reshape(1, -1, 1)).astype(float)
+    spec['reset'] = np.random.randint(0, 2, (time_steps, batch_size, 1))
+    return layer, spec
+
+
 def lstm_layer_2d(spec):
     layer = LstmLayerImpl('LstmLayer',
                           {'default': BufferStructure('T', 'B', 2, 2, 1)},
@@ -284,6 +397,30 @@ def clockwork_layer(spec):
     return layer, spec
 
 
+def clockwork_layer_with_reset(spec):
+    time_steps = spec.get('time_steps', 3)
+    batch_size = spec.get('batch_size', 2)
+    layer = ClockworkLayerImpl('ClockworkRnn',
+                               {'default': BufferStructure('T', 'B', 3),
+                                'reset': BufferStructure('T', 'B', 1)},
+                               NO_CON, NO_CON,
+                               size=7,
+                               activation=spec['activation'])
+    spec['inits'] = {'timing': np.array([1, 1, 2, 2, 3, 3, 5])}
+    spec['reset'] = np.random.randint(0, 2, (time_steps, batch_size, 1))
+    return layer, spec
+
+
+def clockwork_layer_unsorted_timing(spec):
+    layer = ClockworkLayerImpl('ClockworkRnn',
+                               {'default': BufferStructure('T', 'B', 3)},
+                               NO_CON, NO_CON,
+                               size=7,
+                               activation=spec['activation'])
+    spec['inits'] = {'timing': np.array([3, 1, 5, 2, 1, 3, 2])}
+    return layer, spec
+
+
 def clockwork_layer_2d(spec):
     layer = ClockworkLayerImpl('ClockworkRnn',
                                {'default': BufferStructure('T', 'B', 2, 1, 2)},
@@ -305,6 +442,21 @@ def clockwork_lstm_layer(spec):
     return layer, spec
 
 
+def clockwork_lstm_layer_with_reset(spec):
+    time_steps = spec.get('time_steps', 3)
+    batch_size = spec.get('batch_size', 2)
+    layer = ClockworkLstmLayerImpl('ClockworkLstm',
+                                   {'default': BufferStructure('T', 'B', 3),
+                                    'reset': BufferStructure('T', 'B', 1)},
+                                   NO_CON, NO_CON,
+                                   size=4,
+                                   activation=spec['activation'])
+
+    spec['inits'] = {'timing': np.array([1, 2, 2, 3])}
+    spec['reset'] = np.random.randint(0, 2, (time_steps, batch_size, 1))
+    return layer, spec
+
+
 def clockwork_lstm_layer_2d(spec):
     layer = ClockworkLstmLayerImpl(
         'ClockworkLstm',
@@ -330,15 +482,24 @@ layers_to_test = [
     loss_layer,
     fully_connected_layer,
     fully_connected_layer_2d,
+    fully_connected_layer_replicas,
+    fully_connected_layer_replicated_input,
+    select_replica_layer,
+    embedding_layer,
     highway_layer,
     binomial_crossentropy_layer,
     softmax_ce_layer,
+    sampled_softmax_ce_layer,
     sigmoid_ce_layer,
     rnn_layer,
+    rnn_layer_with_reset,
+    rnn_layer_with_mask,
     rnn_layer_2d,
     squared_difference_layer,
     squared_error_layer,
     lstm_layer,
+    lstm_layer_with_reset,
+    lstm_layer_with_mask,
     lstm_layer_2d,
     mask_layer,
     convolution_layer_2d_a,
@@ -353,8 +514,11 @@ layers_to_test = [
     l1_decay_layer,
     l2_decay_layer,
     clockwork_layer,
+    clockwork_layer_with_reset,
+    clockwork_layer_unsorted_timing,
     clockwork_layer_2d,
     clockwork_lstm_layer,
+    clockwork_lstm_layer_with_reset,
     clockwork_lstm_layer_2d,
     merge
 ]
@@ -581,6 +745,52 @@ def test_get_layer_class_from_typename_raises_typeerror():
         get_layer_class_from_typename('NonexistentLayer')
 
 
+@pytest.mark.parametrize('layer_fn', [clockwork_layer,
+                                      clockwork_layer_unsorted_timing])
+def test_clockwork_layer_warns_about_unsorted_timing(layer_fn):
+    layer, spec = layer_fn({'time_steps': 3, 'batch_size': 2,
+                            'activation': 'tanh'})
+    layer_buffers = set_up_layer(layer, spec)
+    with warnings.catch_warnings(record=True) as record:
+        warnings.simplefilter('always')
+        layer.forward_pass(layer_buffers)
+    nr_warnings = 0 if layer_fn is clockwork_layer else 1
+    assert len(record) == nr_warnings
+
+
+def test_sampled_softmax_ce_layer_exact_evaluation():
+    layer, spec = sampled_softmax_ce_layer({'time_steps': 3,
+                                            'batch_size': 2,
+                                            'predictions': True})
+    layer_buffers = set_up_layer(layer, spec)
+    layer.forward_pass(layer_buffers, training_pass=False)
+
+    inputs = HANDLER.get_numpy_copy(layer_buffers.inputs.default)
+    W = HANDLER.get_numpy_copy(layer_buffers.parameters.W)
+    bias = HANDLER.get_numpy_copy(layer_buffers.parameters.bias)
+    logits = inputs.reshape(6, 4).dot(W.T) + bias
+    probs = np.exp(logits) / np.exp(logits).sum(axis=1, keepdims=True)
+    expected_loss = -np.log(probs[np.arange(6),
+                                  spec['targets'].reshape(6)])
+    predictions = HANDLER.get_numpy_copy(layer_buffers.outputs.predictions)
+    loss = HANDLER.get_numpy_copy(layer_buffers.outputs.loss)
+    assert np.allclose(predictions.reshape(6, 5), probs)
+    assert np.allclose(loss.reshape(6), expected_loss)
+
+    # with all classes sampled only the target is removed from them, so the
+    # training loss is exact as well
+    layer.forward_pass(layer_buffers, training_pass=True)
+    loss = HANDLER.get_numpy_copy(layer_buffers.outputs.loss)
+    assert np.allclose(loss.reshape(6), expected_loss)
+
+
+def test_sampled_softmax_ce_layer_has_no_predictions_by_default():
+    layer, spec = sampled_softmax_ce_layer({})
+    assert set(layer.out_shapes) == {'loss'}
+    layer_buffers = set_up_layer(layer, spec)
+    layer.forward_pass(layer_buffers, training_pass=False)
+
+
 def test_layer_constructor():
     a = Connection('l', 'default', 'A', 'default')
     b = Connection('l', 'default', 'B', 'default')
@@ -3,14 +3,31 @@
 
 from __future__ import division, print_function, unicode_literals
 
+import mmap
+
 import numpy as np
 import pytest
 
-from brainstorm import Network
-from brainstorm.data_iterators import Undivided
+from brainstorm import Network, create_from_description, get_description
+from brainstorm.data_iterators import (AddGaussianNoise, Minibatches,
+                                       Undivided)
+from brainstorm.handlers import NumpyHandler
+from brainstorm.hooks import (ModifyStepperAttribute, MonitorStepperAttribute,
+                              SaveBestNetwork, SaveNetwork, SaveTrainingState,
+                              StopAfterEpoch)
 from brainstorm.initializers import Gaussian
-from brainstorm.layers import SoftmaxCE, Input, Lstm, Recurrent, FullyConnected
+from brainstorm.layers import (Clockwork, ClockworkLstm, Elementwise,
+                               FullyConnected, Input, Lstm, Merge, Recurrent,
+                               SampledSoftmaxCE, SoftmaxCE)
+from brainstorm.structure import layout, replicate_architecture
+from brainstorm.structure.architecture import get_architecture_hash
+from brainstorm.tools import create_net_from_spec
+from brainstorm.training import MomentumStepper, NesterovStepper, Trainer
+from brainstorm.training.checkpoints import (read_training_state,
+                                             write_training_state)
+from brainstorm.training.schedules import Exponential
 from brainstorm.training.utils import run_network
+from brainstorm.utils import LayerValidationError, SparseArray
 
 from brainstorm.tests.helpers import HANDLER
 
@@ -107,3 +124,537 @@ def test_forward_pass_with_missing_data():
 
     for _ in run_network(simple_net, it, all_inputs=False):
         pass
+
+
+@pytest.mark.parametrize('layer_type', [Recurrent, Lstm, Clockwork,
+                                        ClockworkLstm])
+def test_reset_input_separates_packed_sequences(layer_type):
+    inp = Input(out_shapes={'default': ('T', 'B', 2),
+                            'reset': ('T', 'B', 1)})
+    out = layer_type(3, name='out')
+    inp - 'reset' >> 'reset' - out
+    net = Network.from_layer(inp >> out)
+    net.set_handler(HANDLER)
+    net.initialize(Gaussian(0.1), seed=1234)
+    if layer_type in (Clockwork, ClockworkLstm):
+        HANDLER.set_from_numpy(net.buffer.out.parameters.timing,
+                               np.array([1, 2, 3]))
+    a = np.random.randn(2, 1, 2)
+    b = np.random.randn(3, 1, 2)
+
+    def run(data, reset):
+        net.provide_external_data({'default': data, 'reset': reset})
+        net.forward_pass()
+        return HANDLER.get_numpy_copy(net.buffer.out.outputs.default)
+
+    out_a = run(a, np.zeros((2, 1, 1)))[:2]
+    out_b = run(b, np.zeros((3, 1, 1)))[:3]
+    packed = run(np.concatenate([a, b]), np.array([1, 0, 1, 0, 0]
+                                                  ).reshape(5, 1, 1))
+    assert np.allclose(packed[:2], out_a)
+    assert np.allclose(packed[2:5], out_b)
+
+
+def test_sparse_input_matches_dense_input():
+    def build(sparse_inputs):
+        inp = Input(out_shapes={'default': ('T', 'B', 6),
+                                'targets': ('T', 'B', 1)},
+                    sparse_inputs=sparse_inputs)
+        out = SoftmaxCE(name='Output')
+        inp - 'targets' >> 'targets' - out
+        net = Network.from_layer(inp >> FullyConnected(3, name='Hid') >> out)
+        net.set_handler(HANDLER)
+        net.initialize(Gaussian(0.1), seed=1234)
+        return net
+
+    dense = np.random.randn(2, 3, 6)
+    dense[np.random.rand(2, 3, 6) < 0.5] = 0.
+    targets = np.random.randint(0, 3, (2, 3, 1))
+
+    results = []
+    for sparse_inputs, data in [((), dense),
+                                (('default',), SparseArray.from_dense(dense))]:
+        net = build(sparse_inputs)
+        net.provide_external_data({'default': data, 'targets': targets})
+        net.forward_pass(training_pass=True)
+        net.backward_pass()
+        results.append((
+            HANDLER.get_numpy_copy(net.buffer.Hid.outputs.default),
+            HANDLER.get_numpy_copy(net.buffer.Hid.gradients.W),
+            HANDLER.get_numpy_copy(net.buffer.Hid.gradients.bias)))
+
+    for dense_result, sparse_result in zip(*results):
+        assert np.allclose(dense_result, sparse_result)
+
+
+def test_sparse_input_requires_sparse_data():
+    inp = Input(out_shapes={'default': ('T', 'B', 6)},
+                sparse_inputs=('default',))
+    net = Network.from_layer(inp >> FullyConnected(3, name='out'))
+    with pytest.raises(ValueError):
+        net.provide_external_data({'default': np.zeros((2, 3, 6))})
+
+
+def test_sparse_input_only_connects_to_layers_that_support_it():
+    inp = Input(out_shapes={'default': ('T', 'B', 6)},
+                sparse_inputs=('default',))
+    with pytest.raises(LayerValidationError):
+        Network.from_layer(inp >> Recurrent(3, name='out'))
+
+
+def test_merge_output_is_view_over_both_inputs():
+    inp = Input(out_shapes={'default': ('T', 'B', 2)})
+    merge = Merge(name='Merge')
+    inp >> FullyConnected(3, name='A') >> 'inputs_1' - merge
+    inp >> FullyConnected(4, name='B') >> 'inputs_2' - merge
+    net = Network.from_layer(merge >> FullyConnected(2, name='out'))
+    assert net.layers['Merge'].aliased_outputs == {'default'}
+
+    net.initialize(Gaussian(0.1), seed=1234)
+    net.provide_external_data({'default': np.random.randn(3, 2, 2)})
+    net.forward_pass()
+    buffers = net.buffer
+    for name in ['outputs', 'output_deltas']:
+        a = buffers.A[name].default
+        b = buffers.B[name].default
+        merged = buffers.Merge[name].default
+        assert np.shares_memory(merged, a)
+        assert np.shares_memory(merged, b)
+    assert np.allclose(buffers.Merge.outputs.default,
+                       np.concatenate([buffers.A.outputs.default,
+                                       buffers.B.outputs.default], axis=2))
+
+
+def test_conflicting_merges_fall_back_to_copying():
+    inp = Input(out_shapes={'default': ('T', 'B', 2)})
+    merge_ab = Merge(name='MergeAB')
+    merge_ba = Merge(name='MergeBA')
+    a = inp >> FullyConnected(3, name='A')
+    b = inp >> FullyConnected(4, name='B')
+    a >> 'inputs_1' - merge_ab
+    b >> 'inputs_2' - merge_ab
+    b >> 'inputs_1' - merge_ba
+    a >> 'inputs_2' - merge_ba
+    merge_ab >> FullyConnected(2, name='out_ab')
+    net = Network.from_layer(merge_ba >> FullyConnected(2, name='out_ba'))
+    assert net.layers['MergeAB'].aliased_outputs == {'default'}
+    assert net.layers['MergeBA'].aliased_outputs == set()
+
+    net.set_handler(HANDLER)
+    net.initialize(Gaussian(0.1), seed=1234)
+    net.provide_external_data({'default': np.random.randn(3, 2, 2)})
+    net.forward_pass()
+    a = HANDLER.get_numpy_copy(net.buffer.A.outputs.default)
+    b = HANDLER.get_numpy_copy(net.buffer.B.outputs.default)
+    merged_ab = HANDLER.get_numpy_copy(net.buffer.MergeAB.outputs.default)
+    merged_ba = HANDLER.get_numpy_copy(net.buffer.MergeBA.outputs.default)
+    assert np.allclose(merged_ab, np.concatenate([a, b], axis=2))
+    assert np.allclose(merged_ba, np.concatenate([b, a], axis=2))
+
+
+def test_elementwise_layer_runs_in_place():
+    inp = Input(out_shapes={'default': ('T', 'B', 2)})
+    net = Network.from_layer(
+        inp >> FullyConnected(3, activation='linear', name='A') >>
+        Elementwise('tanh', name='Tanh') >> FullyConnected(2, name='out'),
+        in_place=True)
+    assert net.layers['Tanh'].aliased_outputs == {'default'}
+
+    net.initialize(Gaussian(0.1), seed=1234)
+    net.provide_external_data({'default': np.random.randn(3, 2, 2)})
+    net.forward_pass()
+    buffers = net.buffer
+    for name in ['outputs', 'output_deltas']:
+        assert np.shares_memory(buffers.Tanh[name].default,
+                                buffers.A[name].default)
+    assert np.all(np.abs(buffers.Tanh.outputs.default) < 1.)
+
+
+def test_elementwise_layer_does_not_overwrite_values_needed_elsewhere():
+    inp = Input(out_shapes={'default': ('T', 'B', 2)})
+    # the tanh derivative of A needs its outputs in the backward pass
+    net = Network.from_layer(
+        inp >> FullyConnected(3, activation='tanh', name='A') >>
+        Elementwise('rel', name='Rel') >> FullyConnected(2, name='out'),
+        in_place=True)
+    assert net.layers['Rel'].aliased_outputs == set()
+
+    # the outputs of B are also needed by the layer C
+    inp = Input(out_shapes={'default': ('T', 'B', 2)})
+    b = inp >> FullyConnected(3, activation='linear', name='B')
+    b >> FullyConnected(2, name='C')
+    net = Network.from_layer(b >> Elementwise('rel', name='Rel'),
+                             in_place=True)
+    assert net.layers['Rel'].aliased_outputs == set()
+
+
+def test_layers_only_run_in_place_if_enabled():
+    def create_net(in_place):
+        inp = Input(out_shapes={'default': ('T', 'B', 2)})
+        return Network.from_layer(
+            inp >> FullyConnected(3, activation='linear', name='A') >>
+            Elementwise('tanh', name='Tanh') >> FullyConnected(2, name='out'),
+            in_place=in_place)
+
+    net = create_net(in_place=False)
+    assert net.layers['Tanh'].aliased_outputs == set()
+    net.initialize(Gaussian(0.1), seed=1234)
+    net.provide_external_data({'default': np.random.randn(3, 2, 2)})
+    net.forward_pass()
+    # the outputs of A keep their values, e.g. for a scorer
+    assert np.allclose(np.tanh(net.get('A.outputs.default')),
+                       net.get('Tanh.outputs.default'))
+
+    net = create_net(in_place=True)
+    assert net.layers['Tanh'].aliased_outputs == {'default'}
+    net.initialize(Gaussian(0.1), seed=1234)
+    copy = create_from_description(get_description(net))
+    assert copy.in_place
+    assert copy.layers['Tanh'].aliased_outputs == {'default'}
+
+
+def get_replica_parameters(ensemble, k, net):
+    """Pair the parameters of replica k of an ensemble with those of net."""
+    for layer_name in net.layers:
+        batched = layer_name in ensemble.layers
+        replica_name = layer_name if batched else \
+            'Replica{}_{}'.format(k, layer_name)
+        replica = ensemble.buffer[replica_name].parameters
+        for name, view in net.buffer[layer_name].parameters.items():
+            yield (replica[name][k] if batched else replica[name]), view
+
+
+@pytest.mark.parametrize('stepper_class', [MomentumStepper,
+                                           NesterovStepper])
+def test_ensemble_trains_replicas_like_separate_networks(stepper_class):
+    rnd = np.random.RandomState(42)
+    data = rnd.randn(2, 20, 3)
+    data_iter = Minibatches(batch_size=5, shuffle=False, default=data,
+                            targets=data.sum(2, keepdims=True))
+    arch = create_net_from_spec('regression', 3, 1, 'Ft4 Fr5 L3').architecture
+    learning_rates, momenta = [0.05, 0.1, 0.2], [0.5, 0., 0.9]
+
+    ensemble = Network.from_architecture(replicate_architecture(arch, 3))
+    ensemble.set_handler(NumpyHandler(np.float64))
+    ensemble.initialize(Gaussian(0.1))
+    assert ensemble.layers['FullyConnected_2'].nr_replicas == 3
+    nets = []
+    for k in range(3):
+        net = Network.from_architecture(arch)
+        net.set_handler(NumpyHandler(np.float64))
+        net.initialize(0.)
+        for replica, view in get_replica_parameters(ensemble, k, net):
+            view[:] = replica
+        nets.append(net)
+    tr = Trainer(stepper_class(learning_rates, momenta), verbose=False)
+    tr.add_hook(StopAfterEpoch(2))
+    tr.add_hook(MonitorStepperAttribute('learning_rate'))
+    tr.train(ensemble, data_iter)
+
+    assert tr.logs['Monitor_learning_rate']['Replica1'] == [0.1] * 3
+    for k, net in enumerate(nets):
+        single = Trainer(stepper_class(learning_rates[k], momenta[k]),
+                         verbose=False)
+        single.add_hook(StopAfterEpoch(2))
+        single.train(net, data_iter)
+        for replica, view in get_replica_parameters(ensemble, k, net):
+            assert np.allclose(replica, view)
+        assert np.allclose(
+            tr.logs['rolling_training']['Replica{}_Loss'.format(k)],
+            single.logs['rolling_training']['total_loss'])
+
+
+def test_ensemble_stepper_reuses_its_buffers():
+    arch = create_net_from_spec('regression', 3, 1, 'F4').architecture
+    ensemble = Network.from_architecture(replicate_architecture(arch, 2))
+    ensemble.set_handler(NumpyHandler(np.float64))
+    ensemble.initialize(Gaussian(0.1))
+    ensemble.provide_external_data({'default': np.ones((1, 2, 3)),
+                                    'targets': np.ones((1, 2, 1))})
+    stepper = MomentumStepper([0.1, 0.2], [0.5, 0.9])
+    stepper.start(ensemble)
+    stepper.run()
+    scales = {name: scale for name, (_, scale)
+              in stepper._scaling.scales.items()}
+
+    stepper.learning_rate = [0.3, 0.2]
+    stepper.run()
+    for name, (values, scale) in stepper._scaling.scales.items():
+        assert scale is scales[name]
+    assert set(stepper.get_state()) == {'velocity'}
+
+    # every parameter is scaled by the entry of its replica
+    ensemble.buffer.parameters[:] = stepper._scaling.scales[
+        'learning_rate'][1]
+    parameters = ensemble.buffer.FullyConnected.parameters
+    assert np.allclose(parameters.W[0], -0.3 * 0.5)
+    assert np.allclose(parameters.bias[1], -0.2 * 0.1)
+    parameters = ensemble.buffer.Output_projection.parameters
+    assert np.allclose(parameters.W[1], -0.2 * 0.1)
+
+
+def test_save_network_writes_parameters_of_the_call_in_background(tmpdir):
+    net = create_net_from_spec('regression', 3, 1, 'F4')
+    net.initialize(Gaussian(0.1), seed=1234)
+    filename = str(tmpdir.join('net.h5'))
+    hook = SaveNetwork(filename)
+    hook(1, 0, net, None, {})
+    expected = net.get('parameters')
+    net.buffer.parameters[:] = 0  # the staging copy is already taken
+
+    loaded = hook.load_network()
+    assert np.all(loaded.get('parameters') == expected)
+    assert tmpdir.listdir() == [tmpdir.join('net.h5')]
+
+
+def test_trainer_waits_for_the_last_network_write(tmpdir):
+    net = create_net_from_spec('regression', 3, 1, 'F4')
+    net.initialize(Gaussian(0.1), seed=1234)
+    data_iter = Minibatches(batch_size=5, default=np.ones((1, 10, 3)),
+                            targets=np.ones((1, 10, 1)))
+    filename = str(tmpdir.join('net.h5'))
+    tr = Trainer(MomentumStepper(), verbose=False)
+    tr.add_hook(SaveNetwork(filename))
+    tr.add_hook(StopAfterEpoch(2))
+    tr.train(net, data_iter)
+    loaded = Network.from_hdf5(filename)
+    assert np.all(loaded.get('parameters') == net.get('parameters'))
+
+    tr = Trainer(MomentumStepper(), verbose=False)
+    tr.add_hook(SaveNetwork(str(tmpdir.join('missing', 'net.h5'))))
+    tr.add_hook(StopAfterEpoch(0))  # only the initial call saves
+    with pytest.raises(IOError):
+        tr.train(net, data_iter)
+
+
+def test_save_best_network_waits_for_pending_write(tmpdir):
+    net = create_net_from_spec('regression', 3, 1, 'F4')
+    filename = str(tmpdir.join('best.h5'))
+    hook = SaveBestNetwork('validation.loss', filename, criterion='min',
+                           verbose=False)
+    for epoch_nr, loss in enumerate([3., 1., 2.], start=1):
+        net.initialize(Gaussian(0.1), seed=epoch_nr)
+        if epoch_nr == 2:
+            expected = net.get('parameters')
+        hook(epoch_nr, 0, net, None, {'validation': {'loss': [loss]}})
+
+    assert hook.best_t == 2
+    assert np.all(hook.load_best_network().get('parameters') == expected)
+
+
+@pytest.mark.parametrize('timescale, interval', [('epoch', 1),
+                                                 ('update', 5)])
+def test_resume_continues_training_exactly(tmpdir, timescale, interval):
+    rnd = np.random.RandomState(42)
+    data = rnd.randn(1, 40, 3)
+    targets = data.dot([[1.], [-2.], [0.5]])
+
+    def run(nr_epochs, filename, resume=False):
+        net = create_net_from_spec('regression', 3, 1, 'F8 D0.2')
+        net.set_handler(NumpyHandler(np.float64, seed=5))
+        net.initialize(Gaussian(0.1), seed=3 if resume else 1234)
+        getter = Minibatches(batch_size=5, default=data, targets=targets)
+        getter.rnd.set_seed(7)
+        getter = AddGaussianNoise(getter, {'default': 0.1})
+        getter.rnd.set_seed(8)
+        tr = Trainer(MomentumStepper(0.1, 0.5), verbose=False)
+        tr.add_hook(ModifyStepperAttribute(Exponential(0.1, 0.9),
+                                           timescale='update'))
+        tr.add_hook(SaveTrainingState(tr, filename, timescale=timescale,
+                                      interval=interval))
+        tr.add_hook(StopAfterEpoch(nr_epochs))
+        if resume:
+            tr.resume(filename, net, getter)
+        else:
+            tr.train(net, getter)
+        return net.get('parameters'), tr
+
+    filename = str(tmpdir.join('state.h5'))
+    params, tr = run(4, str(tmpdir.join('uninterrupted.h5')))
+    run(2, filename)
+    resumed_params, resumed_tr = run(4, filename, resume=True)
+
+    assert np.all(resumed_params == params)
+    assert resumed_tr.current_update_nr == tr.current_update_nr
+    assert resumed_tr.stepper.learning_rate == tr.stepper.learning_rate
+    assert resumed_tr.logs == tr.logs
+    if timescale == 'epoch':
+        saved = Network.from_hdf5(filename).get('parameters')
+        assert np.all(saved == params)
+
+
+def test_resume_restores_the_parameters_cached_by_save_best_network(tmpdir):
+    def run(nr_epochs, filename, resume=False):
+        net = create_net_from_spec('regression', 3, 1, 'F4')
+        net.set_handler(NumpyHandler(np.float64))
+        net.initialize(Gaussian(0.1), seed=1234)
+        getter = Minibatches(batch_size=5, shuffle=False,
+                             default=np.ones((1, 10, 3)),
+                             targets=np.ones((1, 10, 1)))
+        tr = Trainer(MomentumStepper(0.1), verbose=False)
+        # the loss is highest after the first epoch
+        hook = SaveBestNetwork('rolling_training.total_loss', criterion='max',
+                               verbose=False)
+        tr.add_hook(hook)
+        tr.add_hook(SaveTrainingState(tr, filename))
+        tr.add_hook(StopAfterEpoch(nr_epochs))
+        if resume:
+            tr.resume(filename, net, getter)
+        else:
+            tr.train(net, getter)
+        return hook.load_best_network()
+
+    filename = str(tmpdir.join('state.h5'))
+    expected = run(3, str(tmpdir.join('uninterrupted.h5')))
+    assert expected is not None
+    run(2, filename)
+    assert np.all(run(3, filename, resume=True) == expected)
+
+
+def test_interrupted_save_keeps_the_previous_training_state(tmpdir):
+    filename = str(tmpdir.join('state.h5'))
+    logs = {'loss': [1., 2.]}
+    write_training_state(filename, {}, np.ones(3), {'epoch': 1},
+                         {'velocity': np.zeros(3)}, logs)
+    logs['loss'].append(3.)
+    with pytest.raises(TypeError):
+        # the object array can not be written
+        write_training_state(filename, {}, np.ones(3) * 2, {'epoch': 2},
+                             {'velocity': np.array([None])}, logs)
+
+    parameters, state, arrays, logs = read_training_state(filename)
+    assert np.all(parameters == 1.)
+    assert state == {'epoch': 1}
+    assert np.all(arrays['velocity'] == 0.)
+    assert logs == {'loss': [1., 2.]}
+
+
+@pytest.mark.parametrize('memory_map', [True, False])
+def test_raw_file_round_trip(tmpdir, memory_map):
+    net = create_net_from_spec('classification', 3, 4, 'F8 L5 D0.2 F4')
+    net.set_handler(NumpyHandler(np.float32))
+    net.initialize(Gaussian(0.1), seed=1234)
+    filename = str(tmpdir.join('net.raw'))
+    net.save_as_raw(filename)
+    loaded = Network.from_raw(filename, mmap=memory_map)
+
+    assert np.all(loaded.get('parameters') == net.get('parameters'))
+    assert get_description(loaded) == get_description(net)
+    for name, layer in net.layers.items():
+        assert loaded.layers[name].aliased_outputs == layer.aliased_outputs
+
+    data = {'default': np.random.randn(4, 2, 3),
+            'targets': np.random.randint(0, 4, (4, 2, 1))}
+    for n in [net, loaded]:
+        n.provide_external_data(data)
+        n.forward_pass()
+        n.backward_pass()
+    assert np.all(loaded.get('Output.outputs.predictions') ==
+                  net.get('Output.outputs.predictions'))
+    assert np.all(loaded.get('gradients') == net.get('gradients'))
+
+    # changes are not written back to the file
+    loaded.buffer.parameters[:] = 0
+    assert np.all(Network.from_raw(filename).get('parameters') ==
+                  net.get('parameters'))
+
+
+def test_raw_file_memory_maps_parameters(tmpdir):
+    net = create_net_from_spec('regression', 3, 1, 'F4')
+    filename = str(tmpdir.join('net.raw'))
+    net.save_as_raw(filename)
+
+    base = Network.from_raw(filename).buffer.parameters
+    while not isinstance(base, np.memmap):
+        base = base.base
+    assert base.offset % mmap.ALLOCATIONGRANULARITY == 0
+
+
+def test_sampled_softmax_ce_draws_samples_from_the_handler():
+    data = {'default': np.random.randn(3, 4, 2),
+            'targets': np.random.randint(0, 6, (3, 4, 1))}
+
+    def run_training_pass(seed):
+        inp = Input(out_shapes={'default': ('T', 'B', 2),
+                                'targets': ('T', 'B', 1)})
+        out = SampledSoftmaxCE(6, 5, name='Out')
+        inp >> out
+        inp - 'targets' >> 'targets' - out
+        net = Network.from_layer(out)
+        net.set_handler(NumpyHandler(np.float64, seed=seed))
+        net.initialize(Gaussian(0.1), seed=1)
+        net.provide_external_data(data)
+        net.forward_pass(training_pass=True)
+        return net
+
+    net = run_training_pass(3)
+    samples = net.get('Out.internals.samples')
+    assert np.all(run_training_pass(3).get('Out.internals.samples') ==
+                  samples)
+
+    # sampled classes that are the target of a position are removed
+    hits = data['targets'] == samples.reshape(1, 1, -1)
+    assert np.all(net.get('Out.internals.hits') == hits)
+    probs = net.get('Out.internals.probs')
+    assert hits.any() and np.all(probs[:, :, 1:][hits] == 0)
+    assert np.allclose(probs.sum(axis=2), 1)
+
+
+def test_layout_is_only_computed_once_per_architecture(monkeypatch):
+    calls = []
+    create_layout = layout.create_layout
+
+    def count_calls(layers, in_place=False):
+        calls.append(sorted(layers))
+        return create_layout(layers, in_place)
+
+    monkeypatch.setattr(layout, 'create_layout', count_calls)
+    layout.clear_layout_cache()
+    net = create_net_from_spec('classification', 3, 4, 'F8 L5 D0.2 F4')
+    arch = get_description(net)['architecture']
+    other = Network.from_architecture(dict(reversed(list(arch.items()))))
+
+    assert len(calls) == 1
+    assert other._buffer_manager.layout == net._buffer_manager.layout
+    for name, l in net.layers.items():
+        assert other.layers[name].aliased_outputs == l.aliased_outputs
+    Network.from_layer(Input(out_shapes={'default': ('T', 'B', 3)}) >>
+                       FullyConnected(5))
+    assert len(calls) == 2
+
+
+def test_network_file_contains_layout(tmpdir, monkeypatch):
+    net = create_net_from_spec('classification', 3, 4, 'F8 L5 D0.2 F4')
+    net.initialize(Gaussian(0.1), seed=1234)
+    filename = str(tmpdir.join('net.h5'))
+    net.save_as_hdf5(filename)
+
+    def fail(layers):
+        raise AssertionError('layout should be read from the file')
+
+    monkeypatch.setattr(layout, 'create_layout', fail)
+    layout.clear_layout_cache()
+    loaded = Network.from_hdf5(filename)
+    assert loaded._buffer_manager.layout == net._buffer_manager.layout
+    assert np.all(loaded.get('parameters') == net.get('parameters'))
+
+
+def test_layout_of_a_file_is_not_cached(tmpdir):
+    net = create_net_from_spec('classification', 3, 4, 'F8 L5 D0.2 F4')
+    filename = str(tmpdir.join('net.h5'))
+    net.save_as_hdf5(filename)
+    layout.clear_layout_cache()
+    Network.from_hdf5(filename)
+    assert len(layout._layout_cache) == 0
+
+
+def test_layout_cache_keeps_the_most_recently_used_layouts(monkeypatch):
+    monkeypatch.setattr(layout, 'LAYOUT_CACHE_SIZE', 2)
+    layout.clear_layout_cache()
+    archs = [create_net_from_spec('regression', 3, 1, 'F{}'.format(i))
+             .architecture for i in range(1, 4)]
+    for arch in archs[:2] + archs[:1] + archs[2:]:
+        Network.from_architecture(arch)
+
+    assert list(layout._layout_cache) == [
+        get_architecture_hash(arch) for arch in [archs[0], archs[2]]]
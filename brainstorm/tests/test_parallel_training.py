@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+# coding=utf-8
+from __future__ import division, print_function, unicode_literals
+
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from multiprocessing.connection import Client
+
+import numpy as np
+import pytest
+
+from brainstorm import Network
+from brainstorm.data_iterators import Minibatches, Pack, Undivided
+from brainstorm.handlers import NumpyHandler
+from brainstorm.hooks import (ModifyStepperAttribute, MonitorScores,
+                              SaveTrainingState, StopAfterEpoch)
+from brainstorm.initializers import Gaussian
+from brainstorm.layers import FullyConnected, Input, Loss, SquaredError
+from brainstorm.scorers import MeanSquaredError
+from brainstorm.tools import create_net_from_spec
+from brainstorm.training import (DataParallelTrainer, HogwildTrainer,
+                                 MomentumStepper, ParameterServer,
+                                 ParameterServerWorker, PipelineTrainer,
+                                 SgdStepper, Sweep, Trainer)
+from brainstorm.training.parallel import _shard_batches
+from brainstorm.training.parameter_server import (decode_gradients,
+                                                  encode_gradients)
+from brainstorm.training.pipeline import (_get_max_batch_size,
+                                          partition_layers)
+from brainstorm.value_modifiers import ClipValues
+
+from brainstorm.tests.helpers import HANDLER
+
+
+def regression_net():
+    inp = Input(out_shapes={'default': ('T', 'B', 3),
+                            'targets': ('T', 'B', 1)})
+    error_func = SquaredError()
+    inp - 'targets' >> 'targets' - error_func
+    inp >> FullyConnected(1, activation='linear') >> error_func
+    net = Network.from_layer(error_func - 'loss' >> Loss())
+    net.set_handler(NumpyHandler(np.float64))
+    net.initialize(Gaussian(0.1), seed=1234)
+    return net
+
+
+def regression_data(shuffle=True):
+    rnd = np.random.RandomState(42)
+    data = rnd.randn(1, 40, 3)
+    targets = data.dot([[1.], [-2.], [0.5]])
+    return Minibatches(batch_size=5, shuffle=shuffle, default=data,
+                       targets=targets)
+
+
+def test_hogwild_trainer_reduces_loss():
+    net = regression_net()
+    initial = net.buffer.parameters.copy()
+    tr = HogwildTrainer(SgdStepper(learning_rate=0.1), nr_workers=2,
+                        verbose=False)
+    tr.add_hook(StopAfterEpoch(5))
+    tr.train(net, regression_data())
+
+    assert tr.current_epoch_nr == 5
+    assert tr.current_update_nr == 5 * 8
+    losses = tr.logs['rolling_training']['total_loss']
+    assert len(losses) == 5
+    assert losses[-1] < 0.1 * losses[0]
+    # the updates of the workers are visible in the coordinator
+    assert not np.allclose(net.buffer.parameters, initial)
+
+
+def test_hogwild_trainer_forwards_stepper_attributes():
+    net = regression_net()
+    initial = net.buffer.parameters.copy()
+    tr = HogwildTrainer(MomentumStepper(learning_rate=0.1, momentum=0.5),
+                        nr_workers=2, share_velocity=True, verbose=False)
+    tr.add_hook(ModifyStepperAttribute(lambda *args: 0., timescale='epoch'))
+    tr.add_hook(StopAfterEpoch(2))
+    tr.train(net, regression_data())
+
+    # the learning rate is set to zero before the first epoch
+    assert tr.stepper.learning_rate == 0.
+    assert np.all(net.buffer.parameters == initial)
+
+
+def test_hogwild_trainer_requires_numpy_handler():
+    net = regression_net()
+    net.set_handler(HANDLER)
+    tr = HogwildTrainer(SgdStepper(), verbose=False)
+    with pytest.raises(ValueError):
+        tr.train(net, regression_data())
+
+
+def test_hogwild_trainer_rejects_resume(tmpdir):
+    tr = HogwildTrainer(SgdStepper(), verbose=False)
+    with pytest.raises(NotImplementedError):
+        tr.resume(str(tmpdir.join('state.h5')), regression_net(),
+                  regression_data())
+
+
+def test_hogwild_trainer_rejects_save_training_state(tmpdir):
+    tr = HogwildTrainer(SgdStepper(), verbose=False)
+    tr.add_hook(SaveTrainingState(tr, str(tmpdir.join('state.h5'))))
+    with pytest.raises(ValueError):
+        tr.train(regression_net(), regression_data())
+
+
+def test_hogwild_workers_shard_the_innermost_data_iterator():
+    data = np.zeros((4, 20, 1))
+    mask = np.ones((4, 20, 1))
+    getter = Minibatches(batch_size=5, default=data, mask=mask)
+    assert _shard_batches(Pack(getter), 3, 1)
+    assert getter.shard == (3, 1)
+    assert not _shard_batches(Undivided(default=data), 3, 1)
+
+
+@pytest.mark.parametrize('trainer_class', [DataParallelTrainer,
+                                           PipelineTrainer])
+def test_parallel_trainers_resume_training_exactly(tmpdir, trainer_class):
+    def run(nr_epochs, filename, resume=False):
+        net = regression_net()
+        getter = regression_data()
+        getter.rnd.set_seed(7)
+        tr = trainer_class(MomentumStepper(0.1, 0.5), verbose=False)
+        tr.add_hook(SaveTrainingState(tr, filename, timescale='update',
+                                      interval=5))
+        tr.add_hook(StopAfterEpoch(nr_epochs))
+        if resume:
+            tr.resume(filename, net, getter)
+        else:
+            tr.train(net, getter)
+        return net.get('parameters'), tr
+
+    filename = str(tmpdir.join('state.h5'))
+    params, tr = run(3, str(tmpdir.join('uninterrupted.h5')))
+    run(2, filename)
+    resumed_params, resumed_tr = run(3, filename, resume=True)
+
+    assert np.allclose(resumed_params, params)
+    assert resumed_tr.current_update_nr == tr.current_update_nr
+    assert np.allclose(resumed_tr.logs['rolling_training']['total_loss'],
+                       tr.logs['rolling_training']['total_loss'])
+
+
+@pytest.mark.parametrize('nr_workers', [1, 2, 3])
+def test_data_parallel_trainer_matches_trainer(nr_workers):
+    results = []
+    for tr in [Trainer(MomentumStepper(0.1, 0.5), verbose=False),
+               DataParallelTrainer(MomentumStepper(0.1, 0.5),
+                                   nr_workers=nr_workers, verbose=False)]:
+        net = regression_net()
+        tr.train_scorers = [
+            MeanSquaredError(out_name='FullyConnected.outputs.default')]
+        tr.add_hook(ModifyStepperAttribute(
+            lambda epoch_nr, *args: 0.1 / (epoch_nr + 1)))
+        tr.add_hook(StopAfterEpoch(3))
+        tr.train(net, regression_data(shuffle=False))
+        results.append((net.buffer.parameters.copy(), tr.logs,
+                        tr.current_update_nr))
+
+    (params, logs, nr_updates), (dp_params, dp_logs, dp_nr_updates) = results
+    assert dp_nr_updates == nr_updates
+    assert np.allclose(dp_params, params)
+    for name in ['total_loss', 'MeanSquaredError']:
+        assert np.allclose(dp_logs['rolling_training'][name],
+                           logs['rolling_training'][name])
+
+
+@pytest.mark.parametrize('compression', [None, 'float16', 'sparse'])
+def test_encode_decode_gradients(compression):
+    gradients = np.zeros(20)
+    gradients[[2, 3, 11]] = [0.5, -1.25, 2.]
+    payload, count = encode_gradients(gradients, compression)
+    decoded = decode_gradients(payload, compression, count, gradients.dtype,
+                               gradients.size)
+    assert np.all(decoded == gradients)
+    if compression == 'sparse':
+        assert len(payload) == 3 * (8 + 8)
+
+
+def test_parameter_server_trains_with_workers_on_localhost():
+    net = regression_net()
+    server = ParameterServer(net, SgdStepper(learning_rate=0.1))
+    server_thread = threading.Thread(target=server.serve, args=(2,))
+    server_thread.start()
+
+    ctx = multiprocessing.get_context('fork')
+    logs = ctx.Queue()
+
+    def run_worker():
+        worker = ParameterServerWorker(regression_net(), server.address,
+                                       server.authkey, compression='float16')
+        logs.put(worker.train(regression_data(), nr_epochs=3))
+
+    workers = [ctx.Process(target=run_worker) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    worker_logs = [logs.get(timeout=60) for _ in workers]
+    for worker in workers:
+        worker.join()
+    server_thread.join()
+
+    assert server.stats['updates'] == server.version == 2 * 3 * 8
+    assert server.stats['rejected'] == 0
+    for log in worker_logs:
+        assert len(log['push_latency']) == 3 * 8
+        assert len(log['pull_latency']) == 3 * 8 + 1
+        # the gradients are sent as float16
+        assert log['bytes_sent'] == 3 * 8 * 4 * 2
+        assert log['bytes_received'] == (3 * 8 + 1) * 4 * 8
+        losses = log['rolling_training']['total_loss']
+        assert losses[-1] < 0.1 * losses[0]
+
+
+def test_parameter_server_rejects_stale_gradients():
+    net = regression_net()
+    server = ParameterServer(net, SgdStepper(learning_rate=0.1),
+                             max_staleness=0)
+    server_thread = threading.Thread(target=server.serve, args=(1,))
+    server_thread.start()
+
+    worker_net = regression_net()
+    worker_net.provide_external_data(next(regression_data()(
+        handler=worker_net.handler)))
+    worker_net.forward_pass(training_pass=True)
+    worker_net.backward_pass()
+    worker = ParameterServerWorker(worker_net, server.address, server.authkey)
+    connection = Client(server.address, authkey=server.authkey)
+    worker._pull(connection)
+    worker._push(connection)
+    # the second push is based on the same parameters as the first one
+    worker._push(connection)
+    connection.send(('done', None))
+    connection.close()
+    server_thread.join()
+
+    assert server.stats['updates'] == 1
+    assert server.stats['rejected'] == 1
+    assert worker.logs['rejected'] == 1
+
+
+def test_parameter_server_applies_weight_modifiers():
+    net = regression_net()
+    net.set_weight_modifiers(ClipValues(low=-0.05, high=0.05))
+    server = ParameterServer(net, SgdStepper(learning_rate=0.1))
+    server_thread = threading.Thread(target=server.serve, args=(1,))
+    server_thread.start()
+
+    worker_net = regression_net()
+    worker_net.provide_external_data(next(regression_data()(
+        handler=worker_net.handler)))
+    worker_net.forward_pass(training_pass=True)
+    worker_net.backward_pass()
+    worker = ParameterServerWorker(worker_net, server.address, server.authkey)
+    connection = Client(server.address, authkey=server.authkey)
+    worker._pull(connection)
+    worker._push(connection)
+    connection.send(('done', None))
+    connection.close()
+    server_thread.join()
+
+    assert server.stats['updates'] == 1
+    assert np.all(np.abs(net.get('parameters')) <= 0.05)
+
+
+def test_parameter_server_generates_a_random_authkey():
+    servers = [ParameterServer(regression_net(), SgdStepper())
+               for _ in range(2)]
+    for server in servers:
+        server._listener.close()
+
+    assert len(servers[0].authkey) == 32
+    assert servers[0].authkey != servers[1].authkey
+    server = ParameterServer(regression_net(), SgdStepper(), authkey=b'key')
+    server._listener.close()
+    assert server.authkey == b'key'
+
+
+def test_partition_layers_minimizes_most_expensive_stage():
+    costs = OrderedDict([('A', 3.), ('B', 1.), ('C', 1.), ('D', 1.),
+                         ('E', 3.), ('F', 1.)])
+    assert partition_layers(costs, 1) == [['A', 'B', 'C', 'D', 'E', 'F']]
+    assert partition_layers(costs, 2) == [['A', 'B', 'C'], ['D', 'E', 'F']]
+    stages = partition_layers(costs, 3)
+    assert sum(stages, []) == list(costs)
+    assert max(sum(costs[n] for n in names) for names in stages) == 4.
+    assert len(partition_layers(costs, 6)) == 6
+    with pytest.raises(ValueError):
+        partition_layers(costs, 7)
+
+
+@pytest.mark.parametrize('nr_stages, nr_micro_batches, shuffle',
+                         [(2, 3, False), (3, 1, False), (4, 5, True)])
+def test_pipeline_trainer_matches_trainer(nr_stages, nr_micro_batches,
+                                          shuffle):
+    rnd = np.random.RandomState(42)
+    data = rnd.randn(3, 40, 3)
+    targets = data.cumsum(0).dot([[1.], [-2.], [0.5]])
+    results = []
+    for tr in [Trainer(MomentumStepper(0.1, 0.5), verbose=False),
+               PipelineTrainer(MomentumStepper(0.1, 0.5), nr_stages=nr_stages,
+                               nr_micro_batches=nr_micro_batches,
+                               verbose=False)]:
+        net = create_net_from_spec('regression', 3, 1, 'Ft8 L5 F4')
+        net.set_handler(NumpyHandler(np.float64))
+        net.initialize(Gaussian(0.1), seed=1234)
+        tr.train_scorers = [MeanSquaredError()]
+        tr.add_hook(StopAfterEpoch(3))
+        getter = Minibatches(batch_size=7, shuffle=shuffle, default=data,
+                             targets=targets)
+        getter.rnd.set_seed(4)  # starts with the smaller last batch
+        tr.train(net, getter)
+        results.append((net.buffer.parameters.copy(), tr.logs,
+                        tr.current_update_nr))
+
+    (params, logs, nr_updates), (pp_params, pp_logs, pp_nr_updates) = results
+    assert pp_nr_updates == nr_updates
+    assert np.allclose(pp_params, params)
+    for name in ['total_loss', 'MeanSquaredError']:
+        assert np.allclose(pp_logs['rolling_training'][name],
+                           logs['rolling_training'][name])
+
+
+def test_pipeline_trainer_bounds_the_batch_size_by_the_data_iterator():
+    data = np.zeros((4, 20, 1))
+    mask = np.ones((4, 20, 1))
+    assert _get_max_batch_size(Minibatches(batch_size=7, default=data)) == 7
+    assert _get_max_batch_size(Pack(Minibatches(
+        batch_size=7, default=data, mask=mask))) == 7
+    assert _get_max_batch_size(Undivided(default=data)) == 20
+
+
+def create_regression_trial(learning_rate, data):
+    assert not data['default'].flags.writeable
+    net = regression_net()
+    tr = Trainer(SgdStepper(learning_rate=learning_rate), verbose=False)
+    tr.add_hook(MonitorScores('valid_getter', [], name='validation'))
+    tr.add_hook(StopAfterEpoch(4))
+    getter = Minibatches(batch_size=5, shuffle=False, **data)
+    return net, tr, {'training_data_iter': getter, 'valid_getter': getter}
+
+
+def regression_arrays():
+    rnd = np.random.RandomState(42)
+    data = rnd.randn(1, 40, 3)
+    return {'default': data, 'targets': data.dot([[1.], [-2.], [0.5]])}
+
+
+def test_sweep_runs_all_configurations():
+    sweep = Sweep(create_regression_trial, regression_arrays(),
+                  nr_processes=2, verbose=False)
+    results = sweep.run([0.1, 0.01, 0.0])
+
+    assert [r['configuration'] for r in results] == [0.1, 0.01, 0.0]
+    for result in results:
+        assert result['error'] is None
+        assert result['epochs'] == 4
+        assert not result['terminated']
+        assert len(result['logs']['validation']['total_loss']) == 5
+    final = [r['logs']['validation']['total_loss'][-1]
+             for r in results]
+    assert final[0] < final[1] < final[2]
+
+
+def test_sweep_terminates_bad_trials_by_successive_halving():
+    sweep = Sweep(create_regression_trial, regression_arrays(),
+                  nr_processes=1, metric='validation.total_loss',
+                  reduction_factor=2, verbose=False)
+    results = sweep.run([0.1, 0.0, 0.05, 0.0])
+
+    assert [r['epochs'] for r in results] == [4, 1, 2, 1]
+    assert [r['terminated'] for r in results] == [False, True, True, True]
+
+
+def test_sweep_reports_failing_trials():
+    def create_trial(configuration, data):
+        raise ValueError('invalid configuration')
+
+    results = Sweep(create_trial, verbose=False).run([1])
+    assert 'invalid configuration' in results[0]['error']
+
+
+def test_sweep_reports_trials_whose_process_dies():
+    def create_trial(configuration, data):
+        os._exit(configuration)
+
+    results = Sweep(create_trial, verbose=False).run([3])
+    assert 'exited with code 3' in results[0]['error']
@@ -5,6 +5,7 @@ from __future__ import division, print_function, unicode_literals
 import pickle
 from copy import copy
 
+import numpy as np
 import pytest
 
 from brainstorm.describable import (Describable, create_from_description,
@@ -69,6 +70,39 @@ def test_randomstate_seeded_get_new_random_state_deterministic(rnd):
     assert rnd1.get_seed() == rnd2.get_seed()
 
 
+def test_randomstate_streams_are_deterministic_and_independent(rnd):
+    a = rnd.create_stream(1).randint(10000, size=10)
+    b = rnd.create_stream(1).randint(10000, size=10)
+    c = rnd.create_stream(2).randint(10000, size=10)
+    assert np.all(a == b)
+    assert np.any(a != c)
+    assert rnd.create_stream(3).get_seed() == rnd.get_seed()
+    assert rnd.create_stream(3).get_stream() == 3
+
+
+def test_randomstate_set_seed_keeps_stream(rnd):
+    stream = rnd.create_stream(5)
+    a = stream.randint(10000, size=10)
+    stream.set_seed(7)
+    stream.set_seed(rnd.get_seed())
+    assert stream.get_stream() == 5
+    assert np.all(stream.randint(10000, size=10) == a)
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_randomstate_generates_in_dtype(rnd, dtype):
+    assert rnd.random_sample((3, 2), dtype=dtype).dtype == dtype
+    assert rnd.standard_normal((3, 2), dtype=dtype).dtype == dtype
+
+
+def test_global_rnd_set_seed_is_reproducible():
+    global_rnd.set_seed(42)
+    a = RandomState().randint(10000, size=10)
+    global_rnd.set_seed(42)
+    b = RandomState().randint(10000, size=10)
+    assert np.all(a == b)
+
+
 # ################## global_rnd ###############################################
 
 def test_global_rnd_exists():
@@ -2,10 +2,15 @@
 # coding=utf-8
 from __future__ import division, print_function, unicode_literals
 
+from collections import OrderedDict
+
 import pytest
 
 from brainstorm.structure.architecture import (combine_buffer_structures,
+                                               get_architecture_hash,
                                                get_canonical_layer_order,
+                                               get_replica_names,
+                                               replicate_architecture,
                                                validate_architecture)
 from brainstorm.structure.buffer_structure import BufferStructure
 from brainstorm.utils import NetworkValidationError
@@ -219,3 +224,151 @@ def test_get_canonical_architecture_order_with_named_sources():
         }
     }
     assert get_canonical_layer_order(arch) == ['A', 'B1', 'B2', 'C', 'D']
+
+
+def test_get_replica_names_sort_in_order():
+    names = get_replica_names(12)
+    assert names[:2] == ['Replica00', 'Replica01']
+    assert sorted(names) == names
+
+
+def test_replicate_architecture():
+    arch = {
+        'Input': {
+            '@type': 'Input',
+            '@outgoing_connections': {'default': ['A'],
+                                      'targets': ['B.targets']}
+        },
+        'A': {
+            '@type': 'layertype',
+            'size': 3,
+            '@outgoing_connections': {'B'}
+        },
+        'B': {
+            '@type': 'layertype',
+            '@outgoing_connections': {}
+        }
+    }
+    ensemble = replicate_architecture(arch, 2)
+    validate_architecture(ensemble)
+    assert ensemble == {
+        'Input': {
+            '@type': 'Input',
+            '@outgoing_connections': {
+                'default': ['Replica0_A', 'Replica1_A'],
+                'targets': ['Replica0_B.targets', 'Replica1_B.targets']}
+        },
+        'Replica0_A': {
+            '@type': 'layertype',
+            'size': 3,
+            '@outgoing_connections': ['Replica0_B']
+        },
+        'Replica1_A': {
+            '@type': 'layertype',
+            'size': 3,
+            '@outgoing_connections': ['Replica1_B']
+        },
+        'Replica0_B': {
+            '@type': 'layertype',
+            '@outgoing_connections': {}
+        },
+        'Replica1_B': {
+            '@type': 'layertype',
+            '@outgoing_connections': {}
+        }
+    }
+    with pytest.raises(ValueError):
+        replicate_architecture(arch, 0)
+
+
+def test_replicate_architecture_batches_fully_connected_layers():
+    arch = {
+        'Input': {
+            '@type': 'Input',
+            '@outgoing_connections': {'default': ['A'],
+                                      'targets': ['C.targets']}
+        },
+        'A': {
+            '@type': 'FullyConnected',
+            'size': 3,
+            '@outgoing_connections': ['B']
+        },
+        'B': {
+            '@type': 'FullyConnected',
+            'size': 2,
+            '@outgoing_connections': ['C']
+        },
+        'C': {
+            '@type': 'layertype',
+            '@outgoing_connections': {}
+        }
+    }
+    ensemble = replicate_architecture(arch, 2)
+    validate_architecture(ensemble)
+    assert ensemble == {
+        'Input': {
+            '@type': 'Input',
+            '@outgoing_connections': {
+                'default': ['A'],
+                'targets': ['Replica0_C.targets', 'Replica1_C.targets']}
+        },
+        'A': {
+            '@type': 'FullyConnected',
+            'size': 3,
+            'nr_replicas': 2,
+            'replicated_input': False,
+            '@outgoing_connections': ['B']
+        },
+        'B': {
+            '@type': 'FullyConnected',
+            'size': 2,
+            'nr_replicas': 2,
+            'replicated_input': True,
+            '@outgoing_connections': ['Replica0_B', 'Replica1_B']
+        },
+        'Replica0_B': {
+            '@type': 'SelectReplica',
+            'replica': 0,
+            '@outgoing_connections': ['Replica0_C']
+        },
+        'Replica1_B': {
+            '@type': 'SelectReplica',
+            'replica': 1,
+            '@outgoing_connections': ['Replica1_C']
+        },
+        'Replica0_C': {
+            '@type': 'layertype',
+            '@outgoing_connections': {}
+        },
+        'Replica1_C': {
+            '@type': 'layertype',
+            '@outgoing_connections': {}
+        }
+    }
+
+
+def test_get_architecture_hash_ignores_only_the_order_of_layers():
+    def get_arch(layer_names, shape_names):
+        arch = {
+            'Input': {
+                '@type': 'Input',
+                'out_shapes': OrderedDict((n, ['T', 'B', 1])
+                                          for n in shape_names),
+                '@outgoing_connections': {'default': ['A']}
+            },
+            'A': {
+                '@type': 'FullyConnected',
+                'size': 3,
+                '@outgoing_connections': {'default': []}
+            }
+        }
+        return OrderedDict((n, arch[n]) for n in layer_names)
+
+    arch_hash = get_architecture_hash(get_arch(['Input', 'A'],
+                                               ['default', 'targets']))
+    assert arch_hash == get_architecture_hash(
+        get_arch(['A', 'Input'], ['default', 'targets']))
+    # the order of the outputs of a layer matters for its layout
+    assert arch_hash != get_architecture_hash(
+        get_arch(['Input', 'A'], ['targets', 'default']))
+    assert get_architecture_hash({'A': {'size': object()}}) is None
@@ -12,6 +12,7 @@ from brainstorm.structure.layout import (Hub, create_layout,
                                          get_forward_closure, get_order,
                                          get_parameter_order,
                                          merge_connections)
+from brainstorm.utils import NetworkValidationError
 
 
 def test_get_order():
@@ -229,6 +230,28 @@ def test_permute_rows2():
         [0, 0, 1, 1, 1]]))
 
 
+def test_permute_rows_respects_orders():
+    h = Hub([0, 1, 2], [0, 1, 2], [1, 2], 0, orders=[([1], [0])])
+
+    h.connection_table = np.array([
+        [1, 0],
+        [1, 0],
+        [0, 1]])
+    h.permute_rows()
+    assert h.flat_sources == [1, 0, 2]
+    assert h.perm == [1, 0, 2]
+
+
+def test_permute_rows_raises_on_conflicting_orders():
+    h = Hub([0, 1], [0, 1], [1], 0, orders=[([1], [0]), ([0], [1])])
+
+    h.connection_table = np.array([
+        [1],
+        [1]])
+    with pytest.raises(NetworkValidationError):
+        h.permute_rows()
+
+
 def test_create_layout_stub(layers):
     layout = create_layout_stub(layers)
     assert layout == {
@@ -4,10 +4,13 @@
 from __future__ import division, print_function, unicode_literals
 
 import numpy as np
+import pytest
 
 from brainstorm.handlers import NumpyHandler
-from brainstorm.utils import (convert_to_nested_indices, flatten, flatten_keys,
-                              flatten_time, flatten_time_and_features,
+from brainstorm.utils import (SparseArray, convert_to_nested_indices, flatten,
+                              flatten_keys, flatten_time,
+                              flatten_time_and_features,
+                              get_active_batch_sizes, get_active_unit_sizes,
                               get_inheritors, progress_bar)
 
 
@@ -60,6 +63,36 @@ def test_flatten_time_and_features():
     assert np.allclose(y, yp)
 
 
+def test_sparse_array_from_and_to_dense():
+    dense = np.array([[[0, 2, 0], [0, 0, 0]],
+                      [[1, 0, 3], [0, 0, 4]]], dtype=np.float32)
+    a = SparseArray.from_dense(dense)
+    assert a.nnz == 4
+    assert np.all(a.indices == [1, 0, 2, 2])
+    assert np.all(a.indptr == [0, 1, 1, 3, 4])
+    assert np.all(a.to_dense() == dense)
+    assert a.reshape((4, 3)).to_dense().shape == (4, 3)
+    with pytest.raises(ValueError):
+        a.reshape((2, 6))
+
+
+def test_get_active_batch_sizes():
+    mask = np.array([[1, 1, 1, 0],
+                     [1, 1, 0, 0],
+                     [1, 0, 1, 0],
+                     [0, 0, 0, 0]]).reshape(4, 4, 1)
+    assert get_active_batch_sizes(mask) == [3, 3, 3, 0]
+    assert get_active_batch_sizes(np.zeros((2, 3, 1))) == [0, 0]
+
+
+def test_get_active_unit_sizes():
+    timing = np.array([1, 2, 2, 4, 3])
+    phase = np.arange(6).reshape(6, 1)
+    assert get_active_unit_sizes(timing, phase) == [5, 1, 3, 5, 4, 1]
+    phase = np.array([[0, 1], [1, 0], [2, 1]])
+    assert get_active_unit_sizes(timing, phase) == [5, 5, 3]
+
+
 def test_flatten_keys():
     d = {'training_loss': None,
          'validation': {'accuracy': [0],
@@ -481,7 +481,7 @@ def trynumber(a):
 
 def create_net_from_spec(task_type, in_shape, out_shape, spec,
                          data_name='default', targets_name='targets',
-                         mask_name=None, use_conv=None):
+                         mask_name=None, use_conv=None, vocab_size=None):
     """
     Create a complete network from a spec line like this "F50 F20 F50".
 
@@ -496,6 +496,7 @@ def create_net_from_spec(task_type, in_shape, out_shape, spec,
           * D : Dropout
           * C : Convolution2D
           * P : Pooling2D
+          * E : Embedding
 
         Where applicable the optional first argument is the activation function
         from the set {l, r, s, t} corresponding to 'linear', 'relu', 'sigmoid'
@@ -516,6 +517,13 @@ def create_net_from_spec(task_type, in_shape, out_shape, spec,
         is the kernel size. As with Convolution2D it can be followed by 'p1'
         for padding and/or 's2' for setting the stride to (2, 2).
 
+        Embedding takes its size as mandatory argument and can only be used
+        as the first layer. It requires `vocab_size` to be set and maps the
+        integer inputs to learned vectors, which is much cheaper than feeding
+        one-hot encoded data into a FullyConnected or Lstm layer. If
+        `vocab_size` is set and the spec does not start with an Embedding,
+        one with the size of the first layer is inserted.
+
         Whitespace is allowed everywhere and will be completely ignored.
 
     Examples:
@@ -526,6 +534,9 @@ def create_net_from_spec(task_type, in_shape, out_shape, spec,
         >>> net = create_net_from_spec(
         ...    'classification', (3, 32, 32), 10,
         ...    'C32:5p2 P3s2 C32:5p2 P3s2 C64:5p2 P3s2 F64')
+        A character-level language model on integer inputs:
+        >>> net = create_net_from_spec('classification', 1, 50, 'E64 L128',
+        ...                            vocab_size=50)
 
     Args:
         task_type (str):
@@ -553,6 +564,10 @@ def create_net_from_spec(task_type, in_shape, out_shape, spec,
             If true the projection layer will use 1x1 convolutions otherwise
             it will be fully connected.
             Default is to autodetect this based on the output shape.
+        vocab_size (Optional[int]):
+            If given, the input data are integer class indices from a
+            vocabulary of this size (with a last dimension of size 1), and
+            the network starts with an Embedding layer. Defaults to None.
 
     Returns:
         brainstorm.structure.network.Network:
@@ -575,12 +590,30 @@ def create_net_from_spec(task_type, in_shape, out_shape, spec,
 
     # spec = re.sub(r'\s', '', spec)  # remove whitespace
 
-    current_layer = inp
+    layer_specs = []
     for m in re.finditer(ARCH_SPEC, spec):
-        layer_type = m.group('layer_type')
         args = re.split(ARG, m.group('args'))[1::2]
-        args = [trynumber(a) for a in args if a != '']
-        current_layer >>= create_layer(layer_type, args)
+        layer_specs.append((m.group('layer_type'),
+                            [trynumber(a) for a in args if a != '']))
+
+    if vocab_size is not None and (not layer_specs or
+                                   layer_specs[0][0] != 'E'):
+        sizes = [a for a in layer_specs[0][1] if isinstance(a, int)] \
+            if layer_specs else []
+        if not sizes:
+            raise ValueError('Could not determine the Embedding size. Please '
+                             'start the spec with an E layer.')
+        layer_specs.insert(0, ('E', sizes[:1]))
+
+    current_layer = inp
+    for i, (layer_type, args) in enumerate(layer_specs):
+        if layer_type == 'E':
+            if i > 0 or vocab_size is None:
+                raise ValueError('Embedding must be the first layer and '
+                                 'requires vocab_size to be set.')
+            current_layer >>= layers.Embedding(vocab_size, *args)
+        else:
+            current_layer >>= create_layer(layer_type, args)
 
     net = Network.from_layer(current_layer >> outp)
     net.output_name = output_name
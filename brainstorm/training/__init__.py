@@ -3,9 +3,16 @@
 from __future__ import division, print_function
 
 from brainstorm.training.trainer import Trainer
+from brainstorm.training.parallel import DataParallelTrainer, HogwildTrainer
+from brainstorm.training.parameter_server import (ParameterServer,
+                                                  ParameterServerWorker)
+from brainstorm.training.pipeline import PipelineTrainer
+from brainstorm.training.sweep import Sweep
 from brainstorm.training.steppers import (
     SgdStepper, MomentumStepper, NesterovStepper)
 from brainstorm.training.schedules import Linear, Exponential, MultiStep
 
-__all__ = ['Trainer', 'SgdStepper', 'MomentumStepper', 'NesterovStepper',
+__all__ = ['Trainer', 'DataParallelTrainer', 'HogwildTrainer',
+           'ParameterServer', 'ParameterServerWorker', 'PipelineTrainer',
+           'Sweep', 'SgdStepper', 'MomentumStepper', 'NesterovStepper',
            'Linear', 'Exponential', 'MultiStep']
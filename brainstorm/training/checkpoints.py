@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding=utf-8
+from __future__ import division, print_function, unicode_literals
+
+import json
+import os
+
+import h5py
+import numpy as np
+
+from brainstorm.utils import get_brainstorm_info
+
+TRAINING_STATE_FORMAT = b'Training state v1.0'
+
+
+def write_training_state(filename, description, parameters, state, arrays,
+                         logs, layout=None):
+    """
+    Write the state of a training to an HDF5 file.
+
+    The file is also a valid network file, so it can be loaded with
+    :meth:`brainstorm.structure.network.Network.from_hdf5`. Besides the
+    description and the parameters of the network it contains a
+    'training_state' group with the JSON encoded ``state``, the numpy
+    ``arrays`` (like the velocity of the stepper) and the ``logs``.
+
+    The file is first written next to the target and then renamed, so an
+    interrupted write leaves the previous state intact.
+
+    Args:
+        filename (str):
+            Name of the file.
+        description (dict):
+            The description of the network.
+        parameters (numpy.ndarray):
+            The parameters of the network.
+        state (dict):
+            Everything else that can be encoded as JSON.
+        arrays (dict[str, numpy.ndarray]):
+            Named arrays of the state.
+        logs (dict):
+            The logs of the trainer.
+        layout (Optional[dict]):
+            The layout of the buffers of the network (see
+            :func:`brainstorm.structure.layout.layout_to_json`), which is
+            then used when the network is loaded. Defaults to None.
+    """
+    temp_filename = filename + '.tmp'
+    with h5py.File(temp_filename, 'w') as f:
+        f.attrs.create('info', get_brainstorm_info())
+        f.attrs.create('format', b'Network file v1.0')
+        f['description'] = json.dumps(description).encode()
+        if layout is not None:
+            f['layout'] = json.dumps(layout).encode()
+        f['parameters'] = parameters
+
+        group = f.create_group('training_state')
+        group.attrs.create('format', TRAINING_STATE_FORMAT)
+        group['state'] = json.dumps(state, default=_to_list).encode()
+        array_group = group.create_group('arrays')
+        for name, value in arrays.items():
+            array_group[name] = value
+        _write_logs(group.create_group('logs'), logs)
+    os.replace(temp_filename, filename)
+
+
+def read_training_state(filename):
+    """
+    Read a training state written by :func:`write_training_state`.
+
+    Returns:
+        tuple[numpy.ndarray, dict, dict, dict]:
+            The parameters, the state, the arrays and the logs.
+    """
+    with h5py.File(filename, 'r') as f:
+        if 'training_state' not in f or _get_format(f['training_state']) != \
+                TRAINING_STATE_FORMAT:
+            raise IOError('{} does not contain a training state'
+                          .format(filename))
+        group = f['training_state']
+        parameters = f['parameters'][()]
+        state = json.loads(group['state'][()].decode())
+        arrays = {name: ds[()] for name, ds in group['arrays'].items()}
+        logs = _read_logs(group['logs'])
+    return parameters, state, arrays, logs
+
+
+def _get_format(group):
+    file_format = group.attrs.get('format', b'')
+    # h5py >= 3 returns the attribute as str
+    return file_format if isinstance(file_format, bytes) else \
+        file_format.encode()
+
+
+def _to_list(array):
+    return array.tolist()
+
+
+def _write_logs(group, logs):
+    for name, log in logs.items():
+        if isinstance(log, dict):
+            _write_logs(group.create_group(name), log)
+        else:
+            group[name] = np.array(log)
+
+
+def _read_logs(group):
+    logs = {}
+    for name, value in group.items():
+        if isinstance(value, h5py.Group):
+            logs[name] = _read_logs(value)
+        else:
+            logs[name] = list(value[()])
+    return logs
@@ -0,0 +1,423 @@
+#!/usr/bin/env python
+# coding=utf-8
+from __future__ import division, print_function, unicode_literals
+
+import multiprocessing
+import sys
+import traceback
+from contextlib import contextmanager
+
+import numpy as np
+
+from brainstorm.data_iterators import DataIterator
+from brainstorm.handlers.numpy_handler import NumpyHandler
+from brainstorm.hooks import SaveTrainingState
+from brainstorm.scorers import (aggregate_losses_and_scores,
+                                gather_losses_and_scores)
+from brainstorm.training.trainer import Trainer
+from brainstorm.training.utils import (create_shared_array, get_attributes,
+                                       get_result_outputs, set_attributes,
+                                       use_random_stream)
+
+
+class HogwildTrainer(Trainer):
+    """
+    Trainer that runs the stepper in several worker processes, which all
+    update the same parameters in shared memory without any locking
+    (Hogwild!).
+
+    The workers are forked when the training starts. Each of them has its own
+    buffers for the activations and deltas and trains on every
+    ``nr_workers``-th batch of the training data iterator. All workers iterate
+    over the same sequence of batches, so iterators that shuffle the data
+    still yield disjoint shards. If the innermost data iterator supports
+    sharding (like Minibatches), every worker only prepares the batches of
+    its own shard. The random numbers of the handler and of the layers are
+    drawn from a different stream in every worker.
+
+    The hooks are run in the coordinating process on the shared parameters
+    and count the updates of all workers. Changes to the attributes of the
+    stepper (e.g. by ModifyStepperAttribute) are forwarded to the workers.
+
+    Note:
+        Only networks using a NumpyHandler are supported. The workers are
+        created using fork, which is not available on Windows. A training
+        can not be resumed, so the SaveTrainingState hook is not supported.
+    """
+    __default_values__ = {'share_velocity': False}
+
+    def __init__(self, stepper, nr_workers=2, share_velocity=False,
+                 verbose=True):
+        """Create a new HogwildTrainer.
+
+        Args:
+            stepper (brainstorm.training.steppers.TrainingStepper):
+            nr_workers (int):
+                Number of worker processes to train with.
+            share_velocity (bool):
+                If True, the velocity of a MomentumStepper or NesterovStepper
+                is shared between the workers just like the parameters.
+                Otherwise every worker keeps its own velocity.
+            verbose (bool):
+        """
+        super(HogwildTrainer, self).__init__(stepper, verbose)
+        if not isinstance(nr_workers, int) or nr_workers < 1:
+            raise ValueError('nr_workers must be a positive int but was {}'
+                             .format(nr_workers))
+        self.nr_workers = nr_workers
+        self.share_velocity = share_velocity
+
+    def resume(self, filename, net, training_data_iter, **named_data_iters):
+        """
+        Not supported: the workers do not keep track of their position in
+        the epoch.
+        """
+        raise NotImplementedError('The HogwildTrainer can not resume a '
+                                  'training.')
+
+    @contextmanager
+    def _stepped_network(self, net, training_data_iter):
+        if not isinstance(net.handler, NumpyHandler):
+            raise ValueError('The HogwildTrainer only supports networks using '
+                             'a NumpyHandler, but the handler was {}'
+                             .format(net.handler))
+        for name, hook in self.hooks.items():
+            if isinstance(hook, SaveTrainingState):
+                raise ValueError('The HogwildTrainer can not resume a '
+                                 'training, so it does not support the '
+                                 'SaveTrainingState hook {}'.format(name))
+        ctx = multiprocessing.get_context('fork')
+        net._buffer_manager.set_external_buffer(
+            'parameters', create_shared_array(ctx, net.buffer.parameters))
+        yield net
+
+    def _run_epochs(self, net, stepped_net, training_data_iter):
+        ctx = multiprocessing.get_context('fork')
+        if self.share_velocity:
+            self._share_velocity(ctx)
+        results = ctx.Queue()
+        stop = ctx.Event()
+        connections, workers = [], []
+        for worker_nr in range(self.nr_workers):
+            connection, worker_connection = ctx.Pipe()
+            worker = ctx.Process(target=self._run_worker,
+                                 args=(net, training_data_iter, worker_nr,
+                                       worker_connection, results, stop))
+            worker.daemon = True
+            worker.start()
+            connections.append(connection)
+            workers.append(worker)
+
+        failed = True
+        try:
+            self._coordinate(net, connections, results, stop)
+            failed = False
+        finally:
+            stop.set()
+            _stop_workers(connections, workers, failed)
+
+    def _share_velocity(self, ctx):
+        if getattr(self.stepper, 'velocity', None) is None:
+            raise ValueError('The stepper {} has no velocity to share.'
+                             .format(self.stepper.__class__.__name__))
+        velocity = create_shared_array(ctx, self.stepper.velocity)
+        velocity[:] = self.stepper.velocity
+        self.stepper.velocity = velocity
+
+    def _coordinate(self, net, connections, results, stop):
+        """Count the updates of the workers and emit the hooks."""
+        should_stop = False
+        while not should_stop:
+            self.current_epoch_nr += 1
+            sys.stdout.flush()
+            train_scores = {s.__name__: [] for s in self.train_scorers}
+            train_scores.update({n: [] for n in net.get_loss_values()})
+
+            if self.verbose:
+                print('\n\n', 12 * '- ', "Epoch", self.current_epoch_nr,
+                      12 * ' -')
+            should_stop = self._coordinate_epoch(net, connections, results,
+                                                 stop, train_scores)
+            stop.clear()
+
+            self._add_log('rolling_training',
+                          aggregate_losses_and_scores(train_scores, net,
+                                                      self.train_scorers))
+
+            should_stop |= self._emit_hooks(net, 'epoch')
+
+    def _coordinate_epoch(self, net, connections, results, stop,
+                          train_scores):
+        """Let the workers run an epoch and collect their updates."""
+        should_stop = False
+        attributes = get_attributes(self.stepper)
+        for connection in connections:
+            connection.send(('epoch', attributes))
+
+        running = len(connections)
+        while running:
+            message, content = results.get()
+            if message == 'error':
+                raise RuntimeError('A worker failed with:\n' + content)
+            elif message == 'done':
+                running -= 1
+                continue
+
+            self.current_update_nr += 1
+            for name, scores in content.items():
+                train_scores[name].extend(scores)
+            if not should_stop and self._emit_hooks(net, 'update'):
+                should_stop = True
+                stop.set()
+
+            attributes = _forward_stepper_attributes(self.stepper, attributes,
+                                                     connections)
+        return should_stop
+
+    def _run_worker(self, net, training_data_iter, worker_nr, connection,
+                    results, stop):
+        """Train on a shard of the data whenever the coordinator says so."""
+        try:
+            use_random_stream(net, worker_nr + 1)
+            sharded = _shard_batches(training_data_iter, self.nr_workers,
+                                     worker_nr)
+            while True:
+                command, attributes = connection.recv()
+                if command == 'stop':
+                    break
+                set_attributes(self.stepper, attributes)
+                if command == 'epoch':
+                    self._run_worker_epoch(net, training_data_iter, worker_nr,
+                                           sharded, connection, results,
+                                           stop)
+                    results.put(('done', None))
+        except Exception:
+            results.put(('error', traceback.format_exc()))
+
+    def _run_worker_epoch(self, net, training_data_iter, worker_nr, sharded,
+                          connection, results, stop):
+        iterator = training_data_iter(handler=net.handler)
+        for i, data in enumerate(iterator):
+            if stop.is_set():
+                break
+            if not sharded and i % self.nr_workers != worker_nr:
+                continue
+            while connection.poll():
+                command, attributes = connection.recv()
+                set_attributes(self.stepper, attributes)
+
+            net.provide_external_data(data)
+            self.stepper.run()
+            train_scores = {s.__name__: [] for s in self.train_scorers}
+            train_scores.update({n: [] for n in net.get_loss_values()})
+            gather_losses_and_scores(net, self.train_scorers, train_scores)
+            net.apply_weight_modifiers()
+            results.put(('update', train_scores))
+
+
+class DataParallelTrainer(Trainer):
+    """
+    Trainer that splits every batch of the training data into shards and
+    computes the gradients for them in several worker processes.
+
+    The workers are forked when the training starts and share the parameters
+    with the coordinating process. Each worker writes the gradients for its
+    shard into its own shared memory, and the coordinator combines them,
+    weighted by the size of the shard, before the stepper performs a single
+    update. Apart from the order of the summation this matches training with
+    the full batches in a single process, unless some layer (like BatchNorm)
+    computes statistics over the batch or uses random numbers, which are drawn
+    from a different stream in every worker.
+
+    The stepper, the hooks and the weight and gradient modifiers all run in
+    the coordinating process, so schedules work unchanged, and a training can
+    be resumed like with the Trainer. Only the random numbers drawn in the
+    workers are not restored.
+
+    Note:
+        Only networks using a NumpyHandler and data iterators that provide
+        numpy arrays are supported. The workers are created using fork, which
+        is not available on Windows.
+    """
+
+    def __init__(self, stepper, nr_workers=2, verbose=True):
+        """Create a new DataParallelTrainer.
+
+        Args:
+            stepper (brainstorm.training.steppers.TrainingStepper):
+            nr_workers (int):
+                Number of worker processes to split every batch between.
+            verbose (bool):
+        """
+        super(DataParallelTrainer, self).__init__(stepper, verbose)
+        if not isinstance(nr_workers, int) or nr_workers < 1:
+            raise ValueError('nr_workers must be a positive int but was {}'
+                             .format(nr_workers))
+        self.nr_workers = nr_workers
+
+    @contextmanager
+    def _stepped_network(self, net, training_data_iter):
+        if not isinstance(net.handler, NumpyHandler):
+            raise ValueError('The DataParallelTrainer only supports networks '
+                             'using a NumpyHandler, but the handler was {}'
+                             .format(net.handler))
+        ctx = multiprocessing.get_context('fork')
+        net._buffer_manager.set_external_buffer(
+            'parameters', create_shared_array(ctx, net.buffer.parameters))
+        gradients = [create_shared_array(ctx, net.buffer.gradients)
+                     for _ in range(self.nr_workers)]
+        results = get_result_outputs(net, self.train_scorers)
+
+        connections, workers = [], []
+        for worker_nr in range(self.nr_workers):
+            connection, worker_connection = ctx.Pipe()
+            worker = ctx.Process(target=self._run_worker,
+                                 args=(net, gradients[worker_nr], results,
+                                       worker_nr, worker_connection))
+            worker.daemon = True
+            worker.start()
+            connections.append(connection)
+            workers.append(worker)
+
+        failed = True
+        try:
+            yield _DataParallelNetwork(net, connections, gradients, results)
+            failed = False
+        finally:
+            _stop_workers(connections, workers, failed)
+
+    def _run_worker(self, net, gradients, results, worker_nr, connection):
+        """Run the passes for the shards sent by the coordinator."""
+        try:
+            use_random_stream(net, worker_nr + 1)
+            net._buffer_manager.set_external_buffer('gradients', gradients)
+            # the gradient modifiers are applied to the combined gradients
+            net.gradient_modifiers = {}
+            while True:
+                command, content = connection.recv()
+                if command == 'stop':
+                    break
+                elif command == 'data':
+                    net.provide_external_data(content)
+                elif command == 'forward':
+                    net.forward_pass(training_pass=content)
+                    connection.send(('done', [_get_output(net, *result)
+                                              for result in results]))
+                elif command == 'backward':
+                    net.backward_pass()
+                    connection.send(('done', None))
+        except Exception:
+            connection.send(('error', traceback.format_exc()))
+
+
+class _DataParallelNetwork(object):
+    """
+    Stand-in for a network that is given to the stepper of the
+    DataParallelTrainer. It runs the passes in the workers, collects the
+    outputs needed for the losses and scores in the network and combines the
+    gradients of the workers, and it forwards everything else to the network.
+    """
+
+    def __init__(self, net, connections, gradients, results):
+        self.net = net
+        self.connections = connections
+        self.gradients = gradients
+        self.results = results  # (layer name, output name)
+        self.splits = []
+
+    def __getattr__(self, item):
+        return getattr(self.net, item)
+
+    def provide_external_data(self, data, all_inputs=True):
+        self.net.provide_external_data(data, all_inputs)
+        batch_size = data[next(iter(data))].shape[1]
+        self.splits = [(split[0], split[-1] + 1) for split in np.array_split(
+            np.arange(batch_size), len(self.connections)) if len(split)]
+        for connection, (start, stop) in zip(self.connections, self.splits):
+            connection.send(('data', {name: d[:, start:stop]
+                                      for name, d in data.items()}))
+
+    def forward_pass(self, training_pass=False, context=None):
+        assert context is None, "Context is not supported."
+        shards = self._run_in_workers('forward', training_pass)
+        batch_size = self.splits[-1][1]
+        for nr, (layer_name, output_name) in enumerate(self.results):
+            output = self.net.buffer[layer_name].outputs[output_name]
+            is_time_batch = _is_time_batch(self.net, layer_name, output_name)
+            if not is_time_batch:
+                output[:] = 0.
+            for (start, stop), values in zip(self.splits, shards):
+                if is_time_batch:
+                    output[:len(values[nr]), start:stop] = values[nr]
+                else:
+                    output += (stop - start) / batch_size * values[nr]
+
+    def backward_pass(self):
+        self._run_in_workers('backward', None)
+        _h = self.net.handler
+        batch_size = self.splits[-1][1]
+        _h.fill(self.net.buffer.gradients, 0.)
+        for (start, stop), gradients in zip(self.splits, self.gradients):
+            _h.mult_add_st((stop - start) / batch_size, gradients,
+                           self.net.buffer.gradients)
+        self.net.apply_gradient_modifiers()
+
+    def _run_in_workers(self, command, content):
+        active = self.connections[:len(self.splits)]
+        for connection in active:
+            connection.send((command, content))
+        results = []
+        for connection in active:
+            message, result = connection.recv()
+            if message == 'error':
+                raise RuntimeError('A worker failed with:\n' + result)
+            results.append(result)
+        return results
+
+
+def _shard_batches(data_iter, nr_shards, shard_nr):
+    """
+    Let the innermost data iterator yield only one shard of the batches, and
+    tell whether it supports this.
+    """
+    innermost = data_iter
+    while isinstance(getattr(innermost, 'iter', None), DataIterator):
+        innermost = innermost.iter
+    if not getattr(innermost, 'supports_sharding', False):
+        return False
+    innermost.shard = (nr_shards, shard_nr)
+    return True
+
+
+def _is_time_batch(net, layer_name, output_name):
+    shape = net.layers[layer_name].out_shapes[output_name].shape
+    return tuple(shape[:2]) == ('T', 'B')
+
+
+def _get_output(net, layer_name, output_name):
+    """Get an output of a network without the context."""
+    output = net.buffer[layer_name].outputs[output_name]
+    if _is_time_batch(net, layer_name, output_name):
+        return output[:net._buffer_manager.time_size]
+    return output
+
+
+def _stop_workers(connections, workers, failed):
+    for connection in connections:
+        try:
+            connection.send(('stop', None))
+        except (IOError, OSError):
+            pass  # the worker already died
+    for worker in workers:
+        if failed:
+            worker.terminate()
+        worker.join()
+
+
+def _forward_stepper_attributes(stepper, attributes, connections):
+    """Send the attributes of the stepper to the workers if they changed."""
+    new_attributes = get_attributes(stepper)
+    if new_attributes != attributes:
+        for connection in connections:
+            connection.send(('set', new_attributes))
+    return new_attributes
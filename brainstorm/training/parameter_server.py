@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# coding=utf-8
+from __future__ import division, print_function, unicode_literals
+
+import os
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from brainstorm.handlers.numpy_handler import NumpyHandler
+from brainstorm.scorers import (aggregate_losses_and_scores,
+                                gather_losses_and_scores)
+from brainstorm.training.utils import run_network
+
+COMPRESSIONS = (None, 'float16', 'sparse')
+
+
+class ParameterServer(object):
+    """
+    Server for asynchronous training, which holds the parameters of a network
+    and updates them with the gradients pushed by ParameterServerWorkers.
+
+    Workers connect over TCP, pull the current parameters, compute the
+    gradients for a batch and push them back. Every accepted push is applied
+    by running the stepper once. A push is rejected if more than
+    `max_staleness` other updates were applied since the worker pulled the
+    parameters it computed the gradients with.
+
+    Workers authenticate with a key shared with the server. Unless a key is
+    given, the server generates a random one, which has to be passed on to
+    the workers.
+
+    Attributes:
+        address (tuple[str, int]):
+            The address the server listens on.
+        authkey (bytes):
+            The key the workers authenticate with.
+        version (int):
+            The number of updates applied so far.
+        stats (dict):
+            Number of applied and rejected updates and the number of bytes
+            of parameters sent and gradients received.
+    """
+
+    def __init__(self, net, stepper, address=('localhost', 0), authkey=None,
+                 max_staleness=None):
+        """
+        Args:
+            net (brainstorm.structure.network.Network):
+                The network holding the parameters. It has to use a
+                NumpyHandler.
+            stepper (brainstorm.training.steppers.TrainingStepper):
+                The stepper that applies the updates.
+            address (Optional[tuple[str, int]]):
+                Host and port to listen on. Port 0 picks a free port.
+                Defaults to ('localhost', 0).
+            authkey (Optional[bytes]):
+                Key the workers need to authenticate with. Defaults to None,
+                in which case a random key is generated.
+            max_staleness (Optional[int]):
+                Maximum number of updates that may have been applied between
+                pulling the parameters and pushing the gradients. Defaults to
+                None, in which case all pushes are accepted.
+        """
+        if not isinstance(net.handler, NumpyHandler):
+            raise ValueError('The ParameterServer only supports networks '
+                             'using a NumpyHandler, but the handler was {}'
+                             .format(net.handler))
+        self.net = net
+        self.stepper = stepper
+        self.max_staleness = max_staleness
+        self.version = 0
+        self.stats = {'updates': 0, 'rejected': 0, 'bytes_sent': 0,
+                      'bytes_received': 0}
+        self.authkey = os.urandom(32) if authkey is None else authkey
+        self._lock = threading.Lock()
+        self._listener = Listener(address, authkey=self.authkey)
+        self.address = self._listener.address
+        self.stepper.start(_PushedGradientsNetwork(net))
+
+    def serve(self, nr_workers):
+        """
+        Accept the given number of workers and serve them until all of them
+        are done.
+
+        Args:
+            nr_workers (int):
+                Number of workers to wait for.
+        Returns:
+            dict:
+                The statistics of the server.
+        """
+        threads = []
+        try:
+            for _ in range(nr_workers):
+                connection = self._listener.accept()
+                thread = threading.Thread(target=self._serve_worker,
+                                          args=(connection,))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+        finally:
+            self._listener.close()
+        return self.stats
+
+    def _serve_worker(self, connection):
+        with connection:
+            while True:
+                command, content = connection.recv()
+                if command == 'done':
+                    break
+                elif command == 'pull':
+                    self._send_parameters(connection)
+                elif command == 'push':
+                    version, compression, count = content
+                    payload = connection.recv_bytes()
+                    connection.send(self._apply_gradients(
+                        version, compression, count, payload))
+
+    def _send_parameters(self, connection):
+        with self._lock:
+            version = self.version
+            payload = self.net.buffer.parameters.tobytes()
+            self.stats['bytes_sent'] += len(payload)
+        connection.send(('parameters', version))
+        connection.send_bytes(payload)
+
+    def _apply_gradients(self, version, compression, count, payload):
+        gradients = self.net.buffer.gradients
+        with self._lock:
+            self.stats['bytes_received'] += len(payload)
+            if self.max_staleness is not None and \
+                    self.version - version > self.max_staleness:
+                self.stats['rejected'] += 1
+                return 'rejected', self.version
+            gradients[:] = decode_gradients(payload, compression, count,
+                                            gradients.dtype, gradients.size)
+            self.stepper.run()
+            self.net.apply_weight_modifiers()
+            self.version += 1
+            self.stats['updates'] += 1
+            return 'applied', self.version
+
+
+class ParameterServerWorker(object):
+    """
+    Worker that computes gradients for a ParameterServer.
+
+    For every batch the worker pushes the gradients for the parameters it
+    pulled last and then pulls the current parameters.
+
+    Attributes:
+        logs (dict):
+            The rolling training losses and scores for every epoch, the
+            latencies of all pulls and pushes in seconds, the number of bytes
+            sent and received and the number of rejected pushes.
+    """
+
+    def __init__(self, net, address, authkey, compression=None, scorers=()):
+        """
+        Args:
+            net (brainstorm.structure.network.Network):
+                A network with the same architecture as the one of the server.
+            address (tuple[str, int]):
+                The address of the server.
+            authkey (bytes):
+                Key to authenticate with the server (see
+                ParameterServer.authkey).
+            compression (Optional[str]):
+                How to encode the gradients: None sends them as they are,
+                'float16' halves their size at the cost of precision, and
+                'sparse' only sends the non-zero entries, which pays off for
+                layers like Embedding. Defaults to None.
+            scorers (Optional[list[brainstorm.scorers.Scorer]]):
+                Scorers to compute on the training batches.
+        """
+        if compression not in COMPRESSIONS:
+            raise ValueError('Unknown compression {}. Choices are {}'.format(
+                compression, COMPRESSIONS))
+        self.net = net
+        self.address = address
+        self.authkey = authkey
+        self.compression = compression
+        self.scorers = scorers
+        self.logs = {'rolling_training': {}, 'pull_latency': [],
+                     'push_latency': [], 'bytes_sent': 0,
+                     'bytes_received': 0, 'rejected': 0}
+        self._version = None
+
+    def train(self, training_data_iter, nr_epochs=1):
+        """
+        Compute and push the gradients for the given number of passes over
+        the training data.
+
+        Returns:
+            dict: The logs of this worker.
+        """
+        net = self.net
+        connection = Client(self.address, authkey=self.authkey)
+        try:
+            self._pull(connection)
+            for _ in range(nr_epochs):
+                train_scores = {s.__name__: [] for s in self.scorers}
+                train_scores.update({n: [] for n in net.get_loss_values()})
+                iterator = training_data_iter(handler=net.handler)
+                for _ in run_network(net, iterator):
+                    net.forward_pass(training_pass=True)
+                    net.backward_pass()
+                    gather_losses_and_scores(net, self.scorers, train_scores)
+                    self._push(connection)
+                    self._pull(connection)
+                results = aggregate_losses_and_scores(train_scores, net,
+                                                      self.scorers)
+                for name, value in results.items():
+                    self.logs['rolling_training'].setdefault(
+                        name, []).append(value)
+            connection.send(('done', None))
+        finally:
+            connection.close()
+        return self.logs
+
+    def _pull(self, connection):
+        start = time.time()
+        connection.send(('pull', None))
+        _, self._version = connection.recv()
+        payload = connection.recv_bytes()
+        parameters = self.net.buffer.parameters
+        parameters[:] = np.frombuffer(payload, dtype=parameters.dtype)
+        self.logs['pull_latency'].append(time.time() - start)
+        self.logs['bytes_received'] += len(payload)
+
+    def _push(self, connection):
+        start = time.time()
+        payload, count = encode_gradients(self.net.buffer.gradients,
+                                          self.compression)
+        connection.send(('push', (self._version, self.compression, count)))
+        connection.send_bytes(payload)
+        status, _ = connection.recv()
+        self.logs['push_latency'].append(time.time() - start)
+        self.logs['bytes_sent'] += len(payload)
+        if status == 'rejected':
+            self.logs['rejected'] += 1
+
+
+def encode_gradients(gradients, compression=None):
+    """
+    Encode a flat gradient vector as bytes.
+
+    Returns:
+        (bytes, int):
+            The encoded gradients and the number of encoded entries.
+    """
+    if compression == 'float16':
+        return gradients.astype(np.float16).tobytes(), gradients.size
+    elif compression == 'sparse':
+        indices = np.flatnonzero(gradients).astype(np.int64)
+        return indices.tobytes() + gradients[indices].tobytes(), len(indices)
+    return gradients.tobytes(), gradients.size
+
+
+def decode_gradients(payload, compression, count, dtype, size):
+    """Decode gradients encoded by :func:`encode_gradients`."""
+    if compression == 'float16':
+        return np.frombuffer(payload, dtype=np.float16).astype(dtype)
+    elif compression == 'sparse':
+        nr_index_bytes = count * np.dtype(np.int64).itemsize
+        indices = np.frombuffer(payload[:nr_index_bytes], dtype=np.int64)
+        gradients = np.zeros(size, dtype=dtype)
+        gradients[indices] = np.frombuffer(payload[nr_index_bytes:],
+                                           dtype=dtype)
+        return gradients
+    return np.frombuffer(payload, dtype=dtype)
+
+
+class _PushedGradientsNetwork(object):
+    """
+    Stand-in for a network that is given to the stepper of the
+    ParameterServer. The gradients are already in place when the stepper
+    runs, so it does not run any passes.
+    """
+
+    def __init__(self, net):
+        self.net = net
+
+    def __getattr__(self, item):
+        return getattr(self.net, item)
+
+    def forward_pass(self, training_pass=False, context=None):
+        pass
+
+    def backward_pass(self):
+        pass
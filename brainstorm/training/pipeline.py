@@ -0,0 +1,590 @@
+#!/usr/bin/env python
+# coding=utf-8
+from __future__ import division, print_function, unicode_literals
+
+import multiprocessing
+import time
+import traceback
+from collections import OrderedDict
+from contextlib import contextmanager
+from copy import copy
+
+import numpy as np
+
+from brainstorm.handlers.numpy_handler import NumpyHandler
+from brainstorm.structure.architecture import \
+    instantiate_layers_from_architecture
+from brainstorm.structure.buffers import BufferManager
+from brainstorm.structure.layout import create_layout
+from brainstorm.structure.network import Network
+from brainstorm.training.trainer import Trainer
+from brainstorm.training.utils import (create_shared_array,
+                                       get_random_states, get_random_streams,
+                                       get_result_outputs, get_seedables,
+                                       set_random_states, use_random_stream)
+
+
+class PipelineTrainer(Trainer):
+    """
+    Trainer that splits the layers of a network into contiguous stages, which
+    run in separate processes, and streams micro-batches through them
+    (pipeline parallelism as in GPipe).
+
+    When the training starts the forward and backward pass of every layer is
+    timed on the first batch (without changing the random numbers of the data
+    iterator and the network), and the layers are partitioned such that the
+    most expensive stage is as cheap as possible. Every stage is forked into
+    its own process with a network of its own, which only holds the buffers of
+    its layers. Every batch is split into micro-batches: the stages run the
+    forward passes for all of them, passing the outputs that are needed by
+    later stages on in shared memory, and then the backward passes in reverse
+    order, passing the deltas back. So while one stage works on a micro-batch,
+    the previous one can already work on the next.
+
+    Only the outputs at the stage boundaries are kept for all micro-batches.
+    Apart from the last micro-batch, a stage recomputes its forward pass
+    (with the same random numbers) right before the backward pass.
+
+    The parameters are shared with the coordinating process, from where the
+    stages copy those of their layers before every batch. Each stage adds the
+    gradients of its layers, weighted by the size of the micro-batches, to the
+    shared gradients. The stepper, the hooks and the weight and gradient
+    modifiers all run in the coordinating process. Apart from the order of the
+    summation this matches training with the full batches in a single process,
+    unless some layer (like BatchNorm) computes statistics over the batch or
+    uses random numbers. A training can be resumed like with the Trainer,
+    except for the random numbers drawn in the stages.
+
+    Note:
+        Only networks using a NumpyHandler and data iterators that provide
+        numpy arrays are supported. The stages are created using fork, which
+        is not available on Windows.
+    """
+    __default_values__ = {'max_batch_size': None}
+
+    def __init__(self, stepper, nr_stages=2, nr_micro_batches=4,
+                 max_batch_size=None, verbose=True):
+        """Create a new PipelineTrainer.
+
+        Args:
+            stepper (brainstorm.training.steppers.TrainingStepper):
+            nr_stages (int):
+                Number of stages (processes) to split the layers into.
+            nr_micro_batches (int):
+                Number of micro-batches to split every batch into.
+            max_batch_size (Optional[int]):
+                The largest batch size of the training data, for which the
+                memory shared between the stages is allocated. Defaults to
+                None, in which case the smallest bound given by the
+                data_shapes and the batch_size of the data iterator (or an
+                iterator it wraps) is used.
+            verbose (bool):
+        """
+        super(PipelineTrainer, self).__init__(stepper, verbose)
+        if not isinstance(nr_stages, int) or nr_stages < 1:
+            raise ValueError('nr_stages must be a positive int but was {}'
+                             .format(nr_stages))
+        if not isinstance(nr_micro_batches, int) or nr_micro_batches < 1:
+            raise ValueError('nr_micro_batches must be a positive int but '
+                             'was {}'.format(nr_micro_batches))
+        self.nr_stages = nr_stages
+        self.nr_micro_batches = nr_micro_batches
+        self.max_batch_size = max_batch_size
+
+    @contextmanager
+    def _stepped_network(self, net, training_data_iter):
+        if not isinstance(net.handler, NumpyHandler):
+            raise ValueError('The PipelineTrainer only supports networks '
+                             'using a NumpyHandler, but the handler was {}'
+                             .format(net.handler))
+        if net.layers['Input'].kwargs.get('sparse_inputs'):
+            raise ValueError('The PipelineTrainer does not support sparse '
+                             'inputs.')
+        ctx = multiprocessing.get_context('fork')
+        stage_names = self._partition_layers(net, training_data_iter)
+
+        net._buffer_manager.set_external_buffer(
+            'parameters', create_shared_array(ctx, net.buffer.parameters))
+        net._buffer_manager.set_external_buffer(
+            'gradients', create_shared_array(ctx, net.buffer.gradients))
+        max_time_size = max(s[0] for s in training_data_iter.data_shapes
+                            .values())
+        max_batch_size = self.max_batch_size or \
+            _get_max_batch_size(training_data_iter)
+        pipeline_net = _PipelineNetwork(
+            ctx, net, stage_names,
+            get_result_outputs(net, self.train_scorers), max_time_size,
+            max_batch_size, self.nr_micro_batches)
+
+        processes = []
+        for stage in pipeline_net.stages:
+            process = ctx.Process(target=stage.run,
+                                  args=(pipeline_net.finished,))
+            process.daemon = True
+            process.start()
+            processes.append(process)
+
+        failed = True
+        try:
+            yield pipeline_net
+            failed = False
+        finally:
+            for stage in pipeline_net.stages:
+                stage.inboxes[stage.nr].put(('stop', None))
+            for process in processes:
+                if failed:
+                    process.terminate()
+                process.join()
+
+    def _partition_layers(self, net, training_data_iter):
+        # measure the costs without changing the course of the training
+        seedables = get_seedables(training_data_iter) + \
+            get_random_streams(net)
+        random_states = get_random_states(seedables)
+        data = next(iter(training_data_iter(handler=net.handler)))
+        costs = measure_layer_costs(net, data)
+        set_random_states(seedables, random_states)
+        stage_names = partition_layers(costs, self.nr_stages)
+        if self.verbose:
+            for i, names in enumerate(stage_names):
+                print('Stage {}: {} ({:.2e}s)'.format(
+                    i, ', '.join(names), sum(costs[n] for n in names)))
+        return stage_names
+
+
+def measure_layer_costs(net, data):
+    """
+    Measure how long the forward and backward pass of every layer of a
+    network take on the given data.
+
+    Args:
+        net (brainstorm.structure.network.Network):
+            The network to measure.
+        data (dict):
+            A batch of data for the network as provided by a data iterator.
+    Returns:
+        OrderedDict[str, float]:
+            The time in seconds for every layer apart from the Input layer,
+            in the order of the layers.
+    """
+    layers = list(net.layers.items())[1:]
+    net.provide_external_data(data)
+    net.forward_pass(training_pass=True)  # warm up
+
+    costs = OrderedDict((name, 0.) for name, _ in layers)
+    for name, layer in layers:
+        start = time.time()
+        layer.forward_pass(net.buffer[name], training_pass=True)
+        costs[name] += time.time() - start
+    net._buffer_manager.clear_backward_buffers()
+    for name, layer in reversed(layers):
+        start = time.time()
+        layer.backward_pass(net.buffer[name])
+        costs[name] += time.time() - start
+    return costs
+
+
+def partition_layers(costs, nr_stages):
+    """
+    Split a sequence of layers into contiguous stages, such that the cost of
+    the most expensive stage is as small as possible.
+
+    Args:
+        costs (OrderedDict[str, float]):
+            The cost of every layer, in the order of the layers.
+        nr_stages (int):
+            Number of stages to create. Every stage gets at least one layer.
+    Returns:
+        list[list[str]]:
+            The names of the layers in every stage.
+    """
+    names = list(costs.keys())
+    nr_layers = len(names)
+    if not 1 <= nr_stages <= nr_layers:
+        raise ValueError('Can not split {} layers into {} stages.'.format(
+            nr_layers, nr_stages))
+    total = np.concatenate([[0.], np.cumsum(list(costs.values()))])
+
+    # best[k, i]: smallest maximal cost of splitting the first i layers into
+    # k stages, which is achieved by starting the last stage at split[k, i]
+    best = np.full((nr_stages + 1, nr_layers + 1), np.inf)
+    best[0, 0] = 0.
+    split = np.zeros((nr_stages + 1, nr_layers + 1), dtype=np.int_)
+    for k in range(1, nr_stages + 1):
+        for i in range(k, nr_layers + 1):
+            for j in range(k - 1, i):
+                cost = max(best[k - 1, j], total[i] - total[j])
+                if cost < best[k, i]:
+                    best[k, i] = cost
+                    split[k, i] = j
+
+    stages = []
+    stop = nr_layers
+    for k in range(nr_stages, 0, -1):
+        start = split[k, stop]
+        stages.append(names[start:stop])
+        stop = start
+    return stages[::-1]
+
+
+class _SharedTensor(object):
+    """
+    Shared memory for an output (or its deltas) that is passed between the
+    processes, with room for all the micro-batches of a batch.
+
+    Outputs with time and batch dimensions are stored like the full batch,
+    all other outputs once per micro-batch.
+    """
+
+    def __init__(self, ctx, shape, dtype, max_time_size, max_batch_size,
+                 nr_micro_batches):
+        self.is_time_batch = tuple(shape[:2]) == ('T', 'B')
+        if self.is_time_batch:
+            full_shape = (max_time_size, max_batch_size) + tuple(shape[2:])
+        else:
+            full_shape = (nr_micro_batches,) + tuple(shape)
+        self.array = create_shared_array(ctx, np.empty(full_shape, dtype))
+
+    def view(self, micro_batch, time_size, splits):
+        if not self.is_time_batch:
+            return self.array[micro_batch]
+        start, stop = splits[micro_batch]
+        return self.array[:time_size, start:stop]
+
+
+class _PipelineStage(object):
+    """
+    One stage of the pipeline, which runs the passes of some layers in its
+    own process.
+
+    The stages notify each other via their inboxes when the outputs or deltas
+    for a micro-batch are ready.
+    """
+
+    def __init__(self, nr, net, slices, parameters, gradients, inboxes):
+        self.nr = nr
+        self.net = net
+        self.slices = slices  # (own, shared) parameters of every layer
+        self.parameters = parameters
+        self.gradients = gradients
+        self.inboxes = inboxes
+        self.inputs = []  # (input name, tensor, delta tensor or None)
+        self.outputs = []  # (layer name, output name, tensor, delta tensors)
+        self.producers = set()
+        self.consumers = set()
+        self._arrived = {}
+        self._commands = []
+        self._random_states = []
+
+    def run(self, finished):
+        """Run the passes that the coordinator asks for until stopped."""
+        try:
+            use_random_stream(self.net, self.nr + 1)
+            while True:
+                while not self._commands:
+                    self._receive()
+                command, content = self._commands.pop(0)
+                if command == 'stop':
+                    break
+                elif command == 'forward':
+                    self._forward(*content)
+                elif command == 'backward':
+                    self._backward(*content)
+                finished.put(('done', None))
+        except Exception:
+            finished.put(('error', traceback.format_exc()))
+
+    def _receive(self):
+        message, content = self.inboxes[self.nr].get()
+        if message in ('outputs', 'deltas'):
+            key = (message, content)
+            self._arrived[key] = self._arrived.get(key, 0) + 1
+        else:
+            self._commands.append((message, content))
+
+    def _wait_for(self, message, micro_batch, count):
+        key = (message, micro_batch)
+        while self._arrived.get(key, 0) < count:
+            self._receive()
+        self._arrived.pop(key, None)
+
+    def _forward(self, time_size, splits, training_pass):
+        parameters = self.net.buffer.parameters
+        for own, shared in self.slices:
+            parameters[own] = self.parameters[shared]
+        self._random_states = []
+        for m in range(len(splits)):
+            self._wait_for('outputs', m, len(self.producers))
+            self._random_states.append(
+                get_random_states(get_random_streams(self.net)))
+            self._run_forward_pass(m, time_size, splits, training_pass)
+            for name, output_name, tensor, _ in self.outputs:
+                output = self.net.buffer[name].outputs[output_name]
+                if tensor.is_time_batch:
+                    output = output[:time_size]  # without the context
+                tensor.view(m, time_size, splits)[:] = output
+            for consumer in self.consumers:
+                self.inboxes[consumer].put(('outputs', m))
+
+    def _backward(self, time_size, splits, training_pass):
+        _h = self.net.handler
+        batch_size = splits[-1][1]
+        for _, shared in self.slices:
+            _h.fill(self.gradients[shared], 0.)
+        for m in reversed(range(len(splits))):
+            self._wait_for('deltas', m, len(self.consumers))
+            if m != len(splits) - 1:
+                # only the buffers for the last micro-batch are still there
+                set_random_states(get_random_streams(self.net),
+                                  self._random_states[m])
+                self._run_forward_pass(m, time_size, splits, training_pass)
+            self._run_backward_pass(m, time_size, splits)
+            start, stop = splits[m]
+            gradients = self.net.buffer.gradients
+            for own, shared in self.slices:
+                _h.mult_add_st((stop - start) / batch_size, gradients[own],
+                               self.gradients[shared])
+            for name, _, deltas in self.inputs:
+                if deltas is not None:
+                    deltas.view(m, time_size, splits)[:] = \
+                        self.net.buffer.Input.output_deltas[name]
+            for producer in self.producers:
+                self.inboxes[producer].put(('deltas', m))
+
+    def _run_forward_pass(self, micro_batch, time_size, splits,
+                          training_pass):
+        self.net.provide_external_data(
+            {name: tensor.view(micro_batch, time_size, splits)
+             for name, tensor, _ in self.inputs})
+        self.net.forward_pass(training_pass=training_pass)
+
+    def _run_backward_pass(self, micro_batch, time_size, splits):
+        # like Network.backward_pass, but with the deltas of later stages
+        net = self.net
+        net._buffer_manager.clear_backward_buffers()
+        for name, output_name, _, delta_tensors in self.outputs:
+            output_deltas = net.buffer[name].output_deltas[output_name]
+            output_deltas = output_deltas[:time_size]
+            for deltas in delta_tensors:
+                net.handler.add_tt(
+                    output_deltas, deltas.view(micro_batch, time_size, splits),
+                    output_deltas)
+        for layer_name, layer in reversed(list(net.layers.items())[1:]):
+            layer.backward_pass(net.buffer[layer_name])
+
+
+class _PipelineNetwork(object):
+    """
+    Stand-in for a network that is given to the stepper of the
+    PipelineTrainer. It runs the passes in the stages and collects the
+    outputs needed for the losses and scores in the network, and it forwards
+    everything else to the network.
+    """
+
+    def __init__(self, ctx, net, stage_names, results, max_time_size,
+                 max_batch_size, nr_micro_batches):
+        self.net = net
+        self.results = []  # (layer name, output name, tensor)
+        self.inputs = []  # (input name, tensor)
+        self.max_time_size = max_time_size
+        self.max_batch_size = max_batch_size
+        self.nr_micro_batches = nr_micro_batches
+        self.splits = []
+        self.training_pass = False
+        self.finished = ctx.Queue()
+
+        stage_of = {name: nr for nr, names in enumerate(stage_names)
+                    for name in names}
+        stage_of['Input'] = None
+        consumers = _find_consumers(net, stage_of)
+        self._create_stages(ctx, stage_names, stage_of, consumers,
+                            set(consumers) | set(results))
+        tensors = self._connect_stages(ctx, stage_of, consumers)
+
+        for source in results:
+            tensor = tensors.get(source) or self._create_tensor(ctx, *source)
+            if source not in tensors:
+                self.stages[stage_of[source[0]]].outputs.append(
+                    source + (tensor, []))
+            self.results.append(source + (tensor,))
+
+    def _create_stages(self, ctx, stage_names, stage_of, consumers,
+                       exported):
+        inboxes = [ctx.Queue() for _ in stage_names]
+        self.stages = []
+        for nr, names in enumerate(stage_names):
+            boundary = OrderedDict(
+                (source, '{}__{}'.format(*source))
+                for source, c in consumers.items() if nr in c)
+            stage_net = _create_stage_network(
+                self.net, names, boundary, {s for s in exported
+                                            if stage_of[s[0]] == nr})
+            slices = [(_get_parameter_slice(stage_net, name),
+                       _get_parameter_slice(self.net, name))
+                      for name in names]
+            self.stages.append(_PipelineStage(
+                nr, stage_net, [s for s in slices if s[0] != slice(0, 0)],
+                self.net.buffer.parameters, self.net.buffer.gradients,
+                inboxes))
+
+    def _connect_stages(self, ctx, stage_of, consumers):
+        """Create the tensors for the outputs that are passed on."""
+        tensors = {}
+        for source, nrs in consumers.items():
+            tensor = self._create_tensor(ctx, *source)
+            producer = stage_of[source[0]]
+            delta_tensors = []
+            for nr in sorted(nrs):
+                deltas = None
+                if producer is not None:
+                    deltas = self._create_tensor(ctx, *source)
+                    delta_tensors.append(deltas)
+                    self.stages[nr].producers.add(producer)
+                    self.stages[producer].consumers.add(nr)
+                self.stages[nr].inputs.append(('{}__{}'.format(*source),
+                                               tensor, deltas))
+            if producer is None:
+                self.inputs.append((source[1], tensor))
+            else:
+                self.stages[producer].outputs.append(
+                    source + (tensor, delta_tensors))
+            tensors[source] = tensor
+        return tensors
+
+    def _create_tensor(self, ctx, layer_name, output_name):
+        return _SharedTensor(
+            ctx, self.net.layers[layer_name].out_shapes[output_name].shape,
+            self.net.handler.dtype, self.max_time_size, self.max_batch_size,
+            self.nr_micro_batches)
+
+    def __getattr__(self, item):
+        return getattr(self.net, item)
+
+    def provide_external_data(self, data, all_inputs=True):
+        self.net.provide_external_data(data, all_inputs)
+        time_size, batch_size = data[next(iter(data))].shape[:2]
+        if time_size > self.max_time_size or \
+                batch_size > self.max_batch_size:
+            raise ValueError(
+                'The batch of shape {} is larger than the maximal shape {}. '
+                'Set the max_batch_size of the PipelineTrainer.'
+                .format((time_size, batch_size),
+                        (self.max_time_size, self.max_batch_size)))
+        self.splits = [
+            (split[0], split[-1] + 1) for split in np.array_split(
+                np.arange(batch_size), min(self.nr_micro_batches,
+                                           batch_size))]
+        for name, tensor in self.inputs:
+            data = self.net.buffer.Input.outputs[name]
+            for m, (start, stop) in enumerate(self.splits):
+                tensor.view(m, time_size, self.splits)[:] = \
+                    data[:, start:stop]
+
+    def forward_pass(self, training_pass=False, context=None):
+        assert context is None, "Context is not supported."
+        self.training_pass = training_pass
+        self._run_in_stages('forward')
+        time_size, batch_size = self.net._buffer_manager.time_size, \
+            self.net._buffer_manager.batch_size
+        for name, output_name, tensor in self.results:
+            output = self.net.buffer[name].outputs[output_name]
+            if tensor.is_time_batch:
+                output = output[:time_size]
+            else:
+                output[:] = 0.
+            for m, (start, stop) in enumerate(self.splits):
+                value = tensor.view(m, time_size, self.splits)
+                if tensor.is_time_batch:
+                    output[:, start:stop] = value
+                else:
+                    output += (stop - start) / batch_size * value
+
+    def backward_pass(self):
+        self._run_in_stages('backward')
+        self.net.apply_gradient_modifiers()
+
+    def _run_in_stages(self, command):
+        content = (self.net._buffer_manager.time_size, self.splits,
+                   self.training_pass)
+        for stage in self.stages:
+            stage.inboxes[stage.nr].put((command, content))
+        for _ in self.stages:
+            message, result = self.finished.get()
+            if message == 'error':
+                raise RuntimeError('A stage failed with:\n' + result)
+
+
+def _get_max_batch_size(data_iter):
+    """Get an upper bound for the batch size of a data iterator."""
+    bounds = [shape[1] for shape in data_iter.data_shapes.values()]
+    bounds += [it.batch_size for it in get_seedables(data_iter)
+               if isinstance(getattr(it, 'batch_size', None), int)]
+    return min(bounds)
+
+
+def _find_consumers(net, stage_of):
+    """Find the outputs that have to be passed on to other stages."""
+    consumers = OrderedDict()
+    for layer in net.layers.values():
+        for con in sorted(layer.outgoing):
+            consumer = stage_of[con.end_layer]
+            if consumer != stage_of[con.start_layer]:
+                consumers.setdefault((con.start_layer, con.output_name),
+                                     set()).add(consumer)
+    return consumers
+
+
+def _create_stage_network(net, layer_names, boundary, exported):
+    """
+    Create a network for some of the layers of the given network, whose
+    Input layer provides the given outputs of the other layers.
+    """
+    architecture = {}
+    out_shapes, input_connections = {}, {}
+    for (layer_name, output_name), input_name in boundary.items():
+        layer = net.layers[layer_name]
+        out_shapes[input_name] = layer.out_shapes[output_name].shape
+        input_connections[input_name] = [
+            '{}.{}'.format(c.end_layer, c.input_name)
+            for c in sorted(layer.outgoing)
+            if c.output_name == output_name and c.end_layer in layer_names]
+    for (layer_name, output_name), input_name in boundary.items():
+        if tuple(out_shapes[input_name][:2]) != ('T', 'B'):
+            raise ValueError('Can not split the network at {}.{}, because it '
+                             'has no time and batch dimension.'
+                             .format(layer_name, output_name))
+    architecture['Input'] = {'@type': 'Input', 'out_shapes': out_shapes,
+                             '@outgoing_connections': input_connections}
+    for name in layer_names:
+        layer = copy(net.architecture[name])
+        layer['@outgoing_connections'] = {
+            output_name: [t for t in targets
+                          if t.split('.')[0] in layer_names]
+            for output_name, targets in
+            layer['@outgoing_connections'].items()}
+        architecture[name] = layer
+
+    # keep the order of the layers of the original network
+    layers = instantiate_layers_from_architecture(architecture)
+    layers = OrderedDict((n, layers[n]) for n in ['Input'] + layer_names)
+    # outputs that are passed on must not be overwritten in place
+    for layer in layers.values():
+        read = {c.input_name for c in layer.incoming
+                if (c.start_layer, c.output_name) in exported}
+        if read & set(layer.in_place_outputs.values()):
+            layer.in_place_outputs = {o: i for o, i in
+                                      layer.in_place_outputs.items()
+                                      if i not in read}
+    hubs, layout = create_layout(layers, net.in_place)
+    return Network(layers, BufferManager(layout, hubs), architecture,
+                   handler=net.handler, in_place=net.in_place)
+
+
+def _get_parameter_slice(net, layer_name):
+    """Get the part of the parameters of a network used by a layer."""
+    slices = [entry['@slice'] for key, entry in
+              net._buffer_manager.layout[layer_name]['parameters'].items()
+              if not key.startswith('@')]
+    if not slices:
+        return slice(0, 0)
+    return slice(min(s[0] for s in slices), max(s[1] for s in slices))
@@ -2,7 +2,10 @@
 # coding=utf-8
 from __future__ import division, print_function, unicode_literals
 
+import numpy as np
+
 from brainstorm.describable import Describable
+from brainstorm.structure.architecture import get_replica_names
 
 
 # ########################### Base Class ######################################
@@ -11,17 +14,34 @@ class TrainingStepper(Describable):
     """
     Base class for all training steps. Defines the common interface
     """
-    __undescribed__ = {'net'}
+    __undescribed__ = {'net', '_scaling'}
 
     def __init__(self):
         self.net = None
+        self._scaling = None
 
     def start(self, net):
         self.net = net
+        self._scaling = _ReplicaScaling(net)
 
     def run(self):
         pass
 
+    def get_state(self):
+        """
+        Return numpy copies of the buffers that this stepper keeps between
+        updates (like the velocity), so the training can be resumed.
+        """
+        handler = self.net.handler
+        return {name: handler.get_numpy_copy(getattr(self, name))
+                for name in self.__get_all_undescribed__()
+                if isinstance(getattr(self, name, None), handler.array_type)}
+
+    def set_state(self, state):
+        """Restore the buffers returned by :meth:`get_state`."""
+        for name, value in state.items():
+            self.net.handler.set_from_numpy(getattr(self, name), value)
+
 
 # ########################## Training Steps ###################################
 
@@ -46,6 +66,8 @@ class ForwardStepper(TrainingStepper):
 class SgdStepper(TrainingStepper):
     """
     Stochastic Gradient Descent.
+    For an ensemble (see brainstorm.structure.replicate_architecture) the
+    learning_rate can also be a list with one value per replica.
     """
     __undescribed__ = {'update'}
 
@@ -61,9 +83,9 @@ class SgdStepper(TrainingStepper):
     def run(self):
         self.net.forward_pass(training_pass=True)
         self.net.backward_pass()
-        self.net.handler.mult_st(-self.learning_rate,
-                                 self.net.buffer.gradients,
-                                 out=self.update)
+        self._scaling.mult_st('learning_rate',
+                              -_per_replica(self.learning_rate),
+                              self.net.buffer.gradients, out=self.update)
         self.net.handler.add_tt(self.update,
                                 self.net.buffer.parameters,
                                 out=self.net.buffer.parameters)
@@ -76,6 +98,8 @@ class MomentumStepper(TrainingStepper):
     brainstorm.training.schedules
     If scale_learning_rate is True (default),
     learning_rate is multiplied by (1 - momentum) when used.
+    For an ensemble (see brainstorm.structure.replicate_architecture) both
+    can also be lists with one value per replica.
     """
     __undescribed__ = {'velocity'}
     __default_values__ = {'scale_learning_rate': True}
@@ -95,20 +119,19 @@ class MomentumStepper(TrainingStepper):
         self.velocity = net.handler.zeros(net.buffer.parameters.shape)
 
     def run(self):
-        learning_rate = self.learning_rate
-        momentum = self.momentum
+        learning_rate = _per_replica(self.learning_rate)
+        momentum = _per_replica(self.momentum)
         if self.scale_learning_rate:
-            learning_rate *= (1 - momentum)
+            learning_rate = learning_rate * (1 - momentum)
 
         self.net.forward_pass(training_pass=True)
         self.net.backward_pass()
 
-        self.net.handler.mult_st(momentum,
-                                 self.velocity,
-                                 out=self.velocity)
-        self.net.handler.mult_add_st(-learning_rate,
-                                     self.net.buffer.gradients,
-                                     out=self.velocity)
+        self._scaling.mult_st('momentum', momentum, self.velocity,
+                              out=self.velocity)
+        self._scaling.mult_add_st('learning_rate', -learning_rate,
+                                  self.net.buffer.gradients,
+                                  out=self.velocity)
         self.net.handler.add_tt(self.velocity,
                                 self.net.buffer.parameters,
                                 out=self.net.buffer.parameters)
@@ -123,23 +146,103 @@ class NesterovStepper(MomentumStepper):
     learning_rate is multiplied by (1 - momentum) when used.
     """
     def run(self):
-        learning_rate = self.learning_rate
-        momentum = self.momentum
+        learning_rate = _per_replica(self.learning_rate)
+        momentum = _per_replica(self.momentum)
         if self.scale_learning_rate:
-            learning_rate *= (1 - momentum)
+            learning_rate = learning_rate * (1 - momentum)
 
-        self.net.handler.mult_st(momentum,
-                                 self.velocity,
-                                 out=self.velocity)
+        self._scaling.mult_st('momentum', momentum, self.velocity,
+                              out=self.velocity)
         self.net.handler.add_tt(self.velocity,
                                 self.net.buffer.parameters,
                                 out=self.net.buffer.parameters)
         self.net.forward_pass(training_pass=True)
         self.net.backward_pass()
 
-        self.net.handler.mult_add_st(-learning_rate,
-                                     self.net.buffer.gradients,
-                                     self.velocity)
-        self.net.handler.mult_add_st(-learning_rate,
-                                     self.net.buffer.gradients,
-                                     self.net.buffer.parameters)
+        self._scaling.mult_add_st('learning_rate', -learning_rate,
+                                  self.net.buffer.gradients, self.velocity)
+        self._scaling.mult_add_st('learning_rate', -learning_rate,
+                                  self.net.buffer.gradients,
+                                  self.net.buffer.parameters)
+
+
+# ############################ Helpers ########################################
+
+def _per_replica(value):
+    """Turn a list with one value per replica into an array."""
+    return value if np.ndim(value) == 0 else np.asarray(value, dtype=float)
+
+
+class _ReplicaScaling(object):
+    """
+    Multiplies by a scalar, or for an array of scalars the parameters (or
+    gradients) of every replica by their own entry. For that the entries are
+    expanded to the size of the parameters, and uploaded to the handler only
+    when their values change.
+    """
+
+    def __init__(self, net):
+        self.net = net
+        self.handler = net.handler
+        self.scales = {}  # name -> (numpy values, handler array)
+        self.replica_ids = None
+
+    def mult_st(self, name, s, t, out):
+        if np.ndim(s) == 0:
+            self.handler.mult_st(s, t, out=out)
+        else:
+            self.handler.mult_tt(self._get_scale(name, s), t, out=out)
+
+    def mult_add_st(self, name, s, t, out):
+        """Like :meth:`mult_st`, but add the result to out."""
+        if np.ndim(s) == 0:
+            self.handler.mult_add_st(s, t, out=out)
+        else:
+            self.handler.mult_add_tt(self._get_scale(name, s), t, out=out)
+
+    def _get_scale(self, name, s):
+        values = np.asarray(s, dtype=self.handler.dtype)
+        cached_values, scale = self.scales.get(name, (None, None))
+        if cached_values is None or cached_values.shape != values.shape:
+            scale = self.handler.create_from_numpy(
+                values[self._get_ids(len(values))])
+        elif not np.array_equal(cached_values, values):
+            self.handler.set_from_numpy(
+                scale, values[self._get_ids(len(values))])
+        self.scales[name] = (values, scale)
+        return scale
+
+    def _get_ids(self, nr_replicas):
+        if self.replica_ids is None or \
+                self.replica_ids.max() != nr_replicas - 1:
+            self.replica_ids = _get_replica_ids(self.net, nr_replicas)
+        return self.replica_ids
+
+
+def _get_replica_ids(net, nr_replicas):
+    """
+    Get the replica of every entry of the parameters of an ensemble (see
+    brainstorm.structure.replicate_architecture).
+
+    Raises:
+        ValueError: If some parameters belong to no replica.
+    """
+    layout = net._buffer_manager.layout
+    offset = layout['parameters']['@slice'][0]
+    ids = np.full(net.buffer.parameters.size, -1, dtype=np.int64)
+    names = get_replica_names(nr_replicas)
+    for layer_name, layer in net.layers.items():
+        prefix = layer_name.partition('_')[0]
+        for entry in layout[layer_name]['parameters'].values():
+            if not isinstance(entry, dict):
+                continue
+            start, stop = [i - offset for i in entry['@slice']]
+            if layer.nr_replicas == nr_replicas:
+                ids[start:stop] = np.repeat(np.arange(nr_replicas),
+                                            (stop - start) // nr_replicas)
+            elif prefix in names:
+                ids[start:stop] = names.index(prefix)
+    if np.any(ids < 0):
+        raise ValueError('The parameters of the network are not those of an '
+                         'ensemble with {} replicas'.format(nr_replicas))
+    return ids
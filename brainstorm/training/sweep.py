@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# coding=utf-8
+from __future__ import division, print_function, unicode_literals
+
+import multiprocessing
+import os
+import traceback
+from queue import Empty
+from contextlib import contextmanager
+
+import numpy as np
+
+from brainstorm import optional
+from brainstorm.hooks import Hook
+from brainstorm.training.utils import create_shared_array
+from brainstorm.utils import get_by_path
+
+BLAS_ENVIRONMENT_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                              'MKL_NUM_THREADS')
+# seconds to wait for a message before checking for trials that died
+POLL_INTERVAL = 1.0
+
+
+class Sweep(object):
+    """
+    Runner for hyperparameter sweeps, which trains a network for every
+    configuration in a pool of processes.
+
+    Every trial is forked into its own process, where it calls
+    ``create_trial(configuration, data)``. This has to return the network,
+    the trainer and a dictionary of the data iterators, which are passed to
+    ``trainer.train`` as keyword arguments (so it must contain
+    'training_data_iter'). The numpy arrays in ``data`` are copied to shared
+    memory once and are read-only in the trials.
+
+    If a ``metric`` is given, trials are terminated early by asynchronous
+    successive halving: after ``min_epochs``, ``min_epochs *
+    reduction_factor``, ``min_epochs * reduction_factor ** 2``, ... epochs
+    every trial reports the latest value of the metric from its logs, and it
+    is only continued if it is among the best ``1 / reduction_factor`` of all
+    the values reported so far after that number of epochs. The metric is
+    usually logged by a MonitorScores or MonitorLoss hook of the trainer.
+
+    Note:
+        The number of threads that BLAS uses in every trial can only be
+        limited if threadpoolctl is installed. Otherwise only the usual
+        environment variables are set in the trials, which does not affect
+        BLAS libraries that are loaded already. The trials are created using
+        fork, which is not available on Windows.
+
+    Attributes:
+        results (list[dict]):
+            For every configuration of the last run the configuration, the
+            logs of its trainer, the number of epochs it trained, whether it
+            was terminated early and the traceback if it failed.
+    """
+
+    def __init__(self, create_trial, data=None, nr_processes=None,
+                 blas_threads=1, metric=None, criterion='min', min_epochs=1,
+                 reduction_factor=3, verbose=True):
+        """
+        Args:
+            create_trial (callable):
+                Function that creates the network, the trainer and the named
+                data iterators for a configuration and the shared data.
+            data (Optional[dict]):
+                The data for all trials, usually numpy arrays.
+            nr_processes (Optional[int]):
+                Maximal number of trials to run at the same time. Defaults to
+                the number of CPUs divided by ``blas_threads``.
+            blas_threads (Optional[int]):
+                Number of threads BLAS may use in every trial. Defaults to 1.
+            metric (Optional[str]):
+                The log entry used for successive halving in the form
+                <monitorname>.<log_name>, e.g. 'validation.Accuracy'. Defaults
+                to None, in which case all trials are trained until they
+                stop by themselves.
+            criterion (Optional[str]):
+                Whether the metric should be minimized ('min') or maximized
+                ('max'). Defaults to 'min'.
+            min_epochs (Optional[int]):
+                Number of epochs before the first comparison. Defaults to 1.
+            reduction_factor (Optional[int]):
+                Factor by which the number of trials is reduced and the number
+                of epochs is increased between comparisons. Defaults to 3.
+            verbose (Optional[bool]):
+                Whether to print when the trials finish.
+        """
+        if criterion not in ('min', 'max'):
+            raise ValueError("criterion must be 'min' or 'max' but was {}"
+                             .format(criterion))
+        if not isinstance(min_epochs, int) or min_epochs < 1:
+            raise ValueError('min_epochs must be a positive int but was {}'
+                             .format(min_epochs))
+        if not isinstance(reduction_factor, int) or reduction_factor < 2:
+            raise ValueError('reduction_factor must be an int larger than 1 '
+                             'but was {}'.format(reduction_factor))
+        self.create_trial = create_trial
+        self.data = {} if data is None else data
+        self.blas_threads = blas_threads
+        self.nr_processes = nr_processes or max(
+            1, (os.cpu_count() or 1) // blas_threads)
+        self.metric = metric
+        self.criterion = criterion
+        self.min_epochs = min_epochs
+        self.reduction_factor = reduction_factor
+        self.verbose = verbose
+        self.results = []
+        self._rungs = {}
+
+    def run(self, configurations):
+        """
+        Train a network for every configuration.
+
+        Args:
+            configurations (list):
+                The configurations to pass to ``create_trial``.
+        Returns:
+            list[dict]:
+                The results of all trials, see :attr:`results`.
+        """
+        configurations = list(configurations)
+        ctx = multiprocessing.get_context('fork')
+        shared_data = _share_data(ctx, self.data)
+        self.results = [{'configuration': c, 'logs': {}, 'epochs': 0,
+                         'terminated': False, 'error': None}
+                        for c in configurations]
+        self._rungs = {}
+
+        messages = ctx.Queue()
+        pending = list(range(len(configurations)))
+        running = {}
+        exited = set()
+        try:
+            while pending or running:
+                while pending and len(running) < self.nr_processes:
+                    trial_nr = pending.pop(0)
+                    connection, trial_connection = ctx.Pipe()
+                    process = ctx.Process(
+                        target=self._run_trial,
+                        args=(trial_nr, configurations[trial_nr],
+                              shared_data, trial_connection, messages))
+                    process.start()
+                    running[trial_nr] = (process, connection)
+
+                try:
+                    message, trial_nr, content = messages.get(
+                        timeout=POLL_INTERVAL)
+                except Empty:
+                    self._collect_exited_trials(running, exited)
+                    continue
+                if message == 'report':
+                    epoch_nr, value = content
+                    running[trial_nr][1].send(self._decide(epoch_nr, value))
+                    continue
+                process, connection = running.pop(trial_nr)
+                process.join()
+                if message == 'error':
+                    self.results[trial_nr]['error'] = content
+                else:
+                    logs, epochs, terminated = content
+                    self.results[trial_nr].update(
+                        logs=logs, epochs=epochs, terminated=terminated)
+                self._print_result(trial_nr)
+        finally:
+            for process, _ in running.values():
+                process.terminate()
+                process.join()
+        return self.results
+
+    def _collect_exited_trials(self, running, exited):
+        """
+        Record a failure for trials whose process exited without a result.
+
+        A process may exit right after putting its last message, so a trial is
+        only considered dead if it had exited already at the previous poll.
+        """
+        for trial_nr in sorted(exited.intersection(running)):
+            process, connection = running.pop(trial_nr)
+            process.join()
+            self.results[trial_nr]['error'] = (
+                'The process of the trial exited with code {} without '
+                'reporting a result'.format(process.exitcode))
+            self._print_result(trial_nr)
+        exited.clear()
+        exited.update(trial_nr for trial_nr, (process, _) in running.items()
+                      if process.exitcode is not None)
+
+    def _decide(self, epoch_nr, value):
+        """Decide whether a trial is among the best at a comparison."""
+        values = self._rungs.setdefault(epoch_nr, [])
+        values.append(value)
+        if np.isnan(value):
+            return False
+        if self.criterion == 'min':
+            nr_better = sum(v < value for v in values)
+        else:
+            nr_better = sum(v > value for v in values)
+        return nr_better < np.ceil(len(values) / self.reduction_factor)
+
+    def _run_trial(self, trial_nr, configuration, data, connection,
+                   messages):
+        try:
+            with limit_blas_threads(self.blas_threads):
+                net, trainer, data_iters = self.create_trial(configuration,
+                                                             data)
+                halving = None
+                if self.metric is not None:
+                    halving = _SuccessiveHalving(
+                        self.metric, self.min_epochs, self.reduction_factor,
+                        trial_nr, connection, messages)
+                    trainer.add_hook(halving)
+                trainer.train(net, **data_iters)
+            messages.put(('done', trial_nr, (
+                trainer.logs, trainer.current_epoch_nr,
+                halving is not None and halving.terminated)))
+        except Exception:
+            messages.put(('error', trial_nr, traceback.format_exc()))
+
+    def _print_result(self, trial_nr):
+        if not self.verbose:
+            return
+        result = self.results[trial_nr]
+        if result['error'] is not None:
+            status = 'failed:\n' + result['error']
+        else:
+            status = '{} after {} epochs'.format(
+                'terminated' if result['terminated'] else 'finished',
+                result['epochs'])
+        print('Trial {} {}'.format(trial_nr, status))
+
+
+class _SuccessiveHalving(Hook):
+    """
+    Report the metric of a trial to the Sweep at every comparison and stop
+    the training unless the trial is among the best.
+    """
+
+    def __init__(self, metric, min_epochs, reduction_factor, trial_nr,
+                 connection, messages):
+        super(_SuccessiveHalving, self).__init__(name='SuccessiveHalving')
+        self.metric = metric
+        self.min_epochs = min_epochs
+        self.reduction_factor = reduction_factor
+        self.trial_nr = trial_nr
+        self.connection = connection
+        self.messages = messages
+        self.terminated = False
+
+    def __call__(self, epoch_nr, update_nr, net, stepper, logs):
+        rung = self.min_epochs
+        while rung < epoch_nr:
+            rung *= self.reduction_factor
+        if rung != epoch_nr:
+            return
+        value = get_by_path(logs, self.metric)[-1]
+        self.messages.put(('report', self.trial_nr, (epoch_nr, value)))
+        if not self.connection.recv():
+            self.terminated = True
+            raise StopIteration
+
+
+@contextmanager
+def limit_blas_threads(nr_threads):
+    """
+    Limit the number of threads used by BLAS (and OpenMP) within the context.
+    """
+    if optional.has_threadpoolctl:
+        with optional.threadpoolctl.threadpool_limits(limits=nr_threads):
+            yield
+        return
+    previous = {name: os.environ.get(name)
+                for name in BLAS_ENVIRONMENT_VARIABLES}
+    os.environ.update({name: str(nr_threads)
+                       for name in BLAS_ENVIRONMENT_VARIABLES})
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                del os.environ[name]
+            else:
+                os.environ[name] = value
+
+
+def _share_data(ctx, data):
+    """Copy all numpy arrays to read-only shared memory."""
+    shared = {}
+    for name, value in data.items():
+        if isinstance(value, np.ndarray):
+            array = create_shared_array(ctx, value)
+            array[:] = value
+            array.flags.writeable = False
+            value = array
+        shared[name] = value
+    return shared
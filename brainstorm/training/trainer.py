@@ -5,11 +5,19 @@ from __future__ import division, print_function, unicode_literals
 import sys
 import traceback
 from collections import OrderedDict
+from contextlib import contextmanager
 
-from brainstorm.describable import Describable
+import numpy as np
+
+from brainstorm.describable import Describable, get_description
 from brainstorm.scorers import (aggregate_losses_and_scores,
                                 gather_losses_and_scores)
-from brainstorm.training.utils import run_network
+from brainstorm.training.checkpoints import (read_training_state,
+                                             write_training_state)
+from brainstorm.training.utils import (get_attributes, get_random_states,
+                                       get_random_streams, get_seedables,
+                                       run_network, set_attributes,
+                                       set_random_states)
 
 
 class Trainer(Describable):
@@ -22,7 +30,9 @@ class Trainer(Describable):
         'current_update_nr': 0,
         'logs': {},
         'results': {},
-        'failed_hooks': {}
+        'failed_hooks': {},
+        '_data_iters': {},
+        '_epoch': None
     }
     __default_values__ = {'verbose': True}
 
@@ -41,6 +51,8 @@ class Trainer(Describable):
         self.current_update_nr = 0
         self.logs = {}
         self.results = {}
+        self._data_iters = {}
+        self._epoch = None
 
     def add_hook(self, hook):
         """Add a hook to this trainer.
@@ -69,6 +81,76 @@ class Trainer(Describable):
         Train a network using a data iterator and further named data
         iterators.
         """
+        self._run_training(net, training_data_iter, named_data_iters)
+
+    def resume(self, filename, net, training_data_iter, **named_data_iters):
+        """
+        Continue a training from a state saved by :meth:`save_state`.
+
+        The trainer has to be set up like the one that saved the state (same
+        kind of stepper, hooks with the same names and data iterators with
+        the same data), and the network needs the same architecture. It can
+        be created from the file with ``Network.from_hdf5(filename)``.
+
+        This restores the parameters and the random states of the network,
+        the buffers and attributes of the stepper, the counters and logs of
+        the trainer, the states of the hooks (see
+        :meth:`brainstorm.hooks.Hook.get_state`) and the random states of the
+        data iterators. If the state was saved during an epoch, the
+        batches of that epoch that were already used are skipped. So the
+        training continues exactly as if it had not been interrupted.
+        """
+        self._run_training(net, training_data_iter, named_data_iters,
+                           resume_from=filename)
+
+    def save_state(self, filename, net):
+        """
+        Save the state of the training to a file, so it can be continued
+        using :meth:`resume`. Usually this is called by the
+        :class:`brainstorm.hooks.SaveTrainingState` hook.
+        """
+        arrays = {'stepper.' + name: value
+                  for name, value in self.stepper.get_state().items()}
+        epoch_position = None
+        if self._epoch is not None:
+            epoch_position = self._epoch['position']
+            for name, scores in self._epoch['scores'].items():
+                arrays['epoch_scores.' + name] = np.array(scores)
+
+        iterator_states = {name: get_random_states(get_seedables(it))
+                           for name, it in self._data_iters.items()}
+        if self._epoch is not None:
+            iterator_states['training_data_iter'] = \
+                self._epoch['iterator_states']
+
+        state = {
+            'current_epoch_nr': self.current_epoch_nr,
+            'current_update_nr': self.current_update_nr,
+            'epoch_position': epoch_position,
+            'stepper': get_attributes(self.stepper),
+            'hooks': self._get_hook_states(arrays),
+            'network_random_states': get_random_states(
+                get_random_streams(net)),
+            'iterator_random_states': iterator_states
+        }
+        write_training_state(filename, get_description(net),
+                             net.get('parameters'), state, arrays, self.logs,
+                             layout=net._get_layout_description())
+
+    def _get_hook_states(self, arrays):
+        """Get the states of the hooks and move their arrays to arrays."""
+        states = {}
+        for name, hook in self.hooks.items():
+            states[name] = {}
+            for key, value in hook.get_state().items():
+                if isinstance(value, np.ndarray):
+                    arrays['hooks.{}.{}'.format(name, key)] = value
+                else:
+                    states[name][key] = value
+        return states
+
+    def _run_training(self, net, training_data_iter, named_data_iters,
+                      resume_from=None):
         if self.verbose:
             print('\n\n', 10 * '- ', "Before Training", 10 * ' -')
         assert set(training_data_iter.data_shapes.keys()) == set(
@@ -77,42 +159,124 @@ class Trainer(Describable):
             "map to the network input names {}".format(
                 training_data_iter.data_shapes.keys(),
                 net.buffer.Input.outputs.keys())
-        self.stepper.start(net)
         named_data_iters['training_data_iter'] = training_data_iter
-        self._start_hooks(net, named_data_iters)
-        if self._emit_hooks(net, 'update') or self._emit_hooks(net, 'epoch'):
-            return
+        self._data_iters = named_data_iters
+        self._epoch = None
+        try:
+            with self._stepped_network(net, training_data_iter) as \
+                    stepped_net:
+                self.stepper.start(stepped_net)
+                self._start_hooks(net, named_data_iters)
+                if resume_from is not None:
+                    self._load_state(resume_from, net)
+                elif self._emit_hooks(net, 'update') or \
+                        self._emit_hooks(net, 'epoch'):
+                    return
+                self._run_epochs(net, stepped_net, training_data_iter)
+        finally:
+            self._finish_hooks()
 
+    @contextmanager
+    def _stepped_network(self, net, training_data_iter):
+        """
+        Provide the network that the stepper drives during the training.
+
+        Trainers that run the passes in other processes override this to set
+        those up and to yield a stand-in for the network, which leaves the
+        losses and the outputs needed for the scores in the network.
+        """
+        yield net
+
+    def _run_epochs(self, net, stepped_net, training_data_iter):
         should_stop = False
         while not should_stop:
-            self.current_epoch_nr += 1
+            if self._epoch is None:
+                self._start_epoch(net, training_data_iter)
             sys.stdout.flush()
-            train_scores = {s.__name__: [] for s in self.train_scorers}
-            train_scores.update({n: [] for n in net.get_loss_values()})
 
             if self.verbose:
                 print('\n\n', 12 * '- ', "Epoch", self.current_epoch_nr,
                       12 * ' -')
-            iterator = training_data_iter(handler=net.handler)
-            for _ in run_network(net, iterator):
-                self.current_update_nr += 1
-                self.stepper.run()
-                gather_losses_and_scores(net, self.train_scorers, train_scores)
-                net.apply_weight_modifiers()
-                if self._emit_hooks(net, 'update'):
-                    should_stop = True
-                    break
+            should_stop = self._run_epoch(net, stepped_net,
+                                          training_data_iter)
 
+            train_scores = self._epoch['scores']
+            self._epoch = None
             self._add_log('rolling_training',
                           aggregate_losses_and_scores(train_scores, net,
                                                       self.train_scorers))
 
             should_stop |= self._emit_hooks(net, 'epoch')
 
+    def _run_epoch(self, net, stepped_net, training_data_iter):
+        """Run the (rest of the) current epoch and tell if it should stop."""
+        iterator = training_data_iter(handler=net.handler)
+        for _ in range(self._epoch['position']):
+            next(iterator)
+        for _ in run_network(stepped_net, iterator):
+            self.current_update_nr += 1
+            self._epoch['position'] += 1
+            self.stepper.run()
+            gather_losses_and_scores(net, self.train_scorers,
+                                     self._epoch['scores'])
+            net.apply_weight_modifiers()
+            if self._emit_hooks(net, 'update'):
+                return True
+        return False
+
+    def _start_epoch(self, net, training_data_iter):
+        self.current_epoch_nr += 1
+        scores = {s.__name__: [] for s in self.train_scorers}
+        scores.update({n: [] for n in net.get_loss_values()})
+        self._epoch = {
+            'position': 0,
+            'scores': scores,
+            'iterator_states': get_random_states(
+                get_seedables(training_data_iter))
+        }
+
+    def _load_state(self, filename, net):
+        parameters, state, arrays, logs = read_training_state(filename)
+        net.handler.set_from_numpy(net.buffer.parameters, parameters)
+        set_random_states(get_random_streams(net),
+                          state['network_random_states'])
+        self.stepper.set_state({name[len('stepper.'):]: value
+                                for name, value in arrays.items()
+                                if name.startswith('stepper.')})
+        set_attributes(self.stepper, state['stepper'])
+        for name, hook_state in state['hooks'].items():
+            if name in self.hooks:
+                prefix = 'hooks.{}.'.format(name)
+                hook_state.update({key[len(prefix):]: value
+                                   for key, value in arrays.items()
+                                   if key.startswith(prefix)})
+                self.hooks[name].set_state(hook_state)
+
+        self.current_epoch_nr = state['current_epoch_nr']
+        self.current_update_nr = state['current_update_nr']
+        self.logs = logs
+        iterator_states = state['iterator_random_states']
+        for name, it in self._data_iters.items():
+            if name in iterator_states:
+                set_random_states(get_seedables(it), iterator_states[name])
+
+        if state['epoch_position'] is not None:
+            self._epoch = {
+                'position': state['epoch_position'],
+                'scores': {name[len('epoch_scores.'):]: [tuple(s) for s in v]
+                           for name, v in arrays.items()
+                           if name.startswith('epoch_scores.')},
+                'iterator_states': state['iterator_random_states'][
+                    'training_data_iter']
+            }
+
     def evaluate(self, net, **named_data_iters):
         self._start_hooks(net, named_data_iters)
-        self._emit_hooks(net, 'epoch', logs=self.results)
-        self._emit_hooks(net, 'update', logs=self.results)
+        try:
+            self._emit_hooks(net, 'epoch', logs=self.results)
+            self._emit_hooks(net, 'update', logs=self.results)
+        finally:
+            self._finish_hooks()
         return self.results
 
     def __init_from_description__(self, description):
@@ -137,6 +301,17 @@ class Trainer(Describable):
                       .format(name), file=sys.stderr)
                 raise
 
+    def _finish_hooks(self):
+        """Call the ::attr::`finish()` methods for all the hooks."""
+        for name, hook in self.hooks.items():
+            try:
+                if hasattr(hook, 'finish'):
+                    hook.finish()
+            except Exception:
+                print('An error occurred while finishing the "{}" hook:'
+                      .format(name), file=sys.stderr)
+                raise
+
     def _emit_hooks(self, net, timescale, logs=None):
         """Call the hooks which should be called at this timescale."""
         should_stop = False
@@ -2,8 +2,88 @@
 # coding=utf-8
 from __future__ import division, print_function, unicode_literals
 
+import numpy as np
+from six import string_types
+
+from brainstorm.describable import get_description
+from brainstorm.randomness import RandomState, Seedable
+
 
 def run_network(net, iterator, all_inputs=True):
     for i, data in enumerate(iterator):
         net.provide_external_data(data, all_inputs=all_inputs)
         yield i
+
+
+def create_shared_array(ctx, array):
+    """Allocate an array of zeros like the given one in shared memory."""
+    dtype = np.dtype(array.dtype)
+    memory = ctx.RawArray(np.ctypeslib.as_ctypes_type(dtype), array.size)
+    return np.frombuffer(memory, dtype=dtype).reshape(array.shape)
+
+
+def use_random_stream(net, stream):
+    """Draw the random numbers of the handler and the layers from a stream."""
+    net.handler.rnd = net.handler.rnd.create_stream(stream)
+    for layer in net.layers.values():
+        if isinstance(getattr(layer, 'rnd', None), RandomState):
+            layer.rnd = layer.rnd.create_stream(stream)
+
+
+def get_result_outputs(net, scorers):
+    """
+    Get the outputs of a network that the losses and the given scorers are
+    computed from, as (layer name, output name) tuples.
+    """
+    results = [(name, 'loss') for name in net.loss_layers]
+    for sc in scorers:
+        layer_name, _, output_name = (sc.out_name or
+                                      net.output_name).split('.', 2)
+        if (layer_name, output_name) not in results:
+            results.append((layer_name, output_name))
+    return results
+
+
+def get_attributes(obj):
+    """Get the described attributes of an object that are plain values
+    (numbers, strings and lists of them)."""
+    return {k: v for k, v in get_description(obj).items()
+            if not k.startswith('@') and _is_plain(v)}
+
+
+def _is_plain(value):
+    if isinstance(value, (list, tuple)):
+        return all(_is_plain(v) for v in value)
+    return value is None or isinstance(value, (bool, int, float,
+                                               string_types))
+
+
+def set_attributes(obj, attributes):
+    for name, value in attributes.items():
+        setattr(obj, name, value)
+
+
+def get_seedables(data_iter):
+    """Get the data iterator and all the data iterators it wraps."""
+    seedables = [data_iter]
+    for value in vars(data_iter).values():
+        if isinstance(value, Seedable):
+            seedables.extend(get_seedables(value))
+    return seedables
+
+
+def get_random_streams(net):
+    """Get the random states of a network, its handler and its layers."""
+    return [net.rnd, net.handler.rnd] + [
+        layer.rnd for layer in net.layers.values()
+        if isinstance(getattr(layer, 'rnd', None), RandomState)]
+
+
+def get_random_states(seedables):
+    """Get the states of the given Seedables or random states."""
+    return [getattr(s, 'rnd', s).get_state(legacy=False) for s in seedables]
+
+
+def set_random_states(seedables, states):
+    for seedable, state in zip(seedables, states):
+        getattr(seedable, 'rnd', seedable).set_state(state)
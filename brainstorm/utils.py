@@ -8,6 +8,8 @@ import math
 import operator
 import re
 
+import numpy as np
+
 from brainstorm.__about__ import __version__
 
 
@@ -170,6 +172,109 @@ def flatten_all_but_last(array):
     return array.reshape((int(product(array.shape[:-1])), array.shape[-1]))
 
 
+class SparseArray(object):
+    """
+    A sparse array stored in compressed sparse row (CSR) format.
+
+    The leading dimensions of `shape` are flattened into the rows of the CSR
+    matrix (in C-order) and the last dimension corresponds to its columns.
+    So a (T, B, F) array has T * B rows, ordered like in
+    :func:`flatten_time`, and F columns.
+
+    The three arrays can either be numpy arrays (e.g. when yielded by a data
+    iterator) or arrays of a handler.
+
+    Args:
+        data (array_type): The values of the non-zero entries.
+        indices (array_type): The column index of every entry in `data`.
+        indptr (array_type): For every row the position in `data` where it
+            starts, followed by the total number of non-zero entries.
+        shape (tuple[int]): The shape of the corresponding dense array.
+    """
+
+    def __init__(self, data, indices, indptr, shape):
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+        self.shape = tuple(shape)
+
+    @classmethod
+    def from_dense(cls, array):
+        """Create a sparse version of a dense numpy array."""
+        flat = array.reshape(-1, array.shape[-1])
+        rows, cols = np.nonzero(flat)
+        indptr = np.searchsorted(rows, np.arange(flat.shape[0] + 1))
+        return cls(flat[rows, cols], cols, indptr, array.shape)
+
+    @property
+    def nnz(self):
+        return self.data.shape[0]
+
+    def reshape(self, new_shape):
+        new_shape = tuple(new_shape)
+        if new_shape[-1] != self.shape[-1] or \
+                product(new_shape) != product(self.shape):
+            raise ValueError('Only the leading dimensions of sparse arrays '
+                             'can be reshaped (from {} to {})'
+                             .format(self.shape, new_shape))
+        return SparseArray(self.data, self.indices, self.indptr, new_shape)
+
+    def to_dense(self, dtype=None):
+        """Convert to a dense numpy array (only for numpy arrays)."""
+        nr_rows = self.indptr.shape[0] - 1
+        rows = np.repeat(np.arange(nr_rows),
+                         np.diff(self.indptr).astype(np.int64))
+        dense = np.zeros((nr_rows, self.shape[-1]),
+                         dtype=dtype or self.data.dtype)
+        np.add.at(dense, (rows, self.indices.astype(np.int64)), self.data)
+        return dense.reshape(self.shape)
+
+
+def get_active_batch_sizes(mask):
+    """Determine how many leading batch columns are active at each step.
+
+    A column is active until the last non-zero entry of its mask. For every
+    time step this returns the index after the last active column, such
+    that all computations for later columns can be skipped. This is most
+    effective if the columns are sorted by decreasing sequence length.
+
+    Args:
+        mask (numpy.ndarray): Mask of shape (T, B, 1).
+    Returns:
+        list[int]: The number of columns to compute for each time step.
+    """
+    active = mask.reshape(mask.shape[:2]) != 0
+    active = np.logical_or.accumulate(active[::-1], axis=0)[::-1]
+    sizes = active.shape[1] - np.argmax(active[:, ::-1], axis=1)
+    sizes[~active.any(axis=1)] = 0
+    return [int(n) for n in sizes]
+
+
+def get_active_unit_sizes(timing, phase):
+    """Determine how many leading units of a clockwork layer can be active.
+
+    Unit `i` is active at a step whose clock phase is `p` if `p` is divisible
+    by `timing[i]`. For every time step this returns the index after the last
+    unit that is active in any batch column, such that the recurrent
+    computations for all later units can be skipped. If the units are sorted
+    by increasing period and each period divides the larger ones, the active
+    units are always exactly this prefix.
+
+    Args:
+        timing (numpy.ndarray): The period of every unit.
+        phase (numpy.ndarray): Clock phase of shape (T, B) or (T, B, 1).
+    Returns:
+        list[int]: The number of units to compute for each time step.
+    """
+    phase = phase.reshape(phase.shape[0], -1, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        active = np.fmod(phase, timing.reshape(1, 1, -1)) == 0
+    active = active.any(axis=1)
+    sizes = active.shape[1] - np.argmax(active[:, ::-1], axis=1)
+    sizes[~active.any(axis=1)] = 0
+    return [int(n) for n in sizes]
+
+
 def flatten_keys(dictionary):
     """
     Flattens the keys for a nested dictionary using dot notation. This
@@ -91,7 +91,8 @@ live_viz = ['bokeh']
 draw_net = ['pygraphviz']
 tests = ['pytest', 'mock']
 pycuda = ['pycuda>=2015.1.3', 'scikit-cuda>=0.5.1']
-all_deps = live_viz + draw_net + tests + pycuda
+sweep = ['threadpoolctl']
+all_deps = live_viz + draw_net + tests + pycuda + sweep
 
 setup(
     name='brainstorm',
@@ -106,13 +107,15 @@ setup(
               'brainstorm.layers',
               'brainstorm.training',
               'brainstorm.handlers'],
-    setup_requires=['cython', 'numpy>=1.8'],
-    install_requires=['cython', 'h5py', 'mock', 'numpy>=1.8', 'six'],
+    python_requires='>=3.5',
+    setup_requires=['cython', 'numpy>=1.17'],
+    install_requires=['cython', 'h5py', 'mock', 'numpy>=1.17', 'six'],
     extras_require={
         'live_viz':  live_viz,
         'draw_net': draw_net,
         'test': tests,
         'pycuda': pycuda,
+        'sweep': sweep,
         'all': all_deps
     },
     tests_require=tests,
@@ -125,8 +128,12 @@ setup(
         'Intended Audience :: Education',
         'License :: OSI Approved :: MIT License',
         'Natural Language :: English',
-        'Programming Language :: Python :: 2.7',
-        'Programming Language :: Python :: 3.3',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
     ],
 
     ext_modules=extensions,